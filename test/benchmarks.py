@@ -0,0 +1,455 @@
+# SPDX-FileCopyrightText: © 2024 Zachary Frazee
+# SPDX-License-Identifier: Apache-2.0
+
+#Benchmark kernels for measuring the minibyte architecture
+#
+#Small but real workloads with known results, to compare cycles, instruction counts, CPI and
+#code density across RTL, gate level and reference model runs (and later across changes to the
+#CU). Every kernel is a minibyte_asm.py program that:
+#   - starts at 0x00 out of reset and ends in "done: jmp done"
+#   - gets its inputs from .byte data assembled into the image
+#   - leaves its results in memory, checked against a Python version of the kernel
+#   - marks its loop headers with "; bound N" comments, for wcet.py
+#
+#There is no indirect load, so kernels walking an array patch the operand of an LDA_DIR
+#(self modifying code), and LDA does not touch the CCR, so "or #0" sets N/Z from A.
+#
+#   python benchmarks.py                (reference model)
+#   make TESTCASE=test_benchmarks       (RTL next to the model, BENCHMARKS=<file> saves a json)
+
+#Includes
+#-------------------------
+import json
+import sys
+from collections import namedtuple
+
+from minibyte_asm import assemble
+from minibyte_isa import TM_OFF, TM_DEMO_ROM, TM_ONBOARD_RAM, S_FETCH_1
+from minibyte_model import MinibyteModel, REG_RAM_BASE
+
+#Constants
+#-------------------------
+
+#Cycle budget before a kernel is declared hung
+MAX_CYCLES = 200000
+
+#name       - short name for the tables
+#source     - assembly, must define done
+#ui_in      - test bits the kernel runs with (onboard RAM for the reg RAM kernels)
+#expected   - function(program) => {label: expected bytes at that label}
+Benchmark = namedtuple("Benchmark", ["name", "source", "ui_in", "expected"])
+
+#cycles/instructions are counted from reset release to the first fetch of done
+Result    = namedtuple("Result", ["name", "target", "cycles", "instructions", "cpi", "code_bytes", "passed", "message"])
+
+
+#Kernels
+#-------------------------
+
+#Copy 8 bytes into the reg RAM and back out to memory, through one memcpy "subroutine"
+#(the return address is passed in ret and memcpy ends with a JMP_IND)
+MEMCPY = """
+        lda #src
+        sta from
+        lda #0x78
+        sta to
+        lda #back1
+        sta ret
+        jmp memcpy
+back1:  lda #0x78
+        sta from
+        lda #out
+        sta to
+        lda #back2
+        sta ret
+        jmp memcpy
+back2:
+done:   jmp done
+
+memcpy: lda from
+        sta load+1
+        lda #8
+        sta count
+load:   lda 0               ; operand patched with the source address, bound 8
+        sta (to)
+        lda load+1
+        add #1
+        sta load+1
+        lda to
+        add #1
+        sta to
+        lda count
+        sub #1
+        sta count
+        bne load
+        jmp (ret)
+
+from:   .byte 0
+to:     .byte 0
+ret:    .byte 0
+count:  .byte 0
+src:    .byte 0xde, 0xad, 0xbe, 0xef, 0x01, 0x23, 0x45, 0x67
+out:    .fill 8
+"""
+
+def _memcpy_expected(program):
+    src = bytes(program.memory[program.labels["src"]:program.labels["src"] + 8])
+    return {"out": src}
+
+#8x8 shift and add multiply, low byte of the product (there is no carry flag for the high byte)
+MULTIPLY = """
+        lda #0
+        sta prod
+loop:   lda y               ; bound 1..8 (y is shifted right until it is 0)
+        and #1
+        beq skip
+        lda prod
+        add x
+        sta prod
+skip:   lda x
+        lsl #1
+        sta x
+        lda y
+        lsr #1
+        sta y
+        bne loop
+done:   jmp done
+
+x:      .byte 13
+y:      .byte 11
+prod:   .byte 0
+"""
+
+def _multiply_expected(program):
+    return {"prod": bytes([(13 * 11) & 0xff])}
+
+#Restoring division of an 8 bit dividend by a 7 bit divisor, quotient and remainder
+#The ALU compares signed, so a remainder with bit 7 set is known to be >= the divisor
+DIVIDE = """
+        lda #0
+        sta rem
+        sta quot
+        lda #8
+        sta count
+loop:   lda rem             ; rem = rem << 1 | msb(num), bound 8
+        lsl #1
+        sta rem
+        lda num
+        or #0
+        bpl nobit
+        lda rem
+        or #1
+        sta rem
+nobit:  lda num
+        lsl #1
+        sta num
+        lda quot
+        lsl #1
+        sta quot
+        lda rem
+        or #0
+        bmi ge
+        sub den
+        bmi next            ; rem < den
+        jmp take
+ge:     sub den
+take:   sta rem
+        lda quot
+        or #1
+        sta quot
+next:   lda count
+        sub #1
+        sta count
+        bne loop
+done:   jmp done
+
+num:    .byte 251
+den:    .byte 7
+count:  .byte 0
+quot:   .byte 0
+rem:    .byte 0
+"""
+
+def _divide_expected(program):
+    return {"quot": bytes([251 // 7]), "rem": bytes([251 % 7])}
+
+#First 13 Fibonacci numbers (the last one that fits in a byte is fib(13) = 233)
+FIBONACCI = """
+        lda #0
+        sta f0
+        lda #1
+        sta f1
+        lda #out
+        sta ptr
+        lda #13
+        sta count
+loop:   lda f0              ; bound 13
+        sta (ptr)
+        add f1
+        sta next
+        lda f1
+        sta f0
+        lda next
+        sta f1
+        lda ptr
+        add #1
+        sta ptr
+        lda count
+        sub #1
+        sta count
+        bne loop
+done:   jmp done
+
+f0:     .byte 0
+f1:     .byte 0
+next:   .byte 0
+ptr:    .byte 0
+count:  .byte 0
+out:    .fill 13
+"""
+
+def _fibonacci_expected(program):
+    fib = [0, 1]
+    while len(fib) < 13:
+        fib.append(fib[-1] + fib[-2])
+    return {"out": bytes(fib[:13])}
+
+#CRC-8 (polynomial 0x07, init 0, no reflection) of a short message, one bit at a time
+CRC8 = """
+        lda #0
+        sta crc
+        lda #msg
+        sta load+1
+        lda #LEN
+        sta count
+byte:                       ; bound 4 (LEN)
+load:   lda msg             ; operand patched with the message pointer
+        xor crc
+        sta crc
+        lda #8
+        sta bits
+bit:    lda crc             ; bound 8
+        or #0
+        bpl shift
+        lsl #1
+        xor #0x07
+        jmp store
+shift:  lsl #1
+store:  sta crc
+        lda bits
+        sub #1
+        sta bits
+        bne bit
+        lda load+1
+        add #1
+        sta load+1
+        lda count
+        sub #1
+        sta count
+        bne byte
+done:   jmp done
+
+LEN     = 4
+msg:    .byte '1', '2', '3', '4'
+crc:    .byte 0
+count:  .byte 0
+bits:   .byte 0
+"""
+
+def crc8(data, poly=0x07):
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ poly if crc & 0x80 else crc << 1) & 0xff
+    return crc
+
+def _crc8_expected(program):
+    return {"crc": bytes([crc8(b"1234")])}
+
+#Bubble sort of 7 values in 0..127 (the ALU compares signed)
+#Swaps store through the patched load operands, "sta (load+1)" writes where load reads from
+BUBBLE_SORT = """
+        lda #N-1
+        sta pass
+outer:  lda #array          ; bound 6 (N-1)
+        sta load0+1
+        add #1
+        sta load1+1
+        lda #N-1
+        sta count
+inner:                      ; bound 6 (N-1)
+load0:  lda array
+        sta lo
+load1:  lda array+1
+        sta hi
+        sub lo
+        bpl noswap          ; already in order
+        lda hi
+        sta (load0+1)
+        lda lo
+        sta (load1+1)
+noswap: lda load1+1
+        sta load0+1
+        add #1
+        sta load1+1
+        lda count
+        sub #1
+        sta count
+        bne inner
+        lda pass
+        sub #1
+        sta pass
+        bne outer
+done:   jmp done
+
+N       = 7
+array:  .byte 42, 7, 99, 0, 127, 13, 64
+pass:   .byte 0
+count:  .byte 0
+lo:     .byte 0
+hi:     .byte 0
+"""
+
+def _bubble_sort_expected(program):
+    return {"array": bytes(sorted([42, 7, 99, 0, 127, 13, 64]))}
+
+BENCHMARKS = [
+    Benchmark("memcpy",    MEMCPY,      TM_ONBOARD_RAM, _memcpy_expected),
+    Benchmark("multiply",  MULTIPLY,    TM_OFF,         _multiply_expected),
+    Benchmark("divide",    DIVIDE,      TM_OFF,         _divide_expected),
+    Benchmark("fibonacci", FIBONACCI,   TM_OFF,         _fibonacci_expected),
+    Benchmark("crc8",      CRC8,        TM_OFF,         _crc8_expected),
+    Benchmark("bubble",    BUBBLE_SORT, TM_OFF,         _bubble_sort_expected),
+]
+
+
+#Checking
+#-------------------------
+
+#Compare memory against the expected results, returns an error message or ""
+def check_results(bench, program, memory):
+    errors = []
+    for label, expected in bench.expected(program).items():
+        addr   = program.labels[label]
+        actual = bytes(memory[addr:addr + len(expected)])
+        if actual != expected:
+            errors.append(f"{label}: {actual.hex()} != {expected.hex()}")
+    return ", ".join(errors)
+
+def _result(bench, target, program, memory, cycles, instructions, message=None):
+    if message is None:
+        message = check_results(bench, program, memory)
+    cpi = cycles / instructions if instructions else None
+    return Result(bench.name, target, cycles, instructions, cpi, program.code_bytes, not message, message)
+
+
+#Reference Model
+#-------------------------
+def run_model(bench, max_cycles=MAX_CYCLES):
+    program = assemble(bench.source)
+    memory  = bytearray(program.memory)
+    model   = MinibyteModel(memory, demo_rom=bool(bench.ui_in & TM_DEMO_ROM), onboard_ram=bool(bench.ui_in & TM_ONBOARD_RAM))
+    done    = program.labels["done"]
+
+    #Out of reset into the first fetch, then whole instructions
+    model.cycle()
+    while model.pc != done:
+        if model.cycles >= max_cycles:
+            return _result(bench, "model", program, memory, model.cycles, model.instructions, f"no done after {max_cycles} cycles")
+        model.step()
+
+    return _result(bench, "model", program, memory, model.cycles, model.instructions)
+
+
+#cocotb
+#-------------------------
+
+#Run one kernel on the DUT with a clock already running. External memory answers on uio_in
+#every falling edge and takes the stores, reg RAM stores show up on the bus as well.
+async def run_rtl(dut, bench, max_cycles=MAX_CYCLES):
+    from cocotb.triggers import FallingEdge
+
+    from clock_advance import FastClockCycles
+
+    program = assemble(bench.source)
+    memory  = bytearray(program.memory)
+    done    = program.labels["done"]
+
+    #Instructions are counted off the CU state when there is an RTL hierarchy to look at
+    try:
+        state = dut.user_project.cpu.cu.curr_state
+    except AttributeError:
+        state = None
+
+    dut.ena.value    = 1
+    dut.ui_in.value  = bench.ui_in
+    dut.uio_in.value = memory[0]
+    dut.rst_n.value  = 0
+    await FastClockCycles(dut.clk, 10)
+    dut.rst_n.value  = 1
+
+    #Falling edge n after the reset release sees the state after n rising edges, same as model.cycles
+    cycles       = 0
+    instructions = 0
+    while True:
+        await FallingEdge(dut.clk)
+        uo_out = dut.uo_out.value.integer
+        addr   = uo_out & 0x7f
+
+        if uo_out & 0x80 and dut.uio_oe.value.integer == 0xff:
+            memory[addr] = dut.uio_out.value.integer
+        dut.uio_in.value = memory[addr]
+
+        if addr == done:
+            break
+        if state is not None and state.value.integer == S_FETCH_1:
+            instructions += 1
+        if cycles >= max_cycles:
+            return _result(bench, "rtl", program, memory, cycles, instructions or None, f"no done after {max_cycles} cycles")
+        cycles += 1
+
+    return _result(bench, "rtl", program, memory, cycles, instructions or None)
+
+
+#Reports
+#-------------------------
+def format_results(results):
+    lines = [f"{'kernel':<11}{'target':<7}{'cycles':>8}{'instrs':>8}{'CPI':>7}{'bytes':>7}  result"]
+    for r in results:
+        instructions = "-" if r.instructions is None else r.instructions
+        cpi          = "-" if r.cpi is None else f"{r.cpi:.2f}"
+        lines.append(f"{r.name:<11}{r.target:<7}{r.cycles:>8}{instructions:>8}{cpi:>7}{r.code_bytes:>7}  "
+                     f"{'ok' if r.passed else 'FAIL ' + r.message}")
+    return "\n".join(lines)
+
+def write_results(path, results):
+    with open(path, "w") as f:
+        json.dump([r._asdict() for r in results], f, indent=2)
+
+
+#Command line
+#-------------------------
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the benchmark kernels on the reference model")
+    parser.add_argument("kernels",  nargs="*", help="kernels to run (all by default)")
+    parser.add_argument("--json",   help="also write the results here")
+    parser.add_argument("--source", action="store_true", help="print the listing of each kernel")
+    args = parser.parse_args(argv)
+
+    benches = [bench for bench in BENCHMARKS if not args.kernels or bench.name in args.kernels]
+    results = []
+    for bench in benches:
+        if args.source:
+            print(f"{bench.name}:\n{assemble(bench.source).listing()}\n")
+        results.append(run_model(bench))
+
+    print(format_results(results))
+    if args.json:
+        write_results(args.json, results)
+    return 0 if all(r.passed for r in results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
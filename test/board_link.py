@@ -0,0 +1,642 @@
+# SPDX-FileCopyrightText: © 2024 Zachary Frazee
+# SPDX-License-Identifier: Apache-2.0
+
+#Host side link to a minibyte board, and a board emulator to develop and load test it against
+#
+#On the board a bridge MCU takes the place of the EEPROM in docs/external_rom.png: it clocks the
+#chip, holds the 128 bytes of external memory and answers the bus from them. The host streams the
+#image in, maps the addresses it wants to answer itself (peripherals) and gets every store back.
+#Host and bridge talk in frames over a serial link:
+#   A5 <kind> <seq> <len> <payload> <sum>           sum = kind + seq + len + payload, mod 256
+#
+#Host -> board                                       Board -> host
+#   H                       hello                       H <version> <memory size>
+#   L <addr> <data..>       load memory                 A
+#   P <addr> <len>          read memory back            D <addr> <data..>
+#   M <16 byte mask>        addresses the host answers  A
+#   X <ui_in>               reset, with these testmodes A
+#   G <cycles u32>          run                         E and Q while running, then F <cycle u32>
+#   V <data>                answer to a Q (same seq)
+#                                                       E <cycle u32, addr, data>..  stores
+#                                                       Q <cycle u32> <addr>  clock held until V
+#                                                       N <code>              command refused
+#
+#Commands are answered in order, so BoardLink keeps up to WINDOW of them in flight and only
+#waits when the window is full or it needs the answer: an image, a reset and a run go out in one
+#write. Stores come back EVENTS_PER_FRAME to a frame, and always ahead of a Q, so the host has
+#seen every earlier store when it answers a read. A Q is the only round trip, one for every cycle
+#a mapped address is on the bus (the bridge cannot tell whether the CPU latches it, which is why
+#Peripheral.read must not change anything).
+#
+#BoardEmulator is the bridge side on a pty, with MinibyteModel as the chip:
+#   python board_link.py emulate                            # prints the pty to point a host at
+#   python board_link.py run program.s --port /dev/ttyACM0 --cycles 5000
+#   python board_link.py loadtest --runs 200 --latency 1    # against an emulator, checked against the model
+
+#Includes
+#-------------------------
+import collections
+import os
+import select
+import struct
+import sys
+import termios
+import time
+import tty
+
+from minibyte_isa import TM_OFF, TM_HALT_CU, TM_DEMO_ROM, TM_ONBOARD_RAM
+from minibyte_model import REG_RAM_BASE, MinibyteModel
+
+#Constants
+#-------------------------
+VERSION          = 1
+MEM_SIZE         = 128
+SYNC             = 0xa5
+MAX_PAYLOAD      = 255
+WINDOW           = 8            #Commands in flight, WINDOW full frames must fit the 4k tty buffer
+CHUNK            = 64           #Image bytes per L frame
+DEFAULT_BAUD     = 1000000
+TIMEOUT          = 5.0          #Seconds to wait for any frame from the board
+
+EVENT            = struct.Struct("<IBB")    #cycle, addr, data
+QUERY            = struct.Struct("<IB")     #cycle, addr
+CYCLES           = struct.Struct("<I")
+EVENTS_PER_FRAME = MAX_PAYLOAD // EVENT.size
+
+#Testmodes the bridge can run the chip in, the debug outputs would take the address bus away
+BOARD_MODES      = TM_HALT_CU | TM_DEMO_ROM | TM_ONBOARD_RAM
+
+#N codes
+ERR_CHECKSUM     = 1
+ERR_COMMAND      = 2
+ERR_ARGUMENT     = 3
+ERR_SEQUENCE     = 4
+
+ERRORS           = {ERR_CHECKSUM: "bad checksum", ERR_COMMAND: "unknown command",
+                    ERR_ARGUMENT: "bad argument", ERR_SEQUENCE: "answer out of sequence"}
+
+
+#Frames
+#-------------------------
+def frame(kind, seq, payload=b""):
+    head = bytes((ord(kind), seq & 0xff, len(payload)))
+    return bytes((SYNC,)) + head + payload + bytes(((sum(head) + sum(payload)) & 0xff,))
+
+#Splits a byte stream into (kind, seq, payload), anything that does not parse raises IOError
+class FrameReader:
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+
+    #Next whole frame or None
+    def next(self):
+        buffer = self.buffer
+        if not buffer:
+            return None
+        if buffer[0] != SYNC:
+            raise IOError(f"lost frame sync on 0x{buffer[0]:02x}")
+        if len(buffer) < 4 or len(buffer) < buffer[3] + 5:
+            return None
+        end = buffer[3] + 4
+        if sum(buffer[1:end]) & 0xff != buffer[end]:
+            raise IOError(f"bad checksum on a {chr(buffer[1])!r} frame (seq {buffer[2]})")
+        kind, seq, payload = chr(buffer[1]), buffer[2], bytes(buffer[4:end])
+        del buffer[:end + 1]
+        return kind, seq, payload
+
+
+#Serial
+#-------------------------
+def open_serial(path, baud=DEFAULT_BAUD):
+    fd = os.open(path, os.O_RDWR | os.O_NOCTTY)
+    tty.setraw(fd)
+    speed = getattr(termios, f"B{baud}", None)
+    if speed is not None:
+        attrs    = termios.tcgetattr(fd)
+        attrs[4] = attrs[5] = speed
+        termios.tcsetattr(fd, termios.TCSANOW, attrs)
+    return fd
+
+def _write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+#Host
+#-------------------------
+class BoardLink:
+    def __init__(self, fd, window=WINDOW, timeout=TIMEOUT):
+        self.fd          = fd
+        self.window      = window
+        self.timeout     = timeout
+        self.reader      = FrameReader()
+        self.out         = bytearray()
+        self.seq         = 0
+        self.pending     = collections.deque()  #(seq, kind) of the commands in flight
+        self.replies     = {}                   #seq => payload, for the commands that return something
+        self.bus         = None                 #Answers the Qs and takes the stores of the run
+        self.writes      = []                   #(cycle, addr, data), every store of the last run
+        self.cycle       = 0                    #Board cycle at the end of the last run
+        self.round_trips = 0
+        self.frames_in   = 0
+        self.frames_out  = 0
+        self.bytes_in    = 0
+        self.bytes_out   = 0
+
+    @classmethod
+    def open(cls, path, baud=DEFAULT_BAUD, **kwargs):
+        return cls(open_serial(path, baud), **kwargs)
+
+    def close(self):
+        os.close(self.fd)
+
+    #Transfers
+    #-------------------------
+    def _command(self, kind, payload=b""):
+        while len(self.pending) >= self.window:
+            self._receive()
+        seq      = self.seq
+        self.seq = (seq + 1) & 0xff
+        self._send(kind, seq, payload)
+        self.pending.append((seq, kind))
+        return seq
+
+    def _send(self, kind, seq, payload=b""):
+        self.out        += frame(kind, seq, payload)
+        self.frames_out += 1
+
+    def _flush(self):
+        if self.out:
+            self.bytes_out += len(self.out)
+            _write_all(self.fd, self.out)
+            self.out = bytearray()
+
+    def _next(self):
+        self._flush()
+        while True:
+            next_frame = self.reader.next()
+            if next_frame is not None:
+                self.frames_in += 1
+                return next_frame
+            if not select.select([self.fd], [], [], self.timeout)[0]:
+                raise IOError(f"board did not answer in {self.timeout}s ({len(self.pending)} commands in flight)")
+            data = os.read(self.fd, 4096)
+            if not data:
+                raise ConnectionError("board went away")
+            self.bytes_in += len(data)
+            self.reader.feed(data)
+
+    #Handle the next frame from the board
+    def _receive(self):
+        kind, seq, payload = self._next()
+        if kind == "E":
+            for cycle, addr, data in EVENT.iter_unpack(payload):
+                self.writes.append((cycle, addr, data))
+                if self.bus is not None:
+                    self.bus.cycle = cycle
+                    self.bus[addr] = data
+            return
+        if kind == "Q":
+            cycle, addr    = QUERY.unpack(payload)
+            self.bus.cycle = cycle
+            self._send("V", seq, bytes((self.bus[addr] & 0xff,)))
+            self.round_trips += 1
+            return
+
+        if not self.pending:
+            raise IOError(f"board sent an unexpected {kind!r} frame (seq {seq})")
+        expected, command = self.pending.popleft()
+        if seq != expected:
+            raise IOError(f"board answered seq {seq}, expected {expected} ({command!r})")
+        if kind == "N":
+            code = payload[0] if payload else 0
+            raise IOError(f"board refused {command!r} (seq {seq}): {ERRORS.get(code, f'error {code}')}")
+        if kind == "F":
+            self.cycle = CYCLES.unpack(payload)[0]
+        if kind in "HDF":
+            self.replies[seq] = payload
+
+    def _wait(self, seq):
+        while seq not in self.replies:
+            self._receive()
+        return self.replies.pop(seq)
+
+    #Wait for every command in flight
+    def sync(self):
+        while self.pending:
+            self._receive()
+
+    #Commands
+    #-------------------------
+
+    #(version, memory size)
+    def hello(self):
+        payload = self._wait(self._command("H"))
+        return payload[0], payload[1]
+
+    #Queued, goes out with whatever comes next
+    def load(self, image, base=0):
+        image = bytes(image)
+        for offset in range(0, len(image), CHUNK):
+            self._command("L", bytes(((base + offset) & 0x7f,)) + image[offset:offset + CHUNK])
+
+    def peek(self, base=0, length=MEM_SIZE):
+        seqs = [self._command("P", bytes(((base + offset) & 0x7f, min(CHUNK, length - offset))))
+                for offset in range(0, length, CHUNK)]
+        return b"".join(self._wait(seq)[1:] for seq in seqs)
+
+    def map(self, addresses):
+        mask = bytearray(MEM_SIZE // 8)
+        for addr in addresses:
+            mask[addr >> 3] |= 1 << (addr & 7)
+        self._command("M", bytes(mask))
+
+    def reset(self, ui_in=TM_OFF):
+        self._command("X", bytes((ui_in,)))
+
+    #Run cycles on, with bus answering the mapped addresses and taking the stores (None to only
+    #record them in writes), returns the board's cycle count
+    def run(self, cycles, bus=None):
+        self.bus    = bus
+        self.writes = []
+        self._wait(self._command("G", CYCLES.pack(cycles)))
+        if hasattr(bus, "flush"):
+            bus.flush()
+        return self.cycle
+
+    def stats(self):
+        return {"frames_out": self.frames_out, "frames_in": self.frames_in, "bytes_out": self.bytes_out,
+                "bytes_in": self.bytes_in, "round_trips": self.round_trips}
+
+#Run the memory of a PeripheralBus on the board for cycles out of reset (same count as
+#peripherals.run_model), the peripherals are answered from the host
+def run_board(link, bus, cycles, ui_in=TM_OFF):
+    link.load(bus.memory)
+    link.map(addr for addr, device in enumerate(bus.devices) if device is not None)
+    link.reset(ui_in)
+    return link.run(cycles, bus)
+
+
+#Board emulator
+#-------------------------
+
+#External memory as the model sees it: a mapped read holds the host's answer for one cycle,
+#stores are queued up for the host
+class _BoardMemory:
+    def __init__(self):
+        self.memory = bytearray(MEM_SIZE)
+        self.events = bytearray()
+        self.cycle  = 0
+        self.held   = None          #(addr, data) answered by the host for this cycle
+
+    def __len__(self):
+        return MEM_SIZE
+
+    def __getitem__(self, addr):
+        if self.held is not None and self.held[0] == addr:
+            return self.held[1]
+        return self.memory[addr]
+
+    def __setitem__(self, addr, data):
+        self.memory[addr] = data
+        self.events      += EVENT.pack(self.cycle, addr, data)
+
+#A command refused with an N code
+class _Refused(Exception):
+    pass
+
+#The bridge side of the link with MinibyteModel standing in for the chip, baud throttles the
+#writes to the line rate of a real link (0 for as fast as the pty goes) and latency (seconds)
+#delays each of them like the turnaround of a USB serial bridge
+class BoardEmulator:
+    def __init__(self, fd, baud=0, latency=0):
+        self.fd       = fd
+        self.baud     = baud
+        self.latency  = latency
+        self.reader   = FrameReader()
+        self.out      = bytearray()
+        self.queued   = collections.deque()     #Commands that came in while waiting for a V
+        self.bus      = _BoardMemory()
+        self.mapped   = bytearray(MEM_SIZE)
+        self.model    = MinibyteModel(self.bus)
+        self.seq      = 0                       #Of the command being run
+        self.qseq     = 0
+        self.running  = True
+        self.queries  = 0
+
+    #Transfers
+    #-------------------------
+    def _send(self, kind, seq, payload=b""):
+        self.out += frame(kind, seq, payload)
+
+    def _flush(self):
+        if self.out:
+            if self.latency:
+                time.sleep(self.latency)
+            _write_all(self.fd, self.out)
+            if self.baud:
+                time.sleep(len(self.out) * 10 / self.baud)
+            self.out = bytearray()
+
+    #Next frame from the host, None once the link is closed. Answers go out when it runs out of
+    #frames to work on, so a window of commands is answered in one write
+    def _next(self):
+        while self.running:
+            try:
+                next_frame = self.reader.next()
+            except IOError:
+                #No way to find the next frame, drop what came in and refuse it
+                seq = self.reader.buffer[2] if len(self.reader.buffer) > 2 else 0
+                self.reader.buffer.clear()
+                self._send("N", seq, bytes((ERR_CHECKSUM,)))
+                self._flush()
+                continue
+            if next_frame is not None:
+                return next_frame
+            self._flush()
+            if not select.select([self.fd], [], [], 0.1)[0]:
+                continue
+            try:
+                data = os.read(self.fd, 4096)
+            except OSError:
+                return None
+            if not data:
+                return None
+            self.reader.feed(data)
+        return None
+
+    def _events(self):
+        events = self.bus.events
+        step   = EVENTS_PER_FRAME * EVENT.size
+        for offset in range(0, len(events), step):
+            self._send("E", self.seq, bytes(events[offset:offset + step]))
+        events.clear()
+
+    #Stop the clock with addr on the bus until the host answers
+    def _query(self, cycle, addr):
+        self._events()
+        self.qseq = (self.qseq + 1) & 0xff
+        self._send("Q", self.qseq, QUERY.pack(cycle, addr))
+        self.queries += 1
+        while True:
+            next_frame = self._next()
+            if next_frame is None:
+                raise ConnectionError("host went away")
+            kind, seq, payload = next_frame
+            if kind != "V":
+                self.queued.append(next_frame)
+            elif seq != self.qseq or len(payload) != 1:
+                raise _Refused(ERR_SEQUENCE)
+            else:
+                return payload[0]
+
+    #Commands
+    #-------------------------
+    def _run(self, cycles):
+        model  = self.model
+        bus    = self.bus
+        mapped = self.mapped
+        ask    = any(mapped) and not model.demo_rom
+        for _ in range(cycles):
+            cycle = bus.cycle = model.cycles
+            if ask:
+                addr, _, drive, _ = model.bus()
+                if mapped[addr] and not drive and not (model.onboard_ram and addr >= REG_RAM_BASE):
+                    bus.held = (addr, self._query(cycle, addr))
+            model.cycle()
+            bus.held = None
+            if len(bus.events) >= EVENTS_PER_FRAME * EVENT.size:
+                self._events()
+        self._events()
+        return model.cycles
+
+    def _handle(self, kind, seq, payload):
+        memory   = self.bus.memory
+        self.seq = seq
+        if kind == "H":
+            self._send("H", seq, bytes((VERSION, MEM_SIZE)))
+        elif kind == "L":
+            if not payload:
+                raise _Refused(ERR_ARGUMENT)
+            for i, data in enumerate(payload[1:]):
+                memory[(payload[0] + i) & 0x7f] = data
+            self._send("A", seq)
+        elif kind == "P":
+            if len(payload) != 2 or payload[1] >= MAX_PAYLOAD:
+                raise _Refused(ERR_ARGUMENT)
+            addr, length = payload
+            self._send("D", seq, bytes((addr,)) + bytes(memory[(addr + i) & 0x7f] for i in range(length)))
+        elif kind == "M":
+            if len(payload) != MEM_SIZE // 8:
+                raise _Refused(ERR_ARGUMENT)
+            self.mapped = bytearray((payload[addr >> 3] >> (addr & 7)) & 1 for addr in range(MEM_SIZE))
+            self._send("A", seq)
+        elif kind == "X":
+            if len(payload) != 1 or payload[0] & ~BOARD_MODES:
+                raise _Refused(ERR_ARGUMENT)
+            ui_in           = payload[0]
+            self.model      = MinibyteModel(self.bus, demo_rom=bool(ui_in & TM_DEMO_ROM), onboard_ram=bool(ui_in & TM_ONBOARD_RAM))
+            self.model.halt = bool(ui_in & TM_HALT_CU)
+            self._send("A", seq)
+        elif kind == "G":
+            if len(payload) != CYCLES.size:
+                raise _Refused(ERR_ARGUMENT)
+            cycles = self._run(CYCLES.unpack(payload)[0])
+            self._send("F", seq, CYCLES.pack(cycles))
+        elif kind == "V":
+            raise _Refused(ERR_SEQUENCE)
+        else:
+            raise _Refused(ERR_COMMAND)
+
+    #Answer commands until the host closes the link or stop() is called
+    def serve(self):
+        while self.running:
+            next_frame = self.queued.popleft() if self.queued else self._next()
+            if next_frame is None:
+                break
+            kind, seq, _ = next_frame
+            try:
+                self._handle(*next_frame)
+            except _Refused as refused:
+                self.bus.events.clear()
+                self._send("N", seq, bytes((refused.args[0],)))
+            except ConnectionError:
+                break
+        self._flush()
+
+    def stop(self):
+        self.running = False
+
+#Emulator on a new pty, serving from a thread, returns (emulator, thread, path of the pty)
+def start_emulator(baud=0, latency=0):
+    import threading
+
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    emulator = BoardEmulator(master, baud, latency)
+    emulator.slave = slave      #Held open, the master side fails once no slave is left
+    thread   = threading.Thread(target=emulator.serve, daemon=True)
+    thread.start()
+    return emulator, thread, os.ttyname(slave)
+
+
+#Load test
+#-------------------------
+
+#Prints "HELLO" on the UART, then the timer to the LEDs
+HELLO = """
+        sta 0x44            ; clear the timer
+next:   lda 0x43            ; wait for the UART
+        and #1
+        bne next
+load:   lda text            ; operand walks the string
+        or #0               ; loads leave the flags alone
+        beq done
+        sta 0x42
+        lda load+1
+        add #1
+        sta load+1
+        jmp next
+done:   lda 0x44
+        sta 0x40
+halt:   jmp halt
+text:   .byte 'H', 'E', 'L', 'L', 'O', 0
+"""
+HELLO_CYCLES = 1500
+
+#(name, program, cycles, ui_in, bench or None) for every run of the load test
+def _load_test_programs():
+    from benchmarks import BENCHMARKS, run_model
+    from minibyte_asm import assemble
+
+    programs = [("hello", assemble(HELLO), HELLO_CYCLES, TM_OFF, None)]
+    for bench in BENCHMARKS:
+        programs.append((bench.name, assemble(bench.source), run_model(bench).cycles + 16, bench.ui_in, bench))
+    return programs
+
+#The kernels keep data where the peripherals are, so they get plain memory
+def _bus(program, bench):
+    from peripherals import OutputLatch, PeripheralBus, UartTx, standard_bus
+
+    if bench is None:
+        return standard_bus(program.memory)
+    return PeripheralBus(program.memory), OutputLatch(), None, UartTx(), None
+
+#Run every program on the board runs times round, each checked against the model, returns
+#(runs, cycles, failures)
+def load_test(link, runs, log=print):
+    from benchmarks import check_results
+    from peripherals import run_model
+
+    programs = _load_test_programs()
+    failures = []
+    cycles   = 0
+    for run in range(runs):
+        name, program, run_cycles, ui_in, bench = programs[run % len(programs)]
+
+        bus, latch, _, uart, _ = _bus(program, bench)
+        cycles += run_board(link, bus, run_cycles, ui_in)
+        board   = link.peek()
+        ref, ref_latch, _, ref_uart, _ = _bus(program, bench)
+        run_model(ref, run_cycles, ui_in)
+
+        #Memory, seen through the stores and read back, peripherals and what the kernels compute
+        plain    = [addr for addr in range(MEM_SIZE) if bus.devices[addr] is None]
+        problems = []
+        if any(bus.memory[addr] != ref.memory[addr] or board[addr] != ref.memory[addr] for addr in plain):
+            problems.append("memory differs from the model")
+        if uart.frames != ref_uart.frames:
+            problems.append(f"UART sent {uart.text()!r} (model {ref_uart.text()!r})")
+        if latch.history != ref_latch.history:
+            problems.append(f"{len(latch.history)} LED writes (model {len(ref_latch.history)})")
+        if bench is not None:
+            message = check_results(bench, program, board)
+            if message:
+                problems.append(message)
+        if problems:
+            failures.append((run, name, problems))
+            log(f"run {run} {name}: " + ", ".join(problems))
+    return runs, cycles, failures
+
+
+#Command line
+#-------------------------
+def _spawn_emulator(baud, latency):
+    import subprocess
+
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "emulate", "--baud", str(baud), "--latency", str(latency)],
+                               stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline().split()
+    if not line:
+        process.kill()
+        raise ConnectionError("emulator did not start")
+    return process, line[-1]
+
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Host link to a minibyte board, and a pty board emulator")
+    parser.add_argument("command",   choices=["emulate", "run", "loadtest"])
+    parser.add_argument("source",    nargs="?", help="program to run (assembly)")
+    parser.add_argument("--port",    help="serial port of the board, an emulator is started without one")
+    parser.add_argument("--baud",    type=int, default=DEFAULT_BAUD, help="line rate (the emulator throttles to it, 0 for none)")
+    parser.add_argument("--latency", type=float, default=0, help="emulator turnaround per write, in ms")
+    parser.add_argument("--cycles",  type=int, default=10000)
+    parser.add_argument("--ui-in",   type=lambda text: int(text, 0), default=TM_OFF)
+    parser.add_argument("--runs",    type=int, default=100)
+    parser.add_argument("--window",  type=int, default=WINDOW)
+    args = parser.parse_args(argv)
+
+    if args.command == "emulate":
+        emulator, thread, path = start_emulator(args.baud, args.latency / 1000)
+        print(f"board emulator on {path}", flush=True)
+        try:
+            thread.join()
+        except KeyboardInterrupt:
+            emulator.stop()
+        return 0
+
+    process = None
+    path    = args.port
+    if path is None:
+        process, path = _spawn_emulator(args.baud, args.latency)
+    link = BoardLink.open(path, args.baud, window=args.window)
+    try:
+        version, size = link.hello()
+        print(f"board on {path}: protocol {version}, {size} bytes of memory")
+
+        if args.command == "run":
+            from minibyte_asm import assemble
+            from peripherals import standard_bus
+
+            if args.source is None:
+                parser.error("run needs a program")
+            with open(args.source) as f:
+                program = assemble(f.read())
+            bus, latch, _, uart, _ = standard_bus(program.memory)
+            cycles = run_board(link, bus, args.cycles, args.ui_in)
+            print(f"{cycles} cycles, {len(link.writes)} stores, {link.round_trips} reads from the host")
+            print(f"UART: {uart.text()!r}")
+            print(f"LEDs: {' '.join(f'{value:02x}' for _, value in latch.history)}")
+            return 0
+
+        start                   = time.perf_counter()
+        runs, cycles, failures  = load_test(link, args.runs)
+        seconds                 = time.perf_counter() - start
+        stats                   = link.stats()
+        print(f"{runs} runs, {cycles} cycles in {seconds:.2f}s: {runs / seconds:.1f} runs/s, {cycles / seconds:.0f} cycles/s")
+        print(f"{stats['frames_out']} frames ({stats['bytes_out']} bytes) out, {stats['frames_in']} frames ({stats['bytes_in']} bytes) in, "
+              f"{stats['round_trips']} round trips")
+        print(f"{len(failures)} runs differ from the model" if failures else "every run matches the model")
+        return 1 if failures else 0
+    finally:
+        link.close()
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,67 @@
+# SPDX-FileCopyrightText: © 2024 Zachary Frazee
+# SPDX-License-Identifier: Apache-2.0
+
+#Ring buffer of the last bus cycles, for failure reports
+#
+#Shared by the soak runs (soak.py) and the watchdogs (watchdog.py), so this must not import
+#cocotb or any of the tools.
+
+#Constants
+#-------------------------
+TB_RING = 32    #WD_RING in tb.v
+
+#Ring Buffer
+#-------------------------
+
+#The last size bus cycles, (cycle, uo_out, uio_out, uio_oe), preallocated
+class BusRing:
+    def __init__(self, size):
+        self.size    = size
+        self.cycle   = [0] * size
+        self.uo_out  = [0] * size
+        self.uio_out = [0] * size
+        self.uio_oe  = [0] * size
+        self.index   = 0
+        self.count   = 0
+
+    def push(self, cycle, uo_out, uio_out, uio_oe):
+        i = self.index
+        self.cycle[i], self.uo_out[i], self.uio_out[i], self.uio_oe[i] = cycle, uo_out, uio_out, uio_oe
+        self.index = (i + 1) % self.size
+        self.count += 1
+
+    #Oldest first
+    def entries(self):
+        n     = min(self.count, self.size)
+        start = (self.index - n) % self.size
+        for k in range(n):
+            i = (start + k) % self.size
+            yield self.cycle[i], self.uo_out[i], self.uio_out[i], self.uio_oe[i]
+
+    def format(self, last=None):
+        entries = list(self.entries())
+        if last is not None:
+            entries = entries[-last:]
+        lines = [f"{'cycle':>12}  addr  we  data  oe"]
+        for cycle, uo_out, uio_out, uio_oe in entries:
+            drive = uio_oe == 0xff
+            lines.append(f"{cycle:>12}  0x{uo_out & 0x7f:02x}  {(uo_out >> 7) & 1:>2}  "
+                         f"{'0x%02x' % uio_out if drive else '  --'}  0x{uio_oe:02x}")
+        return "\n".join(lines)
+
+
+#tb.v
+#-------------------------
+
+#The bus changes tb.v's watchdog ring kept (see tb.v) into ring, cycles counted from start_cycle
+#(a wd_cycle value). Entries still X/Z are skipped
+def read_tb_ring(dut, ring, start_cycle=0):
+    count = dut.wd_ring_count.value.integer
+    for n in range(max(0, count - min(ring.size, TB_RING)), count):
+        try:
+            cycle  = dut.wd_ring_cycle[n % TB_RING].value.integer - start_cycle
+            packed = dut.wd_ring_bus[n % TB_RING].value.integer
+        except ValueError:
+            continue
+        oe = packed & 0xff
+        ring.push(cycle, packed >> 16, (packed >> 8) & 0xff if oe == 0xff else 0, oe)
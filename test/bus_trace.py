@@ -0,0 +1,388 @@
+# SPDX-FileCopyrightText: © 2024 Zachary Frazee
+# SPDX-License-Identifier: Apache-2.0
+
+#Streaming binary bus-transaction traces
+#
+#Every clock cycle the external bus of tt_um_minibyte is sampled (see project.v):
+#   uo_out[6:0] => Address Buss
+#   uo_out[7]   => WE
+#   uio_out     => Data out (valid when uio_oe == 0xff)
+#   uio_in      => Data in  (what memory is driving when uio_oe == 0x00)
+#
+#and written as one fixed size record to a binary file. Records are buffered and flushed in
+#blocks so the memory used stays constant no matter how long the run is. The file can be read
+#back zero-copy with numpy.memmap (load_bus_trace) or with plain mmap (iter_bus_trace).
+#
+#On the simulator the sampling is done by tb.v, which buffers BT_DEPTH cycles at a time, so
+#cocotb only wakes up to copy out a full buffer (and once at the end) instead of on every falling
+#edge. sample() takes the pins directly, for the model and other pure Python sources.
+#
+#File layout (little endian):
+#   Header (16 bytes): magic "MBTRACE" + version (u8), flags (u8), record size (u8), 6 pad bytes
+#       flags: FLAG_CU_STATE (records hold the CU state), FLAG_CHANGES_ONLY (a record holds
+#              until the next one, written by a changes_only writer)
+#   Records (16 bytes each):
+#       cycle    u64  - cycles since the writer was started
+#       addr     u8   - 7-bit address
+#       we       u8   - write enable
+#       data     u8   - uio_out if the CPU is driving, otherwise uio_in
+#       oe       u8   - 1 if the CPU is driving the data buss
+#       cu_state u8   - CU state (CU_STATE_NONE if not recorded)
+#       pad      3 bytes
+
+#Includes
+#-------------------------
+import mmap
+import struct
+import sys
+from collections import namedtuple
+
+#Format
+#-------------------------
+TRACE_MAGIC      = b"MBTRACE"
+TRACE_VERSION    = 1
+
+FLAG_CU_STATE     = 0x01
+FLAG_CHANGES_ONLY = 0x02
+
+CU_STATE_NONE    = 0xff
+
+HEADER_STRUCT    = struct.Struct("<7sBBB6x")
+RECORD_STRUCT    = struct.Struct("<QBBBBB3x")
+
+HEADER_SIZE      = HEADER_STRUCT.size
+RECORD_SIZE      = RECORD_STRUCT.size
+
+BusRecord = namedtuple("BusRecord", ["cycle", "addr", "we", "data", "oe", "cu_state"])
+
+#Numpy view of a record, built on first use so numpy stays optional
+def record_dtype():
+    import numpy as np
+
+    return np.dtype({
+        "names"   : ["cycle", "addr", "we", "data", "oe", "cu_state"],
+        "formats" : ["<u8",   "u1",   "u1", "u1",   "u1", "u1"],
+        "offsets" : [0,       8,      9,    10,     11,   12],
+        "itemsize": RECORD_SIZE,
+    })
+
+
+#Writer
+#-------------------------
+TB_BUFFER_FILE = "bus_trace.hex"    #Written by tb.v on bt_dump, in the simulator's working directory
+
+#Resolve a signal to an int, treating X/Z as 0 (uio_in floats before the test drives it)
+def _read(handle):
+    try:
+        return handle.value.integer
+    except ValueError:
+        return 0
+
+#tb.v buffer records, {cycle[63:0], uo_out, uio_out, uio_in, uio_oe, cu_state} per line, as
+#(cycle, uo_out, uio_out, uio_oe, uio_in, cu_state) with X/Z fields read as 0 like _read()
+def read_tb_buffer(path=TB_BUFFER_FILE):
+    def field(text):
+        return 0 if any(c in text for c in "xz") else int(text, 16)
+
+    records = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip().lower()
+            if not line or line[0] in "/@":
+                continue
+            records.append((field(line[:16]), field(line[16:18]), field(line[18:20]),
+                            field(line[22:24]), field(line[20:22]), field(line[24:26])))
+    return records
+
+class BusTraceWriter:
+    #dut          - cocotb handle of tb
+    #path         - output file
+    #cu_state     - also record the CU state (RTL only, needs the hierarchy)
+    #changes_only - only write a record when the bus changes from the previous cycle
+    #block        - number of records buffered between writes
+    def __init__(self, dut, path, cu_state=False, changes_only=False, block=4096):
+        self.dut          = dut
+        self.path         = path
+        self.changes_only = changes_only
+        self.cycle        = 0
+        self.records      = 0
+
+        #Find the CU state register if asked for
+        self.cu_state = None
+        if cu_state:
+            try:
+                self.cu_state = dut.user_project.cpu.cu.curr_state
+            except AttributeError:
+                dut._log.warning("No RTL hierarchy, bus trace will not include the CU state")
+
+        #Preallocated block buffer
+        self._buf   = bytearray(RECORD_SIZE * block)
+        self._block = block
+        self._fill  = 0
+        self._last  = None
+        self._task  = None
+
+        #Write the header
+        self._file = open(path, "wb")
+        self._file.write(HEADER_STRUCT.pack(
+            TRACE_MAGIC, TRACE_VERSION,
+            (FLAG_CU_STATE if self.cu_state is not None else 0) | (FLAG_CHANGES_ONLY if changes_only else 0),
+            RECORD_SIZE
+        ))
+
+    #Have tb.v sample on the falling edge of every clock (mid cycle, when the buss is settled)
+    #from the next one on, into its buffer
+    def start(self):
+        import cocotb
+
+        dut = self.dut
+        dut.bt_cu_state.value     = 1 if self.cu_state is not None else 0
+        dut.bt_changes_only.value = 1 if self.changes_only else 0
+        dut.bt_enable.value       = 1
+        dut.bt_clear.value        = 1
+        self._task = cocotb.start_soon(self._monitor())
+        return self
+
+    #Only wakes up when the tb.v buffer is full
+    async def _monitor(self):
+        from cocotb.triggers import RisingEdge, Timer
+
+        dut = self.dut
+        await Timer(1, units="ns")
+        dut.bt_clear.value = 0
+        while True:
+            await RisingEdge(dut.bt_full)
+            await self._drain()
+
+    #Copy the records in the tb.v buffer to the trace and empty it
+    async def _drain(self):
+        from cocotb.triggers import Timer
+
+        dut = self.dut
+        dut.bt_dump.value = 1
+        await Timer(1, units="ns")
+        dut.bt_dump.value = 0
+        await Timer(1, units="ns")
+        if dut.bt_dumped.value.integer:
+            for record in read_tb_buffer():
+                self._add(*record)
+
+    #Add one cycle worth of pin values to the trace (cu_state is read from the DUT if not given)
+    def sample(self, uo_out, uio_out, uio_oe, uio_in, cu_state=None):
+        if cu_state is None:
+            cu_state = _read(self.cu_state) if self.cu_state is not None else CU_STATE_NONE
+        self._add(self.cycle, uo_out, uio_out, uio_oe, uio_in, cu_state)
+
+    def _add(self, cycle, uo_out, uio_out, uio_oe, uio_in, cu_state):
+        oe         = 1 if uio_oe else 0
+        addr       = uo_out & 0x7f
+        we         = uo_out >> 7
+        data       = uio_out if oe else uio_in
+        self.cycle = cycle + 1
+
+        #Skip repeats if we only want changes (tb.v only skips exact repeats of the pins)
+        if self.changes_only:
+            bus = (addr, we, data, oe, cu_state)
+            if bus == self._last:
+                return
+            self._last = bus
+
+        RECORD_STRUCT.pack_into(self._buf, self._fill * RECORD_SIZE, cycle, addr, we, data, oe, cu_state)
+        self._fill += 1
+        if self._fill == self._block:
+            self.flush()
+
+    #Write out any buffered records
+    def flush(self):
+        if self._fill:
+            self._file.write(memoryview(self._buf)[:self._fill * RECORD_SIZE])
+            self.records += self._fill
+            self._fill    = 0
+
+    #Stop sampling and write out what is left in the tb.v buffer
+    async def close(self):
+        if self._task is not None:
+            self._task.kill()
+            self._task = None
+            self.dut.bt_enable.value = 0
+            await self._drain()
+        self.close_file()
+
+    #Write out the buffered records and close the file (all there is to do for sample() writers)
+    def close_file(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+
+#Reader
+#-------------------------
+
+#Read and check the header, returns (flags, number of records)
+def read_header(path):
+    with open(path, "rb") as f:
+        header = f.read(HEADER_SIZE)
+        f.seek(0, 2)
+        size = f.tell()
+
+    if len(header) != HEADER_SIZE:
+        raise ValueError(f"{path}: truncated bus trace header")
+
+    magic, version, flags, record_size = HEADER_STRUCT.unpack(header)
+    if magic != TRACE_MAGIC or version != TRACE_VERSION or record_size != RECORD_SIZE:
+        raise ValueError(f"{path}: not a version {TRACE_VERSION} minibyte bus trace")
+
+    #A partially written last record (killed sim) is ignored
+    return flags, (size - HEADER_SIZE) // RECORD_SIZE
+
+#Zero-copy numpy view of all records (structured array with the record_dtype() fields)
+def load_bus_trace(path):
+    import numpy as np
+
+    _, count = read_header(path)
+    if count == 0:
+        return np.zeros(0, dtype=record_dtype())
+
+    return np.memmap(path, dtype=record_dtype(), mode="r", offset=HEADER_SIZE, shape=(count,))
+
+#Iterate over the records without numpy (mmap backed, nothing is read up front)
+def iter_bus_trace(path):
+    _, count = read_header(path)
+    if count == 0:
+        return
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        view = memoryview(mm)[HEADER_SIZE:HEADER_SIZE + count * RECORD_SIZE]
+        try:
+            for record in RECORD_STRUCT.iter_unpack(view):
+                yield BusRecord._make(record)
+        finally:
+            view.release()
+
+
+#Analysis
+#-------------------------
+
+#Index of the record in effect on cycle (the last one at or before it), -1 if none
+def record_at(trace, cycle):
+    import numpy as np
+
+    return int(np.searchsorted(trace["cycle"], cycle, side="right")) - 1
+
+#Cycle of the first difference between the two traces (None if they match)
+#The traces are walked by cycle number, a changes_only record holds until the next one, so full
+#and changes_only traces of the same run match (pass the FLAG_CHANGES_ONLY of each header as
+#a_changes_only/b_changes_only). The CU state is only compared when both traces have it
+def first_difference(a, b, a_changes_only=False, b_changes_only=False):
+    import numpy as np
+
+    if len(a) == 0 or len(b) == 0:
+        if len(a) == len(b):
+            return None
+        return int((a if len(a) else b)["cycle"][0])
+
+    fields = ["addr", "we", "data", "oe"]
+    if (a["cu_state"] != CU_STATE_NONE).all() and (b["cu_state"] != CU_STATE_NONE).all():
+        fields.append("cu_state")
+
+    #Every cycle either trace has a record on, and the record of each trace in effect there
+    cycles = np.union1d(a["cycle"], b["cycle"])
+    ia     = np.searchsorted(a["cycle"], cycles, side="right") - 1
+    ib     = np.searchsorted(b["cycle"], cycles, side="right") - 1
+    diff   = (ia < 0) | (ib < 0)
+    ia, ib = np.maximum(ia, 0), np.maximum(ib, 0)
+    for field in fields:
+        diff |= a[field][ia] != b[field][ib]
+
+    #A full trace ends on its last record, a changes_only one holds its last record on
+    for trace, changes_only in ((a, a_changes_only), (b, b_changes_only)):
+        if not changes_only:
+            diff |= cycles > trace["cycle"][-1]
+
+    where = np.flatnonzero(diff)
+    return int(cycles[where[0]]) if len(where) else None
+
+#All write transactions (WE high while the CPU drives the buss)
+def writes(trace):
+    return trace[(trace["we"] == 1) & (trace["oe"] == 1)]
+
+
+#Replay
+#-------------------------
+
+#Drive uio_in from a recorded trace so the same program runs again without the original memory model
+#Must be started on the same cycle the writer was started on, and only full (not changes_only)
+#traces can be replayed. Works on both BusRecords and numpy records (fields are read by position)
+#Returns the cycle of the first record where the CPU outputs differ from the recording, or None
+async def replay_bus_trace(dut, trace, check=True):
+    from cocotb.triggers import FallingEdge
+
+    falling = FallingEdge(dut.clk)
+    for record in trace:
+        cycle, addr, we, data, oe = (int(field) for field in tuple(record)[:5])
+        await falling
+
+        #Memory is driving, replay what it drove
+        if not oe:
+            dut.uio_in.value = data
+
+        if not check:
+            continue
+
+        #Compare what the CPU put out against the recording
+        uo_out = _read(dut.uo_out)
+        if (uo_out & 0x7f) != addr or (uo_out >> 7) != we or (1 if _read(dut.uio_oe) else 0) != oe:
+            return cycle
+        if oe and _read(dut.uio_out) != data:
+            return cycle
+
+    return None
+
+
+#Command line
+#-------------------------
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Summarize or diff minibyte bus traces")
+    parser.add_argument("trace")
+    parser.add_argument("--diff",   help="second trace to compare against")
+    parser.add_argument("--head",   type=int, default=0, help="print the first N records")
+    parser.add_argument("--writes", action="store_true",  help="print every write transaction")
+    args = parser.parse_args(argv)
+
+    flags, count = read_header(args.trace)
+    print(f"{args.trace}: {count} records, cu_state={'yes' if flags & FLAG_CU_STATE else 'no'}, "
+          f"changes_only={'yes' if flags & FLAG_CHANGES_ONLY else 'no'}")
+
+    for i, record in enumerate(iter_bus_trace(args.trace)):
+        if i < args.head or (args.writes and record.we and record.oe):
+            print(f"{record.cycle:>12} addr=0x{record.addr:02x} we={record.we} data=0x{record.data:02x} oe={record.oe}"
+                  + (f" state=0x{record.cu_state:02x}" if record.cu_state != CU_STATE_NONE else ""))
+        elif i >= args.head and not args.writes:
+            break
+
+    if args.diff:
+        a       = load_bus_trace(args.trace)
+        b       = load_bus_trace(args.diff)
+        a_flags = flags & FLAG_CHANGES_ONLY
+        b_flags = read_header(args.diff)[0] & FLAG_CHANGES_ONLY
+        cycle   = first_difference(a, b, bool(a_flags), bool(b_flags))
+        if cycle is None:
+            print("Traces match")
+            return 0
+        print(f"First difference at cycle {cycle}")
+        for name, trace, changes_only in ((args.trace, a, a_flags), (args.diff, b, b_flags)):
+            index = record_at(trace, cycle)
+            if index < 0:
+                print(f"  {name}: <not started>")
+            elif not changes_only and cycle > trace["cycle"][-1]:
+                print(f"  {name}: <ended>")
+            else:
+                print(f"  {name}: {trace[index]}")
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,264 @@
+# SPDX-FileCopyrightText: © 2024 Zachary Frazee
+# SPDX-License-Identifier: Apache-2.0
+
+#Multi-seed regression campaigns
+#
+#Runs the randomized cocotb tests over many seeds, several simulator processes at a time:
+#   - every (test, seed) job gets its own directory (results.xml, tb.vcd, sim.log)
+#   - the design is compiled once up front and shared by every job
+#   - on the first failure the outstanding jobs are cancelled, running ones are killed, and the
+#     failing job's directory is kept together with the command to reproduce it
+#   - at the end, per-test pass rates and wall/sim time distributions are printed and written
+#     to <out>/summary.json
+#
+#   python campaign.py --seeds 200 --jobs 8
+#   python campaign.py --tests test_alu_ccr --seed-base 1000 --seeds 50 --keep-going
+
+#Includes
+#-------------------------
+import json
+import os
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+#Constants
+#-------------------------
+TEST_DIR     = os.path.dirname(os.path.abspath(__file__))
+
+#Tests that draw from the random module (and so change with RANDOM_SEED)
+RANDOM_TESTS = ["test_alu_imm_dir", "test_alu_ccr"]
+
+#Job
+#-------------------------
+class Job:
+    def __init__(self, test, seed, workdir):
+        self.test    = test
+        self.seed    = seed
+        self.workdir = workdir
+        self.passed  = None
+        self.wall    = None
+        self.sim_ns  = None
+        self.message = ""
+        self.proc    = None
+
+    @property
+    def name(self):
+        return f"{self.test}_{self.seed}"
+
+    #Command line to rerun this job by hand
+    def repro(self, gates=False):
+        return f"make -C {TEST_DIR} TESTCASE={self.test} RANDOM_SEED={self.seed}" + (" GATES=yes" if gates else "")
+
+#make command line for one job. The Makefile finds the sources through $(PWD), so that is pinned
+#to the test directory while make itself runs in the job directory (results.xml, tb.vcd land there)
+def _make_command(sim_build, gates):
+    command = ["make", "-f", os.path.join(TEST_DIR, "Makefile"), f"PWD={TEST_DIR}", f"SIM_BUILD={sim_build}"]
+    if gates:
+        command.append("GATES=yes")
+    return command
+
+def _make_env(test, seed):
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH" : os.pathsep.join(filter(None, [TEST_DIR, env.get("PYTHONPATH")])),
+        "TESTCASE"   : test,
+        "RANDOM_SEED": str(seed),
+    })
+    return env
+
+#Pull pass/fail, sim time and the failure message out of cocotb's results.xml
+def _parse_results(job):
+    path = os.path.join(job.workdir, "results.xml")
+    if not os.path.exists(path):
+        job.passed  = False
+        job.message = "no results.xml (simulator crashed?)"
+        return
+
+    cases = [case for case in ET.parse(path).iter("testcase") if case.get("name") == job.test]
+    if not cases:
+        job.passed  = False
+        job.message = f"{job.test} did not run"
+        return
+
+    case        = cases[0]
+    failure     = case.find("failure")
+    job.passed  = failure is None
+    job.sim_ns  = float(case.get("sim_time_ns", "nan"))
+    if failure is not None:
+        job.message = (failure.get("message") or failure.text or "failed").strip().splitlines()[0]
+
+
+#Campaign
+#-------------------------
+class Campaign:
+    def __init__(self, tests, seeds, jobs, out, gates=False, keep_going=False, keep_all=False, log=print):
+        self.tests      = tests
+        self.seeds      = seeds
+        self.jobs       = jobs
+        self.out        = os.path.abspath(out)
+        self.gates      = gates
+        self.keep_going = keep_going
+        self.keep_all   = keep_all
+        self.log        = log
+        self.sim_build  = os.path.join(self.out, "sim_build", "gl" if gates else "rtl")
+        self.results    = []
+        self.cancelled  = 0
+        self._stop      = threading.Event()
+        self._lock      = threading.Lock()
+        self._running   = set()
+
+    def _run_job(self, job):
+        if self._stop.is_set():
+            return job
+
+        os.makedirs(job.workdir, exist_ok=True)
+        start = time.monotonic()
+        with open(os.path.join(job.workdir, "sim.log"), "w") as log:
+            job.proc = subprocess.Popen(
+                _make_command(self.sim_build, self.gates),
+                cwd=job.workdir, env=_make_env(job.test, job.seed),
+                stdout=log, stderr=subprocess.STDOUT, start_new_session=True
+            )
+            #A cancel between the check above and here has already swept _running, so go
+            #down on our own
+            with self._lock:
+                self._running.add(job)
+                if self._stop.is_set():
+                    os.killpg(job.proc.pid, signal.SIGTERM)
+            job.proc.wait()
+            with self._lock:
+                self._running.discard(job)
+        job.wall = time.monotonic() - start
+
+        #Killed by a cancel, not a real result
+        if self._stop.is_set() and job.proc.returncode < 0:
+            job.passed = None
+            return job
+
+        _parse_results(job)
+        return job
+
+    #Kill every simulator still running (whole process group, make + vvp)
+    def _kill_running(self):
+        with self._lock:
+            for job in self._running:
+                try:
+                    os.killpg(job.proc.pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+    def run(self):
+        os.makedirs(self.out, exist_ok=True)
+        jobs = [Job(test, seed, os.path.join(self.out, f"{test}_{seed}")) for seed in self.seeds for test in self.tests]
+        if not jobs:
+            return True
+
+        #First job on its own so the compile happens once, the rest reuse the build
+        self.log(f"Campaign: {len(jobs)} jobs ({len(self.tests)} tests x {len(self.seeds)} seeds), {self.jobs} at a time")
+        self._finish(self._run_job(jobs[0]))
+
+        if self._stop.is_set():
+            self.cancelled = len(jobs) - 1
+        else:
+            with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                futures = [pool.submit(self._run_job, job) for job in jobs[1:]]
+                for future in as_completed(futures):
+                    if future.cancelled():
+                        continue
+                    self._finish(future.result())
+                    if self._stop.is_set():
+                        self.cancelled = sum(future.cancel() for future in futures)
+                        self._kill_running()
+
+        self.report()
+        return all(job.passed for job in self.results)
+
+    def _finish(self, job):
+        #Cancelled while running, nothing worth keeping
+        if job.passed is None:
+            shutil.rmtree(job.workdir, ignore_errors=True)
+            return
+        self.results.append(job)
+
+        if job.passed:
+            if not self.keep_all:
+                shutil.rmtree(job.workdir, ignore_errors=True)
+            return
+
+        self.log(f"FAIL {job.name}: {job.message}")
+        self.log(f"     artifacts: {job.workdir}")
+        self.log(f"     reproduce: {job.repro(self.gates)}")
+        with open(os.path.join(job.workdir, "repro.txt"), "w") as f:
+            f.write(job.repro(self.gates) + "\n")
+        if not self.keep_going:
+            self._stop.set()
+
+    #Statistics
+    #-------------------------
+    def stats(self):
+        stats = {}
+        for test in self.tests:
+            runs = [job for job in self.results if job.test == test]
+            if not runs:
+                continue
+            walls  = sorted(job.wall for job in runs)
+            sims   = [job.sim_ns for job in runs if job.sim_ns is not None]
+            stats[test] = {
+                "runs"         : len(runs),
+                "passed"       : sum(job.passed for job in runs),
+                "pass_rate"    : sum(job.passed for job in runs) / len(runs),
+                "failing_seeds": [job.seed for job in runs if not job.passed],
+                "wall_s"       : {
+                    "min"   : walls[0],
+                    "median": statistics.median(walls),
+                    "mean"  : statistics.fmean(walls),
+                    "p95"   : walls[min(len(walls) - 1, int(0.95 * len(walls)))],
+                    "max"   : walls[-1],
+                },
+                "sim_ns_mean"  : statistics.fmean(sims) if sims else None,
+            }
+        return stats
+
+    def report(self):
+        stats = self.stats()
+        with open(os.path.join(self.out, "summary.json"), "w") as f:
+            json.dump({"seeds": list(self.seeds), "cancelled": self.cancelled, "tests": stats}, f, indent=2)
+
+        self.log(f"{'test':<20}{'runs':>6}{'pass':>8}{'wall min':>10}{'median':>9}{'p95':>9}{'max':>9}")
+        for test, s in stats.items():
+            wall = s["wall_s"]
+            self.log(f"{test:<20}{s['runs']:>6}{s['pass_rate'] * 100:>7.1f}%"
+                     f"{wall['min']:>9.1f}s{wall['median']:>8.1f}s{wall['p95']:>8.1f}s{wall['max']:>8.1f}s")
+        if self.cancelled:
+            self.log(f"{self.cancelled} jobs cancelled after the first failure")
+
+
+#Command line
+#-------------------------
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the randomized tests over many seeds in parallel")
+    parser.add_argument("--tests",      nargs="+", default=RANDOM_TESTS)
+    parser.add_argument("--seeds",      type=int, default=100,               help="number of seeds")
+    parser.add_argument("--seed-base",  type=int, default=1,                 help="first seed")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count())
+    parser.add_argument("--out",        default=os.path.join(TEST_DIR, "campaign"))
+    parser.add_argument("--gates",      action="store_true",                 help="run on the gate level netlist")
+    parser.add_argument("--keep-going", action="store_true",                 help="do not stop on the first failure")
+    parser.add_argument("--keep-all",   action="store_true",                 help="keep the artifacts of passing jobs too")
+    args = parser.parse_args(argv)
+
+    campaign = Campaign(args.tests, range(args.seed_base, args.seed_base + args.seeds), args.jobs, args.out,
+                        gates=args.gates, keep_going=args.keep_going, keep_all=args.keep_all)
+    return 0 if campaign.run() else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,107 @@
+# SPDX-FileCopyrightText: © 2024 Zachary Frazee
+# SPDX-License-Identifier: Apache-2.0
+
+#Multi-cycle waits without a Python wakeup per clock edge
+#
+#ClockCycles(clk, n) awaits n edges one after the other, every one a trip through the GPI and the
+#scheduler. FastClockCycles(clk, n) is a drop-in for it that lets the simulator run on its own:
+#   - await the first edge, the clock period is known from an earlier wait on the same signal in
+#     the same test (or measured on the next edge the first time, or passed in steps, e.g. Clock.period)
+#   - one Timer to a quarter period past edge n-1, off both clock edges
+#   - await edge n, the very trigger ClockCycles would have resumed on, so whatever the test
+#     reads or writes next happens at the same point of the same edge
+#The edge it lands on is checked against the period. If the clock did not keep it (restarted
+#slower) the wait measures the period again and counts the rest of the edges one by one,
+#ClockAdvanceError is only raised when it has already gone past edge n. A period that changes
+#within a test can still land on an edge that fits the old one, so a test that changes it must
+#pass period=. Short waits (below MIN_CYCLES) are plain ClockCycles, they would not save anything.
+#
+#Under a cocotb Clock this only removes the test's wakeups, the Clock coroutine still toggles clk
+#from Python on every edge: an n cycle wait goes from about 3n wakeups to 2n + 3. Worth it for
+#long waits only, runs that need the clock out of Python have tb.v drive it.
+#
+#   await FastClockCycles(dut.clk, 10)
+#   await FastClockCycles(dut.clk, 1000, period=clock.period)
+
+#Includes
+#-------------------------
+import cocotb
+from cocotb.triggers import ClockCycles, Timer
+from cocotb.utils import get_sim_time
+
+#Constants
+#-------------------------
+MIN_CYCLES = 4                  #First edge, Timer and last edge: 3 wakeups at best
+
+#Signal path -> (test, period, time of the last edge seen), periods in simulator steps
+_clocks    = {}
+
+
+class ClockAdvanceError(AssertionError):
+    pass
+
+
+#Each test starts its own Clock, what was learnt in another test does not count
+def _current_test():
+    return getattr(getattr(cocotb, "regression_manager", None), "_test_task", None)
+
+#Period of signal if it was learnt in this test and its edge at now is in step with the one
+#seen last, else None
+def _known_period(signal, now):
+    test, period, last = _clocks.get(signal._path, (None, None, None))
+    if test is not _current_test() or period is None or (now - last) % period:
+        return None
+    return period
+
+
+#Trigger
+#-------------------------
+#period is in simulator steps, None to learn it from the clock
+class FastClockCycles(ClockCycles):
+    def __init__(self, signal, num_cycles, rising=True, period=None):
+        super().__init__(signal, num_cycles, rising)
+        self.period = period
+
+    async def _wait(self):
+        edge  = self._type(self.signal)
+        count = self.num_cycles
+        if count < MIN_CYCLES:
+            for _ in range(count):
+                await edge
+            return self
+
+        await edge
+        start  = get_sim_time("step")
+        period = self.period or _known_period(self.signal, start)
+        if not period:
+            await edge
+            period = get_sim_time("step") - start
+
+        now  = get_sim_time("step")
+        land = start + (count - 2) * period + max(period // 4, 1)
+        if land > now:
+            await Timer(land - now, units="step")
+        await edge
+
+        end = get_sim_time("step")
+        if end != start + (count - 1) * period:
+            await self._recount(edge, start, end, period)
+            return self
+        _clocks[self.signal._path] = (_current_test(), period, end)
+        return self
+
+    #The clock does not run at period: measure it on the next edge, work out how many edges went
+    #by since start and wait for the rest one at a time
+    async def _recount(self, edge, start, end, period):
+        _clocks.pop(self.signal._path, None)
+        await edge
+        now          = get_sim_time("step")
+        actual       = now - end
+        passed, rest = divmod(now - start, actual) if actual > 0 else (0, 1)
+        passed      += 1
+        if rest or passed > self.num_cycles:
+            raise ClockAdvanceError(f"{self!r}: clock period {actual} steps, not {period}, "
+                                    f"edge {self.num_cycles} went by before step {end}")
+        for _ in range(self.num_cycles - passed):
+            await edge
+        _clocks[self.signal._path] = (_current_test(), actual, get_sim_time("step"))
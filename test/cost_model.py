@@ -0,0 +1,312 @@
+# SPDX-FileCopyrightText: © 2024 Zachary Frazee
+# SPDX-License-Identifier: Apache-2.0
+
+#What-if timing model for control_unit.v
+#
+#Every instruction walks a fixed path of CU states (S_FETCH_0 .. back to S_FETCH_0), one cycle
+#each. A variant changes what states cost instead of changing the RTL:
+#   - {state: cycles}               e.g. {S_FETCH_2: 0}, fold the PC increment into S_FETCH_1
+#   - {(from, to): cycles}          cost of "to" only when entered from "from", e.g.
+#                                   {(S_ADD_IMM_1, S_PC_INC_0): 0}
+#A state costing 0 is merged into the state before it on the path. Merges are checked against
+#the control outputs of the states involved (a merged state must not need a register one of
+#the states it is merged with writes), so impossible variants are flagged, not just ranked.
+#
+#Traces are histograms of state paths, taken from reference model runs (the benchmark kernels
+#and the demo ROM by default) or from bus traces recorded with the CU state.
+#
+#   python cost_model.py
+#   python cost_model.py --trace traces/test_demorom.bin
+
+#Includes
+#-------------------------
+import sys
+from collections import Counter, namedtuple
+
+import minibyte_isa
+from minibyte_isa import (TM_ONBOARD_RAM, S_PC_INC_0, S_FETCH_0, S_FETCH_1, S_FETCH_2, S_DECODE_0,
+                          S_STA_IND_0, S_JMP_DIR_0, S_JMP_IND_0, IR_NAMES, S_NAMES)
+from minibyte_model import ALU_PASSB, CU_BRANCH, CU_DECODE, CU_NEXT, CU_OUTPUTS, MinibyteModel
+
+#Constants
+#-------------------------
+ALU_STATES = ("ADD", "SUB", "AND", "OR", "XOR", "LSL", "LSR", "ASL", "ASR", "RSL", "RSR")
+
+#name        - short name for the tables
+#costs       - {state or (from, to): cycles}, everything else costs 1
+#description - what the RTL change would be
+Variant = namedtuple("Variant", ["name", "costs", "description"])
+
+Estimate = namedtuple("Estimate", ["variant", "cycles", "speedup", "hazards"])
+
+
+#State Paths
+#-------------------------
+
+#States of one instruction from S_FETCH_0 up to (not including) the next S_FETCH_0
+def state_path(ir, taken=True):
+    path  = [S_FETCH_0, S_FETCH_1, S_FETCH_2, S_DECODE_0]
+    if ir in CU_BRANCH:
+        state = CU_BRANCH[ir][2] if taken else S_PC_INC_0
+    else:
+        state = CU_DECODE.get(ir, S_FETCH_0)
+    while state != S_FETCH_0:
+        path.append(state)
+        state = CU_NEXT[state]
+    return tuple(path)
+
+#Every path the CU can take, {path: [names]}. Opcodes can share a path (a taken BNE_DIR runs
+#the JMP_DIR states), so each path keeps the names of all of them
+def all_paths():
+    paths = {}
+    for ir, name in IR_NAMES.items():
+        if ir in CU_BRANCH:
+            outcomes = ((name + " taken", True), (name + " not taken", False))
+        else:
+            outcomes = ((name, True),)
+        for label, taken in outcomes:
+            paths.setdefault(state_path(ir, taken), []).append(label)
+    return paths
+
+#Split a per cycle list of CU states into a Counter of instruction paths
+#Cycles halted in S_FETCH_0 are not charged, the partial instruction at either end is dropped
+def paths_from_states(states):
+    paths   = Counter()
+    current = None
+    for state in states:
+        if state == S_FETCH_0:
+            if current is not None and current[-1] == S_FETCH_0:
+                continue
+            if current:
+                paths[tuple(current)] += 1
+            current = [state]
+        elif current is not None:
+            current.append(state)
+    return paths
+
+#Paths of a reference model run, max_cycles or until(model) is true
+def paths_from_model(model, max_cycles, until=None):
+    paths = Counter()
+    end   = model.cycles + max_cycles
+    while model.state != S_FETCH_0:
+        model.cycle()
+    while model.cycles < end:
+        path = [model.state]
+        model.cycle()
+        while model.state != S_FETCH_0:
+            path.append(model.state)
+            model.cycle()
+        paths[tuple(path)] += 1
+        if until is not None and until(model):
+            break
+    return paths
+
+#Paths out of a bus trace recorded with the CU state (make BUS_TRACE=<dir> does)
+#Change only traces are expanded again from the cycle numbers
+def paths_from_bus_trace(path):
+    from bus_trace import CU_STATE_NONE, iter_bus_trace
+
+    def states():
+        previous = None
+        for record in iter_bus_trace(path):
+            if record.cu_state == CU_STATE_NONE:
+                raise ValueError(f"{path}: recorded without the CU state")
+            if previous is not None:
+                for _ in range(record.cycle - previous.cycle - 1):
+                    yield previous.cu_state
+            yield record.cu_state
+            previous = record
+
+    return paths_from_states(states())
+
+
+#Hazards
+#-------------------------
+
+#(reads, writes) of a state, from its control outputs
+def state_access(state):
+    addr_m, alu_op, set_a, set_m, set_pc, inc_pc, set_ir, set_ccr, we, drive = CU_OUTPUTS[state]
+    latch  = set_a or set_m or set_pc or set_ir
+    reads  = set()
+    writes = set()
+
+    if latch or we:
+        reads.add("m" if addr_m else "pc")
+        reads.add("bus")
+    if latch and alu_op != ALU_PASSB or drive:
+        reads.add("a")
+    if inc_pc:
+        reads.add("pc")
+    if state == S_DECODE_0:
+        reads.update(("ir", "ccr"))
+
+    for name, flag in (("a", set_a), ("m", set_m), ("pc", set_pc or inc_pc), ("ir", set_ir), ("ccr", set_ccr), ("mem", drive)):
+        if flag:
+            writes.add(name)
+    return reads, writes
+
+#What goes wrong if these consecutive states become one cycle, [] if nothing
+def merge_hazards(states):
+    hazards = []
+    written = {}
+    bus     = None
+    for state in states:
+        reads, writes = state_access(state)
+
+        #Reading a register an earlier state of the group only just wrote
+        for name in sorted(reads & set(written)):
+            if name != "bus":
+                hazards.append(f"{S_NAMES[state]} needs {name} written by {S_NAMES[written[name]]}")
+
+        #Two different addresses on the bus in one cycle
+        if "bus" in reads:
+            address = "m" if CU_OUTPUTS[state][0] else "pc"
+            if bus is not None and bus[0] != address:
+                hazards.append(f"{S_NAMES[state]} and {S_NAMES[bus[1]]} both use the bus")
+            bus = bus or (address, state)
+
+        for name in writes:
+            written.setdefault(name, state)
+    return hazards
+
+
+#Cost Model
+#-------------------------
+class CostModel:
+    def __init__(self, variant):
+        self.variant = variant
+        self.costs   = variant.costs
+
+    def state_cost(self, previous, state):
+        if (previous, state) in self.costs:
+            return self.costs[(previous, state)]
+        return self.costs.get(state, 1)
+
+    def path_cycles(self, path):
+        cycles   = 0
+        previous = None
+        for state in path:
+            cycles  += self.state_cost(previous, state)
+            previous = state
+        return cycles
+
+    def cycles(self, paths):
+        return sum(count * self.path_cycles(path) for path, count in paths.items())
+
+    #Groups of states that end up in one cycle on these paths
+    def merged_groups(self, paths):
+        groups = set()
+        for path in paths:
+            group    = [path[0]]
+            previous = path[0]
+            for state in path[1:] + (S_FETCH_0,):
+                if self.state_cost(previous, state) == 0 and state != S_FETCH_0:
+                    group.append(state)
+                else:
+                    if len(group) > 1:
+                        groups.add(tuple(group))
+                    group = [state]
+                previous = state
+        return groups
+
+    def hazards(self, paths):
+        hazards = set()
+        for group in self.merged_groups(paths):
+            hazards.update(merge_hazards(group))
+        return sorted(hazards)
+
+
+#Variants
+#-------------------------
+def _imm_pc_inc():
+    return {(getattr(minibyte_isa, f"S_{name}_IMM_1"), S_PC_INC_0): 0 for name in ALU_STATES + ("LDA",)}
+
+def _wait_states():
+    costs = {getattr(minibyte_isa, f"S_{name}_DIR_0"): 0 for name in ALU_STATES + ("LDA", "STA")}
+    costs.update({getattr(minibyte_isa, f"S_{name}_IMM_0"): 0 for name in ALU_STATES + ("LDA",)})
+    costs.update({S_STA_IND_0: 0, S_JMP_DIR_0: 0, S_JMP_IND_0: 0})
+    return costs
+
+VARIANTS = [
+    Variant("baseline",       {},                                    "control_unit.v as it is"),
+    Variant("fold_fetch_2",   {S_FETCH_2: 0},                        "increment PC in S_FETCH_1 while IR loads"),
+    Variant("fold_decode",    {S_DECODE_0: 0},                       "decode in S_FETCH_2"),
+    Variant("fold_fetch_2_decode", {S_FETCH_2: 0, S_DECODE_0: 0},    "S_FETCH_1 loads IR, increments PC and decodes"),
+    Variant("imm_pc_inc",     _imm_pc_inc(),                         "IMM ops increment PC in their last state"),
+    Variant("no_pc_inc",      {S_PC_INC_0: 0},                       "every op increments PC in its last state"),
+    Variant("no_wait_states", _wait_states(),                        "drop the address setup state (<op>_0) of every op"),
+    Variant("fetch_and_pc",   {S_FETCH_2: 0, S_PC_INC_0: 0},          "fold_fetch_2 + no_pc_inc"),
+]
+
+def variant_by_name(name):
+    for variant in VARIANTS:
+        if variant.name == name:
+            return variant
+    raise KeyError(name)
+
+
+#Ranking
+#-------------------------
+
+#Estimate every variant on the paths, best projected speedup first
+def rank(paths, variants=VARIANTS):
+    baseline  = CostModel(VARIANTS[0]).cycles(paths)
+    estimates = []
+    for variant in variants:
+        model  = CostModel(variant)
+        cycles = model.cycles(paths)
+        estimates.append(Estimate(variant, cycles, baseline / cycles if cycles else float("inf"), model.hazards(paths)))
+    return sorted(estimates, key=lambda estimate: estimate.cycles)
+
+def format_ranking(estimates):
+    lines = [f"{'variant':<22}{'cycles':>10}{'speedup':>9}  hazards"]
+    for e in estimates:
+        lines.append(f"{e.variant.name:<22}{e.cycles:>10}{e.speedup:>8.3f}x  {len(e.hazards) or ''}")
+        for hazard in e.hazards:
+            lines.append(f"{'':<43}{hazard}")
+    return "\n".join(lines)
+
+#Paths of the benchmark kernels and a few passes of the demo ROM
+def default_paths(demo_cycles=20000):
+    from benchmarks import BENCHMARKS
+    from minibyte_asm import assemble
+
+    paths = Counter()
+    for bench in BENCHMARKS:
+        program = assemble(bench.source)
+        done    = program.labels["done"]
+        model   = MinibyteModel(bytearray(program.memory), onboard_ram=bool(bench.ui_in & TM_ONBOARD_RAM))
+        paths  += paths_from_model(model, 200000, until=lambda model: model.pc == done)
+
+    paths += paths_from_model(MinibyteModel(demo_rom=True, onboard_ram=True), demo_cycles)
+    return paths
+
+
+#Command line
+#-------------------------
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Rank CU timing changes by projected speedup")
+    parser.add_argument("--trace",   nargs="*", default=[], help="bus traces recorded with the CU state (default: benchmarks + demo ROM on the model)")
+    parser.add_argument("--paths",   action="store_true",   help="also print the path histogram")
+    args = parser.parse_args(argv)
+
+    paths = Counter()
+    for path in args.trace:
+        paths += paths_from_bus_trace(path)
+    if not args.trace:
+        paths = default_paths()
+
+    if args.paths:
+        names = all_paths()
+        for path, count in paths.most_common():
+            print(f"{count:>8}{len(path):>4} cycles  {', '.join(names.get(path, ['?']))}")
+            print(f"{'':<20}{' '.join(S_NAMES[s][2:] for s in path)}")
+        print()
+
+    print(format_ranking(rank(paths)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
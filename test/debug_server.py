@@ -0,0 +1,640 @@
+# SPDX-FileCopyrightText: © 2024 Zachary Frazee
+# SPDX-License-Identifier: Apache-2.0
+
+#Remote debug server for the RTL (inside cocotb) and for the reference model
+#
+#Speaks a small subset of the gdb remote serial protocol over a local TCP socket, so gdb's
+#"target remote" works for the basics and any script can drive it with DebugClient.
+#While the server waits for a command the simulation does not advance at all.
+#
+#Packets:
+#   ?                       last stop reason
+#   g                       registers as 6 hex bytes: A, M, PC, IR, CCR, CU state
+#   p<n>                    one register (same order as g)
+#   m<addr>,<len>           memory (0x78-0x7F is the reg RAM, the rest needs a memory model)
+#   c / s / i               continue / step one instruction / step one clock cycle
+#   Z0,<pc>,1   z0,<pc>,1   set/clear a PC breakpoint (stops in S_FETCH_0 before the fetch)
+#   Z2,<addr>,1             bus address breakpoint on writes (Z3 reads, Z4 any access)
+#   D / k                   detach, the simulation runs on freely
+#   qRcmd,<hex>             monitor commands:
+#       break op <ir>       stop in S_DECODE_0 when IR == ir
+#       break state <s>     stop when the CU enters state s
+#       runto <cycle>       on the next continue, run without any checks up to this cycle
+#                           (one simulator callback), breakpoints on the way are not hit
+#       delete              clear every breakpoint
+#       info                list breakpoints and the current cycle
+#
+#On the RTL a continue hands the breakpoints to comparators in tb.v (up to DBG_SLOTS), which
+#raise one event on a match, so the simulator runs on its own until then, waking the server only
+#every INTERRUPT_POLL cycles to look for a ^C. Steps, the cycles after a stop until the stopping
+#breakpoint may hit again, more breakpoints than tb.v has slots and the model target are polled
+#in Python at every falling edge.
+#
+#With DEBUG_PORT=<port> set test_debug_port in test.py runs the demo ROM under the server;
+#DEBUG_AT=<cycle> lets the simulation run at full speed up to that cycle before it starts
+#listening and DEBUG_TIMEOUT=<seconds> bounds the wait for the client.
+
+#Includes
+#-------------------------
+import os
+import select
+import socket
+import sys
+
+from minibyte_isa import (TM_DEBUG_OUT_A, TM_DEBUG_OUT_A_UPPER, TM_DEBUG_OUT_M, TM_DEBUG_OUT_PC,
+                          TM_DEBUG_OUT_IR, TM_DEBUG_OUT_CCR, TM_DEBUG_OUT_CU_STATE, S_FETCH_0, S_DECODE_0)
+from minibyte_model import MinibyteModel, REG_RAM_BASE, REG_RAM_SIZE
+
+#Constants
+#-------------------------
+DEFAULT_PORT    = 3333
+DEBUG_TIMEOUT   = 600       #Seconds, 0 waits forever
+
+SIGTRAP         = 5
+SIGINT          = 2
+
+REGISTER_NAMES  = ["a", "m", "pc", "ir", "ccr", "state"]
+
+#Breakpoint kinds
+BP_PC           = "pc"
+BP_OP           = "op"
+BP_STATE        = "state"
+BP_WRITE        = "write"
+BP_READ         = "read"
+BP_ACCESS       = "access"
+
+#Z packet type => breakpoint kind (0/1 are sw/hw breakpoints, 2/3/4 are watchpoints)
+Z_KINDS         = {0: BP_PC, 1: BP_PC, 2: BP_WRITE, 3: BP_READ, 4: BP_ACCESS}
+
+#Cycles run between checks for a ^C from the client while continuing
+INTERRUPT_POLL  = 1024
+
+#tb.v breakpoint comparators: slots and dbg_kind of every breakpoint kind
+DBG_SLOTS       = 16
+DBG_KINDS       = {BP_PC: 1, BP_OP: 2, BP_STATE: 3, BP_WRITE: 4, BP_READ: 5, BP_ACCESS: 6}
+
+
+#Targets
+#-------------------------
+
+#Reference model target, everything is synchronous but exposed the same way as the RTL target
+class ModelTarget:
+    name        = "model"
+    comparators = 0
+
+    def __init__(self, model):
+        self.model = model
+
+    @property
+    def cycles(self):
+        return self.model.cycles
+
+    #(pc, ir, state, addr, we) for the cycle the target is stopped in
+    def probe(self):
+        model = self.model
+        addr, we, _, _ = model.bus()
+        return model.pc, model.ir, model.state, addr, we
+
+    async def clock(self):
+        self.model.cycle()
+
+    async def advance(self, cycles):
+        for _ in range(cycles):
+            self.model.cycle()
+
+    async def read_registers(self):
+        return [self.model.a, self.model.m, self.model.pc, self.model.ir, self.model.ccr, self.model.state]
+
+    async def read_memory(self, addr):
+        if addr >= REG_RAM_BASE:
+            return self.model.reg_ram[addr & 0x07]
+        return self.model.memory[addr] & 0xff
+
+#RTL target, stops on falling edges (mid cycle, the registers and CU state are settled and the
+#tests only act on rising edges). Registers are read through the DFT debug output modes so the
+#same target works on the gate level netlist, breakpoints on PC/IR/CU state need the RTL hierarchy
+class RtlTarget:
+    name = "rtl"
+
+    #memory - optional external memory model of the test (anything indexable with 0..127)
+    def __init__(self, dut, memory=None):
+        self.dut     = dut
+        self.memory  = memory
+        self.period  = None
+        self._cycles = 0
+        self._loaded = set()
+
+        #tb.v breakpoint comparators, if this testbench has them
+        self.comparators = DBG_SLOTS if hasattr(dut, "dbg_hit") else 0
+
+        try:
+            cpu         = dut.user_project.cpu
+            self._pc    = cpu.reg_pc.reg_out
+            self._ir    = cpu.reg_ir.reg_out
+            self._state = cpu.cu.curr_state
+            self._ram   = [getattr(dut.user_project.ram, f"r{i}").reg_out for i in range(REG_RAM_SIZE)]
+        except AttributeError:
+            self._pc = self._ir = self._state = self._ram = None
+
+    @property
+    def cycles(self):
+        return self._cycles
+
+    @property
+    def has_hierarchy(self):
+        return self._state is not None
+
+    #Line up on a falling edge and measure the clock period (needed to skip cycles with one Timer)
+    async def attach(self):
+        from cocotb.triggers import FallingEdge
+        from cocotb.utils import get_sim_time
+
+        await FallingEdge(self.dut.clk)
+        start = get_sim_time("step")
+        await FallingEdge(self.dut.clk)
+        self.period   = get_sim_time("step") - start
+        self._cycles += 2
+
+    def probe(self):
+        uo_out = _int(self.dut.uo_out)
+        if not self.has_hierarchy:
+            return None, None, None, uo_out & 0x7f, uo_out >> 7
+        return _int(self._pc), _int(self._ir), _int(self._state), uo_out & 0x7f, uo_out >> 7
+
+    async def clock(self):
+        from cocotb.triggers import FallingEdge
+
+        await FallingEdge(self.dut.clk)
+        self._cycles += 1
+
+    #Half a period short of the target, then the falling edge itself, so there is no race with the clock
+    async def advance(self, cycles):
+        from cocotb.triggers import FallingEdge, Timer
+
+        if cycles <= 0:
+            return
+        if cycles > 1:
+            await Timer(self.period * (cycles - 1) + self.period // 2, units="step")
+        await FallingEdge(self.dut.clk)
+        self._cycles += cycles
+
+    #Have tb.v compare the breakpoints at every falling edge and stop on the first match or after
+    #cycles falling edges, a single trigger for the whole run. Returns the cycles run
+    async def run_until(self, breakpoints, cycles):
+        from cocotb.triggers import RisingEdge
+
+        dut = self.dut
+        if breakpoints != self._loaded:
+            slots = sorted(breakpoints)
+            for n in range(DBG_SLOTS):
+                kind, value = slots[n] if n < len(slots) else (None, 0)
+                dut.dbg_kind[n].value  = DBG_KINDS.get(kind, 0)
+                dut.dbg_value[n].value = value
+            self._loaded = set(breakpoints)
+
+        dut.dbg_limit.value = cycles
+        dut.dbg_count.value = 0
+        dut.dbg_hit.value   = 0
+        dut.dbg_armed.value = 1
+        await RisingEdge(dut.dbg_hit)
+
+        ran = dut.dbg_count.value.integer
+        self._cycles += ran
+        return ran
+
+    async def _debug_out(self, mode):
+        from cocotb.triggers import Timer
+
+        dut     = self.dut
+        tm_bits = _int(dut.ui_in)
+        dut.ui_in.value = (tm_bits & ~0x07) | mode
+        await Timer(1, units="ns")
+        value = _int(dut.uo_out) & 0x7f
+        dut.ui_in.value = tm_bits
+        await Timer(1, units="ns")
+        return value
+
+    #Only 7 bits of each register make it to uo_out, A[7] has its own mode
+    async def read_registers(self):
+        a = await self._debug_out(TM_DEBUG_OUT_A) | (await self._debug_out(TM_DEBUG_OUT_A_UPPER) & 0x01) << 7
+        values = [a]
+        for mode in (TM_DEBUG_OUT_M, TM_DEBUG_OUT_PC, TM_DEBUG_OUT_IR, TM_DEBUG_OUT_CCR, TM_DEBUG_OUT_CU_STATE):
+            values.append(await self._debug_out(mode))
+        return values
+
+    async def read_memory(self, addr):
+        if addr >= REG_RAM_BASE:
+            if self._ram is None:
+                return None
+            return _int(self._ram[addr & 0x07])
+        if self.memory is None:
+            return None
+        return self.memory[addr] & 0xff
+
+#Resolve a signal to an int, treating X/Z as 0
+def _int(handle):
+    try:
+        return handle.value.integer
+    except ValueError:
+        return 0
+
+
+#Packets
+#-------------------------
+def _checksum(data):
+    return sum(data.encode("latin-1")) & 0xff
+
+def _frame(data):
+    return f"${data}#{_checksum(data):02x}".encode("latin-1")
+
+def _hex(text):
+    return text.encode("latin-1").hex()
+
+
+#Server
+#-------------------------
+class DebugServer:
+    def __init__(self, target, port=DEFAULT_PORT, host="127.0.0.1", log=print):
+        self.target      = target
+        self.port        = port
+        self.host        = host
+        self.log         = log
+        self.breakpoints = set()   #(kind, value)
+        self.runto       = None
+        self.last_stop   = SIGTRAP
+        self.ignore      = None    #(breakpoints, addr, we) matching where the target stopped
+        self.no_ack      = False
+        self._conn       = None
+        self._buffer     = b""
+
+    #Socket
+    #-------------------------
+    def _recv(self):
+        data = self._conn.recv(4096)
+        if not data:
+            raise ConnectionError("debug client went away")
+        self._buffer += data
+
+    #Next packet payload, or "\x03" for an interrupt
+    def _read_packet(self):
+        while True:
+            start = self._buffer.find(b"$")
+            if self._buffer[:1] == b"\x03":
+                self._buffer = self._buffer[1:]
+                return "\x03"
+            if start > 0:
+                self._buffer = self._buffer[start:]
+            end = self._buffer.find(b"#")
+            if start >= 0 and end > 0 and len(self._buffer) >= end + 3:
+                data         = self._buffer[1:end].decode("latin-1")
+                self._buffer = self._buffer[end + 3:]
+                if not self.no_ack:
+                    self._conn.sendall(b"+")
+                return data
+            if start < 0:
+                self._buffer = b""
+            self._recv()
+
+    def _send(self, data):
+        self._conn.sendall(_frame(data))
+
+    #A ^C waiting on the socket (only checked every INTERRUPT_POLL cycles while running)
+    def _interrupted(self):
+        if b"\x03" in self._buffer:
+            return True
+        readable, _, _ = select.select([self._conn], [], [], 0)
+        if readable:
+            self._recv()
+        return b"\x03" in self._buffer
+
+    #Breakpoints
+    #-------------------------
+    def _matches(self, pc, ir, state, addr, we):
+        matches = set()
+        for kind, value in self.breakpoints:
+            if kind == BP_PC and state == S_FETCH_0 and pc == value:
+                matches.add((kind, value))
+            elif kind == BP_OP and state == S_DECODE_0 and ir == value:
+                matches.add((kind, value))
+            elif kind == BP_STATE and state == value:
+                matches.add((kind, value))
+            elif kind == BP_WRITE and addr == value and we:
+                matches.add((kind, value))
+            elif kind == BP_READ and addr == value and not we:
+                matches.add((kind, value))
+            elif kind == BP_ACCESS and addr == value:
+                matches.add((kind, value))
+        return matches
+
+    #The breakpoints matching where the target stopped are not hit again until the address/WE
+    #changes or the next instruction boundary (a store keeps WE and its address up for two
+    #cycles, a step off a write watchpoint would stop right away on the second)
+    def _stopped(self, probe):
+        matches     = self._matches(*probe)
+        self.ignore = (matches, probe[3], probe[4]) if matches else None
+
+    def _track(self, probe):
+        if self.ignore is not None and (probe[3:] != self.ignore[1:] or probe[2] == S_FETCH_0):
+            self.ignore = None
+
+    def _hit(self, pc, ir, state, addr, we):
+        matches = self._matches(pc, ir, state, addr, we)
+        if self.ignore is not None:
+            matches -= self.ignore[0]
+        return bool(matches)
+
+    def _add_breakpoint(self, kind, value):
+        if kind in (BP_PC, BP_OP, BP_STATE) and getattr(self.target, "has_hierarchy", True) is False:
+            return "E02"
+        self.breakpoints.add((kind, value))
+        return "OK"
+
+    #Execution
+    #-------------------------
+
+    #Run until a breakpoint, the runto cycle, step_done(probe) or a ^C
+    async def _run(self, step_done=None):
+        target = self.target
+
+        #No checks before the runto cycle: one Timer up to the cycle before it, the loop takes
+        #the last one
+        if step_done is None and self.runto is not None:
+            await target.advance(self.runto - target.cycles - 1)
+
+        polled = 0
+        while True:
+            #A continue with nothing ignored runs on the target's comparators up to the next
+            #match, ^C check or the runto cycle, anything else goes a cycle at a time
+            if step_done is None and self.ignore is None and target.comparators and len(self.breakpoints) <= target.comparators:
+                limit   = INTERRUPT_POLL - polled
+                if self.runto is not None:
+                    limit = max(1, min(limit, self.runto - target.cycles))
+                polled += await target.run_until(self.breakpoints, limit) - 1
+            else:
+                await target.clock()
+            probe = target.probe()
+            self._track(probe)
+
+            if self.runto is not None and target.cycles >= self.runto:
+                self.runto = None
+                break
+            if step_done is not None and step_done(probe):
+                break
+            if self._hit(*probe):
+                break
+
+            polled += 1
+            if polled >= INTERRUPT_POLL:
+                polled = 0
+                if self._interrupted():
+                    self._buffer = self._buffer.replace(b"\x03", b"", 1)
+                    self._stopped(probe)
+                    return SIGINT
+
+        self._stopped(probe)
+        return SIGTRAP
+
+    #Commands
+    #-------------------------
+    async def _handle(self, packet):
+        target = self.target
+        cmd    = packet[:1]
+
+        if packet == "\x03" or cmd == "?":
+            return f"S{self.last_stop:02x}"
+
+        if cmd == "g":
+            return "".join(f"{value:02x}" for value in await target.read_registers())
+
+        if cmd == "p":
+            index = int(packet[1:], 16)
+            if index >= len(REGISTER_NAMES):
+                return "E01"
+            return f"{(await target.read_registers())[index]:02x}"
+
+        if cmd == "m":
+            addr, length = (int(field, 16) for field in packet[1:].split(","))
+            data = []
+            for i in range(length):
+                value = await target.read_memory((addr + i) & 0x7f)
+                if value is None:
+                    return "E01"
+                data.append(f"{value:02x}")
+            return "".join(data)
+
+        if cmd == "c":
+            self.last_stop = await self._run()
+            return f"S{self.last_stop:02x}"
+
+        if cmd == "s":
+            #Next instruction boundary, after at least one cycle (needs the CU state)
+            if getattr(target, "has_hierarchy", True) is False:
+                return "E02"
+            self.last_stop = await self._run(lambda probe: probe[2] == S_FETCH_0)
+            return f"S{self.last_stop:02x}"
+
+        if cmd == "i":
+            await target.clock()
+            self._track(target.probe())
+            self.last_stop = SIGTRAP
+            return f"S{SIGTRAP:02x}"
+
+        if cmd in ("Z", "z"):
+            ztype, value = packet[1:].split(",")[:2]
+            kind = Z_KINDS.get(int(ztype))
+            if kind is None:
+                return ""
+            value = int(value, 16) & (0xff if kind == BP_PC else 0x7f)
+            if cmd == "Z":
+                return self._add_breakpoint(kind, value)
+            self.breakpoints.discard((kind, value))
+            return "OK"
+
+        if packet.startswith("qRcmd,"):
+            return _hex(self._monitor(bytes.fromhex(packet[6:]).decode("latin-1")) + "\n")
+
+        if packet.startswith("qSupported"):
+            return "PacketSize=1000;QStartNoAckMode+"
+        if packet == "QStartNoAckMode":
+            self._send("OK")
+            self.no_ack = True
+            return None
+        if packet == "qAttached":
+            return "1"
+        if packet in ("qfThreadInfo", "qC"):
+            return "m1" if packet == "qfThreadInfo" else "QC1"
+        if packet == "qsThreadInfo":
+            return "l"
+        if cmd == "H":
+            return "OK"
+
+        return ""
+
+    def _monitor(self, line):
+        words = line.split()
+        if not words:
+            return ""
+
+        if words[0] == "break" and len(words) == 3 and words[1] in (BP_PC, BP_OP, BP_STATE, BP_WRITE, BP_READ, BP_ACCESS):
+            reply = self._add_breakpoint(words[1], int(words[2], 0))
+            return "ok" if reply == "OK" else "breakpoint needs the RTL hierarchy"
+        if words[0] == "runto" and len(words) == 2:
+            self.runto = int(words[1], 0)
+            return f"will stop at cycle {self.runto} on continue"
+        if words[0] == "delete":
+            self.breakpoints.clear()
+            return "ok"
+        if words[0] == "info":
+            lines = [f"{self.target.name} target at cycle {self.target.cycles}"]
+            lines += [f"break {kind} 0x{value:02x}" for kind, value in sorted(self.breakpoints)]
+            return "\n".join(lines)
+        return f"unknown monitor command: {line}"
+
+    #Main loop
+    #-------------------------
+
+    #Wait for one client and serve it until it detaches, the simulation is frozen meanwhile
+    #timeout (seconds) bounds the wait for the client and for each packet, None waits forever
+    async def serve(self, timeout=None):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.settimeout(timeout)
+        listener.bind((self.host, self.port))
+        listener.listen(1)
+        self.port = listener.getsockname()[1]
+        self.log(f"Debug server ({self.target.name}) waiting on {self.host}:{self.port} at cycle {self.target.cycles}")
+
+        try:
+            self._conn, _ = listener.accept()
+            self._conn.settimeout(timeout)
+            while True:
+                packet = self._read_packet()
+                if packet[:1] in ("D", "k"):
+                    if packet[:1] == "D":
+                        self._send("OK")
+                    break
+                reply = await self._handle(packet)
+                if reply is not None:
+                    self._send(reply)
+        except ConnectionError:
+            pass
+        except socket.timeout:
+            self.log(f"Debug server timed out after {timeout}s without a command")
+        finally:
+            if self._conn is not None:
+                self._conn.close()
+            listener.close()
+        self.log(f"Debug client detached at cycle {self.target.cycles}")
+
+
+#cocotb
+#-------------------------
+
+#Start the server for a test if DEBUG_PORT is set, memory is the test's external memory model if any
+#Must be called right after reset, DEBUG_AT=<cycle> runs that many cycles first without stopping,
+#DEBUG_TIMEOUT=<seconds> (default DEBUG_TIMEOUT) lets the simulation go on if no client shows up
+#or the client goes quiet
+def start_debug_server(dut, memory=None):
+    port = os.environ.get("DEBUG_PORT")
+    if not port:
+        return None
+
+    import cocotb
+
+    timeout = float(os.environ.get("DEBUG_TIMEOUT", DEBUG_TIMEOUT)) or None
+
+    async def run():
+        target = RtlTarget(dut, memory)
+        await target.attach()
+        await target.advance(int(os.environ.get("DEBUG_AT", "0")) - target.cycles)
+        await DebugServer(target, int(port), log=dut._log.info).serve(timeout)
+
+    return cocotb.start_soon(run())
+
+
+#Client
+#-------------------------
+
+#Minimal blocking client, enough to script a debug session
+class DebugClient:
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, timeout=None):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self._buffer = b""
+
+    def command(self, data):
+        self.sock.sendall(_frame(data))
+        while True:
+            start = self._buffer.find(b"$")
+            end   = self._buffer.find(b"#", start)
+            if start >= 0 and end > 0 and len(self._buffer) >= end + 3:
+                reply        = self._buffer[start + 1:end].decode("latin-1")
+                self._buffer = self._buffer[end + 3:]
+                self.sock.sendall(b"+")
+                return reply
+            chunk = self.sock.recv(4096)
+            if not chunk:
+                raise ConnectionError("debug server went away")
+            self._buffer += chunk
+
+    def registers(self):
+        reply = self.command("g")
+        return dict(zip(REGISTER_NAMES, bytes.fromhex(reply)))
+
+    def read(self, addr, length=1):
+        reply = self.command(f"m{addr:x},{length:x}")
+        if reply.startswith("E"):
+            raise IOError(f"memory read at 0x{addr:02x} failed ({reply})")
+        return bytes.fromhex(reply)
+
+    def reg_ram(self):
+        return self.read(REG_RAM_BASE, REG_RAM_SIZE)
+
+    def monitor(self, line):
+        return bytes.fromhex(self.command("qRcmd," + _hex(line))).decode("latin-1").rstrip("\n")
+
+    def break_pc(self, pc):
+        return self.command(f"Z0,{pc:x},1")
+
+    def cont(self):
+        return self.command("c")
+
+    def step(self):
+        return self.command("s")
+
+    def detach(self):
+        try:
+            self.command("D")
+        finally:
+            self.sock.close()
+
+
+#Command line
+#-------------------------
+
+#Run a coroutine that never really suspends (the model target) to completion without an event loop
+def run_sync(coro):
+    try:
+        while True:
+            coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve the minibyte reference model to a debug client")
+    parser.add_argument("program",       help="raw binary image loaded at address 0")
+    parser.add_argument("--port",        type=int, default=DEFAULT_PORT)
+    parser.add_argument("--demo-rom",    action="store_true", help="same as ui_in[4]")
+    parser.add_argument("--onboard-ram", action="store_true", help="same as ui_in[7]")
+    args = parser.parse_args(argv)
+
+    model = MinibyteModel(demo_rom=args.demo_rom, onboard_ram=args.onboard_ram)
+    with open(args.program, "rb") as f:
+        model.load(f.read())
+
+    run_sync(DebugServer(ModelTarget(model), args.port).serve())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,713 @@
+# SPDX-FileCopyrightText: © 2024 Zachary Frazee
+# SPDX-License-Identifier: Apache-2.0
+
+#Compiler from a small Python syntax language to minibyte assembly (minibyte_asm.py)
+#
+#   total = 0
+#   n = 10
+#   while n != 0:
+#       total += n
+#       n -= 1
+#   out(total)
+#
+#Everything is an 8 bit value:
+#   - statements        x = e, x op= e, if/elif/else, while, pass
+#                       out(e) stores e to the output port, poke(addr, e) stores e to addr
+#   - expressions       + - & | ^ << >> (logical), * by a constant, unary - and ~, peek(addr),
+#                       rol(e, n) ror(e, n) asr(e, n) (rotates and arithmetic shift right)
+#   - conditions        == != < <= > >= (signed, on the sign of the 8 bit difference), and,
+#                       or, not, or any expression (true when not 0)
+#
+#Variables and expression temporaries go in the onboard reg RAM (0x78-0x7F, run with ui_in[7]
+#set), the most used ones first (uses weighted by loop depth). Variables that can be read before
+#they are written are zeroed first, the reg RAM is not reset. Whatever does not fit is spilled
+#to external memory, after the code or at spill_base, or refused with rom=True for boards where
+#external memory is an EEPROM. Code picks IMM forms for constants, DIR forms for variables,
+#keeps track of what A and the CCR already hold, tests loops at the bottom and finally goes
+#through peephole.py.
+#
+#   python dsl_compiler.py program.py -o program.s --check
+
+#Includes
+#-------------------------
+import ast
+import sys
+
+from minibyte_asm import AsmError, assemble
+from minibyte_isa import CYCLES_ALU_IMM, CYCLES_ALU_DIR
+
+#Constants
+#-------------------------
+OUT_PORT      = 0x40            #Where the demo setup latches the data buss
+REG_RAM       = list(range(0x78, 0x80))
+
+BINOPS        = {ast.Add: "add", ast.Sub: "sub", ast.BitAnd: "and", ast.BitOr: "or", ast.BitXor: "xor",
+                 ast.LShift: "lsl", ast.RShift: "lsr"}
+COMMUTATIVE   = ("add", "and", "or", "xor")
+BUILTIN_OPS   = {"rol": "rsl", "ror": "rsr", "asr": "asr"}
+
+#Comparison => (subtract the right from the left?, branch if true, branch if false)
+COMPARES      = {
+    ast.Eq   : (True,  "beq", "bne"),
+    ast.NotEq: (True,  "bne", "beq"),
+    ast.Lt   : (True,  "bmi", "bpl"),
+    ast.GtE  : (True,  "bpl", "bmi"),
+    ast.Gt   : (False, "bmi", "bpl"),
+    ast.LtE  : (False, "bpl", "bmi"),
+}
+
+#Weight of one use per level of loop nesting
+LOOP_WEIGHT   = 8
+
+class CompileError(ValueError):
+    pass
+
+def _error(node, message):
+    return CompileError(f"line {getattr(node, 'lineno', '?')}: {message}")
+
+
+#Compiler
+#-------------------------
+class Compiler:
+    #out_port   - address out() stores to
+    #reg_ram    - addresses variables go to first
+    #spill_base - where spilled variables go (None: right after the code)
+    #rom        - external memory is read only, spilling is an error
+    #optimize   - run the peephole optimizer over the result
+    def __init__(self, out_port=OUT_PORT, reg_ram=REG_RAM, spill_base=None, rom=False, optimize=True):
+        self.out_port   = out_port
+        self.reg_ram    = list(reg_ram)
+        self.spill_base = spill_base
+        self.rom        = rom
+        self.optimize   = optimize
+
+    def compile(self, source):
+        tree = ast.parse(source)
+
+        self.lines    = []
+        self.labels   = 0
+        self.weights  = {}
+        self.temps    = []
+        self.depth    = 0
+        self.io       = {self.out_port}
+        self._forget()
+
+        #The reg RAM comes up holding anything, variables read before they are written start
+        #at 0 (as interpret() has them)
+        for name in sorted(read_before_write(tree.body)):
+            self._expr(ast.Constant(0))
+            self._use("v_" + name)
+            self._emit(f"sta v_{name}")
+
+        self._block(tree.body)
+        self._label("done")
+        self._emit("jmp done")
+
+        code = self._layout()
+        try:
+            assemble(code)
+        except AsmError as e:
+            raise CompileError(f"program does not fit in memory ({e})")
+        if self.optimize:
+            from peephole import Peephole
+            code = Peephole(volatile=self.io).optimize(code)
+
+        #Code reaching into the reg RAM would read back variables when ui_in[7] is set
+        program = assemble(code)
+        limit   = min(self.reg_ram, default=0x80)
+        if program.used and max(program.used) >= limit:
+            raise CompileError(f"program needs {max(program.used) + 1} bytes, only {limit} fit below the reg RAM")
+        return code
+
+    #Output
+    #-------------------------
+    def _emit(self, text):
+        self.lines.append(f"        {text}")
+
+    def _label(self, name):
+        self.lines.append(f"{name}:")
+        self._forget()
+
+    def _new_label(self):
+        self.labels += 1
+        return f"_L{self.labels}"
+
+    #Nothing known about A or the flags (somewhere control flow can join)
+    def _forget(self):
+        self.a     = None       #("var", name) or ("const", value) A is known to hold
+        self.flags = False      #CCR reflects A
+
+    def _use(self, name):
+        self.weights[name] = self.weights.get(name, 0) + LOOP_WEIGHT ** self.depth
+
+    def _var(self, node):
+        self._use("v_" + node.id)
+        return "v_" + node.id
+
+    def _temp(self):
+        name = f"_t{len(self.temps)}"
+        self.temps.append(name)
+        self._use(name)
+        return name
+
+    def _free(self):
+        self.temps.pop()
+
+    #Variables in the reg RAM by weight, the rest spilled
+    def _layout(self):
+        names  = sorted(self.weights, key=lambda name: (-self.weights[name], name))
+        header = [f"; compiled by dsl_compiler.py, run with ui_in[7] set (variables in the reg RAM)"]
+        spills = names[len(self.reg_ram):]
+        if spills and self.rom:
+            raise CompileError(f"{len(names)} variables, only {len(self.reg_ram)} fit in the reg RAM "
+                               f"(spilled: {', '.join(name[2:] for name in spills)})")
+
+        for name, addr in zip(names, self.reg_ram):
+            header.append(f"{name} = 0x{addr:02x}")
+        for i, name in enumerate(spills):
+            if self.spill_base is not None:
+                header.append(f"{name} = 0x{self.spill_base + i:02x}")
+        header.append(f"OUT = 0x{self.out_port:02x}")
+
+        data = [f"{name}: .byte 0" for name in spills] if self.spill_base is None else []
+        return "\n".join(header + self.lines + data) + "\n"
+
+    #Statements
+    #-------------------------
+    def _block(self, body):
+        for statement in body:
+            self._statement(statement)
+
+    def _statement(self, node):
+        if isinstance(node, ast.Assign):
+            if len(node.targets) != 1 or not isinstance(node.targets[0], ast.Name):
+                raise _error(node, "only plain variables can be assigned")
+            self._store(node.targets[0], node.value)
+        elif isinstance(node, ast.AugAssign):
+            if not isinstance(node.target, ast.Name):
+                raise _error(node, "only plain variables can be assigned")
+            value = ast.BinOp(ast.Name(node.target.id, ast.Load()), node.op, node.value, lineno=node.lineno)
+            self._store(node.target, value)
+        elif isinstance(node, ast.If):
+            self._if(node)
+        elif isinstance(node, ast.While):
+            self._while(node)
+        elif isinstance(node, ast.Expr) and isinstance(node.value, ast.Call):
+            self._call_statement(node.value)
+        elif isinstance(node, ast.Pass):
+            pass
+        else:
+            raise _error(node, f"{type(node).__name__} is not supported")
+
+    def _store(self, target, value):
+        name = self._var(target)
+        self._expr(value)
+        self._emit(f"sta {name}")
+        self.a = ("var", name)
+
+    def _call_statement(self, call):
+        name = call.func.id if isinstance(call.func, ast.Name) else None
+        if name == "out" and len(call.args) == 1:
+            self._expr(call.args[0])
+            self._emit("sta OUT")
+        elif name == "poke" and len(call.args) == 2:
+            addr = self._constant(call.args[0])
+            if addr is not None:
+                self.io.add(addr & 0x7f)
+                self._expr(call.args[1])
+                self._emit(f"sta 0x{addr & 0x7f:02x}")
+            else:
+                pointer = self._temp()
+                self._expr(call.args[0])
+                self._emit(f"sta {pointer}")
+                self._expr(call.args[1])
+                self._emit(f"sta ({pointer})")
+                self._free()
+        else:
+            raise _error(call, "only out(e) and poke(addr, e) can be called as statements")
+
+    def _if(self, node):
+        end = self._new_label()
+        if node.orelse:
+            other = self._new_label()
+            self._branch(node.test, other, False)
+            self._block(node.body)
+            self._emit(f"jmp {end}")
+            self._label(other)
+            self._block(node.orelse)
+        else:
+            self._branch(node.test, end, False)
+            self._block(node.body)
+        self._label(end)
+
+    #Guard once on entry, then test at the bottom: one taken branch per iteration instead of a
+    #branch and a jump, and the test sees what the body left in A and the CCR
+    def _while(self, node):
+        if node.orelse:
+            raise _error(node, "while/else is not supported")
+
+        forever = self._constant(node.test)
+        if forever is not None and not forever:
+            return
+
+        body = self._new_label()
+        end  = self._new_label()
+        if forever is None:
+            self._branch(node.test, end, False)
+
+        self.depth += 1
+        self._label(body)
+        self._block(node.body)
+        if forever is None:
+            self._branch(node.test, body, True)
+        else:
+            self._emit(f"jmp {body}")
+        self.depth -= 1
+        self._label(end)
+
+    #Conditions
+    #-------------------------
+
+    #Jump to target when test is (when), fall through otherwise
+    def _branch(self, test, target, when):
+        value = self._constant(test)
+        if value is not None:
+            if bool(value) == when:
+                self._emit(f"jmp {target}")
+            return
+
+        if isinstance(test, ast.UnaryOp) and isinstance(test.op, ast.Not):
+            return self._branch(test.operand, target, not when)
+
+        if isinstance(test, ast.BoolOp):
+            #and jumping on false / or jumping on true: any operand decides
+            decides = isinstance(test.op, ast.And) != when
+            if decides:
+                for operand in test.values:
+                    self._branch(operand, target, when)
+                return
+            skip = self._new_label()
+            for operand in test.values[:-1]:
+                self._branch(operand, skip, not when)
+            self._branch(test.values[-1], target, when)
+            self._label(skip)
+            return
+
+        if isinstance(test, ast.Compare):
+            if len(test.ops) != 1:
+                raise _error(test, "chained comparisons are not supported")
+            left, right = test.left, test.comparators[0]
+            forward, if_true, if_false = COMPARES[type(test.ops[0])]
+
+            #Against 0 the value itself sets the flags
+            if self._constant(right) == 0 and forward:
+                self._expr(left)
+            elif self._constant(left) == 0 and not forward:
+                self._expr(right)
+            elif forward:
+                self._expr(ast.BinOp(left, ast.Sub(), right, lineno=test.lineno))
+            else:
+                self._expr(ast.BinOp(right, ast.Sub(), left, lineno=test.lineno))
+            self._flags()
+            self._emit(f"{if_true if when else if_false} {target}")
+            return
+
+        self._expr(test)
+        self._flags()
+        self._emit(f"{'bne' if when else 'beq'} {target}")
+
+    #Make the CCR reflect A (LDA does not touch it)
+    def _flags(self):
+        if not self.flags:
+            self._emit("or #0")
+            self.flags = True
+
+    #Expressions
+    #-------------------------
+
+    #Value of a constant expression (folded), None if it is not constant
+    def _constant(self, node):
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, bool)):
+            return int(node.value) & 0xff
+        if isinstance(node, ast.UnaryOp):
+            value = self._constant(node.operand)
+            if value is None:
+                return None
+            if isinstance(node.op, ast.USub):
+                return -value & 0xff
+            if isinstance(node.op, ast.Invert):
+                return ~value & 0xff
+            if isinstance(node.op, ast.Not):
+                return int(not value)
+            return value
+        if isinstance(node, ast.BinOp) and (type(node.op) in BINOPS or isinstance(node.op, ast.Mult)):
+            a, b = self._constant(node.left), self._constant(node.right)
+            if a is None or b is None:
+                return None
+            return evaluate_binop(type(node.op), a, b)
+        return None
+
+    #Operand text for an instruction reading node directly, None if it needs computing
+    def _operand(self, node):
+        value = self._constant(node)
+        if value is not None:
+            return f"#0x{value:02x}"
+        if isinstance(node, ast.Name):
+            return self._var(node)
+        return None
+
+    def _alu(self, op, operand):
+        self._emit(f"{op} {operand}")
+        self.a     = None
+        self.flags = True
+
+    #Code leaving the value of node in A
+    def _expr(self, node):
+        value = self._constant(node)
+        if value is not None:
+            if self.a != ("const", value):
+                self._emit(f"lda #0x{value:02x}")
+                self.a, self.flags = ("const", value), False
+            return
+
+        if isinstance(node, ast.Name):
+            name = self._var(node)
+            if self.a != ("var", name):
+                self._emit(f"lda {name}")
+                self.a, self.flags = ("var", name), False
+            return
+
+        if isinstance(node, ast.BinOp):
+            if isinstance(node.op, ast.Mult):
+                return self._multiply(node)
+            if type(node.op) not in BINOPS:
+                raise _error(node, f"{type(node.op).__name__} is not supported")
+            return self._binary(BINOPS[type(node.op)], node.left, node.right)
+
+        if isinstance(node, ast.UnaryOp):
+            self._expr(node.operand)
+            if isinstance(node.op, ast.USub):
+                #-x = (x + 0x7f) ^ 0x7f, 14 cycles (see idioms.s)
+                self._alu("add", "#0x7f")
+                self._alu("xor", "#0x7f")
+            elif isinstance(node.op, ast.Invert):
+                self._alu("xor", "#0xff")
+            elif not isinstance(node.op, ast.UAdd):
+                raise _error(node, f"{type(node.op).__name__} is only allowed in conditions")
+            return
+
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+            name = node.func.id
+            if name == "peek" and len(node.args) == 1:
+                addr = self._constant(node.args[0])
+                if addr is None:
+                    raise _error(node, "peek() needs a constant address (there is no indirect load)")
+                self.io.add(addr & 0x7f)
+                self._emit(f"lda 0x{addr & 0x7f:02x}")
+                self.a, self.flags = None, False
+                return
+            if name in BUILTIN_OPS and len(node.args) == 2:
+                return self._binary(BUILTIN_OPS[name], node.args[0], node.args[1])
+
+        raise _error(node, f"{ast.dump(node)[:40]}... is not supported")
+
+    #left op right, with right as an IMM/DIR operand whenever possible
+    def _binary(self, op, left, right):
+        operand = self._operand(right)
+        if operand is not None:
+            self._expr(left)
+            self._alu(op, operand)
+            return
+
+        operand = self._operand(left)
+        if operand is not None and op in COMMUTATIVE:
+            self._expr(right)
+            self._alu(op, operand)
+            return
+
+        #k - e = -e + k, 14 cycles of negate against a store and a load
+        if operand is not None and op == "sub":
+            self._expr(ast.UnaryOp(ast.USub(), right, lineno=right.lineno))
+            self._alu("add", operand)
+            return
+
+        temp = self._temp()
+        self._expr(right)
+        self._emit(f"sta {temp}")
+        self._expr(left)
+        self._alu(op, temp)
+        self._free()
+
+    #Multiply by a constant: shifts for powers of two, otherwise the cheaper of the binary and the
+    #signed digit (x*7 = (x << 3) - x) shift and add chains, from the top digit down
+    def _multiply(self, node):
+        left, right = self._constant(node.left), self._constant(node.right)
+        if right is None and left is None:
+            raise _error(node, "one side of * must be a constant")
+        value, k = (node.left, right) if right is not None else (node.right, left)
+
+        if k == 0:
+            return self._expr(ast.Constant(0))
+        self._expr(value)
+        if k == 1:
+            return
+        if k & (k - 1) == 0:
+            return self._alu("lsl", f"#{k.bit_length() - 1}")
+
+        chain   = min(multiply_chains(k), key=chain_cycles)
+        operand = self._operand(value)
+        if operand is None:
+            operand = self._temp()
+            self._emit(f"sta {operand}")
+        for shift, op in chain:
+            if shift:
+                self._alu("lsl", f"#{shift}")
+            if op:
+                self._alu(op, operand)
+        if operand.startswith("_t"):
+            self._free()
+
+
+#Constant Multiplies
+#-------------------------
+
+#Digits of k, most significant first, binary and signed digit (non adjacent form)
+def _digits(k):
+    binary = [int(bit) for bit in bin(k)[2:]]
+    signed = []
+    while k:
+        digit = 2 - k % 4 if k & 1 else 0
+        signed.insert(0, digit)
+        k     = (k - digit) >> 1
+    return binary, signed
+
+#Ways to multiply A (= x) by k with x as an operand, [(shift before, "add" or "sub")]
+def multiply_chains(k):
+    chains = []
+    for digits in _digits(k):
+        chain = []
+        shift = 0
+        for digit in digits[1:]:
+            shift += 1
+            if digit:
+                chain.append((shift, "add" if digit > 0 else "sub"))
+                shift = 0
+        if shift:
+            chain.append((shift, None))
+        chains.append(chain)
+    return chains
+
+def chain_cycles(chain):
+    return sum((CYCLES_ALU_IMM if shift else 0) + (CYCLES_ALU_DIR if op else 0) for shift, op in chain)
+
+
+#Reference Semantics
+#-------------------------
+def evaluate_binop(op, a, b):
+    if op is ast.Add:
+        return (a + b) & 0xff
+    if op is ast.Sub:
+        return (a - b) & 0xff
+    if op is ast.Mult:
+        return (a * b) & 0xff
+    if op is ast.BitAnd:
+        return a & b
+    if op is ast.BitOr:
+        return a | b
+    if op is ast.BitXor:
+        return a ^ b
+    if op is ast.LShift:
+        return (a << b) & 0xff if b < 8 else 0
+    if op is ast.RShift:
+        return a >> b
+    raise ValueError(op)
+
+#Variables of body that some path reads before assigning (a loop body may run 0 times, an if
+#only assigns what both branches assign)
+def read_before_write(body):
+    unset = set()
+
+    def reads(node, assigned):
+        calls = {id(n.func) for n in ast.walk(node) if isinstance(n, ast.Call)}
+        for n in ast.walk(node):
+            if isinstance(n, ast.Name) and id(n) not in calls and n.id not in assigned:
+                unset.add(n.id)
+
+    def block(body, assigned):
+        assigned = set(assigned)
+        for node in body:
+            if isinstance(node, ast.Assign):
+                reads(node.value, assigned)
+                assigned.update(target.id for target in node.targets if isinstance(target, ast.Name))
+            elif isinstance(node, ast.AugAssign):
+                reads(node.value, assigned)
+                reads(ast.Name(node.target.id, ast.Load()), assigned)
+                assigned.add(node.target.id)
+            elif isinstance(node, ast.If):
+                reads(node.test, assigned)
+                assigned = block(node.body, assigned) & block(node.orelse, assigned)
+            elif isinstance(node, ast.While):
+                reads(node.test, assigned)
+                block(node.body, assigned)
+            elif isinstance(node, ast.Expr):
+                reads(node.value, assigned)
+        return assigned
+
+    block(body, set())
+    return unset
+
+#Run a DSL program the way the CPU would (8 bit values, signed compares on the difference),
+#returns the values passed to out() (and poked to out_port)
+#memory is the image the compiled program runs on (128 bytes, zeros if None), peek() reads it
+#and poke() writes it. The reg RAM and spilled variables are not in it, so peeks and pokes of
+#the addresses the compiler gave to variables are not modeled.
+def interpret(source, memory=None, out_port=OUT_PORT, max_steps=100000):
+    from minibyte_model import ALU_ASR, ALU_RSL, ALU_RSR, alu
+
+    memory    = bytearray(memory) if memory is not None else bytearray(128)
+    variables = {}
+    outputs   = []
+    steps     = [0]
+
+    #Stores to out_port only drive the latch, like run_compiled()
+    def store(addr, data):
+        if addr & 0x7f == out_port:
+            outputs.append(data)
+        else:
+            memory[addr & 0x7f] = data
+
+    def value(node):
+        if isinstance(node, ast.Constant):
+            return int(node.value) & 0xff
+        if isinstance(node, ast.Name):
+            return variables.get(node.id, 0)
+        if isinstance(node, ast.BinOp):
+            return evaluate_binop(type(node.op), value(node.left), value(node.right))
+        if isinstance(node, ast.UnaryOp):
+            v = value(node.operand)
+            if isinstance(node.op, ast.USub):
+                return -v & 0xff
+            if isinstance(node.op, ast.Invert):
+                return ~v & 0xff
+            if isinstance(node.op, ast.Not):
+                return int(not truth(node.operand))
+            return v
+        if isinstance(node, ast.Call):
+            name = node.func.id
+            if name in BUILTIN_OPS:
+                op = {"rol": ALU_RSL, "ror": ALU_RSR, "asr": ALU_ASR}[name]
+                return alu(op, value(node.args[0]), value(node.args[1]))[0]
+            if name == "peek":
+                return memory[value(node.args[0]) & 0x7f]
+        if isinstance(node, (ast.Compare, ast.BoolOp)):
+            return int(truth(node))
+        raise CompileError(f"cannot interpret {ast.dump(node)[:40]}")
+
+    def truth(node):
+        if isinstance(node, ast.Compare):
+            a, b = value(node.left), value(node.comparators[0])
+            diff = (a - b) & 0xff
+            op   = type(node.ops[0])
+            return {ast.Eq: diff == 0, ast.NotEq: diff != 0, ast.Lt: bool(diff & 0x80), ast.GtE: not diff & 0x80,
+                    ast.Gt: bool((b - a) & 0x80), ast.LtE: not (b - a) & 0x80}[op]
+        if isinstance(node, ast.BoolOp):
+            results = (truth(v) for v in node.values)
+            return all(results) if isinstance(node.op, ast.And) else any(results)
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return not truth(node.operand)
+        return value(node) != 0
+
+    def run(body):
+        for node in body:
+            steps[0] += 1
+            if steps[0] > max_steps:
+                raise TimeoutError("step limit")
+            if isinstance(node, ast.Assign):
+                variables[node.targets[0].id] = value(node.value)
+            elif isinstance(node, ast.AugAssign):
+                variables[node.target.id] = evaluate_binop(type(node.op), variables.get(node.target.id, 0), value(node.value))
+            elif isinstance(node, ast.If):
+                run(node.body if truth(node.test) else node.orelse)
+            elif isinstance(node, ast.While):
+                while truth(node.test):
+                    run(node.body)
+                    steps[0] += 1
+                    if steps[0] > max_steps:
+                        raise TimeoutError("step limit")
+            elif isinstance(node, ast.Expr) and node.value.func.id == "out":
+                store(out_port, value(node.value.args[0]))
+            elif isinstance(node, ast.Expr) and node.value.func.id == "poke":
+                store(value(node.value.args[0]), value(node.value.args[1]))
+
+    try:
+        run(ast.parse(source).body)
+    except TimeoutError:
+        pass
+    return outputs
+
+#Run compiled code on the reference model, returns (values stored to out_port, cycles)
+#Like the EEPROM setup, stores to out_port only drive the latch, memory there is left alone
+def run_compiled(code, out_port=OUT_PORT, max_cycles=200000):
+    from minibyte_model import MinibyteModel
+
+    program = assemble(code)
+    model   = MinibyteModel(bytearray(program.memory), onboard_ram=True)
+    done    = program.labels["done"]
+    outputs = []
+    while model.cycles < max_cycles and model.pc != done:
+        addr, we, drive, data = model.bus()
+        if drive and addr == out_port:
+            outputs.append(data)
+            latched = model.memory[out_port]
+            model.cycle()
+            model.memory[out_port] = latched
+        else:
+            model.cycle()
+    return outputs, model.cycles
+
+
+#Command line
+#-------------------------
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compile a small Python syntax program to minibyte assembly")
+    parser.add_argument("source")
+    parser.add_argument("-o", "--output")
+    parser.add_argument("--out-port",   type=lambda v: int(v, 0), default=OUT_PORT)
+    parser.add_argument("--spill-base", type=lambda v: int(v, 0), default=None, help="external RAM for variables that do not fit")
+    parser.add_argument("--rom",        action="store_true", help="external memory is read only, do not spill")
+    parser.add_argument("--no-opt",     action="store_true", help="skip the peephole optimizer")
+    parser.add_argument("--check",      action="store_true", help="compare out() values with a Python run of the program")
+    args = parser.parse_args(argv)
+
+    with open(args.source) as f:
+        source = f.read()
+
+    compiler = Compiler(args.out_port, spill_base=args.spill_base, rom=args.rom, optimize=not args.no_opt)
+    try:
+        code = compiler.compile(source)
+        program = assemble(code)
+    except (CompileError, SyntaxError, AsmError) as e:
+        print(f"{args.source}: {e}", file=sys.stderr)
+        return 1
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(code)
+    else:
+        print(code)
+
+    outputs, cycles = run_compiled(code, args.out_port)
+    print(f"{program.code_bytes} code bytes, {len(program.used)} bytes used, {cycles} cycles to done", file=sys.stderr)
+    if args.check:
+        expected = interpret(source, program.memory, args.out_port)
+        finished = cycles < 200000
+        if outputs != expected[:len(outputs)] or finished and len(outputs) != len(expected):
+            print(f"MISMATCH: compiled {outputs[:16]}, python {expected[:16]}", file=sys.stderr)
+            return 1
+        print(f"out() values match ({len(outputs)})", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
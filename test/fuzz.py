@@ -0,0 +1,337 @@
+# SPDX-FileCopyrightText: © 2024 Zachary Frazee
+# SPDX-License-Identifier: Apache-2.0
+
+#Differential fuzzing of the RTL against the reference model
+#
+#Random programs and memory images (a case: 128 byte image + ui_in) run on the DUT and must
+#match the reference model:
+#   - every case is compiled into tb.v replay vectors (vectors.py): every cycle's bus is
+#     checked, then the CU is halted and A, CCR, M, PC and IR are read out through the debug
+#     outputs. Memory is compared through the writes on the bus
+#   - a batch of cases is one vector stream with a reset in front of each case, so a whole batch
+#     replays in tb.v with no Python in the loop. After a mismatch the rest of the batch is
+#     replayed again
+#   - coverage is taken on the model: CU state transitions, (opcode, CCR) at decode and the
+#     flags each ALU op leaves. Cases adding coverage join the corpus, new cases are mostly
+#     mutations of corpus entries (byte/opcode/operand changes, inserts, splices)
+#   - mismatches are deduplicated by the first divergent opcode and CU state (on the model)
+#
+#<dir>/corpus/*.bin and <dir>/crashes/<opcode>_<state>.bin (+ .txt) persist between runs, a
+#case file is ui_in followed by the 128 byte image.
+#
+#   make TESTCASE=test_fuzz FUZZ=fuzz FUZZ_MINUTES=10 [FUZZ_PROGRAMS=100000 FUZZ_SEED=1]
+#   python fuzz.py fuzz --minutes 1          # grow the corpus on the model alone
+#   python fuzz.py fuzz --crashes            # list the deduplicated mismatches
+
+#Includes
+#-------------------------
+import hashlib
+import os
+import random
+import sys
+import time
+from collections import namedtuple
+
+from minibyte_asm import disassemble
+from minibyte_isa import (TM_OFF, TM_DEBUG_OUT_A, TM_DEBUG_OUT_A_UPPER, TM_DEBUG_OUT_M, TM_DEBUG_OUT_PC,
+                          TM_DEBUG_OUT_IR, TM_DEBUG_OUT_CCR, TM_DEBUG_OUT_CU_STATE, TM_HALT_CU,
+                          TM_ONBOARD_RAM, IR_NOP, S_DECODE_0, IR_NAMES, S_NAMES)
+from minibyte_model import CU_BRANCH, MinibyteModel
+from vectors import Scenario, compile_scenario
+
+#Constants
+#-------------------------
+CYCLES        = 300             #Cycles each case runs before the readout
+RESET_CYCLES  = 4
+BATCH         = 32              #Cases per replay, BATCH * (CYCLES + ...) stays in one VECTOR_DEPTH chunk
+OPCODES       = sorted(IR_NAMES)
+INTERESTING   = [0x00, 0x01, 0x3f, 0x40, 0x41, 0x7f, 0x78, 0x7b, 0x7e, 0x80, 0xfe, 0xff]
+
+#Readout after the run: halt, wait for S_FETCH_0, then one cycle per debug output
+READOUT       = [TM_DEBUG_OUT_A] * 12 + [TM_DEBUG_OUT_A_UPPER, TM_DEBUG_OUT_CCR, TM_DEBUG_OUT_M,
+                                          TM_DEBUG_OUT_PC, TM_DEBUG_OUT_IR, TM_DEBUG_OUT_CU_STATE]
+
+Case     = namedtuple("Case", ["ui_in", "image"])
+Mismatch = namedtuple("Mismatch", ["case", "cycle", "signature", "message"])
+
+
+#Cases
+#-------------------------
+def case_bytes(case):
+    return bytes([case.ui_in]) + bytes(case.image)
+
+def case_from_bytes(data):
+    return Case(data[0], bytes(data[1:129]).ljust(128, b"\0"))
+
+def case_id(case):
+    return hashlib.sha1(case_bytes(case)).hexdigest()[:16]
+
+def scenario(case, cycles=CYCLES):
+    changes = {RESET_CYCLES + cycles + i: case.ui_in | TM_HALT_CU | debug for i, debug in enumerate(READOUT)}
+    return Scenario(case.image, case.ui_in, cycles + len(READOUT), RESET_CYCLES, changes)
+
+#Vectors of a batch, and where each case starts in them
+def compile_batch(cases, cycles=CYCLES):
+    vectors = []
+    starts  = []
+    for case in cases:
+        starts.append(len(vectors))
+        vectors += compile_scenario(scenario(case, cycles))
+    return vectors, starts
+
+
+#Model Runs
+#-------------------------
+
+#Coverage features of a case on the model
+def coverage(case, cycles=CYCLES):
+    memory   = bytearray(case.image)
+    model    = MinibyteModel(memory, onboard_ram=bool(case.ui_in & TM_ONBOARD_RAM))
+    features = set()
+    for _ in range(cycles):
+        state = model.state
+        ccr   = model.ccr
+        ir    = model.ir if model.ir in IR_NAMES else -1
+        if state == S_DECODE_0:
+            features.add(("decode", ir, ccr if ir in CU_BRANCH else 0))
+        model.cycle()
+        features.add(("edge", state, model.state))
+        if model.ccr != ccr:
+            features.add(("ccr", ir, model.ccr))
+    return features
+
+#Model state when vector cycle (of a case's own vectors) is checked: (ir, state)
+def model_state_at(case, cycle, cycles=CYCLES):
+    sc     = scenario(case, cycles)
+    memory = bytearray(sc.memory)
+    model  = MinibyteModel(memory)
+    ui_in  = sc.ui_in
+    for i in range(sc.reset_cycles, cycle):
+        ui_in = sc.ui_in_changes.get(i, ui_in)
+        model.onboard_ram = bool(ui_in & TM_ONBOARD_RAM)
+        model.halt        = bool(ui_in & TM_HALT_CU)
+        model.debug       = ui_in & 0x07
+        model.cycle()
+    return model.ir, model.state
+
+def signature(case, cycle, cycles=CYCLES):
+    ir, state = model_state_at(case, cycle, cycles)
+    return f"{IR_NAMES.get(ir, '0x%02x' % ir)}_{S_NAMES.get(state, state)}"
+
+
+#Generation
+#-------------------------
+class Generator:
+    def __init__(self, rng):
+        self.rng = rng
+
+    def operand(self):
+        rng = self.rng
+        if rng.random() < 0.3:
+            return rng.choice(INTERESTING)
+        return rng.randrange(0x80) if rng.random() < 0.8 else rng.randrange(0x100)
+
+    def instruction(self):
+        rng = self.rng
+        ir  = rng.randrange(0x100) if rng.random() < 0.03 else rng.choice(OPCODES)
+        return [ir] if ir == IR_NOP else [ir, self.operand()]
+
+    def case(self):
+        rng   = self.rng
+        image = bytearray(rng.randrange(0x100) for _ in range(128))
+        code  = []
+        for _ in range(rng.randrange(4, 32)):
+            code += self.instruction()
+        image[:len(code)] = bytes(code)
+        return Case(rng.choice((TM_OFF, TM_ONBOARD_RAM)), bytes(image))
+
+    def mutate(self, case, corpus):
+        rng   = self.rng
+        image = bytearray(case.image)
+        ui_in = case.ui_in
+        for _ in range(rng.randrange(1, 4)):
+            kind = rng.randrange(7)
+            i    = rng.randrange(0, 128, 2)
+            if kind == 0:
+                image[rng.randrange(128)] ^= 1 << rng.randrange(8)
+            elif kind == 1:
+                image[i] = rng.choice(OPCODES)
+            elif kind == 2:
+                image[i + 1] = self.operand()
+            elif kind == 3:
+                image[i:i] = bytes(self.instruction())
+                del image[128:]
+            elif kind == 4:
+                del image[i:i + 2]
+                image += bytes(2)
+            elif kind == 5 and corpus:
+                other = rng.choice(corpus).image
+                j     = rng.randrange(0, 128, 2)
+                n     = rng.randrange(2, 32, 2)
+                image[i:i + n] = other[j:j + n]
+                del image[128:]
+                image = image.ljust(128, b"\0")
+            else:
+                ui_in ^= TM_ONBOARD_RAM
+        return Case(ui_in, bytes(image))
+
+
+#Campaign
+#-------------------------
+class FuzzCampaign:
+    def __init__(self, directory, seed=None, cycles=CYCLES, log=print):
+        self.directory = directory
+        self.cycles    = cycles
+        self.log       = log
+        self.rng       = random.Random(seed)
+        self.generator = Generator(self.rng)
+        self.corpus    = []
+        self.covered   = set()
+        self.crashes   = {}         #signature => count
+        self.programs  = 0
+        self.start     = time.perf_counter()
+
+        os.makedirs(os.path.join(directory, "corpus"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "crashes"), exist_ok=True)
+        for name in sorted(os.listdir(os.path.join(directory, "corpus"))):
+            with open(os.path.join(directory, "corpus", name), "rb") as f:
+                case = case_from_bytes(f.read())
+            self.corpus.append(case)
+            self.covered |= coverage(case, cycles)
+        for name in os.listdir(os.path.join(directory, "crashes")):
+            if name.endswith(".bin"):
+                self.crashes[name[:-4]] = 0
+
+    #New cases, coverage increasing ones join the corpus right away
+    def next_batch(self, size=BATCH):
+        cases = []
+        for _ in range(size):
+            if self.corpus and self.rng.random() < 0.8:
+                case = self.generator.mutate(self.rng.choice(self.corpus), self.corpus)
+            else:
+                case = self.generator.case()
+
+            new = coverage(case, self.cycles) - self.covered
+            if new:
+                self.covered |= new
+                self.corpus.append(case)
+                with open(os.path.join(self.directory, "corpus", case_id(case) + ".bin"), "wb") as f:
+                    f.write(case_bytes(case))
+            cases.append(case)
+        return cases
+
+    #Mismatches of a batch, await replay(vectors) -> (failing cycle, message) or None
+    async def check(self, cases, replay):
+        mismatches = []
+        while cases:
+            vectors, starts = compile_batch(cases, self.cycles)
+            failure = await replay(vectors)
+            if failure is None:
+                self.programs += len(cases)
+                break
+
+            #Blame the case the cycle falls in, replay the ones after it
+            cycle, message = failure
+            index    = max(i for i, start in enumerate(starts) if start <= cycle)
+            case     = cases[index]
+            local    = cycle - starts[index]
+            mismatch = Mismatch(case, local, signature(case, local, self.cycles), message)
+            mismatches.append(mismatch)
+            self._save(mismatch)
+
+            self.programs += index + 1
+            cases = cases[index + 1:]
+        return mismatches
+
+    def _save(self, mismatch):
+        new = mismatch.signature not in self.crashes
+        self.crashes[mismatch.signature] = self.crashes.get(mismatch.signature, 0) + 1
+        if not new:
+            return
+
+        base = os.path.join(self.directory, "crashes", mismatch.signature)
+        with open(base + ".bin", "wb") as f:
+            f.write(case_bytes(mismatch.case))
+        with open(base + ".txt", "w") as f:
+            f.write(describe(mismatch))
+        self.log(f"new mismatch {mismatch.signature}: {mismatch.message}")
+
+    def rate(self):
+        minutes = (time.perf_counter() - self.start) / 60
+        return self.programs / max(minutes, 1e-9)
+
+    def status(self):
+        return (f"{self.programs} programs ({self.rate():,.0f}/min), corpus {len(self.corpus)}, "
+                f"coverage {len(self.covered)}, {len(self.crashes)} unique mismatches")
+
+def describe(mismatch):
+    case  = mismatch.case
+    lines = [f"signature {mismatch.signature}", f"vector cycle {mismatch.cycle} (reset is {RESET_CYCLES} cycles)",
+             mismatch.message, f"ui_in 0x{case.ui_in:02x}", ""]
+    lines += disassemble(case.image, 0, 64).splitlines()
+    return "\n".join(lines) + "\n"
+
+
+#cocotb
+#-------------------------
+
+#Replay through tb.v, (cycle, message) of the first failure or None
+async def replay_rtl(dut, vectors):
+    from vectors import format_failure, replay_vectors
+
+    failure = await replay_vectors(dut, vectors)
+    if failure is None:
+        return None
+    return failure.cycle, format_failure(failure)
+
+#Vector cycles of one case
+def case_cycles(cycles=CYCLES):
+    return RESET_CYCLES + cycles + len(READOUT)
+
+#Fuzz for minutes of wall time (or until programs ran), returns the campaign and its mismatches
+async def fuzz_rtl(dut, directory, minutes=1.0, programs=None, seed=None, batch=BATCH, report_every=60):
+    campaign   = FuzzCampaign(directory, seed, log=dut._log.info)
+    end        = time.perf_counter() + minutes * 60
+    report     = time.perf_counter() + report_every
+    mismatches = []
+
+    async def replay(vectors):
+        return await replay_rtl(dut, vectors)
+
+    while time.perf_counter() < end and (programs is None or campaign.programs < programs):
+        mismatches += await campaign.check(campaign.next_batch(batch), replay)
+        if time.perf_counter() > report:
+            dut._log.info(campaign.status())
+            report += report_every
+
+    dut._log.info(campaign.status())
+    return campaign, mismatches
+
+
+#Command line
+#-------------------------
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Grow a fuzzing corpus on the reference model, or list mismatches")
+    parser.add_argument("directory")
+    parser.add_argument("--minutes", type=float, default=1.0)
+    parser.add_argument("--seed",    type=int, default=None)
+    parser.add_argument("--crashes", action="store_true", help="list the deduplicated mismatches")
+    args = parser.parse_args(argv)
+
+    campaign = FuzzCampaign(args.directory, args.seed)
+    if args.crashes:
+        for name in sorted(campaign.crashes):
+            with open(os.path.join(args.directory, "crashes", name + ".txt")) as f:
+                print(f.read())
+        return 0
+
+    end = time.perf_counter() + args.minutes * 60
+    while time.perf_counter() < end:
+        campaign.programs += len(campaign.next_batch())
+    print(campaign.status())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,283 @@
+# SPDX-FileCopyrightText: © 2024 Zachary Frazee
+# SPDX-License-Identifier: Apache-2.0
+
+#GPI crossing and await profiler for the cocotb tests
+#
+#With GPI_PROFILE=<dir>, test.py installs it for every test. It counts and times:
+#   - signal reads and writes (.value get/set, setimmediatevalue), each one crosses into the simulator
+#   - trigger awaits, each resume is a GPI callback. ClockCycles is kept apart from the
+#     RisingEdge wakeups it awaits internally (one per cycle)
+#keyed by test and by the call stack inside the test sources (test.py and the helpers next to
+#it). Awaits are wall time blocked (simulator + scheduler). Awaits with no test source on the
+#stack (the Clock, ...) are reported apart as background, they overlap everything. Per test it
+#writes:
+#   <dir>/<test>.txt      hot spots, sorted by time, and where the test's wall time went
+#   <dir>/<test>.folded   folded stacks in microseconds, for flamegraph.pl / speedscope / inferno
+#   <dir>/<test>.json     raw counts, merged by the command line
+#
+#   make GPI_PROFILE=profile
+#   python gpi_profile.py profile              # hot spots over every test
+#   flamegraph.pl profile/test_demorom.folded > test_demorom.svg
+
+#Includes
+#-------------------------
+import json
+import os
+import sys
+import time
+
+#Constants
+#-------------------------
+TEST_DIR  = os.path.dirname(os.path.abspath(__file__))
+MAX_DEPTH = 16
+TOP       = 25
+
+
+#Stacks
+#-------------------------
+
+#Frames of the test sources from the outermost in, "function:line"
+def _stack(frame):
+    frames = []
+    while frame is not None and len(frames) < MAX_DEPTH:
+        filename = frame.f_code.co_filename
+        if filename.startswith(TEST_DIR) and filename != __file__:
+            frames.append(f"{frame.f_code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    if not frames:
+        frames.append("<cocotb>")
+    return tuple(reversed(frames))
+
+#Name of the test running now
+def _current_test():
+    import cocotb
+
+    manager = getattr(cocotb, "regression_manager", None)
+    test    = getattr(manager, "_test", None)
+    return getattr(test, "__qualname__", None) or getattr(test, "name", None) or "<no test>"
+
+
+#Profiler
+#-------------------------
+class GpiProfiler:
+    def __init__(self, directory):
+        self.directory = directory
+        self.stats     = {}         #test => {(stack, kind): [count, ns]}
+        self.started   = {}         #test => perf_counter_ns of its first event
+        self.patches   = []
+
+    def _record(self, stack, kind, ns, count=1):
+        test  = _current_test()
+        stats = self.stats.get(test)
+        if stats is None:
+            stats = self.stats[test] = {}
+            self.started[test] = time.perf_counter_ns()
+        entry = stats.get((stack, kind))
+        if entry is None:
+            stats[(stack, kind)] = [count, ns]
+        else:
+            entry[0] += count
+            entry[1] += ns
+
+    #Patching
+    #-------------------------
+    def _patch(self, owner, name, value):
+        self.patches.append((owner, name, owner.__dict__[name]))
+        setattr(owner, name, value)
+
+    def install(self):
+        import cocotb.handle as handle
+        import cocotb.regression as regression
+        import cocotb.triggers as triggers
+
+        from clock_advance import FastClockCycles
+
+        profiler    = self
+        clock_waits = (triggers.ClockCycles._wait.__code__, FastClockCycles._wait.__code__)
+
+        #Reads and writes, on every handle class with its own value property
+        for cls in (handle.ModifiableObject, handle.RealObject, handle.EnumObject, handle.IntegerObject,
+                    handle.StringObject, handle.NonHierarchyIndexableObject):
+            prop = cls.__dict__.get("value")
+            if prop is None:
+                continue
+
+            def getter(obj, _fget=prop.fget):
+                start = time.perf_counter_ns()
+                value = _fget(obj)
+                ns    = time.perf_counter_ns() - start
+                profiler._record(_stack(sys._getframe(1)), f"read {obj._name}", ns)
+                return value
+
+            def setter(obj, value, _fset=prop.fset):
+                start = time.perf_counter_ns()
+                _fset(obj, value)
+                ns    = time.perf_counter_ns() - start
+                profiler._record(_stack(sys._getframe(1)), f"write {obj._name}", ns)
+
+            self._patch(cls, "value", property(getter, setter, doc=prop.__doc__))
+
+        setimmediate = handle.NonHierarchyObject.__dict__["setimmediatevalue"]
+
+        def setimmediatevalue(obj, value):
+            start = time.perf_counter_ns()
+            setimmediate(obj, value)
+            profiler._record(_stack(sys._getframe(1)), f"write {obj._name}", time.perf_counter_ns() - start)
+
+        self._patch(handle.NonHierarchyObject, "setimmediatevalue", setimmediatevalue)
+
+        #Trigger awaits, the frame awaiting is the caller of this generator
+        trigger_await = triggers.Trigger.__dict__["__await__"]
+
+        def await_trigger(trigger):
+            caller = sys._getframe(1)
+            kind   = "ClockCycles wakeup" if caller.f_code in clock_waits else f"await {type(trigger).__name__}"
+            stack  = _stack(caller)
+            start  = time.perf_counter_ns()
+            result = yield from trigger_await(trigger)
+            profiler._record(stack, kind, time.perf_counter_ns() - start)
+            return result
+
+        self._patch(triggers.Trigger, "__await__", await_trigger)
+
+        #ClockCycles, First, Combine, ...
+        waitable_await = triggers.Waitable.__dict__["__await__"]
+
+        def await_waitable(waitable):
+            stack  = _stack(sys._getframe(1))
+            start  = time.perf_counter_ns()
+            result = yield from waitable_await(waitable)
+            profiler._record(stack, f"await {type(waitable).__name__}", time.perf_counter_ns() - start)
+            if isinstance(waitable, triggers.ClockCycles):
+                profiler._record(stack, "ClockCycles cycles", 0, waitable.num_cycles)
+            return result
+
+        self._patch(triggers.Waitable, "__await__", await_waitable)
+
+        #Reports as each test ends
+        record_result = regression.RegressionManager.__dict__["_record_result"]
+
+        def _record_result(manager, test, *args, **kwargs):
+            result = record_result(manager, test, *args, **kwargs)
+            name   = getattr(test, "__qualname__", None) or getattr(test, "name", None)
+            if name in profiler.stats:
+                profiler.write(name)
+            return result
+
+        self._patch(regression.RegressionManager, "_record_result", _record_result)
+        return self
+
+    def uninstall(self):
+        while self.patches:
+            owner, name, value = self.patches.pop()
+            setattr(owner, name, value)
+
+    #Reports
+    #-------------------------
+    def write(self, test):
+        os.makedirs(self.directory, exist_ok=True)
+        stats = self.stats[test]
+        wall  = time.perf_counter_ns() - self.started[test]
+        base  = os.path.join(self.directory, test)
+
+        with open(base + ".json", "w") as f:
+            json.dump({"test": test, "wall_ns": wall,
+                       "stats": [[list(stack), kind, count, ns] for (stack, kind), (count, ns) in stats.items()]}, f)
+        with open(base + ".folded", "w") as f:
+            f.write(folded(test, stats))
+        with open(base + ".txt", "w") as f:
+            f.write(report(test, stats, wall))
+
+def install_gpi_profiler(directory):
+    return GpiProfiler(directory).install()
+
+
+#Formatting
+#-------------------------
+
+#Flame graph stacks: test;frames...;kind <us>, nested waits subtracted from ClockCycles
+def folded(test, stats):
+    times = {}
+    for (stack, kind), (count, ns) in stats.items():
+        if kind == "ClockCycles cycles":
+            continue
+        key = (stack, kind)
+        times[key] = times.get(key, 0) + ns
+
+    lines = []
+    for (stack, kind), ns in sorted(times.items()):
+        if kind == "await ClockCycles":
+            ns -= times.get((stack, "ClockCycles wakeup"), 0)
+            frames = (test,) + stack + ("await ClockCycles",)
+        elif kind == "ClockCycles wakeup":
+            frames = (test,) + stack + ("await ClockCycles", "RisingEdge wakeup")
+        else:
+            frames = (test,) + stack + (kind,)
+        us = ns // 1000
+        if us > 0:
+            lines.append(";".join(frame.replace(";", ",").replace(" ", "_") for frame in frames) + f" {us}")
+    return "\n".join(lines) + "\n"
+
+#Hot spots by innermost test source line, and the wall time split
+def report(test, stats, wall_ns, top=TOP):
+    spots   = {}
+    totals  = {"read": [0, 0], "write": [0, 0], "await": [0, 0], "wakeup": [0, 0], "background": [0, 0]}
+    cycles  = 0
+    for (stack, kind), (count, ns) in stats.items():
+        if kind == "ClockCycles cycles":
+            cycles += count
+            continue
+        entry     = spots.setdefault((stack[-1], kind), [0, 0])
+        entry[0] += count
+        entry[1] += ns
+
+        group = "wakeup" if kind == "ClockCycles wakeup" else kind.split()[0]
+        if group == "await" and stack[-1].endswith("<cocotb>"):
+            group = "background"
+        totals[group][0] += count
+        totals[group][1] += ns
+
+    lines = [f"{test}: {wall_ns / 1e9:.3f}s wall"]
+    for group, label in (("read", "signal reads"), ("write", "signal writes"), ("await", "awaits (blocked)"),
+                         ("wakeup", "  ClockCycles wakeups"), ("background", "background awaits")):
+        count, ns = totals[group]
+        lines.append(f"  {label:<22}{count:>10} {ns / 1e9:>9.3f}s {100 * ns / max(wall_ns, 1):>6.1f}%")
+    lines.append(f"  {'ClockCycles cycles':<22}{cycles:>10}")
+    lines.append("")
+    lines.append(f"{'total ms':>10}{'count':>10}{'mean us':>10}  {'kind':<26}where")
+    for (where, kind), (count, ns) in sorted(spots.items(), key=lambda item: -item[1][1])[:top]:
+        lines.append(f"{ns / 1e6:>10.1f}{count:>10}{ns / 1e3 / count:>10.2f}  {kind:<26}{where}")
+    return "\n".join(lines) + "\n"
+
+
+#Command line
+#-------------------------
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Merge the per test GPI profiles into one hot spot report")
+    parser.add_argument("directory")
+    parser.add_argument("--top", type=int, default=TOP)
+    args = parser.parse_args(argv)
+
+    merged = {}
+    wall   = 0
+    names  = sorted(name for name in os.listdir(args.directory) if name.endswith(".json"))
+    for name in names:
+        with open(os.path.join(args.directory, name)) as f:
+            data = json.load(f)
+        wall += data["wall_ns"]
+        for stack, kind, count, ns in data["stats"]:
+            key   = ((f"{data['test']}:{stack[-1]}",), kind)
+            entry = merged.setdefault(key, [0, 0])
+            entry[0] += count
+            entry[1] += ns
+
+    if not names:
+        print(f"{args.directory}: no profiles", file=sys.stderr)
+        return 1
+    print(report(f"{len(names)} tests", merged, wall, args.top), end="")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
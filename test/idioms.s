@@ -0,0 +1,71 @@
+; Minimum cycle minibyte idioms, generated by superopt.py --library (up to 32 cycles)
+; Inputs and results in A, t0 is a scratch byte, the CCR is clobbered
+
+; mul3: A = A * 3 (25 cycles, 6 bytes)
+        sta t0
+        lsl #0x01
+        add t0
+
+; mul5: A = A * 5 (25 cycles, 6 bytes)
+        sta t0
+        lsl #0x02
+        add t0
+
+; mul6: A = A * 6 (32 cycles, 8 bytes)
+        lsl #0x01
+        sta t0
+        lsl #0x01
+        add t0
+
+; mul7: A = A * 7 (25 cycles, 6 bytes)
+        sta t0
+        lsl #0x03
+        sub t0
+
+; mul9: A = A * 9 (25 cycles, 6 bytes)
+        sta t0
+        lsl #0x03
+        add t0
+
+; mul10: A = A * 10 (32 cycles, 8 bytes)
+        lsl #0x01
+        sta t0
+        lsl #0x02
+        add t0
+
+; negate: A = -A (14 cycles, 4 bytes)
+        add #0x7f
+        xor #0x7f
+
+; sign_mask: A = 0xff if A < 0 else 0 (7 cycles, 2 bytes)
+        asr #0x07
+
+; sign_extend_4: sign extend the low nibble (14 cycles, 4 bytes)
+        lsl #0x04
+        asr #0x04
+
+; swap_nibbles: A = A[3:0], A[7:4] (7 cycles, 2 bytes)
+        rsl #0x04
+
+; clear_lowest_bit: A = A & (A - 1) (25 cycles, 6 bytes)
+        sta t0
+        add #0xff
+        and t0
+
+; lowest_bit: A = A & -A (32 cycles, 8 bytes)
+        sta t0
+        add #0x7f
+        xor #0x7f
+        and t0
+
+; high_nibble_down: A = A >> 4 (logical) (7 cycles, 2 bytes)
+        lsr #0x04
+
+; div2_signed: A = A / 2 rounding down (signed) (7 cycles, 2 bytes)
+        asr #0x01
+
+; bool: A = 1 if A != 0 else 0 (32 cycles, 8 bytes)
+        sta t0
+        lda #0x01
+        lsr t0
+        xor #0x01
@@ -0,0 +1,360 @@
+# SPDX-FileCopyrightText: © 2024 Zachary Frazee
+# SPDX-License-Identifier: Apache-2.0
+
+#Lane parallel reference model: thousands of CPU states stepped at once with numpy
+#
+#MinibyteModel steps one CPU a cycle at a time in Python. LaneModel holds A, PC, M, IR, CCR,
+#the cycle counts and a 128 byte memory (plus reg RAM) for every lane as numpy arrays, and
+#steps every lane a whole instruction at a time:
+#   - the opcode and operand of every lane are gathered from its own memory (self modifying
+#     code, per lane demo ROM and onboard RAM settings work as on the model)
+#   - what each opcode does is looked up by IR and CCR: where the new PC and M come from, what
+#     gets stored and the cycles, so there are no per lane branches and a branch is decided by
+#     the lookup. A and the CCR come from one lookup in a table of every op x A x B result
+#   - registers are int32 arrays (values 0..255), memory is lanes x 128 bytes
+#   - cycles come from the CU tables (instruction_cycles), lanes drift apart in cycles as they
+#     take different paths, run() masks off the lanes that are done
+#Between instructions (at S_FETCH_0) a lane matches a MinibyteModel run the same way exactly.
+#
+#   lanes = grid(program.memory, a=range(256), ccr=range(4))    # every A x CCR from one image
+#   lanes.run(1000)
+#   python lane_model.py --lanes 4096 --cycles 2000             # check against MinibyteModel, and time both
+
+#Includes
+#-------------------------
+import sys
+import time
+
+from minibyte_isa import (TM_ONBOARD_RAM, CCR_N, CCR_Z, IR_NOP, IR_STA_DIR, IR_STA_IND, IR_JMP_DIR,
+                          IR_JMP_IND, S_FETCH_0, S_JMP_IND_0, IR_NAMES)
+from minibyte_model import (CU_BRANCH, CU_DECODE, CU_NEXT, CU_OUTPUTS, DEMO_ROM, REG_RAM_BASE, REG_RAM_SIZE,
+                            MinibyteModel, instruction_cycles, ALU_ADD, ALU_AND, ALU_ASL, ALU_ASR, ALU_LSL,
+                            ALU_LSR, ALU_OR, ALU_PASSA, ALU_PASSB, ALU_RSL, ALU_RSR, ALU_SUB, ALU_XOR)
+
+#Constants
+#-------------------------
+MEM_SIZE     = 128
+RESET_CYCLES = 1                #S_RESET_0, lanes start at their first fetch
+
+#Where the new PC, M and store address come from (1 and 2 are PC + 1 and PC + 2)
+FROM_OPERAND = 3                #The byte after the opcode
+FROM_DEREF   = 4                #The byte the operand points at
+
+#Tables (numpy arrays), built on first use
+_TABLES = {}
+
+
+#Tables
+#-------------------------
+
+#(alu op, sets the ccr) of the state that loads A, None if nothing does
+def _loads_a(ir):
+    state = CU_DECODE.get(ir, S_FETCH_0)
+    while state != S_FETCH_0:
+        _, alu_op, set_a, _, _, _, _, set_ccr, _, _ = CU_OUTPUTS[state]
+        if set_a:
+            return alu_op, set_ccr
+        state = CU_NEXT[state]
+    return None
+
+#What one opcode does with a CCR: (alu op, keeps the ccr, B is dereferenced, pc from, m from,
+#store to, cycles). Anything not loading A passes A through the ALU
+def _behaviour(ir, ccr):
+    name  = IR_NAMES.get(ir)
+    loads = _loads_a(ir) if name is not None else None
+    op    = ALU_PASSA if loads is None else loads[0]
+    keep  = loads is None or not loads[1]
+    deref = loads is not None and name.endswith("_DIR")
+    size  = 1 if name is None or ir == IR_NOP else 2
+
+    taken = True
+    if ir in CU_BRANCH:
+        mask, value, first = CU_BRANCH[ir]
+        taken    = (ccr & mask) == value
+        indirect = first == S_JMP_IND_0
+    else:
+        indirect = ir == IR_JMP_IND
+    jumps = ir in CU_BRANCH or ir in (IR_JMP_DIR, IR_JMP_IND)
+
+    pc_from = (FROM_DEREF if indirect else FROM_OPERAND) if jumps and taken else size
+    m_from  = 0
+    if deref or ir == IR_STA_DIR or (indirect and taken):
+        m_from = FROM_OPERAND
+    elif ir == IR_STA_IND:
+        m_from = FROM_DEREF
+    store = {IR_STA_DIR: FROM_OPERAND, IR_STA_IND: FROM_DEREF}.get(ir, 0)
+    return op, keep, deref, pc_from, m_from, store, instruction_cycles(ir, taken)
+
+def _tables():
+    import numpy as np
+
+    if _TABLES:
+        return _TABLES
+
+    #Per IR << 2 | CCR
+    behaviour = [_behaviour(ir, ccr) for ir in range(256) for ccr in range(4)]
+    for i, name in enumerate(("alu_op", "keep_ccr", "deref_b", "pc_from", "m_from", "store", "cycles")):
+        column = np.array([entry[i] for entry in behaviour], dtype=np.int64 if name == "cycles" else np.int32)
+        #The ones that do not depend on the CCR are looked up by IR alone
+        _TABLES[name] = column if name in ("pc_from", "m_from", "cycles") else column[::4].copy()
+
+    #Every ALU result by op << 16 | a << 8 | b, and the CCR of every result
+    op, a, b = np.meshgrid(np.arange(ALU_RSR + 1), np.arange(256), np.arange(256), indexing="ij")
+    _TABLES["alu"]      = alu_lanes(op.ravel(), a.ravel(), b.ravel())[0].astype(np.uint8)
+    _TABLES["flags"]    = alu_lanes(np.full(256, ALU_PASSB), np.zeros(256, dtype=np.int32), np.arange(256))[1].astype(np.int32)
+    _TABLES["demo_rom"] = np.frombuffer(DEMO_ROM, dtype=np.uint8).astype(np.int32)
+    return _TABLES
+
+
+#ALU
+#-------------------------
+
+#alu() of minibyte_model.py over lanes, op/a/b int arrays, returns (result, ccr)
+def alu_lanes(op, a, b):
+    import numpy as np
+
+    shift = np.minimum(b, 7)
+    turn  = b & 7
+    signs = np.where(a & 0x80, a | 0xff00, a)
+    res   = np.select(
+        [op == ALU_PASSA, op == ALU_PASSB, op == ALU_ADD, op == ALU_SUB, op == ALU_AND, op == ALU_OR, op == ALU_XOR,
+         (op == ALU_LSL) | (op == ALU_ASL), op == ALU_LSR, op == ALU_ASR, op == ALU_RSL, op == ALU_RSR],
+        [a, b, a + b, a - b, a & b, a | b, a ^ b,
+         np.where(b < 8, a << shift, 0), np.where(b < 8, a >> shift, 0), signs >> np.minimum(b, 8),
+         (a << turn) | (a >> (8 - turn)), (a >> turn) | (a << (8 - turn))],
+        0) & 0xff
+    return res, np.where(res == 0, CCR_Z, 0) | np.where(res & 0x80, CCR_N, 0)
+
+
+#Model
+#-------------------------
+class LaneModel:
+    #memory      - one image for every lane, or a lanes x 128 array
+    #demo_rom    - same as ui_in[4], for every lane or per lane
+    #onboard_ram - same as ui_in[7], for every lane or per lane
+    def __init__(self, lanes, memory=None, demo_rom=False, onboard_ram=False):
+        import numpy as np
+
+        self.lanes       = lanes
+        self.memory      = np.zeros((lanes, MEM_SIZE), dtype=np.uint8)
+        self.reg_ram     = np.zeros((lanes, REG_RAM_SIZE), dtype=np.uint8)
+        self.demo_rom    = np.broadcast_to(np.asarray(demo_rom, dtype=bool), (lanes,)).copy()
+        self.onboard_ram = np.broadcast_to(np.asarray(onboard_ram, dtype=bool), (lanes,)).copy()
+        if memory is not None:
+            if isinstance(memory, (bytes, bytearray)):
+                memory = np.frombuffer(bytes(memory), dtype=np.uint8)
+            memory = np.asarray(memory, dtype=np.uint8)[..., :MEM_SIZE]
+            self.memory[:, :memory.shape[-1]] = memory
+        self._flat     = self.memory.reshape(-1)
+        self._reg_flat = self.reg_ram.reshape(-1)
+        self._base     = np.arange(lanes, dtype=np.int64) * MEM_SIZE
+        self.reset()
+
+    #Same as MinibyteModel.reset() followed by the reset cycle, memory is untouched
+    def reset(self):
+        import numpy as np
+
+        lanes = self.lanes
+        self.a      = np.zeros(lanes, dtype=np.int32)
+        self.m      = np.zeros(lanes, dtype=np.int32)
+        self.pc     = np.zeros(lanes, dtype=np.int32)
+        self.ir     = np.zeros(lanes, dtype=np.int32)
+        self.ccr    = np.zeros(lanes, dtype=np.int32)
+        self.cycles = np.full(lanes, RESET_CYCLES, dtype=np.int64)
+        self.instructions = np.zeros(lanes, dtype=np.int64)
+        self.reg_ram[:] = 0
+
+    #Memory Map
+    #-------------------------
+
+    #Bytes at addr (0..127) of the lanes at base (lane * 128), as MinibyteModel.read() sees them
+    #demo/onboard - the lanes' settings, None when no lane has it set
+    def _read(self, base, addr, demo, onboard):
+        import numpy as np
+
+        data = self._flat.take(base + addr).astype(np.int32)
+        if demo is not None:
+            data = np.where(demo, _tables()["demo_rom"].take(addr & 0x3f), data)
+        if onboard is not None:
+            reg  = onboard & (addr >= REG_RAM_BASE)
+            data = np.where(reg, self._reg_flat.take((base >> 4) + (addr & 0x07)), data)
+        return data
+
+    #Execution
+    #-------------------------
+
+    #One instruction on the lanes in index (lane numbers, all of them by default)
+    def step(self, index=None):
+        import numpy as np
+
+        t     = _tables()
+        lanes = slice(None) if index is None else index
+        base  = self._base if index is None else self._base.take(index)
+        a     = self.a[lanes]
+        pc    = self.pc[lanes]
+        ccr   = self.ccr[lanes]
+
+        demo    = self.demo_rom[lanes]
+        demo    = demo if demo.any() else None
+        onboard = self.onboard_ram[lanes]
+        onboard = onboard if onboard.any() else None
+
+        ir      = self._read(base, pc & 0x7f, demo, onboard)
+        operand = self._read(base, (pc + 1) & 0x7f, demo, onboard)
+        deref   = self._read(base, operand & 0x7f, demo, onboard)    #Direct operand, IND pointer or IND target
+        key     = (ir << 2) | ccr
+
+        #Loads, ALU ops and everything else (PASSA, CCR kept) in one lookup
+        b      = np.where(t["deref_b"].take(ir), deref, operand)
+        new_a  = t["alu"].take((t["alu_op"].take(ir) << 16) | (a << 8) | b).astype(np.int32)
+        new_cc = np.where(t["keep_ccr"].take(ir), ccr, t["flags"].take(new_a))
+
+        #Where the PC and M come from, by IR and CCR (so branches are already decided)
+        source = t["pc_from"].take(key)
+        new_pc = np.where(source >= FROM_OPERAND, np.where(source == FROM_DEREF, deref, operand), pc + source) & 0xff
+        m_from = t["m_from"].take(key)
+        new_m  = np.where(m_from == FROM_OPERAND, operand, np.where(m_from == FROM_DEREF, deref, self.m[lanes]))
+
+        #Stores (reg RAM takes its own and memory takes them all, like MinibyteModel.write)
+        store = t["store"].take(ir)
+        if store.any():
+            stores = store != 0
+            addr   = np.where(store == FROM_DEREF, deref, operand)[stores] & 0x7f
+            at     = base[stores]
+            data   = a[stores]
+            self._flat[at + addr] = data
+            reg    = addr >= REG_RAM_BASE
+            self._reg_flat[(at[reg] >> 4) + (addr[reg] & 0x07)] = data[reg]
+
+        self.a[lanes]   = new_a
+        self.m[lanes]   = new_m
+        self.pc[lanes]  = new_pc
+        self.ir[lanes]  = ir
+        self.ccr[lanes] = new_cc
+        self.cycles[lanes]       += t["cycles"].take(key)
+        self.instructions[lanes] += 1
+
+    #Run whole instructions until every lane has used max_cycles (counted from now, like
+    #MinibyteModel.run()) or until(model) is true for it. until returns a lane mask.
+    #Returns the lanes until stopped
+    def run(self, max_cycles, until=None):
+        import numpy as np
+
+        end     = self.cycles + max_cycles
+        stopped = np.zeros(self.lanes, dtype=bool)
+        while True:
+            running = np.flatnonzero((self.cycles < end) & ~stopped)
+            if not len(running):
+                return stopped
+            self.step(None if len(running) == self.lanes else running)
+            if until is not None:
+                stopped |= until(self)
+
+    #Registers of one lane, same keys as MinibyteModel.registers() (always between instructions)
+    def registers(self, lane):
+        return {"a": int(self.a[lane]), "m": int(self.m[lane]), "pc": int(self.pc[lane]), "ir": int(self.ir[lane]),
+                "ccr": int(self.ccr[lane]), "state": S_FETCH_0}
+
+    #A MinibyteModel in the state of one lane
+    def model(self, lane):
+        model = MinibyteModel(bytearray(self.memory[lane].tobytes()), bool(self.demo_rom[lane]), bool(self.onboard_ram[lane]))
+        model.a, model.m, model.pc, model.ir, model.ccr = (int(self.a[lane]), int(self.m[lane]), int(self.pc[lane]),
+                                                           int(self.ir[lane]), int(self.ccr[lane]))
+        model.state        = S_FETCH_0
+        model.cycles       = int(self.cycles[lane])
+        model.instructions = int(self.instructions[lane])
+        model.reg_ram[:]   = self.reg_ram[lane].tobytes()
+        return model
+
+#Lanes for every combination of image x A x CCR, starting at the first fetch (A and the CCR
+#are set as if an earlier program had left them). Lane order is image major
+def grid(memories, a=(0,), ccr=(0,), demo_rom=False, onboard_ram=False):
+    import numpy as np
+
+    if isinstance(memories, (bytes, bytearray)):
+        memories = [memories]
+    images = np.zeros((len(memories), MEM_SIZE), dtype=np.uint8)
+    for i, memory in enumerate(memories):
+        image = bytes(memory)[:MEM_SIZE]
+        images[i, :len(image)] = np.frombuffer(image, dtype=np.uint8)
+
+    a     = np.asarray(a, dtype=np.uint8)
+    ccr   = np.asarray(ccr, dtype=np.uint8)
+    lanes = LaneModel(len(images) * len(a) * len(ccr), np.repeat(images, len(a) * len(ccr), axis=0), demo_rom, onboard_ram)
+    lanes.a[:]   = np.tile(np.repeat(a, len(ccr)), len(images))
+    lanes.ccr[:] = np.tile(ccr, len(images) * len(a))
+    return lanes
+
+
+#Checking
+#-------------------------
+
+#Compare lanes with MinibyteModels started from them (lanes.model()) and run the same way,
+#returns mismatch messages
+def compare(lanes, sample, models):
+    errors = []
+    for lane, model in zip(sample, models):
+        expected = model.registers()
+        actual   = lanes.registers(lane)
+        problems = [f"{key} {actual[key]:#x} != {expected[key]:#x}" for key in expected if actual[key] != expected[key]]
+        if int(lanes.cycles[lane]) != model.cycles:
+            problems.append(f"cycles {int(lanes.cycles[lane])} != {model.cycles}")
+        if bytes(lanes.memory[lane].tobytes()) != bytes(model.memory):
+            problems.append("memory differs")
+        if bytes(lanes.reg_ram[lane].tobytes()) != bytes(model.reg_ram):
+            problems.append("reg RAM differs")
+        if problems:
+            errors.append(f"lane {lane}: " + ", ".join(problems))
+    return errors
+
+
+#Command line
+#-------------------------
+def main(argv):
+    import argparse
+    import random
+
+    import numpy as np
+
+    from fuzz import Generator
+
+    parser = argparse.ArgumentParser(description="Check the lane model against MinibyteModel on random programs and time both")
+    parser.add_argument("--lanes",  type=int, default=4096)
+    parser.add_argument("--cycles", type=int, default=2000)
+    parser.add_argument("--sample", type=int, default=64, help="lanes also run on MinibyteModel")
+    parser.add_argument("--seed",   type=int, default=1)
+    args = parser.parse_args(argv)
+
+    #Random programs from random A/CCR, like the fuzzer's
+    rng       = random.Random(args.seed)
+    generator = Generator(rng)
+    cases     = [generator.case() for _ in range(args.lanes)]
+    lanes     = LaneModel(args.lanes, np.array([np.frombuffer(case.image, dtype=np.uint8) for case in cases]),
+                          onboard_ram=[bool(case.ui_in & TM_ONBOARD_RAM) for case in cases])
+    lanes.a[:]   = [rng.randrange(256) for _ in range(args.lanes)]
+    lanes.ccr[:] = [rng.randrange(4) for _ in range(args.lanes)]
+    sample = sorted(rng.sample(range(args.lanes), min(args.sample, args.lanes)))
+
+    models = [lanes.model(lane) for lane in sample]
+    start  = time.perf_counter()
+    for model in models:
+        model.run(args.cycles)
+    model_time = time.perf_counter() - start
+
+    _tables()
+    start      = time.perf_counter()
+    lanes.run(args.cycles)
+    lanes_time = time.perf_counter() - start
+    errors     = compare(lanes, sample, models)
+
+    model_rate = sum(model.instructions for model in models) / model_time
+    lanes_rate = int(lanes.instructions.sum()) / lanes_time
+    print(f"MinibyteModel: {model_rate:12.0f} instructions/s ({len(models)} states)")
+    print(f"LaneModel:     {lanes_rate:12.0f} instructions/s ({args.lanes} lanes), {lanes_rate / model_rate:.0f}x")
+    for error in errors[:20]:
+        print(error)
+    print(f"{len(sample) - len(errors)} of {len(sample)} lanes match MinibyteModel after {args.cycles} cycles")
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
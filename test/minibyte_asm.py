@@ -0,0 +1,369 @@
+# SPDX-FileCopyrightText: © 2024 Zachary Frazee
+# SPDX-License-Identifier: Apache-2.0
+
+#Two pass assembler and disassembler for minibyte programs
+#
+#   ; comment
+#   label:  lda #5          ; immediate     (LDA_IMM, <ALU>_IMM)
+#           add count       ; direct        (LDA_DIR, STA_DIR, <ALU>_DIR, JMP_DIR, B<cc>_DIR)
+#           sta (ptr)       ; indirect      (STA_IND, JMP_IND, B<cc>_IND)
+#           .org 0x40       ; move the location counter
+#           .byte 1, 2, 'A' ; data
+#           .fill 8, 0xff   ; n bytes of a value (0 by default)
+#   SIZE    = 8             ; constant (also .equ SIZE 8)
+#
+#Expressions can use numbers (decimal, 0x.., $.., 0b.., 'c'), labels, constants, . for the
+#current address, + - * / % & | ^ << >> ~ and parentheses, so self modifying code can say
+#"sta load+1". Everything is assembled into a 128 byte memory image.
+#
+#   python minibyte_asm.py program.s -o program.bin --listing
+
+#Includes
+#-------------------------
+import ast
+import re
+import sys
+from collections import namedtuple
+
+from minibyte_isa import IR_NOP, IR_NAMES
+
+#Constants
+#-------------------------
+MEM_SIZE      = 128
+
+#Mnemonic => {addressing mode: opcode}
+MODE_IMM      = "imm"
+MODE_DIR      = "dir"
+MODE_IND      = "ind"
+
+OPCODES = {"nop": {None: IR_NOP}}
+for _ir, _name in IR_NAMES.items():
+    if "_" in _name:
+        _mnemonic, _mode = _name.lower().split("_")
+        OPCODES.setdefault(_mnemonic, {})[_mode] = _ir
+
+#One assembled instruction (operand is None for NOP)
+Instruction = namedtuple("Instruction", ["addr", "ir", "operand", "line", "text"])
+
+class AsmError(ValueError):
+    pass
+
+
+#Expressions
+#-------------------------
+_SYMBOL = "_sym_"
+
+_BINOPS = {
+    ast.Add: lambda a, b: a + b,        ast.Sub: lambda a, b: a - b,
+    ast.Mult: lambda a, b: a * b,       ast.FloorDiv: lambda a, b: a // b,
+    ast.Div: lambda a, b: a // b,       ast.Mod: lambda a, b: a % b,
+    ast.BitAnd: lambda a, b: a & b,     ast.BitOr: lambda a, b: a | b,
+    ast.BitXor: lambda a, b: a ^ b,     ast.LShift: lambda a, b: a << b,
+    ast.RShift: lambda a, b: a >> b,
+}
+
+def _eval_node(node, symbols):
+    if isinstance(node, ast.Expression):
+        return _eval_node(node.body, symbols)
+    if isinstance(node, ast.Constant) and isinstance(node.value, int):
+        return node.value
+    if isinstance(node, ast.Name):
+        name = node.id[len(_SYMBOL):]
+        if name not in symbols:
+            raise KeyError(name)
+        return symbols[name]
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINOPS:
+        return _BINOPS[type(node.op)](_eval_node(node.left, symbols), _eval_node(node.right, symbols))
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd, ast.Invert)):
+        value = _eval_node(node.operand, symbols)
+        return -value if isinstance(node.op, ast.USub) else ~value if isinstance(node.op, ast.Invert) else value
+    raise ValueError("unsupported expression")
+
+#Evaluate an operand expression, raises KeyError for symbols that are not defined (yet)
+#Symbols are prefixed before parsing so labels can be Python keywords (from, pass, ...)
+def evaluate(text, symbols):
+    text = re.sub(r"\$([0-9a-fA-F]+)", r"0x\1", text)
+    text = re.sub(r"'(.)'", lambda match: str(ord(match.group(1))), text)
+    text = re.sub(r"(?<![\w.])\.(?![\w.])", "_here_", text)
+    text = re.sub(r"(?<!\w)([A-Za-z_]\w*)", _SYMBOL + r"\1", text)
+    try:
+        return _eval_node(ast.parse(text.strip(), mode="eval"), symbols)
+    except SyntaxError:
+        raise ValueError(f"bad expression '{text.strip()}'")
+
+
+#Names an operand expression refers to
+def symbols_in(text):
+    text = re.sub(r"'(.)'", "", text)
+    text = re.sub(r"\$[0-9a-fA-F]+", "", text)
+    return set(re.findall(r"(?<!\w)([A-Za-z_]\w*)", text))
+
+
+#Assembler
+#-------------------------
+class Program:
+    def __init__(self):
+        self.memory       = bytearray(MEM_SIZE)
+        self.labels       = {}
+        self.instructions = []
+        self.used         = set()
+
+    #Bytes taken by instructions (opcodes and operands, not data)
+    @property
+    def code_bytes(self):
+        return sum(1 if ins.operand is None else 2 for ins in self.instructions)
+
+    def listing(self):
+        names = {}
+        for name, addr in self.labels.items():
+            names.setdefault(addr, name)
+        lines = []
+        for ins in self.instructions:
+            label = names.get(ins.addr, "")
+            data  = f"{ins.ir:02x}" if ins.operand is None else f"{ins.ir:02x} {ins.operand:02x}"
+            lines.append(f"{ins.addr:02x}: {data:<6} {label + ':' if label else '':<10}{ins.text}")
+        return "\n".join(lines)
+
+#Split a source line into (label, mnemonic, operand text)
+_LINE = re.compile(r"^\s*(?:(?P<label>[A-Za-z_]\w*)\s*:)?\s*(?:(?P<op>\.?[A-Za-z_]\w*)\s*(?P<args>.*?))?\s*$")
+
+#Cut at the first ; that is not a character literal (';')
+def _strip_comment(line):
+    i = 0
+    while i < len(line):
+        if line[i] == "'" and i + 2 < len(line) and line[i + 2] == "'":
+            i += 3
+            continue
+        if line[i] == ";":
+            return line[:i]
+        i += 1
+    return line
+
+#(addressing mode, expression) of an operand, mode is None without one
+def operand_mode(args):
+    args = args.strip()
+    if not args:
+        return None, ""
+    if args.startswith("#"):
+        return MODE_IMM, args[1:]
+    if args.startswith("(") and args.endswith(")") and _balanced(args[1:-1]):
+        return MODE_IND, args[1:-1]
+    return MODE_DIR, args
+
+def _balanced(text):
+    depth = 0
+    for c in text:
+        depth += {"(": 1, ")": -1}.get(c, 0)
+        if depth < 0:
+            return False
+    return depth == 0
+
+#Split source into (line number, label, mnemonic or directive, operand text, raw line)
+def parse_source(source):
+    statements = []
+    for number, raw in enumerate(source.splitlines(), 1):
+        line = _strip_comment(raw)
+        if not line.strip():
+            continue
+
+        #NAME = expr
+        equ = re.match(r"^\s*([A-Za-z_]\w*)\s*=\s*(.+?)\s*$", line)
+        if equ:
+            statements.append((number, None, ".equ", f"{equ.group(1)} {equ.group(2)}", raw.strip()))
+            continue
+
+        match = _LINE.match(line)
+        if not match:
+            raise AsmError(f"line {number}: cannot parse '{raw.strip()}'")
+        statements.append((number, match.group("label"), (match.group("op") or "").lower(), match.group("args") or "", raw.strip()))
+    return statements
+
+def _size(op, args, number):
+    if op == "":
+        return 0
+    if op in OPCODES:
+        return 1 if op == "nop" else 2
+    if op == ".byte":
+        return len(_split_args(args))
+    raise AsmError(f"line {number}: unknown mnemonic '{op}'")
+
+def _split_args(args):
+    parts, depth, current = [], 0, ""
+    for c in args:
+        if c == "," and depth == 0:
+            parts.append(current)
+            current = ""
+            continue
+        depth += {"(": 1, ")": -1}.get(c, 0)
+        current += c
+    if current.strip():
+        parts.append(current)
+    return [part.strip() for part in parts]
+
+def assemble(source, symbols=None):
+    statements = parse_source(source)
+    program    = Program()
+    known      = dict(symbols or {})
+
+    def value(text, number, here, final):
+        scope = dict(known, _here_=here)
+        try:
+            return evaluate(text, scope)
+        except KeyError as e:
+            if final:
+                raise AsmError(f"line {number}: undefined symbol {e.args[0]}")
+            return 0
+        except (ValueError, ZeroDivisionError) as e:
+            raise AsmError(f"line {number}: {e}")
+
+    #Pass 1 places labels, pass 2 emits with every label known
+    for final in (False, True):
+        here = 0
+        for number, label, op, args, text in statements:
+            if label:
+                if not final and label in program.labels:
+                    raise AsmError(f"line {number}: label '{label}' defined twice")
+                program.labels[label] = here
+                known[label]          = here
+
+            if op == ".equ":
+                name, _, expr = args.strip().partition(" ")
+                known[name] = value(expr, number, here, final)
+                continue
+            if op == ".org":
+                here = value(args, number, here, final)
+                continue
+            if op == ".fill":
+                parts = _split_args(args)
+                count = value(parts[0], number, here, final)
+                fill  = value(parts[1], number, here, final) if len(parts) > 1 else 0
+                if final:
+                    for i in range(count):
+                        _emit(program, here + i, fill, number)
+                here += count
+                continue
+
+            size = _size(op, args, number)
+            if final and op == ".byte":
+                for i, part in enumerate(_split_args(args)):
+                    _emit(program, here + i, value(part, number, here, final), number)
+            elif final and op in OPCODES:
+                mode, expr = operand_mode(args)
+                forms      = OPCODES[op]
+                if mode not in forms:
+                    allowed = ", ".join(str(form) for form in forms)
+                    raise AsmError(f"line {number}: '{op}' has no {mode or 'implied'} form ({allowed})")
+                ir      = forms[mode]
+                operand = None if mode is None else value(expr, number, here, final)
+                _emit(program, here, ir, number)
+                if operand is not None:
+                    _emit(program, here + 1, operand, number)
+                program.instructions.append(Instruction(here, ir, None if operand is None else operand & 0xff, number, f"{op} {args.strip()}".strip()))
+            here += size
+
+    return program
+
+def _emit(program, addr, byte, number):
+    if not 0 <= addr < MEM_SIZE:
+        raise AsmError(f"line {number}: address 0x{addr:x} outside memory")
+    if not -128 <= byte <= 255:
+        raise AsmError(f"line {number}: value {byte} does not fit in a byte")
+    if addr in program.used:
+        raise AsmError(f"line {number}: address 0x{addr:02x} written twice")
+    program.used.add(addr)
+    program.memory[addr] = byte & 0xff
+
+
+#Disassembler
+#-------------------------
+
+#One line of assembly for the instruction at addr
+def disassemble_one(memory, addr):
+    ir   = memory[addr]
+    name = IR_NAMES.get(ir)
+    if name is None:
+        return f".byte 0x{ir:02x}", 1
+    if ir == IR_NOP:
+        return "nop", 1
+
+    operand          = memory[(addr + 1) % len(memory)]
+    mnemonic, mode   = name.lower().split("_")
+    operand_text     = {MODE_IMM: f"#0x{operand:02x}", MODE_DIR: f"0x{operand:02x}", MODE_IND: f"(0x{operand:02x})"}[mode]
+    return f"{mnemonic} {operand_text}", 2
+
+#Turn a binary image back into source, with labels for the jump and branch targets
+#Everything from start to end is taken as code
+def lift(memory, start=0, end=None):
+    end     = len(memory) if end is None else end
+    decoded = []
+    addr    = start
+    while addr < end:
+        text, size = disassemble_one(memory, addr)
+        decoded.append((addr, text, size))
+        addr += size
+
+    #Direct jumps and branches get a label at their target
+    def target(addr, size):
+        name = IR_NAMES.get(memory[addr], "")
+        if size == 2 and name.endswith("_DIR") and (name.startswith("JMP") or name.startswith("B")):
+            return memory[addr + 1]
+        return None
+
+    starts  = {addr for addr, _, _ in decoded}
+    targets = {target(addr, size) for addr, _, size in decoded} & starts
+
+    lines = [f".org 0x{start:02x}"] if start else []
+    for addr, text, size in decoded:
+        if addr in targets:
+            lines.append(f"L{addr:02x}:")
+        to = target(addr, size)
+        if to in targets:
+            text = f"{text.split()[0]} L{to:02x}"
+        lines.append(f"        {text}")
+    return "\n".join(lines) + "\n"
+
+def disassemble(memory, start=0, end=None):
+    end   = len(memory) if end is None else end
+    lines = []
+    addr  = start
+    while addr < end:
+        text, size = disassemble_one(memory, addr)
+        lines.append(f"{addr:02x}: {text}")
+        addr += size
+    return "\n".join(lines)
+
+
+#Command line
+#-------------------------
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Assemble a minibyte program into a 128 byte memory image")
+    parser.add_argument("source")
+    parser.add_argument("-o", "--output",  help="raw binary memory image")
+    parser.add_argument("--listing",       action="store_true")
+    parser.add_argument("--disassemble",   action="store_true", help="source is a binary image, print it as assembly")
+    args = parser.parse_args(argv)
+
+    if args.disassemble:
+        with open(args.source, "rb") as f:
+            print(disassemble(f.read()))
+        return 0
+
+    with open(args.source) as f:
+        try:
+            program = assemble(f.read())
+        except AsmError as e:
+            print(f"{args.source}: {e}", file=sys.stderr)
+            return 1
+
+    if args.listing:
+        print(program.listing())
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(program.memory)
+    print(f"{program.code_bytes} code bytes, {len(program.used)} bytes used")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,182 @@
+# SPDX-FileCopyrightText: © 2024 Zachary Frazee
+# SPDX-License-Identifier: Apache-2.0
+
+#Minibyte ISA and DFT constants
+#Shared by the cocotb tests and the offline tools, so this must not import cocotb
+
+#DFT Testmodes
+#-------------------------
+TM_OFF                = 0x00
+
+TM_DEBUG_OUT_A        = 0x01
+TM_DEBUG_OUT_A_UPPER  = 0x02
+TM_DEBUG_OUT_M        = 0x03
+TM_DEBUG_OUT_PC       = 0x04
+TM_DEBUG_OUT_IR       = 0x05
+TM_DEBUG_OUT_CCR      = 0x06
+TM_DEBUG_OUT_CU_STATE = 0x07
+
+TM_HALT_CU            = 0x08
+TM_DEMO_ROM           = 0x10
+TM_ONBOARD_RAM        = 0x80
+
+#CCR Bits (as seen on TM_DEBUG_OUT_CCR)
+#-------------------------
+CCR_N                 = 0x01
+CCR_Z                 = 0x02
+
+#IR Opcodes
+#-------------------------
+IR_NOP     = 0x00
+IR_LDA_IMM = 0x01
+IR_LDA_DIR = 0x02
+IR_STA_DIR = 0x03
+IR_STA_IND = 0x04
+IR_ADD_IMM = 0x05
+IR_ADD_DIR = 0x06
+IR_SUB_IMM = 0x07
+IR_SUB_DIR = 0x08
+IR_AND_IMM = 0x09
+IR_AND_DIR = 0x0A
+IR_OR_IMM  = 0x0B
+IR_OR_DIR  = 0x0C
+IR_XOR_IMM = 0x0D
+IR_XOR_DIR = 0x0E
+IR_LSL_IMM = 0x0F
+IR_LSL_DIR = 0x10
+IR_LSR_IMM = 0x11
+IR_LSR_DIR = 0x12
+IR_ASL_IMM = 0x13
+IR_ASL_DIR = 0x14
+IR_ASR_IMM = 0x15
+IR_ASR_DIR = 0x16
+IR_RSL_IMM = 0x17
+IR_RSL_DIR = 0x18
+IR_RSR_IMM = 0x19
+IR_RSR_DIR = 0x1A
+IR_JMP_DIR = 0x1B
+IR_JMP_IND = 0x1C
+IR_BNE_DIR = 0x1D
+IR_BNE_IND = 0x1E
+IR_BEQ_DIR = 0x1F
+IR_BEQ_IND = 0x20
+IR_BPL_DIR = 0x21
+IR_BPL_IND = 0x22
+IR_BMI_DIR = 0x23
+IR_BMI_IND = 0x24
+
+#IR Cycle Counts
+#-------------------------
+CYCLES_NOP     = 4  # S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0
+CYCLES_LDA_IMM = 7  # S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_LDA_IMM_0->S_LDA_IMM_1->S_PC_INC_0
+CYCLES_LDA_DIR = 9  # S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_LDA_DIR_0->S_LDA_DIR_1->S_LDA_DIR_2->S_LDA_DIR_3->S_PC_INC_0
+CYCLES_STA_DIR = 9  # S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_STA_DIR_0->S_STA_DIR_1->S_STA_DIR_2->S_STA_DIR_3->S_PC_INC_0
+CYCLES_STA_IND = 11 # S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_STA_DIR_0->S_STA_DIR_1->S_STA_DIR_2->S_STA_DIR_3->S_STA_DIR_4->S_STA_DIR_5->S_PC_INC_0
+
+CYCLES_ALU_IMM = 7  # S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_<ALU>_IMM_0->S_<ALU>_IMM_1->S_PC_INC_0
+CYCLES_ALU_DIR = 9  # S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_<ALU>_DIR_0->S_<ALU>_DIR_1->S_<ALU>_DIR_2->S_<ALU>_DIR_3->S_PC_INC_0
+
+CYCLES_JMP_DIR = 6  # S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_JMP_DIR_0->S_JMP_DIR_1
+CYCLES_JMP_IND = 8  # S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_JMP_IND_0->S_JMP_IND_1->S_JMP_IND_2->S_JMP_IND_3
+
+#CU States (control_unit.v)
+#-------------------------
+S_RESET_0   = 0x00
+S_PC_INC_0  = 0x01
+S_FETCH_0   = 0x02
+S_FETCH_1   = 0x03
+S_FETCH_2   = 0x04
+S_DECODE_0  = 0x05
+S_LDA_IMM_0 = 0x06
+S_LDA_IMM_1 = 0x07
+S_LDA_DIR_0 = 0x08
+S_LDA_DIR_1 = 0x09
+S_LDA_DIR_2 = 0x0A
+S_LDA_DIR_3 = 0x0B
+S_STA_DIR_0 = 0x0C
+S_STA_DIR_1 = 0x0D
+S_STA_DIR_2 = 0x0E
+S_STA_DIR_3 = 0x0F
+S_STA_IND_0 = 0x10
+S_STA_IND_1 = 0x11
+S_STA_IND_2 = 0x12
+S_STA_IND_3 = 0x13
+S_STA_IND_4 = 0x14
+S_STA_IND_5 = 0x15
+S_ADD_IMM_0 = 0x16
+S_ADD_IMM_1 = 0x17
+S_ADD_DIR_0 = 0x18
+S_ADD_DIR_1 = 0x19
+S_ADD_DIR_2 = 0x1A
+S_ADD_DIR_3 = 0x1B
+S_SUB_IMM_0 = 0x1C
+S_SUB_IMM_1 = 0x1D
+S_SUB_DIR_0 = 0x1E
+S_SUB_DIR_1 = 0x1F
+S_SUB_DIR_2 = 0x20
+S_SUB_DIR_3 = 0x21
+S_AND_IMM_0 = 0x22
+S_AND_IMM_1 = 0x23
+S_AND_DIR_0 = 0x24
+S_AND_DIR_1 = 0x25
+S_AND_DIR_2 = 0x26
+S_AND_DIR_3 = 0x27
+S_OR_IMM_0  = 0x28
+S_OR_IMM_1  = 0x29
+S_OR_DIR_0  = 0x2A
+S_OR_DIR_1  = 0x2B
+S_OR_DIR_2  = 0x2C
+S_OR_DIR_3  = 0x2D
+S_XOR_IMM_0 = 0x2E
+S_XOR_IMM_1 = 0x2F
+S_XOR_DIR_0 = 0x30
+S_XOR_DIR_1 = 0x31
+S_XOR_DIR_2 = 0x32
+S_XOR_DIR_3 = 0x33
+S_LSL_IMM_0 = 0x34
+S_LSL_IMM_1 = 0x35
+S_LSL_DIR_0 = 0x36
+S_LSL_DIR_1 = 0x37
+S_LSL_DIR_2 = 0x38
+S_LSL_DIR_3 = 0x39
+S_LSR_IMM_0 = 0x3A
+S_LSR_IMM_1 = 0x3B
+S_LSR_DIR_0 = 0x3C
+S_LSR_DIR_1 = 0x3D
+S_LSR_DIR_2 = 0x3E
+S_LSR_DIR_3 = 0x3F
+S_ASL_IMM_0 = 0x40
+S_ASL_IMM_1 = 0x41
+S_ASL_DIR_0 = 0x42
+S_ASL_DIR_1 = 0x43
+S_ASL_DIR_2 = 0x44
+S_ASL_DIR_3 = 0x45
+S_ASR_IMM_0 = 0x46
+S_ASR_IMM_1 = 0x47
+S_ASR_DIR_0 = 0x48
+S_ASR_DIR_1 = 0x49
+S_ASR_DIR_2 = 0x4A
+S_ASR_DIR_3 = 0x4B
+S_RSL_IMM_0 = 0x4C
+S_RSL_IMM_1 = 0x4D
+S_RSL_DIR_0 = 0x4E
+S_RSL_DIR_1 = 0x4F
+S_RSL_DIR_2 = 0x50
+S_RSL_DIR_3 = 0x51
+S_RSR_IMM_0 = 0x52
+S_RSR_IMM_1 = 0x53
+S_RSR_DIR_0 = 0x54
+S_RSR_DIR_1 = 0x55
+S_RSR_DIR_2 = 0x56
+S_RSR_DIR_3 = 0x57
+S_JMP_DIR_0 = 0x58
+S_JMP_DIR_1 = 0x59
+S_JMP_IND_0 = 0x5A
+S_JMP_IND_1 = 0x5B
+S_JMP_IND_2 = 0x5C
+S_JMP_IND_3 = 0x5D
+
+#Name Tables
+#-------------------------
+IR_NAMES = {value: name[3:] for name, value in list(globals().items()) if name.startswith("IR_")}
+S_NAMES  = {value: name     for name, value in list(globals().items()) if name.startswith("S_")}
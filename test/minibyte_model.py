@@ -0,0 +1,397 @@
+# SPDX-FileCopyrightText: © 2024 Zachary Frazee
+# SPDX-License-Identifier: Apache-2.0
+
+#Cycle accurate Python reference model of the minibyte CPU
+#
+#Steps the same CU states as control_unit.v, one clock edge per cycle(), with the same register
+#transfers, bus timing and memory map as project.v:
+#   - addr >= 0x78 with onboard RAM enabled (ui_in[7]) reads the 8 byte reg RAM
+#   - otherwise with the demo ROM enabled (ui_in[4]) reads the 64 byte demo ROM
+#   - otherwise reads external memory
+#   - writes always go out on the bus, and the reg RAM latches any write to addr >= 0x78, one
+#     cycle before the data is driven (it latches on WE)
+#   - the DFT debug outputs (ui_in[2:0], debug below) replace the address for all of the above,
+#     the demo ROM and reg RAM see the same muxed address as the pins
+#
+#Used as the golden reference for the RTL and to run programs without a simulator.
+
+#Includes
+#-------------------------
+import minibyte_isa
+from minibyte_isa import (TM_OFF, TM_DEBUG_OUT_A, TM_DEBUG_OUT_A_UPPER, TM_DEBUG_OUT_M, TM_DEBUG_OUT_PC,
+                          TM_DEBUG_OUT_IR, TM_DEBUG_OUT_CCR, CCR_N, CCR_Z, IR_NOP, IR_LDA_IMM, IR_LDA_DIR,
+                          IR_STA_DIR, IR_STA_IND, IR_ADD_IMM, IR_LSL_IMM, IR_JMP_DIR, IR_JMP_IND, IR_BNE_DIR,
+                          IR_BPL_DIR, CYCLES_NOP, S_RESET_0, S_PC_INC_0, S_FETCH_0, S_FETCH_1, S_FETCH_2,
+                          S_DECODE_0, S_LDA_IMM_0, S_LDA_IMM_1, S_LDA_DIR_0, S_LDA_DIR_1, S_LDA_DIR_2,
+                          S_LDA_DIR_3, S_STA_DIR_0, S_STA_DIR_1, S_STA_DIR_2, S_STA_DIR_3, S_STA_IND_0,
+                          S_STA_IND_1, S_STA_IND_2, S_STA_IND_3, S_STA_IND_4, S_STA_IND_5, S_JMP_DIR_0,
+                          S_JMP_DIR_1, S_JMP_IND_0, S_JMP_IND_1, S_JMP_IND_2, S_JMP_IND_3, IR_NAMES)
+
+#ALU Ops (alu.v)
+#-------------------------
+ALU_PASSA = 0x0
+ALU_PASSB = 0x1
+ALU_ADD   = 0x2
+ALU_SUB   = 0x3
+ALU_AND   = 0x4
+ALU_OR    = 0x5
+ALU_XOR   = 0x6
+ALU_LSL   = 0x7
+ALU_LSR   = 0x8
+ALU_ASL   = 0x9
+ALU_ASR   = 0xA
+ALU_RSL   = 0xB
+ALU_RSR   = 0xC
+
+#Memory Map
+#-------------------------
+MEM_SIZE      = 128
+REG_RAM_BASE  = 0x78
+REG_RAM_SIZE  = 8
+
+#Demo ROM contents (demo_rom.v), unused space reads 0
+DEMO_ROM = bytes([
+    IR_NOP,
+    IR_LDA_IMM, 0x00,
+    IR_NOP,                 #LOOP0
+    IR_ADD_IMM, 0x01,
+    IR_STA_DIR, 0x40,
+    IR_BNE_DIR, 0x03,
+    IR_LDA_IMM, 0x01,
+    IR_STA_DIR, 0x40,
+    IR_NOP,                 #LOOP1
+    IR_LSL_IMM, 0x01,
+    IR_STA_DIR, 0x40,
+    IR_BPL_DIR, 0x0E,
+    IR_LDA_IMM, 0xDE,       #DEADBEEF into reg RAM
+    IR_STA_DIR, 0x78,
+    IR_LDA_IMM, 0xAD,
+    IR_STA_DIR, 0x79,
+    IR_LDA_IMM, 0xBE,
+    IR_STA_DIR, 0x7A,
+    IR_LDA_IMM, 0xEF,
+    IR_STA_DIR, 0x7B,
+    IR_LDA_DIR, 0x78,       #And back out to 0x40
+    IR_STA_DIR, 0x40,
+    IR_LDA_DIR, 0x79,
+    IR_STA_DIR, 0x40,
+    IR_LDA_DIR, 0x7A,
+    IR_STA_DIR, 0x40,
+    IR_LDA_DIR, 0x7B,
+    IR_STA_DIR, 0x40,
+    IR_JMP_DIR, 0x00,
+]).ljust(64, b"\x00")
+
+
+#ALU
+#-------------------------
+
+#Returns (result, ccr) exactly as alu.v computes them (ccr bit1=Z, bit0=N)
+def alu(op, a, b):
+    if op == ALU_PASSA:
+        res = a
+    elif op == ALU_PASSB:
+        res = b
+    elif op == ALU_ADD:
+        res = a + b
+    elif op == ALU_SUB:
+        res = a - b
+    elif op == ALU_AND:
+        res = a & b
+    elif op == ALU_OR:
+        res = a | b
+    elif op == ALU_XOR:
+        res = a ^ b
+    elif op == ALU_LSL or op == ALU_ASL:
+        res = a << b if b < 8 else 0
+    elif op == ALU_LSR:
+        res = a >> b
+    elif op == ALU_ASR:
+        res = (a | (0xff00 if a & 0x80 else 0)) >> min(b, 8)
+    elif op == ALU_RSL:
+        res = (a << (b & 7)) | (a >> (8 - (b & 7)))
+    elif op == ALU_RSR:
+        res = (a >> (b & 7)) | (a << (8 - (b & 7)))
+    else:
+        res = 0
+
+    res &= 0xff
+    return res, (CCR_Z if res == 0 else 0) | (CCR_N if res & 0x80 else 0)
+
+
+#CU Tables
+#-------------------------
+
+#Per state control outputs, same fields as the control_unit.v output logic
+#(addr_m, alu_op, set_a, set_m, set_pc, inc_pc, set_ir, set_ccr, we, drive)
+CU_OUTPUTS = {}
+
+#Fixed next state for every state that does not decode or halt
+CU_NEXT    = {}
+
+#First state of every non-branch opcode (DECODE_0 -> state)
+CU_DECODE  = {IR_NOP: S_FETCH_0}
+
+#Branch opcodes => (ccr bit, value it must have, first state when taken)
+CU_BRANCH  = {}
+
+def _state(state, next_state, addr_m=0, alu_op=ALU_PASSB, set_a=0, set_m=0, set_pc=0, inc_pc=0, set_ir=0, set_ccr=0, we=0, drive=0):
+    CU_OUTPUTS[state] = (addr_m, alu_op, set_a, set_m, set_pc, inc_pc, set_ir, set_ccr, we, drive)
+    if next_state is not None:
+        CU_NEXT[state] = next_state
+
+def _build_cu_tables():
+    #Reset, PC increment and fetch
+    _state(S_RESET_0,  S_FETCH_0,  alu_op=ALU_PASSA)
+    _state(S_PC_INC_0, S_FETCH_0,  alu_op=ALU_PASSA, inc_pc=1)
+    _state(S_FETCH_0,  None)
+    _state(S_FETCH_1,  S_FETCH_2,  set_ir=1)
+    _state(S_FETCH_2,  S_DECODE_0, inc_pc=1)
+    _state(S_DECODE_0, None,       alu_op=ALU_PASSA)
+
+    #Loads and stores
+    _state(S_LDA_IMM_0, S_LDA_IMM_1)
+    _state(S_LDA_IMM_1, S_PC_INC_0, set_a=1)
+    _state(S_LDA_DIR_0, S_LDA_DIR_1)
+    _state(S_LDA_DIR_1, S_LDA_DIR_2, set_m=1)
+    _state(S_LDA_DIR_2, S_LDA_DIR_3, addr_m=1)
+    _state(S_LDA_DIR_3, S_PC_INC_0,  addr_m=1, set_a=1)
+    _state(S_STA_DIR_0, S_STA_DIR_1)
+    _state(S_STA_DIR_1, S_STA_DIR_2, set_m=1)
+    _state(S_STA_DIR_2, S_STA_DIR_3, addr_m=1, alu_op=ALU_PASSA, we=1)
+    _state(S_STA_DIR_3, S_PC_INC_0,  addr_m=1, alu_op=ALU_PASSA, we=1, drive=1)
+    _state(S_STA_IND_0, S_STA_IND_1)
+    _state(S_STA_IND_1, S_STA_IND_2, set_m=1)
+    _state(S_STA_IND_2, S_STA_IND_3, addr_m=1)
+    _state(S_STA_IND_3, S_STA_IND_4, addr_m=1, set_m=1)
+    _state(S_STA_IND_4, S_STA_IND_5, addr_m=1, alu_op=ALU_PASSA, we=1)
+    _state(S_STA_IND_5, S_PC_INC_0,  addr_m=1, alu_op=ALU_PASSA, we=1, drive=1)
+
+    for ir in (IR_LDA_IMM, IR_LDA_DIR, IR_STA_DIR, IR_STA_IND):
+        CU_DECODE[ir] = getattr(minibyte_isa, "S_" + IR_NAMES[ir] + "_0")
+
+    #ALU ops, IMM and DIR forms
+    for name in ("ADD", "SUB", "AND", "OR", "XOR", "LSL", "LSR", "ASL", "ASR", "RSL", "RSR"):
+        op  = globals()["ALU_" + name]
+        imm = getattr(minibyte_isa, "S_" + name + "_IMM_0")
+        dir = getattr(minibyte_isa, "S_" + name + "_DIR_0")
+
+        _state(imm,     imm + 1,    alu_op=op)
+        _state(imm + 1, S_PC_INC_0, alu_op=op, set_a=1, set_ccr=1)
+        _state(dir,     dir + 1)
+        _state(dir + 1, dir + 2,    set_m=1)
+        _state(dir + 2, dir + 3,    addr_m=1, alu_op=op)
+        _state(dir + 3, S_PC_INC_0, addr_m=1, alu_op=op, set_a=1, set_ccr=1)
+
+        CU_DECODE[getattr(minibyte_isa, "IR_" + name + "_IMM")] = imm
+        CU_DECODE[getattr(minibyte_isa, "IR_" + name + "_DIR")] = dir
+
+    #Jumps (no PC increment after, the new PC is the next fetch address)
+    _state(S_JMP_DIR_0, S_JMP_DIR_1)
+    _state(S_JMP_DIR_1, S_FETCH_0,   set_pc=1)
+    _state(S_JMP_IND_0, S_JMP_IND_1)
+    _state(S_JMP_IND_1, S_JMP_IND_2, set_m=1)
+    _state(S_JMP_IND_2, S_JMP_IND_3, addr_m=1)
+    _state(S_JMP_IND_3, S_FETCH_0,   addr_m=1, set_pc=1)
+
+    CU_DECODE[IR_JMP_DIR] = S_JMP_DIR_0
+    CU_DECODE[IR_JMP_IND] = S_JMP_IND_0
+
+    #Branches, not taken goes through S_PC_INC_0 to skip the operand
+    for name, mask, value in (("BNE", CCR_Z, 0), ("BEQ", CCR_Z, CCR_Z), ("BPL", CCR_N, 0), ("BMI", CCR_N, CCR_N)):
+        CU_BRANCH[getattr(minibyte_isa, "IR_" + name + "_DIR")] = (mask, value, S_JMP_DIR_0)
+        CU_BRANCH[getattr(minibyte_isa, "IR_" + name + "_IND")] = (mask, value, S_JMP_IND_0)
+
+_build_cu_tables()
+
+#True if nothing is latched from the data bus or written in this state, so the address can change
+#(a debug output selected) without changing what the program does
+def bus_quiet(state):
+    _, _, set_a, set_m, set_pc, _, set_ir, _, we, _ = CU_OUTPUTS[state]
+    return not (set_a or set_m or set_pc or set_ir or we)
+
+#Cycles an instruction takes from S_FETCH_0 back to S_FETCH_0 (taken=False for branches not taken)
+def instruction_cycles(ir, taken=True):
+    if ir in CU_BRANCH:
+        if not taken:
+            return CYCLES_NOP + 1
+        ir = IR_JMP_DIR if CU_BRANCH[ir][2] == S_JMP_DIR_0 else IR_JMP_IND
+
+    state  = CU_DECODE.get(ir, S_FETCH_0)
+    cycles = CYCLES_NOP
+    while state != S_FETCH_0:
+        state   = CU_NEXT[state]
+        cycles += 1
+    return cycles
+
+
+#Model
+#-------------------------
+class MinibyteModel:
+    #memory      - external memory, anything indexable with 0..127 (bytearray by default)
+    #demo_rom    - same as ui_in[4]
+    #onboard_ram - same as ui_in[7]
+    #debug       - same as ui_in[2:0], can be changed between cycles like halt
+    def __init__(self, memory=None, demo_rom=False, onboard_ram=False):
+        self.memory      = memory if memory is not None else bytearray(MEM_SIZE)
+        self.reg_ram     = bytearray(REG_RAM_SIZE)
+        self.demo_rom    = demo_rom
+        self.onboard_ram = onboard_ram
+        self.halt        = False
+        self.debug       = TM_OFF
+        self.reset()
+
+    #Same as holding rst_n low (registers and reg RAM clear, memory is untouched)
+    def reset(self):
+        self.a      = 0
+        self.m      = 0
+        self.pc     = 0
+        self.ir     = 0
+        self.ccr    = 0
+        self.state  = S_RESET_0
+        self.cycles = 0
+        self.instructions = 0
+        self.reg_ram[:] = bytes(REG_RAM_SIZE)
+
+    #Copy a program into external memory
+    def load(self, program, base=0):
+        for i, byte in enumerate(program):
+            self.memory[(base + i) & 0x7f] = byte & 0xff
+
+    #Memory Map
+    #-------------------------
+    def read(self, addr):
+        if self.onboard_ram and addr >= REG_RAM_BASE:
+            return self.reg_ram[addr & 0x07]
+        if self.demo_rom:
+            return DEMO_ROM[addr & 0x3f]
+        return self.memory[addr] & 0xff
+
+    def write(self, addr, value):
+        if addr >= REG_RAM_BASE:
+            self.reg_ram[addr & 0x07] = value
+        self.memory[addr] = value
+
+    #Bus
+    #-------------------------
+
+    #The 7 bit address out of the debug mux in cpu.v (debug != TM_OFF)
+    def debug_address(self):
+        debug = self.debug
+        if debug == TM_DEBUG_OUT_A:
+            return self.a & 0x7f
+        if debug == TM_DEBUG_OUT_A_UPPER:
+            return self.a >> 7
+        if debug == TM_DEBUG_OUT_M:
+            return self.m & 0x7f
+        if debug == TM_DEBUG_OUT_PC:
+            return self.pc & 0x7f
+        if debug == TM_DEBUG_OUT_IR:
+            return self.ir & 0x7f
+        if debug == TM_DEBUG_OUT_CCR:
+            return self.ccr
+        return self.state & 0x7f
+
+    #What the pins show during the current state: (addr, we, drive, data out)
+    def bus(self):
+        addr_m, alu_op, _, _, _, _, _, _, we, drive = CU_OUTPUTS[self.state]
+        addr = self.debug_address() if self.debug else (self.m if addr_m else self.pc) & 0x7f
+        return addr, we, drive, self.a if drive else 0
+
+    #Execution
+    #-------------------------
+
+    #One rising clock edge
+    def cycle(self):
+        state = self.state
+        addr_m, alu_op, set_a, set_m, set_pc, inc_pc, set_ir, set_ccr, we, drive = CU_OUTPUTS[state]
+        addr  = self.debug_address() if self.debug else (self.m if addr_m else self.pc) & 0x7f
+
+        #Next state
+        if state == S_FETCH_0:
+            next_state = S_FETCH_0 if self.halt else S_FETCH_1
+        elif state == S_DECODE_0:
+            branch = CU_BRANCH.get(self.ir)
+            if branch is not None:
+                next_state = branch[2] if (self.ccr & branch[0]) == branch[1] else S_PC_INC_0
+            else:
+                next_state = CU_DECODE.get(self.ir, S_FETCH_0)
+        else:
+            next_state = CU_NEXT[state]
+
+        #Register transfers, only touch the bus when something latches from it
+        if set_a or set_m or set_pc or set_ir:
+            res, flags = alu(alu_op, self.a, self.read(addr))
+            if set_a:
+                self.a = res
+            if set_m:
+                self.m = res
+            if set_ir:
+                self.ir = res
+            if set_ccr:
+                self.ccr = flags
+            if set_pc:
+                self.pc = res
+        if inc_pc and not set_pc:
+            self.pc = (self.pc + 1) & 0xff
+
+        #Stores: the reg RAM latches on every edge with WE high (from STA_DIR_2/STA_IND_4 on),
+        #memory on the bus takes the data once it is driven
+        if we and addr >= REG_RAM_BASE:
+            self.reg_ram[addr & 0x07] = self.a
+        if drive:
+            self.write(addr, self.a)
+
+        if state == S_FETCH_1:
+            self.instructions += 1
+
+        self.state   = next_state
+        self.cycles += 1
+
+    #Run until the CU is back in S_FETCH_0, returns the cycles taken
+    def step(self):
+        start = self.cycles
+        self.cycle()
+        while self.state != S_FETCH_0:
+            self.cycle()
+        return self.cycles - start
+
+    #Run whole instructions until the cycle budget is used up or until(model) is true
+    def run(self, max_cycles, until=None):
+        end = self.cycles + max_cycles
+        while self.cycles < end:
+            self.step()
+            if until is not None and until(self):
+                return True
+        return False
+
+    def registers(self):
+        return {"a": self.a, "m": self.m, "pc": self.pc, "ir": self.ir, "ccr": self.ccr, "state": self.state}
+
+
+#Demo ROM
+#-------------------------
+DEMO_ROM_OUT      = 0x40
+DEMO_ROM_DEADBEEF = bytes([0xde, 0xad, 0xbe, 0xef])
+
+#Cycles after reset until passes runs of the demo ROM are done, a pass (count, shift and
+#DEADBEEF loops) is done on the cycle its 0xef goes out to DEMO_ROM_OUT
+def demo_rom_cycles(passes):
+    model = MinibyteModel(demo_rom=True, onboard_ram=True)
+    last  = bytearray(len(DEMO_ROM_DEADBEEF))
+    while passes > 0:
+        addr, we, drive, data = model.bus()
+        model.cycle()
+        if drive and addr == DEMO_ROM_OUT:
+            last[:] = last[1:] + bytes([data])
+            if last == DEMO_ROM_DEADBEEF:
+                passes -= 1
+    return model.cycles
+
+#Demo ROM passes done in cycles after reset, the first pass and then every pass after it take
+#the same time
+def demo_rom_passes(cycles):
+    first = demo_rom_cycles(1)
+    if cycles < first:
+        return 0
+    return 1 + (cycles - first) // (demo_rom_cycles(2) - first)
@@ -0,0 +1,527 @@
+# SPDX-FileCopyrightText: © 2024 Zachary Frazee
+# SPDX-License-Identifier: Apache-2.0
+
+#Cycle aware peephole optimizer for minibyte assembly (minibyte_asm.py syntax)
+#
+#Rewrites are only kept when they save cycles, using the cycle counts of the reference model
+#CU tables (the same state paths as control_unit.v: NOP 4, IMM 7, DIR 9, STA_IND 11,
+#JMP_DIR/taken branch 6, JMP_IND/taken IND branch 8, branch not taken 5). Passes repeat until
+#nothing changes:
+#   - redundant loads       lda x right after sta x (or lda x), lda #k when A is already k
+#   - known operands        lda x / <alu> x => lda #k / <alu> #k when mem[x] is known to be k
+#   - constant folding      <alu> on a known A with a dead CCR => lda #result,
+#                           add #a / add #b => add #a+b (and sub, and, or, xor, shifts, rotates)
+#   - dead code             loads and ALU ops whose A (and CCR) are never used, redundant stores,
+#                           unreachable instructions after a jmp, nops
+#   - jump threading        jumps/branches to a jmp go straight to its target, jumps and branches
+#                           to the next instruction are dropped
+#
+#What is known about A and memory is tracked inside straight line code only (any label starts
+#over). Instructions whose label is used as data (self modifying code, "sta load+1") are never
+#touched. Addresses that are I/O (read back something other than what was stored) must be given
+#as volatile, so loads and stores of them are left alone.
+#
+#   python peephole.py program.s -o program.opt.s
+#   python peephole.py --demo-rom --volatile 0x40
+#   python peephole.py --benchmarks
+
+#Includes
+#-------------------------
+import sys
+from collections import namedtuple
+
+from minibyte_asm import MODE_DIR, MODE_IMM, OPCODES, assemble, evaluate, operand_mode, parse_source, symbols_in
+from minibyte_model import ALU_ADD, ALU_AND, ALU_ASL, ALU_ASR, ALU_LSL, ALU_LSR, ALU_OR, ALU_RSL, ALU_RSR, ALU_SUB, ALU_XOR
+from minibyte_model import MinibyteModel, alu, instruction_cycles
+
+#Constants
+#-------------------------
+ALU_OPS  = {"add": ALU_ADD, "sub": ALU_SUB, "and": ALU_AND, "or": ALU_OR, "xor": ALU_XOR, "lsl": ALU_LSL,
+            "lsr": ALU_LSR, "asl": ALU_ASL, "asr": ALU_ASR, "rsl": ALU_RSL, "rsr": ALU_RSR}
+BRANCHES = ("bne", "beq", "bpl", "bmi")
+
+#Applied rewrite: rule name, source line it was applied to, static cycles saved
+Rewrite  = namedtuple("Rewrite", ["rule", "text", "cycles"])
+
+
+#Statements
+#-------------------------
+class Statement:
+    def __init__(self, labels, op, args):
+        self.labels = list(labels)
+        self.op     = op
+        self.args   = args.strip()
+
+    @property
+    def is_instruction(self):
+        return self.op in OPCODES
+
+    @property
+    def mode(self):
+        return operand_mode(self.args)[0]
+
+    @property
+    def expr(self):
+        return operand_mode(self.args)[1]
+
+    def text(self):
+        return f"{self.op} {self.args}".strip()
+
+    def cycles(self, taken=True):
+        return instruction_cycles(OPCODES[self.op][self.mode], taken)
+
+def parse(source):
+    statements = []
+    pending    = []
+    for number, label, op, args, text in parse_source(source):
+        if label:
+            pending.append(label)
+        if op:
+            statements.append(Statement(pending, op, args))
+            pending = []
+    if pending:
+        statements.append(Statement(pending, "", ""))
+    return statements
+
+#Source text, and the line each statement ended up on
+def emit(statements):
+    lines       = []
+    line_of     = {}
+    for i, s in enumerate(statements):
+        for label in s.labels[:-1]:
+            lines.append(f"{label}:")
+        label = f"{s.labels[-1]}:" if s.labels else ""
+        if s.op == ".equ":
+            name, _, expr = s.args.partition(" ")
+            lines.append(f"{name} = {expr.strip()}")
+        else:
+            lines.append(f"{label:<7} {s.text()}".rstrip())
+        line_of[i] = len(lines)
+    return "\n".join(lines) + "\n", line_of
+
+
+#Analysis
+#-------------------------
+class _Analysis:
+    def __init__(self, statements, volatile):
+        self.statements = statements
+        self.volatile   = set(volatile)
+
+        source, line_of = emit(statements)
+        self.program    = assemble(source)
+        by_line         = {ins.line: ins for ins in self.program.instructions}
+        self.ins        = {i: by_line[line_of[i]] for i, s in enumerate(statements) if s.is_instruction}
+        self.at         = {ins.addr: i for i, ins in self.ins.items()}
+        self.index      = {id(s): i for i, s in enumerate(statements)}
+
+        #Labels used as data (patched operands, jump tables), their instructions are off limits
+        data = set()
+        for s in statements:
+            if s.is_instruction and s.mode == MODE_DIR and (s.op == "jmp" or s.op in BRANCHES):
+                continue
+            if s.op != ".equ":
+                data |= symbols_in(s.args)
+        self.patched = {i for i, s in enumerate(statements) if s.is_instruction and set(s.labels) & data}
+
+        self._liveness()
+
+    def operand(self, i):
+        return self.ins[i].operand
+
+    #Index of the instruction executed after i when it falls through, None if unknown
+    def next(self, i):
+        ins = self.ins[i]
+        return self.at.get(ins.addr + (1 if ins.operand is None else 2))
+
+    #Successors of i, None standing for "anywhere"
+    def successors(self, i):
+        s = self.statements[i]
+        if s.op == "jmp":
+            return [self.at.get(self.operand(i))] if s.mode == MODE_DIR else [None]
+        if s.op in BRANCHES:
+            return [self.next(i), self.at.get(self.operand(i)) if s.mode == MODE_DIR else None]
+        return [self.next(i)]
+
+    #Backward dataflow, A and CCR live after every instruction (unknown successors use both)
+    def _liveness(self):
+        self.live_a   = {i: False for i in self.ins}
+        self.live_ccr = {i: False for i in self.ins}
+        live_in       = {i: (False, False) for i in self.ins}
+
+        changed = True
+        while changed:
+            changed = False
+            for i in sorted(self.ins, reverse=True):
+                out_a = out_ccr = False
+                for succ in self.successors(i):
+                    a, ccr   = (True, True) if succ is None else live_in[succ]
+                    out_a   |= a
+                    out_ccr |= ccr
+                self.live_a[i], self.live_ccr[i] = out_a, out_ccr
+
+                s = self.statements[i]
+                if s.op == "lda":
+                    new = (False, out_ccr)
+                elif s.op == "sta":
+                    new = (True, out_ccr)
+                elif s.op in ALU_OPS:
+                    new = (True, False)
+                elif s.op in BRANCHES:
+                    new = (out_a, True)
+                else:
+                    new = (out_a, out_ccr)
+
+                if new != live_in[i]:
+                    live_in[i] = new
+                    changed    = True
+
+
+#Knowledge
+#-------------------------
+
+#What is known about A and memory at a point of straight line code
+class _Known:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.a       = None     #value of A, None if unknown
+        self.aliases = set()    #addresses known to hold the same value as A
+        self.memory  = {}       #addr => known value
+
+    def store(self, addr):
+        self.memory.pop(addr, None)
+        if self.a is not None:
+            self.memory[addr] = self.a
+        self.aliases.add(addr)
+
+    def store_unknown(self):
+        self.memory  = {}
+        self.aliases = set()
+
+    def load(self, value, addr=None):
+        self.a       = value
+        self.aliases = {addr} if addr is not None else set()
+        if value is not None:
+            self.aliases |= {k for k, v in self.memory.items() if v == value}
+
+
+#Optimizer
+#-------------------------
+class Peephole:
+    #volatile - addresses whose loads and stores must stay exactly as they are (I/O)
+    def __init__(self, volatile=(), max_passes=50):
+        self.volatile   = set(volatile)
+        self.max_passes = max_passes
+        self.rewrites   = []
+
+    def optimize(self, source):
+        statements = parse(source)
+        for _ in range(self.max_passes):
+            before     = len(self.rewrites)
+            statements = self._pass(statements)
+            if len(self.rewrites) == before:
+                break
+        return emit(statements)[0]
+
+    def _log(self, rule, s, cycles):
+        self.rewrites.append(Rewrite(rule, s.text(), cycles))
+
+    #Remove a statement, its labels move on to the next one
+    def _drop(self, out, statements, i):
+        s = statements[i]
+        if s.labels:
+            if i + 1 < len(statements):
+                statements[i + 1].labels = s.labels + statements[i + 1].labels
+            else:
+                out.append(Statement(s.labels, "", ""))
+
+    #One pass over the program, straight line rewrites then jump threading
+    def _pass(self, statements):
+        statements = [Statement(s.labels, s.op, s.args) for s in statements]
+        info       = _Analysis(statements, self.volatile)
+        known      = _Known()
+        out        = []
+        reachable  = True
+
+        for i, s in enumerate(statements):
+            if s.labels or not s.is_instruction:
+                known.reset()
+                reachable = True
+            if not s.is_instruction:
+                out.append(s)
+                continue
+
+            #Unreachable after a jmp (nothing jumps here, there is no label)
+            if not reachable and i not in info.patched:
+                self._log("unreachable", s, 0)
+                self._drop(out, statements, i)
+                continue
+
+            if i in info.patched:
+                self._apply_unknown(known, s)
+                out.append(s)
+                reachable = s.op != "jmp"
+                continue
+
+            keep = self._rewrite(info, known, statements, out, i)
+            if keep:
+                out.append(s)
+                self._apply(info, known, s)
+            reachable = not (keep and s.op == "jmp")
+
+        return self._thread(out)
+
+    #Straight line rules for statement i, False if it was dropped
+    def _rewrite(self, info, known, statements, out, i):
+        s        = statements[i]
+        volatile = self.volatile
+        mode     = s.mode
+        value    = _operand(info, s) if mode is not None else None
+
+        if s.op == "nop":
+            self._log("nop", s, s.cycles())
+            self._drop(out, statements, i)
+            return False
+
+        #A is never used again, the load or ALU op (with its CCR) can go
+        if s.op == "lda" or s.op in ALU_OPS:
+            dead = not info.live_a[i] and (s.op == "lda" or not info.live_ccr[i])
+            if dead and not (mode == MODE_DIR and value in volatile):
+                self._log("dead", s, s.cycles())
+                self._drop(out, statements, i)
+                return False
+
+        if s.op == "lda":
+            #A already holds it
+            if mode == MODE_DIR and value not in volatile and value in known.aliases:
+                self._log("redundant load", s, s.cycles())
+                self._drop(out, statements, i)
+                return False
+            if mode == MODE_IMM and known.a == value:
+                self._log("redundant load", s, s.cycles())
+                self._drop(out, statements, i)
+                return False
+
+        if s.op == "sta" and mode == MODE_DIR and value not in volatile and value in known.aliases:
+            self._log("redundant store", s, s.cycles())
+            self._drop(out, statements, i)
+            return False
+
+        #Known memory operand => immediate
+        if (s.op == "lda" or s.op in ALU_OPS) and mode == MODE_DIR and value not in volatile and value in known.memory:
+            old    = s.cycles()
+            s.args = f"#0x{known.memory[value]:02x}"
+            self._log("known operand", s, old - s.cycles())
+            mode, value = MODE_IMM, known.memory[value]
+
+        if s.op in ALU_OPS and mode == MODE_IMM:
+            #Result known and nobody looks at the flags => plain load
+            if known.a is not None and not info.live_ccr[i]:
+                old    = s.cycles()
+                result = alu(ALU_OPS[s.op], known.a, value)[0]
+                s.op, s.args = "lda", f"#0x{result:02x}"
+                self._log("constant fold", s, old - s.cycles())
+                return self._rewrite(info, known, statements, out, i)
+
+            #Same op twice in a row
+            previous = out[-1] if out else None
+            if previous is not None and not s.labels and previous.is_instruction and previous.mode == MODE_IMM:
+                merged = _merge_imm(previous.op, _operand(info, previous), s.op, value)
+                if merged is not None and info.index[id(previous)] not in info.patched:
+                    previous.op, previous.args = merged[0], f"#0x{merged[1]:02x}"
+                    self._log("merge immediates", s, s.cycles())
+                    #A was unknown going into the pair (or it would have been folded)
+                    known.load(None)
+                    return False
+
+        return True
+
+    #Update what is known after instruction s
+    def _apply(self, info, known, s):
+        mode  = s.mode
+        value = _operand(info, s)
+
+        if s.op == "lda":
+            if mode == MODE_IMM:
+                known.load(value)
+            else:
+                known.load(known.memory.get(value) if value not in self.volatile else None,
+                           value if value not in self.volatile else None)
+        elif s.op == "sta":
+            if mode == MODE_DIR and value is not None and value not in self.volatile:
+                known.store(value)
+            elif mode == MODE_DIR and value is not None:
+                known.memory.pop(value, None)
+            else:
+                known.store_unknown()
+        elif s.op in ALU_OPS:
+            operand = value if mode == MODE_IMM else known.memory.get(value)
+            result  = None if known.a is None or operand is None else alu(ALU_OPS[s.op], known.a, operand)[0]
+            known.load(result)
+
+    def _apply_unknown(self, known, s):
+        if s.op == "lda" or s.op in ALU_OPS:
+            known.load(None)
+        elif s.op == "sta":
+            known.store_unknown()
+
+    #Jump threading
+    #-------------------------
+    def _thread(self, statements):
+        labels = {label: i for i, s in enumerate(statements) for label in s.labels}
+
+        def first_instruction(i):
+            while i < len(statements) and statements[i].op == "":
+                i += 1
+            return i if i < len(statements) and statements[i].is_instruction else None
+
+        out = []
+        for i, s in enumerate(statements):
+            if s.is_instruction and (s.op == "jmp" or s.op in BRANCHES) and s.mode == MODE_DIR and s.expr.strip() in labels:
+                #Follow jmp chains (a jmp to itself is a valid halt, loops of jmps are left alone)
+                args   = s.args
+                seen   = {i}
+                target = first_instruction(labels[s.expr.strip()])
+                while target is not None and target not in seen:
+                    t = statements[target]
+                    if t.op != "jmp" or t.mode != MODE_DIR or t.expr.strip() not in labels:
+                        break
+                    seen.add(target)
+                    args   = t.args
+                    target = first_instruction(labels[t.expr.strip()])
+                if target in seen:
+                    target = first_instruction(labels[s.expr.strip()])
+                elif args != s.args:
+                    s.args = args
+                    self._log("thread jump", s, 0)
+
+                #Jump or branch to the very next instruction
+                if target is not None and target != i and target == first_instruction(i + 1):
+                    self._log("jump to next", s, s.cycles())
+                    statements[i + 1].labels = s.labels + statements[i + 1].labels
+                    continue
+            out.append(s)
+        return out
+
+
+#Helpers
+#-------------------------
+
+#Operand value of s, rewritten operands are always plain numbers
+def _operand(info, s):
+    try:
+        return evaluate(s.expr, {}) & 0xff
+    except (KeyError, ValueError):
+        return info.operand(info.index[id(s)])
+
+#Two immediates of the same op in a row as one, (op, operand) or None
+def _merge_imm(op1, a, op2, b):
+    if a is None or b is None:
+        return None
+    if op1 in ("add", "sub") and op2 in ("add", "sub"):
+        total = (a if op1 == "add" else -a) + (b if op2 == "add" else -b)
+        return ("add", total & 0xff)
+    if op1 != op2:
+        return None
+    if op1 == "and":
+        return ("and", a & b)
+    if op1 == "or":
+        return ("or", a | b)
+    if op1 == "xor":
+        return ("xor", a ^ b)
+    if op1 in ("lsl", "lsr", "asl", "asr"):
+        return (op1, min(a + b, 8 if op1 == "asr" else 255))
+    if op1 in ("rsl", "rsr"):
+        return (op1, (a + b) & 7)
+    return None
+
+#Static cycles saved, by rule
+def summarize(rewrites):
+    rules = {}
+    for rewrite in rewrites:
+        count, cycles = rules.get(rewrite.rule, (0, 0))
+        rules[rewrite.rule] = (count + 1, cycles + rewrite.cycles)
+    return rules
+
+
+#Verification
+#-------------------------
+
+#Stores to addresses outside both programs, in order, over max_cycles (or until pc == done)
+def observable_writes(program, other, max_cycles, demo_rom=False, onboard_ram=False):
+    code   = program.used | other.used
+    model  = MinibyteModel(bytearray(program.memory), demo_rom=demo_rom, onboard_ram=onboard_ram)
+    writes = []
+    done   = program.labels.get("done")
+    while model.cycles < max_cycles and model.pc != done:
+        addr, we, drive, data = model.bus()
+        if drive and addr not in code:
+            writes.append((addr, data))
+        model.cycle()
+    return writes, model.cycles
+
+
+#Command line
+#-------------------------
+def _benchmarks():
+    from benchmarks import BENCHMARKS, Benchmark, run_model
+
+    print(f"{'kernel':<11}{'cycles':>8}{'opt':>8}{'saved':>8}{'bytes':>7}{'opt':>6}  result")
+    for bench in BENCHMARKS:
+        optimizer = Peephole()
+        optimized = Benchmark(bench.name, optimizer.optimize(bench.source), bench.ui_in, bench.expected)
+        before    = run_model(bench)
+        after     = run_model(optimized)
+        print(f"{bench.name:<11}{before.cycles:>8}{after.cycles:>8}{before.cycles - after.cycles:>8}"
+              f"{before.code_bytes:>7}{after.code_bytes:>6}  {'ok' if after.passed else 'FAIL ' + after.message}")
+    return 0
+
+def main(argv):
+    import argparse
+    from minibyte_asm import lift
+    from minibyte_model import DEMO_ROM
+
+    parser = argparse.ArgumentParser(description="Peephole optimize minibyte assembly")
+    parser.add_argument("source",       nargs="?")
+    parser.add_argument("-o", "--output")
+    parser.add_argument("--volatile",   nargs="*", default=[], help="I/O addresses, loads and stores stay")
+    parser.add_argument("--demo-rom",   action="store_true",   help="optimize the demo ROM program")
+    parser.add_argument("--benchmarks", action="store_true",   help="optimize the benchmark kernels and compare")
+    parser.add_argument("--cycles",     type=int, default=20000, help="cycles to compare the programs over")
+    args = parser.parse_args(argv)
+
+    if args.benchmarks:
+        return _benchmarks()
+
+    if args.demo_rom:
+        source = lift(DEMO_ROM, 0, 0x37)
+    else:
+        with open(args.source) as f:
+            source = f.read()
+
+    optimizer = Peephole(volatile=[int(v, 0) for v in args.volatile])
+    optimized = optimizer.optimize(source)
+
+    for rule, (count, cycles) in sorted(summarize(optimizer.rewrites).items()):
+        print(f"{rule:<18}{count:>4}x  {cycles:>4} cycles (static)")
+
+    #Same stores to the outside world, and how long they take
+    before, after = assemble(source), assemble(optimized)
+    a, a_cycles = observable_writes(before, after, args.cycles)
+    b, b_cycles = observable_writes(after, before, args.cycles)
+    length      = min(len(a), len(b))
+    same        = a[:length] == b[:length]
+    print(f"code bytes {before.code_bytes} -> {after.code_bytes}, "
+          f"{len(a)} stores in {a_cycles} cycles -> {len(b)} stores in {b_cycles} cycles, "
+          f"{'same' if same else 'DIFFERENT'} stores")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(optimized)
+    else:
+        print(optimized)
+    return 0 if same else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,330 @@
+# SPDX-FileCopyrightText: © 2024 Zachary Frazee
+# SPDX-License-Identifier: Apache-2.0
+
+#Memory-mapped peripheral models on the external bus
+#
+#A PeripheralBus is the 7-bit address space: memory, with peripherals mapped over address ranges.
+#It is indexable like a bytearray, so it is the memory of a MinibyteModel as is, and the cocotb
+#loops below serve the DUT from it.
+#   - writes to a peripheral go on an event queue as (cycle, addr, data) and are handed over
+#     in batches: from tb.v's write FIFO (serve_bus), a cocotb task woken once per batch
+#     (watch_writes), or inline on the model
+#   - reads are answered on the spot. Pending events are flushed first, so a read always sees
+#     every earlier write
+#   - nothing ticks per cycle: the timer and the UART busy flag are worked out from the cycle
+#     number when they are read
+#
+#Default map (standard_bus):
+#   0x40  output latch (LEDs, the demo ROM's output port)
+#   0x41  input port   (read)
+#   0x42  UART TX data (write starts a frame, dropped while busy)
+#   0x43  UART status  (read, bit 0 busy)
+#   0x44  timer        (read the count, write to clear it)
+#
+#serve_bus() leaves memory to the tb.v memory model and decodes the peripheral addresses there,
+#so Python only wakes up when a peripheral is read or tb.v's write FIFO fills up (a batch of
+#writes). watch_writes() only wakes up when the CPU drives the bus (demo ROM, or memory the
+#testbench serves itself).
+
+#Includes
+#-------------------------
+import bisect
+
+from minibyte_isa import TM_OFF, TM_DEMO_ROM, TM_ONBOARD_RAM
+
+#Constants
+#-------------------------
+MEM_SIZE     = 128
+BATCH        = 64               #Events handed to the peripherals at a time
+BIT_CYCLES   = 16               #UART bit time in CPU cycles
+FRAME_BITS   = 10               #Start, 8 data, stop
+OUTPUT_PORT  = 0x40
+INPUT_PORT   = 0x41
+UART_DATA    = 0x42
+UART_STATUS  = 0x43
+TIMER        = 0x44
+
+UART_BUSY    = 0x01
+
+
+#Peripherals
+#-------------------------
+class Peripheral:
+    size = 1
+
+    def __init__(self, base):
+        self.base = base
+
+    #Events, in order, the cycles are those of the bus cycle the CPU wrote in
+    def write(self, cycle, offset, data):
+        pass
+
+    #Whatever is on the bus gets read, every cycle, so reads must not change anything
+    def read(self, cycle, offset):
+        return 0
+
+#Output latch: the last value written, and every write
+class OutputLatch(Peripheral):
+    def __init__(self, base=OUTPUT_PORT):
+        super().__init__(base)
+        self.value   = 0
+        self.history = []           #(cycle, value)
+
+    def write(self, cycle, offset, data):
+        self.value = data
+        self.history.append((cycle, data))
+
+    def read(self, cycle, offset):
+        return self.value
+
+#Input port: value from a schedule of {cycle: value} or set by the test at any time
+class InputPort(Peripheral):
+    def __init__(self, base=INPUT_PORT, value=0, schedule=None):
+        super().__init__(base)
+        self.value  = value
+        self.cycles = sorted(schedule or {})
+        self.values = [schedule[cycle] for cycle in self.cycles]
+
+    def read(self, cycle, offset):
+        i = bisect.bisect_right(self.cycles, cycle)
+        return self.values[i - 1] if i else self.value
+
+#UART transmitter: data register and status, a frame keeps it busy for FRAME_BITS bit times
+class UartTx(Peripheral):
+    size = 2
+
+    def __init__(self, base=UART_DATA, bit_cycles=BIT_CYCLES):
+        super().__init__(base)
+        self.frame_cycles = bit_cycles * FRAME_BITS
+        self.busy_until   = 0
+        self.frames       = []      #(start cycle, byte)
+        self.overruns     = 0
+
+    def write(self, cycle, offset, data):
+        if offset != 0:
+            return
+        if cycle < self.busy_until:
+            self.overruns += 1
+            return
+        self.frames.append((cycle, data))
+        self.busy_until = cycle + self.frame_cycles
+
+    def read(self, cycle, offset):
+        return UART_BUSY if offset == 1 and cycle < self.busy_until else 0
+
+    @property
+    def data(self):
+        return bytes(byte for _, byte in self.frames)
+
+    def text(self):
+        return self.data.decode("latin-1")
+
+#Free running 8-bit timer, counts every prescale cycles since the last write
+class TimerPort(Peripheral):
+    def __init__(self, base=TIMER, prescale=1):
+        super().__init__(base)
+        self.prescale = prescale
+        self.start    = 0
+
+    def write(self, cycle, offset, data):
+        self.start = cycle
+
+    def read(self, cycle, offset):
+        return ((cycle - self.start) // self.prescale) & 0xff
+
+
+#Bus
+#-------------------------
+class PeripheralBus:
+    def __init__(self, memory=None, batch=BATCH):
+        self.memory  = bytearray(MEM_SIZE)
+        if memory is not None:
+            self.memory[:len(memory)] = bytes(memory)[:MEM_SIZE]
+        self.devices = [None] * MEM_SIZE
+        self.events  = []
+        self.batch   = batch
+        self.cycle   = 0            #Bus cycle of the next access, kept up by whoever drives the bus
+        self.wakeup  = None         #cocotb Event of the draining task, inline flushes without one
+        self.batches = 0
+
+    def attach(self, peripheral):
+        for addr in range(peripheral.base, peripheral.base + peripheral.size):
+            if not 0 <= addr < MEM_SIZE or self.devices[addr] is not None:
+                raise ValueError(f"{type(peripheral).__name__} at 0x{peripheral.base:02x}: address 0x{addr:02x} is taken or out of range")
+            self.devices[addr] = peripheral
+        return peripheral
+
+    #Hand the queued events over
+    def flush(self):
+        events, self.events = self.events, []
+        for cycle, addr, data in events:
+            device = self.devices[addr]
+            device.write(cycle, addr - device.base, data)
+        if events:
+            self.batches += 1
+
+    def __len__(self):
+        return MEM_SIZE
+
+    def __getitem__(self, addr):
+        device = self.devices[addr]
+        if device is None:
+            return self.memory[addr]
+        if self.events:
+            self.flush()
+        return device.read(self.cycle, addr - device.base) & 0xff
+
+    def __setitem__(self, addr, data):
+        device = self.devices[addr]
+        if device is None:
+            self.memory[addr] = data
+            return
+        self.events.append((self.cycle, addr, data))
+        if len(self.events) >= self.batch:
+            if self.wakeup is not None:
+                self.wakeup.set()
+            else:
+                self.flush()
+
+#Memory with the default map over it, returns (bus, latch, port, uart, timer)
+def standard_bus(memory=None, batch=BATCH, bit_cycles=BIT_CYCLES, prescale=1, schedule=None):
+    bus = PeripheralBus(memory, batch)
+    return (bus, bus.attach(OutputLatch()), bus.attach(InputPort(schedule=schedule)),
+            bus.attach(UartTx(bit_cycles=bit_cycles)), bus.attach(TimerPort(prescale=prescale)))
+
+
+#Reference model
+#-------------------------
+
+#Run the model on the bus for cycles (after reset, like model.cycles)
+def run_model(bus, cycles, ui_in=TM_OFF):
+    from minibyte_model import MinibyteModel
+
+    model = MinibyteModel(bus, demo_rom=bool(ui_in & TM_DEMO_ROM), onboard_ram=bool(ui_in & TM_ONBOARD_RAM))
+    for _ in range(cycles):
+        bus.cycle = model.cycles
+        model.cycle()
+    bus.flush()
+    return model
+
+
+#cocotb
+#-------------------------
+
+#Task handing the events over a batch at a time, stop() flushes what is left
+class _Drain:
+    def __init__(self, bus):
+        from cocotb.triggers import Event
+
+        self.bus   = bus
+        self.event = Event()
+        self.task  = None
+        bus.wakeup = self.event
+
+    async def _run(self):
+        while True:
+            await self.event.wait()
+            self.event.clear()
+            self.bus.flush()
+
+    def start(self):
+        import cocotb
+
+        self.task = cocotb.start_soon(self._run())
+        return self
+
+    def stop(self):
+        self.task.kill()
+        self.bus.wakeup = None
+        self.bus.flush()
+
+async def _reset(dut, ui_in, uio_in):
+    from clock_advance import FastClockCycles
+
+    dut.ena.value    = 1
+    dut.ui_in.value  = ui_in
+    dut.uio_in.value = uio_in
+    dut.rst_n.value  = 0
+    await FastClockCycles(dut.clk, 10)
+    dut.rst_n.value  = 1
+
+#Serve the bus for cycles, a cocotb Clock must be running. Memory is the tb.v memory model
+#(tb_memory.py) with the peripheral addresses mapped out: tb.v queues their writes and only wakes
+#this up when one is read, its write FIFO is full or the run is over.
+#Falling edge n after the reset release sees the state after n rising edges, same as model.cycles
+async def serve_bus(dut, bus, cycles, ui_in=TM_OFF):
+    from cocotb.triggers import RisingEdge
+
+    from tb_memory import dump_memory, load_memory
+
+    mapped = [addr for addr in range(MEM_SIZE) if bus.devices[addr] is not None]
+    await load_memory(dut, bus.memory)
+    for addr in mapped:
+        dut.mem_mapped[addr].value = 1
+    dut.mem_end.value        = cycles
+    dut.mem_fifo_count.value = 0
+    dut.mem_hit.value        = 0
+    dut.mem_enable.value     = 1
+
+    hit = RisingEdge(dut.mem_hit)
+    await _reset(dut, ui_in, bus.memory[0])
+    try:
+        while True:
+            await hit
+            cycle = dut.mem_hit_cycle.value.integer
+
+            #Writes since the last wakeup, in order
+            count = dut.mem_fifo_count.value.integer
+            for n in range(count):
+                bus.cycle = dut.mem_fifo_cycle[n].value.integer
+                bus[dut.mem_fifo_addr[n].value.integer] = dut.mem_fifo_data[n].value.integer
+            dut.mem_fifo_count.value = 0
+            bus.flush()
+
+            bus.cycle = cycle
+            if dut.mem_read.value.integer:
+                dut.uio_in.value = bus[dut.uo_out.value.integer & 0x7f]
+            dut.mem_hit.value = 0
+            if cycle >= cycles - 1:
+                break
+    finally:
+        dut.mem_enable.value = 0
+        dut.mem_end.value    = 0
+        for addr in mapped:
+            dut.mem_mapped[addr].value = 0
+
+    #Memory stores went to tb.v
+    memory = await dump_memory(dut)
+    for addr in range(MEM_SIZE):
+        if bus.devices[addr] is None:
+            bus.memory[addr] = memory[addr]
+
+#Only wake up when the CPU drives the bus (uio_oe edges), writes to memory and the peripherals
+#go through the bus while reads are served elsewhere (demo ROM, onboard RAM, the testbench)
+async def watch_writes(dut, bus, cycles, ui_in=TM_DEMO_ROM | TM_ONBOARD_RAM, period_ns=10000):
+    from cocotb.triggers import Edge, First, ReadOnly, Timer
+    from cocotb.utils import get_sim_time
+
+    drain = _Drain(bus).start()
+    await _reset(dut, ui_in, 0)
+    start = int(get_sim_time("ns"))
+    end   = start + cycles * period_ns
+    edge  = Edge(dut.uio_oe)
+
+    try:
+        while True:
+            now = int(get_sim_time("ns"))
+            if now >= end:
+                break
+            timeout = Timer(end - now, units="ns")
+            if await First(edge, timeout) is timeout:
+                break
+
+            await ReadOnly()
+            if dut.uio_oe.value.integer == 0xff:
+                bus.cycle = (int(get_sim_time("ns")) - start) // period_ns
+                out       = dut.uo_out.value.integer
+                if out & 0x80:
+                    bus[out & 0x7f] = dut.uio_out.value.integer
+    finally:
+        drain.stop()
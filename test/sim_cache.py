@@ -0,0 +1,194 @@
+# SPDX-FileCopyrightText: © 2024 Zachary Frazee
+# SPDX-License-Identifier: Apache-2.0
+
+#Compile cache for the simulation builds
+#
+#The Makefile keys every icarus build on what goes into it:
+#   - the contents of VERILOG_SOURCES (not their paths, so other checkouts share builds), in order
+#   - COMPILE_ARGS/EXTRA_ARGS, with every -I<dir> replaced by the contents of the Verilog files in it
+#   - TOPLEVEL, the timescale and the simulator version (iverilog -V)
+#and looks the key up in a shared directory (SIM_CACHE, ~/.cache/minibyte/sim_build by default):
+#   - fetch, before make decides what to rebuild: a cached build is copied into SIM_BUILD, newer
+#     than the sources, so make skips the compile. A build of another key is removed
+#   - store, after the compile: the build is published under its key (copied to a temporary
+#     directory and renamed, so parallel shards never see half a build)
+#
+#   make SIM_CACHE=off                      # always compile
+#   python sim_cache.py list
+#   python sim_cache.py prune --keep 10
+
+#Includes
+#-------------------------
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+#Constants
+#-------------------------
+DEFAULT_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "minibyte", "sim_build")
+KEY_FILE      = ".cache_key"
+INCLUDE_EXTS  = (".v", ".vh", ".sv", ".svh")
+
+#Files making up a build, per simulator
+BUILD_FILES   = {"icarus": ["sim.vvp", "cmds.f"]}
+VERSION_CMDS  = {"icarus": ["iverilog", "-V"], "verilator": ["verilator", "--version"]}
+
+
+#Key
+#-------------------------
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+#First line the simulator prints about itself
+def simulator_version(sim):
+    command = VERSION_CMDS.get(sim, [sim, "--version"])
+    try:
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, timeout=30)
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+    lines = result.stdout.strip().splitlines()
+    return lines[0] if lines else "unknown"
+
+#-I<dir> stands for the Verilog files in it, anything else is kept as is
+def _normalize_args(args):
+    words = []
+    for word in args.split():
+        if word.startswith("-I") and os.path.isdir(word[2:]):
+            directory = word[2:]
+            names     = sorted(name for name in os.listdir(directory) if name.endswith(INCLUDE_EXTS))
+            words.append("-I{" + ",".join(f"{name}:{_file_hash(os.path.join(directory, name))}" for name in names) + "}")
+        else:
+            words.append(word)
+    return " ".join(words)
+
+def build_key(sim, toplevel, args, sources, version=None):
+    digest = hashlib.sha256()
+    for part in (sim, toplevel, _normalize_args(args), version or simulator_version(sim)):
+        digest.update(part.encode() + b"\0")
+    for source in sources:
+        digest.update(_file_hash(source).encode() + b"\0")
+    return digest.hexdigest()[:24]
+
+
+#Cache
+#-------------------------
+def _read_key(sim_build):
+    try:
+        with open(os.path.join(sim_build, KEY_FILE)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def _write_key(sim_build, key):
+    with open(os.path.join(sim_build, KEY_FILE), "w") as f:
+        f.write(key + "\n")
+
+#Make SIM_BUILD hold the build of key if the cache has it, returns what happened
+def fetch(cache, sim_build, key, sim="icarus"):
+    files = BUILD_FILES[sim]
+    entry = os.path.join(cache, key)
+    local = [os.path.join(sim_build, name) for name in files]
+    os.makedirs(sim_build, exist_ok=True)
+
+    #Already there (the sources may still look newer after a checkout)
+    if _read_key(sim_build) == key and all(os.path.exists(path) for path in local):
+        for path in local:
+            os.utime(path)
+        return f"{key} up to date"
+
+    if all(os.path.exists(os.path.join(entry, name)) for name in files):
+        for name, path in zip(files, local):
+            temporary = f"{path}.{os.getpid()}"
+            shutil.copyfile(os.path.join(entry, name), temporary)
+            os.replace(temporary, path)
+        _write_key(sim_build, key)
+        os.utime(entry)
+        return f"{key} from {entry}"
+
+    #A build of something else must not look up to date
+    for path in local + [os.path.join(sim_build, KEY_FILE)]:
+        if os.path.exists(path):
+            os.remove(path)
+    return f"{key} not cached, compiling"
+
+#Publish the build in SIM_BUILD under key
+def store(cache, sim_build, key, sim="icarus"):
+    files = BUILD_FILES[sim]
+    entry = os.path.join(cache, key)
+    _write_key(sim_build, key)
+    if os.path.isdir(entry):
+        return f"{key} already cached"
+
+    os.makedirs(cache, exist_ok=True)
+    temporary = f"{entry}.{os.getpid()}.tmp"
+    os.makedirs(temporary, exist_ok=True)
+    for name in files:
+        shutil.copyfile(os.path.join(sim_build, name), os.path.join(temporary, name))
+    try:
+        os.rename(temporary, entry)
+    except OSError:
+        #Another shard got there first
+        shutil.rmtree(temporary, ignore_errors=True)
+        return f"{key} already cached"
+    return f"{key} stored in {entry}"
+
+#Cached builds, most recently used first: (key, mtime, bytes)
+def entries(cache):
+    if not os.path.isdir(cache):
+        return []
+    found = []
+    for key in os.listdir(cache):
+        path = os.path.join(cache, key)
+        if os.path.isdir(path) and not key.endswith(".tmp"):
+            size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+            found.append((key, os.path.getmtime(path), size))
+    return sorted(found, key=lambda entry: -entry[1])
+
+def prune(cache, keep):
+    removed = []
+    for key, _, _ in entries(cache)[keep:]:
+        shutil.rmtree(os.path.join(cache, key), ignore_errors=True)
+        removed.append(key)
+    return removed
+
+
+#Command line
+#-------------------------
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Content keyed cache of compiled simulation builds")
+    parser.add_argument("command", choices=["key", "fetch", "store", "list", "prune"])
+    parser.add_argument("sources",     nargs="*")
+    parser.add_argument("--cache",     default=DEFAULT_CACHE)
+    parser.add_argument("--sim",       default="icarus")
+    parser.add_argument("--toplevel",  default="")
+    parser.add_argument("--args",      default="", help="COMPILE_ARGS and EXTRA_ARGS")
+    parser.add_argument("--sim-build", default="sim_build")
+    parser.add_argument("--key")
+    parser.add_argument("--keep",      type=int, default=10)
+    args = parser.parse_intermixed_args(argv)
+
+    if args.command == "key":
+        print(build_key(args.sim, args.toplevel, args.args, args.sources))
+    elif args.command == "fetch":
+        print(f"sim_cache: {fetch(args.cache, args.sim_build, args.key, args.sim)}")
+    elif args.command == "store":
+        print(f"sim_cache: {store(args.cache, args.sim_build, args.key, args.sim)}")
+    elif args.command == "list":
+        for key, mtime, size in entries(args.cache):
+            print(f"{key}  {time.strftime('%Y-%m-%d %H:%M', time.localtime(mtime))}  {size / 1e6:8.1f} MB")
+    else:
+        for key in prune(args.cache, args.keep):
+            print(f"removed {key}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,316 @@
+# SPDX-FileCopyrightText: © 2024 Zachary Frazee
+# SPDX-License-Identifier: Apache-2.0
+
+#Bounded memory soak runs
+#
+#Runs the demo ROM or a program image for any number of cycles in constant memory. Nothing
+#grows with the run length:
+#   - the last bus cycles are kept in a fixed size ring buffer, dumped when a check fails
+#   - checkers see one bus write at a time and keep only their current position
+#       DemoRomChecker  every pass of the count, shift and DEADBEEF loops of the demo ROM
+#       ModelChecker    every write (cycle, address, data) against the reference model in lock step
+#   - throughput (cycles/s) and resident memory are logged every report_every cycles
+#
+#On the RTL the run is clocked and served by the tb.v memory model (tb_memory.py) with mem_log
+#set, so every write, reg RAM ones included, goes on its FIFO. Python only wakes up when the
+#FIFO is full or at a report, and feeds the checker a FIFO at a time. The ring is tb.v's
+#watchdog ring then, the last bus changes.
+#
+#It is test_soak in test.py, the VCD is turned off (+no_vcd) for it:
+#   make TESTCASE=test_soak SOAK_CYCLES=100000000 [SOAK_IMAGE=program.s] [SOAK_UI_IN=0x80]
+#
+#The same loop can run the reference model, to check the checkers or get a baseline:
+#   python soak.py --cycles 10000000
+#   python soak.py --cycles 1000000 --image program.s --ui-in 0x80
+
+#Includes
+#-------------------------
+import os
+import sys
+import time
+
+from bus_ring import TB_RING, BusRing, read_tb_ring
+from minibyte_isa import TM_DEMO_ROM, TM_ONBOARD_RAM
+from minibyte_model import MinibyteModel
+
+#Constants
+#-------------------------
+OUT_PORT      = 0x40
+RING_SIZE     = 256
+REPORT_EVERY  = 1000000
+
+class SoakError(AssertionError):
+    pass
+
+
+#Checkers
+#-------------------------
+
+#Demo ROM: 1..255,0 then 1,2,..,0x80 then DE AD BE EF to 0x40, over and over
+#Count and shift allow no other writes, the DEADBEEF loop also goes through the reg RAM
+class DemoRomChecker:
+    COUNT    = "count"
+    SHIFT    = "shift"
+    DEADBEEF = "deadbeef"
+
+    def __init__(self, out_port=OUT_PORT):
+        self.out_port = out_port
+        self.passes   = 0
+        self.writes   = 0
+        self._start(self.COUNT)
+
+    def _start(self, loop):
+        self.loop  = loop
+        self.index = 0
+
+    def expected(self):
+        if self.loop == self.COUNT:
+            return (self.index + 1) & 0xff
+        if self.loop == self.SHIFT:
+            return 1 << self.index
+        return DEADBEEF[self.index]
+
+    def write(self, cycle, addr, data):
+        self.writes += 1
+        if self.loop == self.DEADBEEF and addr != self.out_port:
+            return
+        if addr != self.out_port:
+            raise SoakError(f"cycle {cycle}: pass {self.passes} {self.loop} loop wrote 0x{data:02x} to 0x{addr:02x}, "
+                            f"expected 0x{self.expected():02x} to 0x{self.out_port:02x}")
+        if data != self.expected():
+            raise SoakError(f"cycle {cycle}: pass {self.passes} {self.loop} loop step {self.index} wrote 0x{data:02x}, "
+                            f"expected 0x{self.expected():02x}")
+
+        self.index += 1
+        if self.loop == self.COUNT and self.index == 256:
+            self._start(self.SHIFT)
+        elif self.loop == self.SHIFT and self.index == 8:
+            self._start(self.DEADBEEF)
+        elif self.loop == self.DEADBEEF and self.index == len(DEADBEEF):
+            self.passes += 1
+            self._start(self.COUNT)
+
+    def status(self):
+        return f"{self.passes} passes, {self.loop} loop step {self.index}"
+
+DEADBEEF = (0xde, 0xad, 0xbe, 0xef)
+
+#Any image: the reference model runs alongside and has to make the same write on the same cycle
+class ModelChecker:
+    def __init__(self, memory, ui_in=0):
+        self.model  = MinibyteModel(bytearray(memory), demo_rom=bool(ui_in & TM_DEMO_ROM),
+                                    onboard_ram=bool(ui_in & TM_ONBOARD_RAM))
+        self.passes = 0
+        self.writes = 0
+
+    #Next write of the model, (cycle, addr, data)
+    def _next_write(self, limit):
+        model = self.model
+        while model.cycles <= limit:
+            addr, we, drive, data = model.bus()
+            cycle = model.cycles
+            model.cycle()
+            if drive:
+                return cycle, addr, data
+        return None
+
+    def write(self, cycle, addr, data):
+        self.writes += 1
+        expected = self._next_write(cycle)
+        if expected != (cycle, addr, data):
+            what = "no write" if expected is None else "0x%02x to 0x%02x on cycle %d" % (expected[2], expected[1], expected[0])
+            raise SoakError(f"cycle {cycle}: wrote 0x{data:02x} to 0x{addr:02x}, model made {what}")
+
+    #A write the model makes that the DUT skipped is caught here
+    def check_cycle(self, cycle):
+        model = self.model
+        while model.cycles < cycle:
+            addr, we, drive, data = model.bus()
+            if drive:
+                raise SoakError(f"cycle {model.cycles}: model wrote 0x{data:02x} to 0x{addr:02x}, the DUT did not")
+            model.cycle()
+
+    def status(self):
+        return f"{self.writes} writes match the model"
+
+
+#Images
+#-------------------------
+
+#.s (assembled), .hex (whitespace separated bytes) or raw binary, 128 bytes at most
+def load_image(path):
+    if path.endswith(".s"):
+        from minibyte_asm import assemble
+        with open(path) as f:
+            return bytearray(assemble(f.read()).memory)
+
+    if path.endswith(".hex"):
+        with open(path) as f:
+            data = bytes(int(word, 16) for word in f.read().split())
+    else:
+        with open(path, "rb") as f:
+            data = f.read()
+    if len(data) > 128:
+        raise ValueError(f"{path}: {len(data)} bytes, memory is 128")
+    return bytearray(data.ljust(128, b"\0"))
+
+
+#Reporting
+#-------------------------
+
+#Resident set size of this process in bytes (peak RSS where /proc is missing)
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+class Reporter:
+    def __init__(self, log, every=REPORT_EVERY):
+        self.log   = log
+        self.every = every
+        self.start = self.last = time.perf_counter()
+        self.last_cycle = 0
+
+    def report(self, cycle, checker):
+        now  = time.perf_counter()
+        rate = (cycle - self.last_cycle) / max(now - self.last, 1e-9)
+        self.log(f"{cycle} cycles, {rate:,.0f} cycles/s, RSS {rss_bytes() / 2**20:.1f} MiB, {checker.status()}")
+        self.last, self.last_cycle = now, cycle
+
+    def summary(self, cycle, checker):
+        elapsed = time.perf_counter() - self.start
+        return (f"soak: {cycle} cycles in {elapsed:.1f}s ({cycle / max(elapsed, 1e-9):,.0f} cycles/s), "
+                f"RSS {rss_bytes() / 2**20:.1f} MiB, {checker.status()}")
+
+
+#Soak Loops
+#-------------------------
+
+#Writes tb.v queued since the last wakeup, in order, to the checker
+def _drain_writes(dut, checker):
+    count  = dut.mem_fifo_count.value.integer
+    writes = [(dut.mem_fifo_cycle[n].value.integer, dut.mem_fifo_addr[n].value.integer,
+               dut.mem_fifo_data[n].value.integer) for n in range(count)]
+    dut.mem_fifo_count.value = 0
+    for cycle, addr, data in writes:
+        checker.write(cycle, addr, data)
+
+#mem_hit on the falling edge of cycle (see tb.v), 0 is off
+def _report_end(cycle, cycles):
+    return cycle + 1 if cycle < cycles else 0
+
+#Run the RTL for cycles after reset on the tb.v memory model, loaded with memory (an image) if
+#given, else zeros. No cocotb Clock may be running, tb.v drives the clock
+async def soak_rtl(dut, cycles, checker, memory=None, ui_in=TM_DEMO_ROM | TM_ONBOARD_RAM,
+                   report_every=REPORT_EVERY):
+    from cocotb.triggers import First, RisingEdge
+
+    from tb_memory import load_memory
+
+    reporter = Reporter(dut._log.info, report_every)
+    hit      = RisingEdge(dut.mem_hit)
+    done     = RisingEdge(dut.mem_done)
+
+    await load_memory(dut, memory if memory is not None else b"")
+    dut.ui_in.value          = ui_in
+    dut.mem_cycles.value     = cycles
+    dut.mem_fifo_count.value = 0
+    dut.mem_hit.value        = 0
+    dut.mem_log.value        = 1
+    dut.mem_enable.value     = 1
+
+    #tb.v's falling edge n after the reset release (mem_cycle) sees the state after n rising
+    #edges, same as model.cycles. Its first rising edge after the reset is wd_cycle start + 11
+    next_report         = report_every
+    start               = dut.wd_cycle.value.integer + 11
+    dut.mem_end.value   = _report_end(next_report, cycles)
+    dut.mem_start.value = 1
+    try:
+        while await First(hit, done) is not done:
+            _drain_writes(dut, checker)
+            cycle = dut.mem_hit_cycle.value.integer
+            if cycle == next_report:
+                reporter.report(cycle, checker)
+                if hasattr(checker, "check_cycle"):
+                    checker.check_cycle(cycle)
+                next_report      += report_every
+                dut.mem_end.value = _report_end(next_report, cycles)
+            dut.mem_hit.value = 0
+
+        _drain_writes(dut, checker)
+        if hasattr(checker, "check_cycle"):
+            checker.check_cycle(cycles)
+    except SoakError as e:
+        ring = BusRing(TB_RING)
+        read_tb_ring(dut, ring, start)
+        raise SoakError(f"{e}\nlast {min(ring.count, ring.size)} bus changes:\n{ring.format()}") from None
+    finally:
+        dut.mem_start.value  = 0
+        dut.mem_enable.value = 0
+        dut.mem_log.value    = 0
+        dut.mem_end.value    = 0
+
+    dut._log.info(reporter.summary(cycles, checker))
+    return checker
+
+#Same loop with the reference model as the DUT
+def soak_model(cycles, checker, memory=None, ui_in=TM_DEMO_ROM | TM_ONBOARD_RAM,
+               ring_size=RING_SIZE, report_every=REPORT_EVERY, log=print):
+    model    = MinibyteModel(bytearray(memory) if memory is not None else None,
+                             demo_rom=bool(ui_in & TM_DEMO_ROM), onboard_ram=bool(ui_in & TM_ONBOARD_RAM))
+    ring     = BusRing(ring_size)
+    reporter = Reporter(log, report_every)
+
+    next_report = report_every
+    try:
+        for cycle in range(cycles):
+            addr, we, drive, data = model.bus()
+            ring.push(cycle, addr | (we << 7), data, 0xff if drive else 0)
+            if drive:
+                checker.write(cycle, addr, data)
+            model.cycle()
+
+            if cycle == next_report:
+                reporter.report(cycle, checker)
+                next_report += report_every
+    except SoakError as e:
+        raise SoakError(f"{e}\nlast {ring.size} bus cycles:\n{ring.format()}") from None
+
+    log(reporter.summary(cycles, checker))
+    return checker
+
+
+#Command line
+#-------------------------
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Soak the reference model in constant memory")
+    parser.add_argument("--cycles",       type=lambda v: int(float(v)), default=10000000)
+    parser.add_argument("--image",        help=".s, .hex or binary image (default: the demo ROM)")
+    parser.add_argument("--ui-in",        type=lambda v: int(v, 0), default=None)
+    parser.add_argument("--ring",         type=int, default=RING_SIZE)
+    parser.add_argument("--report-every", type=lambda v: int(float(v)), default=REPORT_EVERY)
+    args = parser.parse_args(argv)
+
+    if args.image:
+        memory  = load_image(args.image)
+        ui_in   = args.ui_in if args.ui_in is not None else 0
+        checker = ModelChecker(memory, ui_in)
+    else:
+        memory  = None
+        ui_in   = args.ui_in if args.ui_in is not None else TM_DEMO_ROM | TM_ONBOARD_RAM
+        checker = DemoRomChecker()
+
+    try:
+        soak_model(args.cycles, checker, memory, ui_in, args.ring, args.report_every)
+    except SoakError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
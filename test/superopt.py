@@ -0,0 +1,315 @@
+# SPDX-FileCopyrightText: © 2024 Zachary Frazee
+# SPDX-License-Identifier: Apache-2.0
+
+#Brute force superoptimizer for straight line minibyte sequences computing a function of A
+#
+#A sequence is judged by what it does to all 256 inputs at once: the machine state after it is
+#a fingerprint of 256 values of A (and of each scratch cell it has written). Candidates are
+#expanded cheapest first (Dijkstra on the CU cycle counts, IMM 7, DIR/STA 9), and a fingerprint
+#that was already reached for fewer or equal cycles is never expanded again, so the first
+#sequence whose A fingerprint equals the goal is a minimum cycle one.
+#
+#Instructions: every IMM ALU op and LDA_IMM with the constants of the search, STA to the scratch
+#cells and LDA/ALU DIR ops reading them back. Instructions with the same 256 input behavior
+#(add #1 and sub #0xff, lsl #8 and lsl #9, ...) are searched once. Branches are not used and
+#the CCR is left as whatever the last ALU op set. Every result is verified on all 256 inputs by
+#running it on the reference model, cycle counts included.
+#
+#   python superopt.py "x*3"
+#   python superopt.py "((x & 0xf) ^ 8) - 8" --constants 4 8 0xf
+#   python superopt.py --library idioms.s --max-cycles 32 --cache superopt.json
+
+#Includes
+#-------------------------
+import heapq
+import json
+import os
+import sys
+from collections import namedtuple
+
+from minibyte_asm import assemble
+from minibyte_isa import CYCLES_LDA_DIR, CYCLES_STA_DIR, CYCLES_ALU_IMM, CYCLES_ALU_DIR
+from minibyte_model import ALU_ADD, ALU_AND, ALU_ASL, ALU_ASR, ALU_LSL, ALU_LSR, ALU_OR, ALU_RSL, ALU_RSR, ALU_SUB, ALU_XOR
+from minibyte_model import MinibyteModel, alu
+
+#Constants
+#-------------------------
+ALU_OPS           = {"add": ALU_ADD, "sub": ALU_SUB, "and": ALU_AND, "or": ALU_OR, "xor": ALU_XOR, "lsl": ALU_LSL,
+                     "lsr": ALU_LSR, "asl": ALU_ASL, "asr": ALU_ASR, "rsl": ALU_RSL, "rsr": ALU_RSR}
+
+CYCLES_IMM        = CYCLES_ALU_IMM
+CYCLES_DIR        = CYCLES_ALU_DIR
+
+#Constants tried with every IMM op unless told otherwise (shift counts, masks, sign bits)
+DEFAULT_CONSTANTS = (0, 1, 2, 3, 4, 5, 6, 7, 8, 0x0f, 0xf0, 0x7f, 0x80, 0xff)
+
+#Scratch cells live at 0x70.. when verified on the model
+SCRATCH_BASE      = 0x70
+
+IDENTITY          = bytes(range(256))
+
+#op      - mnemonic (lda, sta, add, ...)
+#operand - constant for IMM, scratch cell index for DIR
+Op      = namedtuple("Op", ["op", "imm", "operand", "cycles"])
+Result  = namedtuple("Result", ["name", "ops", "cycles", "expanded", "verified"])
+
+
+#Instructions
+#-------------------------
+def op_text(op, scratch_names=None):
+    if op.imm:
+        return f"{op.op} #0x{op.operand:02x}"
+    return f"{op.op} {scratch_names[op.operand] if scratch_names else f't{op.operand}'}"
+
+#Table of an IMM instruction over all 256 values of A
+def _unary_table(op, constant):
+    if op == "lda":
+        return bytes([constant]) * 256
+    return bytes(alu(ALU_OPS[op], a, constant)[0] for a in range(256))
+
+#One instruction per distinct 256 input behavior, cheapest representative kept
+def imm_instructions(constants):
+    tables = {}
+    for op in ["lda"] + list(ALU_OPS):
+        for constant in constants:
+            table = _unary_table(op, constant & 0xff)
+            if table != IDENTITY and table not in tables:
+                tables[table] = Op(op, True, constant & 0xff, CYCLES_IMM)
+    return [(op, table) for table, op in tables.items()]
+
+#a op b for every pair, indexed a << 8 | b
+def _binary_table(op):
+    return bytes(alu(ALU_OPS[op], a, b)[0] for a in range(256) for b in range(256))
+
+_BINARY = {}
+
+def _binary(op, a, b):
+    table = _BINARY.get(op)
+    if table is None:
+        table = _BINARY[op] = _binary_table(op)
+    return bytes(table[x << 8 | y] for x, y in zip(a, b))
+
+
+#Search
+#-------------------------
+class Superoptimizer:
+    #constants  - IMM operands to try
+    #scratch    - number of scratch memory cells sequences may use
+    #max_cycles - give up beyond this cost
+    def __init__(self, constants=DEFAULT_CONSTANTS, scratch=1, max_cycles=40, max_states=1000000):
+        self.constants  = sorted({c & 0xff for c in constants})
+        self.scratch    = scratch
+        self.max_cycles = max_cycles
+        self.max_states = max_states
+        self.imm        = imm_instructions(self.constants)
+
+    #States are (A, cell 0, cell 1, ...) fingerprints, None for cells not written yet
+    def _successors(self, state):
+        a = state[0]
+        for op, table in self.imm:
+            yield op, (a.translate(table),) + state[1:]
+
+        for cell in range(self.scratch):
+            value = state[1 + cell]
+            if value != a:
+                yield Op("sta", False, cell, CYCLES_STA_DIR), state[:1 + cell] + (a,) + state[2 + cell:]
+            if value is None:
+                continue
+            if value != a:
+                yield Op("lda", False, cell, CYCLES_LDA_DIR), (value,) + state[1:]
+            for name in ALU_OPS:
+                yield Op(name, False, cell, CYCLES_DIR), (_binary(name, a, value),) + state[1:]
+
+    #False if the state maps two inputs the goal tells apart to the same values (nothing can
+    #separate them again)
+    @staticmethod
+    def _keeps_information(state, goal):
+        columns = [column for column in state if column is not None]
+        rows    = zip(*columns) if len(columns) > 1 else columns[0]
+        pairs   = set(zip(rows, goal))
+        return len(pairs) == len({row for row, _ in pairs})
+
+    #Cheapest sequence with A == goal for every input, None if there is none within max_cycles
+    #Searched with a cycle bound going up through every cost a sequence can have (sums of 7s and
+    #9s), so the states expanded never cost more than the answer allows
+    def search(self, goal):
+        goal  = bytes(goal(x) & 0xff for x in range(256)) if callable(goal) else bytes(goal)
+        start = (IDENTITY,) + (None,) * self.scratch
+
+        if start[0] == goal:
+            return [], 0, 0
+
+        costs    = sorted({i * CYCLES_IMM + j * CYCLES_DIR for i in range(self.max_cycles // CYCLES_IMM + 1)
+                                                           for j in range(self.max_cycles // CYCLES_DIR + 1)} - {0})
+        expanded = 0
+        for bound in (cost for cost in costs if cost <= self.max_cycles):
+            ops, count = self._search(start, goal, bound)
+            expanded  += count
+            if ops is not None:
+                return ops, sum(op.cycles for op in ops), expanded
+        return None, None, expanded
+
+    #Dijkstra up to bound. Every instruction costs at least CYCLES_IMM, so a state that is not
+    #the goal yet is only worth keeping with that much of the bound left.
+    def _search(self, start, goal, bound):
+        best     = {start: 0}
+        heap     = [(0, 0, start, ())]
+        counter  = 1
+        expanded = 0
+        while heap:
+            cost, _, state, ops = heapq.heappop(heap)
+            if best.get(state, cost) < cost:
+                continue
+            if state[0] == goal:
+                return list(ops), expanded
+
+            expanded += 1
+            for op, next_state in self._successors(state):
+                next_cost = cost + op.cycles
+                done      = next_state[0] == goal
+                if next_cost > bound or (not done and next_cost + CYCLES_IMM > bound):
+                    continue
+                if best.get(next_state, next_cost + 1) <= next_cost:
+                    continue
+                if not done and not self._keeps_information(next_state, goal):
+                    continue
+                if len(best) >= self.max_states:
+                    raise MemoryError(f"more than {self.max_states} states, narrow the constants or lower max_cycles")
+                best[next_state] = next_cost
+                heapq.heappush(heap, (next_cost, counter, next_state, ops + (op,)))
+                counter += 1
+        return None, expanded
+
+
+#Verification
+#-------------------------
+
+#Assembly for a sequence, scratch cells named t0, t1, ...
+def sequence_source(ops, scratch_base=SCRATCH_BASE):
+    cells = sorted({op.operand for op in ops if not op.imm})
+    lines = [f"t{cell} = 0x{scratch_base + cell:02x}" for cell in cells]
+    lines += [f"        {op_text(op)}" for op in ops]
+    return "\n".join(lines) + "\n"
+
+#Run the sequence on the reference model for every input, returns an error message or ""
+def verify(ops, goal, cycles):
+    program = assemble(sequence_source(ops) + "done:   jmp done\n")
+    done    = program.labels["done"]
+    for x in range(256):
+        model = MinibyteModel(bytearray(program.memory))
+        model.cycle()
+        model.a = x
+        start   = model.cycles
+        while model.pc != done:
+            model.step()
+        expected = goal(x) & 0xff
+        if model.a != expected:
+            return f"A={x:#04x}: got {model.a:#04x}, expected {expected:#04x}"
+        if model.cycles - start != cycles:
+            return f"A={x:#04x}: took {model.cycles - start} cycles, expected {cycles}"
+    return ""
+
+def superoptimize(name, goal, **kwargs):
+    optimizer           = Superoptimizer(**kwargs)
+    ops, cycles, count  = optimizer.search(goal)
+    if ops is None:
+        return Result(name, None, None, count, False)
+    error = verify(ops, goal, cycles)
+    if error:
+        raise AssertionError(f"{name}: {error}")
+    return Result(name, ops, cycles, count, True)
+
+
+#Idiom Library
+#-------------------------
+
+#name => (description, goal, extra constants)
+IDIOMS = {
+    "mul3"              : ("A = A * 3",                          lambda x: x * 3,                     ()),
+    "mul5"              : ("A = A * 5",                          lambda x: x * 5,                     ()),
+    "mul6"              : ("A = A * 6",                          lambda x: x * 6,                     ()),
+    "mul7"              : ("A = A * 7",                          lambda x: x * 7,                     ()),
+    "mul9"              : ("A = A * 9",                          lambda x: x * 9,                     ()),
+    "mul10"             : ("A = A * 10",                         lambda x: x * 10,                    ()),
+    "negate"            : ("A = -A",                             lambda x: -x,                        ()),
+    "sign_mask"         : ("A = 0xff if A < 0 else 0",           lambda x: 0xff if x & 0x80 else 0,   ()),
+    "sign_extend_4"     : ("sign extend the low nibble",         lambda x: ((x & 0x0f) ^ 0x08) - 0x08, ()),
+    "swap_nibbles"      : ("A = A[3:0], A[7:4]",                 lambda x: (x << 4 | x >> 4) & 0xff,  ()),
+    "clear_lowest_bit"  : ("A = A & (A - 1)",                    lambda x: x & (x - 1),               ()),
+    "lowest_bit"        : ("A = A & -A",                         lambda x: x & -x,                    ()),
+    "high_nibble_down"  : ("A = A >> 4 (logical)",               lambda x: x >> 4,                    ()),
+    "div2_signed"       : ("A = A / 2 rounding down (signed)",   lambda x: (x - 256 if x & 0x80 else x) >> 1, ()),
+    "bool"              : ("A = 1 if A != 0 else 0",             lambda x: 1 if x else 0,             ()),
+}
+
+#Solved idioms are cached by goal fingerprint and search settings, so a rerun only does new ones
+def _cache_key(goal, constants, scratch, max_cycles):
+    return f"{bytes(goal(x) & 0xff for x in range(256)).hex()}:{','.join(map(str, constants))}:{scratch}:{max_cycles}"
+
+def build_library(path, cache=None, scratch=1, max_cycles=40, log=print):
+    memo = {}
+    if cache and os.path.exists(cache):
+        with open(cache) as f:
+            memo = json.load(f)
+
+    lines = [f"; Minimum cycle minibyte idioms, generated by superopt.py --library (up to {max_cycles} cycles)",
+             "; Inputs and results in A, t0 is a scratch byte, the CCR is clobbered", ""]
+    for name, (description, goal, extra) in IDIOMS.items():
+        constants = sorted(set(DEFAULT_CONSTANTS) | set(extra))
+        key       = _cache_key(goal, constants, scratch, max_cycles)
+        if key in memo:
+            ops, cycles = [Op(*op) for op in memo[key]["ops"]], memo[key]["cycles"]
+            if verify(ops, goal, cycles):
+                raise AssertionError(f"{name}: cached sequence does not verify")
+        else:
+            result = superoptimize(name, goal, constants=constants, scratch=scratch, max_cycles=max_cycles)
+            if result.ops is None:
+                log(f"{name:<18} none within {max_cycles} cycles ({result.expanded} states)")
+                continue
+            ops, cycles = result.ops, result.cycles
+            memo[key]   = {"name": name, "ops": [list(op) for op in ops], "cycles": cycles}
+            log(f"{name:<18} {cycles:>3} cycles  {'; '.join(op_text(op) for op in ops)}  ({result.expanded} states)")
+
+        lines += [f"; {name}: {description} ({cycles} cycles, {2 * len(ops)} bytes)"]
+        lines += [f"        {op_text(op)}" for op in ops] + [""]
+
+    with open(path, "w") as f:
+        f.write("\n".join(lines))
+    if cache:
+        with open(cache, "w") as f:
+            json.dump(memo, f, indent=1)
+
+
+#Command line
+#-------------------------
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Find the minimum cycle sequence computing A = f(A)")
+    parser.add_argument("expression",   nargs="?",                    help="Python expression of x, e.g. 'x*3' (taken mod 256)")
+    parser.add_argument("--constants",  nargs="*", default=[],        help="extra IMM constants to try")
+    parser.add_argument("--scratch",    type=int, default=1,          help="scratch cells the sequence may use")
+    parser.add_argument("--max-cycles", type=int, default=40)
+    parser.add_argument("--library",                                  help="solve the built-in idioms and write them here")
+    parser.add_argument("--cache",      default=None,                 help="json file of solved idioms to reuse")
+    args = parser.parse_args(argv)
+
+    if args.library:
+        build_library(args.library, args.cache, args.scratch, args.max_cycles)
+        return 0
+    if not args.expression:
+        parser.error("give an expression or --library")
+
+    goal      = eval("lambda x: " + args.expression, {})
+    constants = sorted(set(DEFAULT_CONSTANTS) | {int(c, 0) for c in args.constants})
+    result    = superoptimize(args.expression, goal, constants=constants, scratch=args.scratch, max_cycles=args.max_cycles)
+    if result.ops is None:
+        print(f"nothing within {args.max_cycles} cycles ({result.expanded} states)")
+        return 1
+
+    print(f"; {args.expression}: {result.cycles} cycles, verified on all 256 inputs ({result.expanded} states)")
+    print(sequence_source(result.ops), end="")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
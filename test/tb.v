@@ -6,9 +6,12 @@
 module tb ();
 
   // Dump the signals to a VCD file. You can view it with gtkwave.
+  // +no_vcd skips it, soak runs (see soak.py) would fill the disk
   initial begin
-    $dumpfile("tb.vcd");
-    $dumpvars(0, tb);
+    if (!$test$plusargs("no_vcd")) begin
+      $dumpfile("tb.vcd");
+      $dumpvars(0, tb);
+    end
     #1;
   end
 
@@ -22,6 +25,343 @@ module tb ();
   wire [7:0] uio_out;
   wire [7:0] uio_oe;
 
+  // Bus trace buffer (see bus_trace.py)
+  // With bt_enable set, every falling edge appends {cycle, uo_out, uio_out, uio_in, uio_oe,
+  // cu_state} to bt_buf (cu_state is 8'hff without bt_cu_state or on gate level netlists), with
+  // bt_changes_only set only when one of them changed since the last record. bt_full goes high
+  // with BT_DEPTH records buffered, so cocotb sleeps until then instead of waking up on every
+  // falling edge. bt_dump writes the records to bus_trace.hex (bt_dumped is 0 if there were none)
+  // and empties the buffer. bt_clear restarts bt_cycle from 0 and empties the buffer.
+  localparam BT_DEPTH = 4096;
+
+  reg         bt_enable       = 0;
+  reg         bt_cu_state     = 0;
+  reg         bt_changes_only = 0;
+  reg         bt_clear        = 0;
+  reg         bt_dump         = 0;
+  reg         bt_dumped       = 0;
+  reg         bt_full         = 0;
+  reg [63:0]  bt_cycle        = 0;
+  reg [31:0]  bt_count        = 0;
+  reg [103:0] bt_buf [0:BT_DEPTH-1];
+  reg [39:0]  bt_pins;
+  reg [39:0]  bt_last;
+  reg         bt_first;
+
+  always @(posedge bt_clear) begin
+    bt_cycle = 0;
+    bt_count = 0;
+    bt_full  = 0;
+    bt_first = 1;
+  end
+
+  always @(posedge bt_dump) begin
+    bt_dumped = (bt_count != 0);
+    if (bt_dumped)
+      $writememh("bus_trace.hex", bt_buf, 0, bt_count - 1);
+    bt_count = 0;
+    bt_full  = 0;
+  end
+
+  always @(negedge clk) begin
+    if (bt_enable) begin
+      bt_pins[39:8] = {uo_out, uio_out, uio_in, uio_oe};
+      bt_pins[7:0]  = 8'hff;
+`ifndef GL_TEST
+      if (bt_cu_state)
+        bt_pins[7:0] = user_project.cpu.cu.curr_state;
+`endif
+
+      if ((!bt_changes_only || bt_first || bt_pins !== bt_last) && bt_count < BT_DEPTH) begin
+        bt_buf[bt_count] = {bt_cycle, bt_pins};
+        bt_count = bt_count + 1;
+        bt_last  = bt_pins;
+        bt_first = 0;
+        if (bt_count == BT_DEPTH)
+          bt_full = 1;
+      end
+      bt_cycle = bt_cycle + 1;
+    end
+  end
+
+  // Vector replay (see vectors.py)
+  // cocotb writes vectors.hex, sets vector_count and raises vector_start, then only waits for
+  // vector_done. The testbench drives the clock and the inputs and checks the outputs itself
+  // with no Python in the loop. Do not run a cocotb Clock at the same time.
+  // With vector_record set, the outputs of every cycle are written to vectors_out.hex as
+  // {uo_out, uio_out, uio_oe} when the replay ends (see trace_equiv.py).
+  //
+  // One 64-bit word per cycle:
+  //   [63:59] unused  [58] check  [57] ena  [56] rst_n
+  //   [55:48] ui_in   [47:40] uio_in
+  //   [39:32] uo_out  [31:24] uio_out  [23:16] uio_oe   (expected)
+  //   [15:8]  uo_out mask   [7:0] uio_out mask
+  localparam VECTOR_DEPTH       = 16384;
+  localparam VECTOR_HALF_PERIOD = 5000;
+
+  reg [63:0] vectors [0:VECTOR_DEPTH-1];
+  reg [63:0] vector;
+  reg [31:0] vector_index;
+
+  reg        vector_start = 0;
+  reg [31:0] vector_count = 0;
+  reg        vector_done  = 0;
+  reg        vector_fail  = 0;
+  reg [31:0] vector_fail_cycle;
+  reg [7:0]  vector_fail_uo_out;
+  reg [7:0]  vector_fail_uio_out;
+  reg [7:0]  vector_fail_uio_oe;
+  reg        vector_record = 0;
+  reg [23:0] vector_outputs [0:VECTOR_DEPTH-1];
+
+  always @(posedge vector_start) begin
+    $readmemh("vectors.hex", vectors);
+    vector_fail = 0;
+
+    for (vector_index = 0; vector_index < vector_count; vector_index = vector_index + 1) begin
+      vector = vectors[vector_index];
+
+      // Low half: apply this cycle's inputs and let everything settle
+      clk    = 0;
+      rst_n  = vector[56];
+      ena    = vector[57];
+      ui_in  = vector[55:48];
+      uio_in = vector[47:40];
+      #(VECTOR_HALF_PERIOD);
+      vector_outputs[vector_index] = {uo_out, uio_out, uio_oe};
+
+      // Check just before the rising edge (X/Z on a checked bit is a mismatch)
+      if (vector[58] && ((((uo_out ^ vector[39:32]) & vector[15:8]) !== 8'h00) ||
+                         (((uio_out ^ vector[31:24]) & vector[7:0]) !== 8'h00) ||
+                         (uio_oe !== vector[23:16]))) begin
+        vector_fail         = 1;
+        vector_fail_cycle   = vector_index;
+        vector_fail_uo_out  = uo_out;
+        vector_fail_uio_out = uio_out;
+        vector_fail_uio_oe  = uio_oe;
+        vector_index        = vector_count;
+      end
+      else begin
+        clk = 1;
+        #(VECTOR_HALF_PERIOD);
+      end
+    end
+
+    if (vector_record && vector_count != 0)
+      $writememh("vectors_out.hex", vector_outputs, 0, vector_count - 1);
+    vector_done = 1;
+  end
+
+  always @(negedge vector_start) vector_done = 0;
+
+  // External memory model (see tb_memory.py)
+  // 128 bytes answering the bus like the RAM on the board, with mem_enable set. At every falling
+  // edge a write (WE with uio_oe driven) is stored, unless it is for the onboard reg RAM (0x78-0x7F
+  // with ui_in[7]), then uio_in is driven with the byte at the address. cocotb loads memory.hex
+  // with mem_load and dumps it to memory_out.hex with mem_dump. mem_start resets the CPU and runs
+  // it for mem_cycles cycles with the clock driven from here, then raises mem_done, so whole
+  // programs run with no Python in the loop. Do not run a cocotb Clock at the same time.
+  //
+  // Peripherals (see peripherals.py): addresses with mem_mapped set are not memory. Writes to
+  // them go on a FIFO as {cycle, addr, data} and reads are answered by cocotb, which sets uio_in.
+  // mem_hit is raised when one is read (WE low), when the FIFO is full and at the falling edge of
+  // cycle mem_end - 1 (0 is off), with the cycle in mem_hit_cycle, so cocotb only wakes up for
+  // those and clears mem_hit. mem_cycle counts the falling edges since the reset release.
+  // With mem_log set every write goes on the FIFO (reg RAM ones included), memory ones are
+  // still stored, so soak runs (see soak.py) see all of them without waking up per cycle.
+  localparam MEM_RESET_CYCLES = 10;
+  localparam MEM_FIFO         = 64;
+
+  reg [7:0]  mem [0:127];
+  reg        mem_enable = 0;
+  reg        mem_log    = 0;
+  reg        mem_load   = 0;
+  reg        mem_dump   = 0;
+  reg        mem_start  = 0;
+  reg        mem_done   = 0;
+  reg [31:0] mem_cycles = 0;
+  reg [31:0] mem_index;
+
+  reg        mem_mapped [0:127];
+  reg        mem_hit        = 0;
+  reg        mem_read       = 0;
+  reg [31:0] mem_cycle      = 0;
+  reg [31:0] mem_hit_cycle  = 0;
+  reg [31:0] mem_end        = 0;
+  reg [31:0] mem_fifo_count = 0;
+  reg [31:0] mem_fifo_cycle [0:MEM_FIFO-1];
+  reg [6:0]  mem_fifo_addr  [0:MEM_FIFO-1];
+  reg [7:0]  mem_fifo_data  [0:MEM_FIFO-1];
+  reg        mem_wake;
+
+  wire mem_reg_ram = ui_in[7] && (uo_out[6:3] == 4'b1111);
+
+  initial
+    for (mem_index = 0; mem_index < 128; mem_index = mem_index + 1)
+      mem_mapped[mem_index] = 0;
+
+  always @(posedge mem_load) $readmemh("memory.hex", mem);
+  always @(posedge mem_dump) $writememh("memory_out.hex", mem);
+
+  always @(negedge clk) begin
+    if (mem_enable) begin
+      if (uo_out[7] && uio_oe == 8'hff) begin
+        if ((mem_log || (mem_mapped[uo_out[6:0]] && !mem_reg_ram)) && rst_n === 1'b1) begin
+          mem_fifo_cycle[mem_fifo_count] = mem_cycle;
+          mem_fifo_addr[mem_fifo_count]  = uo_out[6:0];
+          mem_fifo_data[mem_fifo_count]  = uio_out;
+          mem_fifo_count = mem_fifo_count + 1;
+        end
+        if (!mem_mapped[uo_out[6:0]] && !mem_reg_ram)
+          mem[uo_out[6:0]] = uio_out;
+      end
+
+      mem_read = mem_mapped[uo_out[6:0]] && uo_out[7] === 1'b0 && rst_n === 1'b1;
+      if (!mem_read)
+        uio_in = mem[uo_out[6:0]];
+
+      if (rst_n === 1'b1) begin
+        mem_wake      = mem_read || mem_fifo_count == MEM_FIFO || mem_cycle + 1 == mem_end;
+        mem_hit_cycle = mem_cycle;
+        mem_cycle     = mem_cycle + 1;
+        if (mem_wake)
+          mem_hit = 1;
+      end
+      else
+        mem_cycle = 0;
+    end
+  end
+
+  // Same reset and cycle count as the cocotb tests: released after the 10th rising edge, then
+  // mem_cycles rising edges
+  always @(posedge mem_start) begin
+    ena   = 1;
+    rst_n = 0;
+    for (mem_index = 0; mem_index < MEM_RESET_CYCLES + mem_cycles; mem_index = mem_index + 1) begin
+      clk = 0;
+      #(VECTOR_HALF_PERIOD);
+      clk = 1;
+      #(VECTOR_HALF_PERIOD);
+      if (mem_index == MEM_RESET_CYCLES - 1)
+        rst_n = 1;
+    end
+    mem_done = 1;
+  end
+
+  always @(negedge mem_start) mem_done = 0;
+
+  // Watchdog counters (see watchdog.py)
+  // At every rising edge, counts the cycles since uo_out (and, with an RTL hierarchy, the PC)
+  // last changed while the CU should be running: out of reset, ena high, no TM_HALT_CU and no
+  // debug output on uo_out. wd_idle_hit goes high once either count reaches wd_idle_limit (0 is
+  // off), so the cocotb watchdog sleeps until then instead of waking up on every bus change. The
+  // last WD_RING bus changes are kept as {uo_out, uio_out, uio_oe} for its report. wd_restart
+  // clears the counts, the hit and the ring.
+  localparam WD_RING = 32;
+
+  reg        wd_restart    = 0;
+  reg [31:0] wd_idle_limit = 0;
+  reg        wd_idle_hit   = 0;
+  reg [31:0] wd_cycle      = 0;
+  reg [31:0] wd_bus_idle   = 0;
+  reg [31:0] wd_pc_idle    = 0;
+  reg [7:0]  wd_bus        = 0;
+  reg [7:0]  wd_pc         = 0;
+  reg [31:0] wd_ring_count = 0;
+  reg [31:0] wd_ring_cycle [0:WD_RING-1];
+  reg [23:0] wd_ring_bus   [0:WD_RING-1];
+
+  wire wd_running = (rst_n === 1'b1) && (ena === 1'b1) && (ui_in[3:0] === 4'b0000);
+
+  always @(posedge wd_restart) begin
+    wd_idle_hit   = 0;
+    wd_bus_idle   = 0;
+    wd_pc_idle    = 0;
+    wd_ring_count = 0;
+  end
+
+  always @(posedge clk) begin
+    wd_cycle = wd_cycle + 1;
+
+    if (uo_out !== wd_bus) begin
+      wd_bus      = uo_out;
+      wd_bus_idle = 0;
+      wd_ring_cycle[wd_ring_count % WD_RING] = wd_cycle;
+      wd_ring_bus[wd_ring_count % WD_RING]   = {uo_out, uio_out, uio_oe};
+      wd_ring_count = wd_ring_count + 1;
+    end
+    else
+      wd_bus_idle = wd_running ? wd_bus_idle + 1 : 0;
+
+`ifndef GL_TEST
+    if (user_project.cpu.reg_pc.reg_out !== wd_pc) begin
+      wd_pc      = user_project.cpu.reg_pc.reg_out;
+      wd_pc_idle = 0;
+    end
+    else
+      wd_pc_idle = wd_running ? wd_pc_idle + 1 : 0;
+`endif
+
+    if (wd_idle_limit != 0 && (wd_bus_idle >= wd_idle_limit || wd_pc_idle >= wd_idle_limit))
+      wd_idle_hit = 1;
+  end
+
+  // Debug breakpoints (see debug_server.py)
+  // The debug server loads up to DBG_SLOTS breakpoints into dbg_kind/dbg_value, clears dbg_count,
+  // sets dbg_limit and arms. From the next falling edge on (the server stops on falling edges),
+  // every falling edge counts in dbg_count and compares the slots with the PC, IR and CU state
+  // (RTL only) and the address/WE on uo_out. A match, or dbg_limit falling edges, disarms and
+  // raises dbg_hit, so a whole continue is a single trigger for the server.
+  //   dbg_kind: 0 off, 1 PC in S_FETCH_0, 2 IR in S_DECODE_0, 3 CU state,
+  //             4 write to / 5 read of / 6 any access to the address
+  localparam DBG_SLOTS    = 16;
+  localparam DBG_FETCH_0  = 8'h02;
+  localparam DBG_DECODE_0 = 8'h05;
+
+  reg        dbg_armed = 0;
+  reg        dbg_hit   = 0;
+  reg [31:0] dbg_count = 0;
+  reg [31:0] dbg_limit = 0;
+  reg [2:0]  dbg_kind  [0:DBG_SLOTS-1];
+  reg [7:0]  dbg_value [0:DBG_SLOTS-1];
+  reg [7:0]  dbg_pc;
+  reg [7:0]  dbg_ir;
+  reg [7:0]  dbg_state;
+  reg        dbg_match;
+  integer    dbg_n;
+
+  initial
+    for (dbg_n = 0; dbg_n < DBG_SLOTS; dbg_n = dbg_n + 1)
+      dbg_kind[dbg_n] = 0;
+
+  always @(negedge clk) begin
+    if (dbg_armed) begin
+      dbg_count = dbg_count + 1;
+`ifndef GL_TEST
+      dbg_pc    = user_project.cpu.reg_pc.reg_out;
+      dbg_ir    = user_project.cpu.reg_ir.reg_out;
+      dbg_state = user_project.cpu.cu.curr_state;
+`endif
+
+      dbg_match = (dbg_count >= dbg_limit);
+      for (dbg_n = 0; dbg_n < DBG_SLOTS; dbg_n = dbg_n + 1)
+        case (dbg_kind[dbg_n])
+          3'd1: if (dbg_state === DBG_FETCH_0 && dbg_pc === dbg_value[dbg_n]) dbg_match = 1;
+          3'd2: if (dbg_state === DBG_DECODE_0 && dbg_ir === dbg_value[dbg_n]) dbg_match = 1;
+          3'd3: if (dbg_state === dbg_value[dbg_n]) dbg_match = 1;
+          3'd4: if (uo_out[6:0] === dbg_value[dbg_n][6:0] && uo_out[7] === 1'b1) dbg_match = 1;
+          3'd5: if (uo_out[6:0] === dbg_value[dbg_n][6:0] && uo_out[7] === 1'b0) dbg_match = 1;
+          3'd6: if (uo_out[6:0] === dbg_value[dbg_n][6:0]) dbg_match = 1;
+          default: ;
+        endcase
+
+      if (dbg_match) begin
+        dbg_armed = 0;
+        dbg_hit   = 1;
+      end
+    end
+  end
+
   // Replace tt_um_example with your module name:
   tt_um_minibyte user_project (
 
@@ -0,0 +1,81 @@
+# SPDX-FileCopyrightText: © 2024 Zachary Frazee
+# SPDX-License-Identifier: Apache-2.0
+
+#cocotb side of the external memory model in tb.v
+#
+#tb.v holds 128 bytes of memory that answer the bus like the RAM on the board: stores are taken
+#(except the onboard reg RAM's, 0x78-0x7F with ui_in[7]) and uio_in follows the address, all in
+#Verilog. Python only loads an image, starts a run and reads the memory back when it is over:
+#   - load_memory() writes memory.hex and has tb.v $readmemh it, any time between runs
+#   - run_program() resets the CPU and runs it for a number of cycles with tb.v driving the clock
+#     (no cocotb Clock may be running), cocotb sleeps until tb.v says it is done
+#   - dump_memory() has tb.v $writememh the memory and reads it back
+#
+#   memory = await run_program(dut, program.memory, cycles)
+
+#Includes
+#-------------------------
+from minibyte_isa import TM_OFF
+
+#Constants
+#-------------------------
+MEM_SIZE    = 128
+MEMORY_FILE = "memory.hex"      #Read by tb.v from the simulator's working directory
+DUMP_FILE   = "memory_out.hex"  #Written by tb.v
+
+
+#Files
+#-------------------------
+def write_image(path, image):
+    memory = bytearray(MEM_SIZE)
+    memory[:len(image)] = bytes(image)[:MEM_SIZE]
+    with open(path, "w") as f:
+        f.writelines(f"{byte:02x}\n" for byte in memory)
+
+#$writememh output, bytes with X/Z bits read as 0
+def read_image(path):
+    memory = bytearray()
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line[0] in "/@":
+                continue
+            memory.append(0 if any(c in line.lower() for c in "xz") else int(line, 16))
+    return memory
+
+
+#cocotb
+#-------------------------
+async def _pulse(signal):
+    from cocotb.triggers import Timer
+
+    signal.value = 1
+    await Timer(1, units="ns")
+    signal.value = 0
+    await Timer(1, units="ns")
+
+async def load_memory(dut, image, path=MEMORY_FILE):
+    write_image(path, image)
+    await _pulse(dut.mem_load)
+
+async def dump_memory(dut, path=DUMP_FILE):
+    await _pulse(dut.mem_dump)
+    return read_image(path)
+
+#Load image, run cycles out of reset (same count as model.cycles) and return the memory
+#The tb.v memory serves the bus only for the run, the other tests drive uio_in themselves
+async def run_program(dut, image, cycles, ui_in=TM_OFF):
+    from cocotb.triggers import RisingEdge, Timer
+
+    await load_memory(dut, image)
+    dut.ui_in.value      = ui_in
+    dut.mem_cycles.value = cycles
+    dut.mem_enable.value = 1
+    try:
+        dut.mem_start.value = 1
+        await RisingEdge(dut.mem_done)
+        dut.mem_start.value = 0
+        await Timer(1, units="ns")
+    finally:
+        dut.mem_enable.value = 0
+    return await dump_memory(dut)
@@ -5,79 +5,26 @@
 #-------------------------
 import cocotb
 from cocotb.clock import Clock
-from cocotb.triggers import ClockCycles
+from cocotb.triggers import ClockCycles, Timer
 
+import os
 import random
 
-#DFT Testmodes
-#-------------------------
-TM_OFF                = 0x00
-
-TM_DEBUG_OUT_A        = 0x01
-TM_DEBUG_OUT_A_UPPER  = 0x02
-TM_DEBUG_OUT_M        = 0x03
-TM_DEBUG_OUT_PC       = 0x04
-TM_DEBUG_OUT_IR       = 0x05
-TM_DEBUG_OUT_CCR      = 0x06
-TM_DEBUG_OUT_CU_STATE = 0x07
-
-TM_HALT_CU            = 0x08
-TM_DEMO_ROM           = 0x10
-TM_ONBOARD_RAM        = 0x80
-
-#IR Opcodes
-#-------------------------
-IR_NOP     = 0x00
-IR_LDA_IMM = 0x01
-IR_LDA_DIR = 0x02
-IR_STA_DIR = 0x03
-IR_STA_IND = 0x04
-IR_ADD_IMM = 0x05
-IR_ADD_DIR = 0x06
-IR_SUB_IMM = 0x07
-IR_SUB_DIR = 0x08
-IR_AND_IMM = 0x09
-IR_AND_DIR = 0x0A
-IR_OR_IMM  = 0x0B
-IR_OR_DIR  = 0x0C
-IR_XOR_IMM = 0x0D
-IR_XOR_DIR = 0x0E
-IR_LSL_IMM = 0x0F
-IR_LSL_DIR = 0x10
-IR_LSR_IMM = 0x11
-IR_LSR_DIR = 0x12
-IR_ASL_IMM = 0x13
-IR_ASL_DIR = 0x14
-IR_ASR_IMM = 0x15
-IR_ASR_DIR = 0x16
-IR_RSL_IMM = 0x17
-IR_RSL_DIR = 0x18
-IR_RSR_IMM = 0x19
-IR_RSR_DIR = 0x1A
-IR_JMP_DIR = 0x1B
-IR_JMP_IND = 0x1C
-IR_BNE_DIR = 0x1D
-IR_BNE_IND = 0x1E
-IR_BEQ_DIR = 0x1F
-IR_BEQ_IND = 0x20
-IR_BPL_DIR = 0x21
-IR_BPL_IND = 0x22
-IR_BMI_DIR = 0x23
-IR_BMI_IND = 0x24
-
-#IR Cycle Counts
-#-------------------------
-CYCLES_NOP     = 4  # S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0
-CYCLES_LDA_IMM = 7  # S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_LDA_IMM_0->S_LDA_IMM_1->S_PC_INC_0
-CYCLES_LDA_DIR = 9  # S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_LDA_DIR_0->S_LDA_DIR_1->S_LDA_DIR_2->S_LDA_DIR_3->S_PC_INC_0
-CYCLES_STA_DIR = 9  # S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_STA_DIR_0->S_STA_DIR_1->S_STA_DIR_2->S_STA_DIR_3->S_PC_INC_0
-CYCLES_STA_IND = 11 # S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_STA_DIR_0->S_STA_DIR_1->S_STA_DIR_2->S_STA_DIR_3->S_STA_DIR_4->S_STA_DIR_5->S_PC_INC_0
-
-CYCLES_ALU_IMM = 7  # S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_<ALU>_IMM_0->S_<ALU>_IMM_1->S_PC_INC_0
-CYCLES_ALU_DIR = 9  # S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_<ALU>_DIR_0->S_<ALU>_DIR_1->S_<ALU>_DIR_2->S_<ALU>_DIR_3->S_PC_INC_0
-
-CYCLES_JMP_DIR = 6  # S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_JMP_DIR_0->S_JMP_DIR_1
-CYCLES_JMP_IND = 8  # S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_JMP_IND_0->S_JMP_IND_1->S_JMP_IND_2->S_JMP_IND_3
+from minibyte_isa import (TM_OFF, TM_DEBUG_OUT_A, TM_DEBUG_OUT_A_UPPER, TM_DEBUG_OUT_PC, TM_DEBUG_OUT_CCR,
+                          TM_DEBUG_OUT_CU_STATE, TM_HALT_CU, TM_DEMO_ROM, TM_ONBOARD_RAM, CCR_N, CCR_Z,
+                          IR_NOP, IR_LDA_IMM, IR_LDA_DIR, IR_STA_DIR, IR_STA_IND, IR_ADD_IMM, IR_ADD_DIR,
+                          IR_SUB_IMM, IR_SUB_DIR, IR_AND_IMM, IR_AND_DIR, IR_OR_IMM, IR_OR_DIR, IR_XOR_IMM,
+                          IR_XOR_DIR, IR_LSL_IMM, IR_LSL_DIR, IR_LSR_IMM, IR_LSR_DIR, IR_ASL_IMM, IR_ASL_DIR,
+                          IR_ASR_IMM, IR_ASR_DIR, IR_RSL_IMM, IR_RSL_DIR, IR_RSR_IMM, IR_RSR_DIR, IR_JMP_DIR,
+                          IR_JMP_IND, IR_BNE_DIR, IR_BNE_IND, IR_BEQ_DIR, IR_BEQ_IND, IR_BPL_DIR, IR_BPL_IND,
+                          IR_BMI_DIR, IR_BMI_IND, CYCLES_NOP, CYCLES_LDA_IMM, CYCLES_LDA_DIR, CYCLES_STA_DIR,
+                          CYCLES_STA_IND, CYCLES_ALU_IMM, CYCLES_ALU_DIR, CYCLES_JMP_DIR, CYCLES_JMP_IND,
+                          S_FETCH_0, S_NAMES)
+
+#Optional signal access/await profiling of every test (GPI_PROFILE=<dir>, see gpi_profile.py)
+if os.environ.get("GPI_PROFILE"):
+    from gpi_profile import install_gpi_profiler
+    install_gpi_profiler(os.environ["GPI_PROFILE"])
 
 #Test Utility Functions
 #-------------------------
@@ -107,6 +54,108 @@ def rotate(x, y):
 
     return x
 
+#Read one of the DFT debug outputs without disturbing the other ui_in bits
+#A ui_in write only lands at the next await, so callers that just wrote it pass the bits in
+async def read_debug_out(dut, tm_debug_mode, tm_bits=None):
+    #Select the debug output and let it settle
+    if tm_bits is None:
+        tm_bits = dut.ui_in.value.integer
+    dut.ui_in.value = (tm_bits & ~0x07) | tm_debug_mode
+    await Timer(1, units="ns")
+
+    #Grab the value (uo_out[7] is always WE)
+    value = dut.uo_out.value.integer & 0x7f
+
+    #Put the test bits back
+    dut.ui_in.value = tm_bits
+    await Timer(1, units="ns")
+
+    return value
+
+#Execute a 2 byte instruction by feeding its opcode and operand on the data buss
+#Leaves the operand on the buss for the remaining cycles (M will read it back on DIR ops)
+async def run_instruction(dut, ir, operand, cycles):
+    dut.uio_in.value = ir
+    await ClockCycles(dut.clk, CYCLES_NOP)
+    dut.uio_in.value = operand
+    await ClockCycles(dut.clk, cycles - CYCLES_NOP)
+
+#Fast-forward A, M, PC and CCR to the given values
+#Halts the CU (TM_HALT_CU) so it parks in S_FETCH_0 and deposits the registers directly through
+#the RTL hierarchy, then resumes. Registers left as None keep their current value.
+#Gate level netlists have no hierarchy to deposit into, so there we fall back to executing the
+#setup instructions (LDA_DIR for M, LDA_IMM+ADD_IMM for CCR, LDA_IMM for A and JMP_DIR for PC)
+async def fast_forward(dut, a=None, m=None, pc=None, ccr=None):
+    #Let any ui_in write still queued by the caller land before reading the test bits back
+    await Timer(1, units="ns")
+    tm_bits = dut.ui_in.value.integer
+    halted  = tm_bits | TM_HALT_CU
+
+    #Halt the CU and clock until it is parked in S_FETCH_0
+    dut.ui_in.value = halted
+    await Timer(1, units="ns")
+    while await read_debug_out(dut, TM_DEBUG_OUT_CU_STATE, halted) != S_FETCH_0:
+        await ClockCycles(dut.clk, 1)
+
+    #Hold for a cycle with the CU halted
+    #S_FETCH_0->S_FETCH_0(current)
+    await ClockCycles(dut.clk, 1)
+    state = await read_debug_out(dut, TM_DEBUG_OUT_CU_STATE, halted)
+    assert state == S_FETCH_0, f"CU left S_FETCH_0 while halted (state 0x{state:02x})"
+
+    try:
+        cpu = dut.user_project.cpu
+    except AttributeError:
+        cpu = None
+
+    #RTL: deposit straight into the registers
+    if cpu is not None:
+        if a is not None:
+            cpu.reg_a.reg_out.value = a & 0xff
+        if m is not None:
+            cpu.reg_m.reg_out.value = m & 0xff
+        if pc is not None:
+            cpu.reg_pc.reg_out.value = pc & 0xff
+        if ccr is not None:
+            cpu.reg_ccr.reg_out.value = ccr & 0x3
+
+        #Resume, the next rising edge takes the CU S_FETCH_0->S_FETCH_1
+        dut.ui_in.value = tm_bits
+        await Timer(1, units="ns")
+        return
+
+    #GL: execute the setup instructions instead
+    dut._log.info("No RTL hierarchy, fast-forwarding by instructions")
+
+    #Save whatever we are about to clobber (still halted, so nothing moves)
+    if pc is None:
+        pc = await read_debug_out(dut, TM_DEBUG_OUT_PC, halted)
+    if a is None and (m is not None or ccr is not None):
+        a  = await read_debug_out(dut, TM_DEBUG_OUT_A, halted)
+        a |= await read_debug_out(dut, TM_DEBUG_OUT_A_UPPER, halted) << 7
+
+    #Resume from S_FETCH_0
+    dut.ui_in.value = tm_bits
+    await Timer(1, units="ns")
+
+    #M (LDA_DIR latches the operand to M)
+    if m is not None:
+        await run_instruction(dut, IR_LDA_DIR, m & 0xff, CYCLES_LDA_DIR)
+
+    #CCR (ADD 0 to a value with the right flags)
+    if ccr is not None:
+        assert ccr & 0x3 != CCR_N | CCR_Z, "Z and N can't both be set by an ALU op"
+        seed = 0x00 if ccr & CCR_Z else 0x80 if ccr & CCR_N else 0x01
+        await run_instruction(dut, IR_LDA_IMM, seed, CYCLES_LDA_IMM)
+        await run_instruction(dut, IR_ADD_IMM, 0x00, CYCLES_ALU_IMM)
+
+    #A (LDA does not touch the CCR)
+    if a is not None:
+        await run_instruction(dut, IR_LDA_IMM, a & 0xff, CYCLES_LDA_IMM)
+
+    #PC last
+    await run_instruction(dut, IR_JMP_DIR, pc & 0xff, CYCLES_JMP_DIR)
+
 #ALU Test Suite
 #-------------------------
 alu_test_suite =[
@@ -271,6 +320,8 @@ alu_test_suite =[
 #-------------------------
 @cocotb.test()
 async def test_tm_debug_out_a(dut):
+    from watchdog import start_watchdog
+
     #Start
     dut._log.info("Start")
 
@@ -278,6 +329,9 @@ async def test_tm_debug_out_a(dut):
     clock = Clock(dut.clk, 10, units="us")
     cocotb.start_soon(clock.start())
 
+    #Fail fast on hangs and runaway loops (see watchdog.py)
+    start_watchdog(dut, "test_tm_debug_out_a")
+
     #Reset
     dut._log.info("Reset")
     dut.ena.value    = 1
@@ -330,6 +384,8 @@ async def test_tm_debug_out_a(dut):
 #-------------------------
 @cocotb.test()
 async def test_nop(dut):
+    from watchdog import start_watchdog
+
     #Start
     dut._log.info("Start")
 
@@ -337,6 +393,9 @@ async def test_nop(dut):
     clock = Clock(dut.clk, 10, units="us")
     cocotb.start_soon(clock.start())
 
+    #Fail fast on hangs and runaway loops (see watchdog.py)
+    start_watchdog(dut, "test_nop")
+
     #Reset
     dut._log.info("Reset")
     dut.ena.value    = 1
@@ -365,6 +424,8 @@ async def test_nop(dut):
 #-------------------------
 @cocotb.test()
 async def test_lda_imm_sta_dir(dut):
+    from watchdog import start_watchdog
+
     #Start
     dut._log.info("Start")
 
@@ -372,6 +433,9 @@ async def test_lda_imm_sta_dir(dut):
     clock = Clock(dut.clk, 10, units="us")
     cocotb.start_soon(clock.start())
 
+    #Fail fast on hangs and runaway loops (see watchdog.py)
+    start_watchdog(dut, "test_lda_imm_sta_dir")
+
     #Reset
     dut._log.info("Reset")
     dut.ena.value    = 1
@@ -459,6 +523,8 @@ async def test_lda_imm_sta_dir(dut):
 #-------------------------
 @cocotb.test()
 async def test_lda_dir_sta_ind(dut):
+    from watchdog import start_watchdog
+
     #Start
     dut._log.info("Start")
 
@@ -466,6 +532,9 @@ async def test_lda_dir_sta_ind(dut):
     clock = Clock(dut.clk, 10, units="us")
     cocotb.start_soon(clock.start())
 
+    #Fail fast on hangs and runaway loops (see watchdog.py)
+    start_watchdog(dut, "test_lda_dir_sta_ind")
+
     #Reset
     dut._log.info("Reset")
     dut.ena.value    = 1
@@ -573,6 +642,8 @@ async def test_lda_dir_sta_ind(dut):
 #-------------------------
 @cocotb.test()
 async def test_alu_imm_dir(dut):
+    from watchdog import start_watchdog
+
     #Start
     dut._log.info("Start")
 
@@ -580,6 +651,9 @@ async def test_alu_imm_dir(dut):
     clock = Clock(dut.clk, 10, units="us")
     cocotb.start_soon(clock.start())
 
+    #Fail fast on hangs and runaway loops (see watchdog.py)
+    start_watchdog(dut, "test_alu_imm_dir")
+
     #Reset
     dut._log.info("Reset")
     dut.ena.value    = 1
@@ -599,23 +673,9 @@ async def test_alu_imm_dir(dut):
     #Main loop
     for alu_ir_name, alu_symbol, alu_ir, alu_cycles, alu_test_func in alu_test_suite:
         for (lhs_test_val, rhs_test_val) in test_vals:
-            #Load the LHS value to A
+            #Fast-forward the LHS value into A
             #---------
-
-            #Set data input buss to a LDA_IMM
-            dut._log.info("IR_LDA_IMM")
-            dut.uio_in.value = IR_LDA_IMM
-
-            #Clock in the first half of the instruction
-            #S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_LDA_IMM_0(current)
-            await ClockCycles(dut.clk, CYCLES_NOP)
-
-            #Set the data buss to the test_value to be loaded
-            dut.uio_in.value = lhs_test_val
-
-            #Clock in the remaining cycles
-            #S_LDA_IMM_0->S_LDA_IMM_1->S_PC_INC_0->S_FETCH_0(current)
-            await ClockCycles(dut.clk, CYCLES_LDA_IMM - CYCLES_NOP)
+            await fast_forward(dut, a=lhs_test_val)
 
             #Add the RHS value to A
             #---------
@@ -659,7 +719,7 @@ async def test_alu_imm_dir(dut):
             dut.ui_in.value = TM_DEBUG_OUT_A
 
             #Clock the second to last cycle
-            #S_PC_INC_0->S_FETCH_0(current)
+            #S_<ALU>_IMM_1/DIR_3->S_PC_INC_0(current)
             await ClockCycles(dut.clk, 1)
 
             #Set debug out (upper bit)
@@ -690,6 +750,8 @@ async def test_alu_imm_dir(dut):
 #-------------------------
 @cocotb.test()
 async def test_alu_ccr(dut):
+    from watchdog import start_watchdog
+
     #Start
     dut._log.info("Start")
 
@@ -697,6 +759,9 @@ async def test_alu_ccr(dut):
     clock = Clock(dut.clk, 10, units="us")
     cocotb.start_soon(clock.start())
 
+    #Fail fast on hangs and runaway loops (see watchdog.py)
+    start_watchdog(dut, "test_alu_ccr")
+
     #Reset
     dut._log.info("Reset")
     dut.ena.value    = 1
@@ -716,23 +781,9 @@ async def test_alu_ccr(dut):
     #Main loop
     for alu_ir_name, alu_symbol, alu_ir, alu_cycles, alu_test_func in alu_test_suite:
         for (lhs_test_val, rhs_test_val) in test_vals:
-            #Load the LHS value to A
+            #Fast-forward the LHS value into A
             #---------
-
-            #Set data input buss to a LDA_IMM
-            dut._log.info("IR_LDA_IMM")
-            dut.uio_in.value = IR_LDA_IMM
-
-            #Clock in the first half of the instruction
-            #S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_LDA_IMM_0(current)
-            await ClockCycles(dut.clk, CYCLES_NOP)
-
-            #Set the data buss to the test_value to be loaded
-            dut.uio_in.value = lhs_test_val
-
-            #Clock in the remaining cycles
-            #S_LDA_IMM_0->S_LDA_IMM_1->S_PC_INC_0->S_FETCH_0(current)
-            await ClockCycles(dut.clk, CYCLES_LDA_IMM - CYCLES_NOP)
+            await fast_forward(dut, a=lhs_test_val)
 
             #Add the RHS value to A
             #---------
@@ -742,14 +793,16 @@ async def test_alu_ccr(dut):
             dut.uio_in.value = alu_ir
 
             #Clock in the first half of the instruction
-            #S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_<ALU>_DIR_0(current)
+            #S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_<ALU>_IMM/DIR_0(current)
             await ClockCycles(dut.clk, CYCLES_NOP)
 
             #Set the data buss to the test_value to be loaded
             dut.uio_in.value = rhs_test_val
 
-            #Clock in the remaining cycles -2
-            #S_<ALU>_DIR_0->S_<ALU>_DIR_1->S_<ALU>_DIR_2->S_<ALU>_DIR_3->S_PC_INC_0->S_FETCH_0(current)
+            #Clock in the remaining cycles -1
+            #S_<ALU>_IMM_0->S_<ALU>_IMM_1->S_PC_INC_0(current)
+            #or
+            #S_<ALU>_DIR_0->S_<ALU>_DIR_1->S_<ALU>_DIR_2->S_<ALU>_DIR_3->S_PC_INC_0(current)
             await ClockCycles(dut.clk, (alu_cycles - CYCLES_NOP ) - 1)
 
             #Set debug out (CCR)
@@ -786,6 +839,8 @@ async def test_alu_ccr(dut):
 #-------------------------
 @cocotb.test()
 async def test_jmp_dir(dut):
+    from watchdog import start_watchdog
+
     #Start
     dut._log.info("Start")
 
@@ -793,6 +848,9 @@ async def test_jmp_dir(dut):
     clock = Clock(dut.clk, 10, units="us")
     cocotb.start_soon(clock.start())
 
+    #Fail fast on hangs and runaway loops (see watchdog.py)
+    start_watchdog(dut, "test_jmp_dir")
+
     #Reset
     dut._log.info("Reset")
     dut.ena.value    = 1
@@ -833,6 +891,8 @@ async def test_jmp_dir(dut):
 #-------------------------
 @cocotb.test()
 async def test_jmp_ind(dut):
+    from watchdog import start_watchdog
+
     #Start
     dut._log.info("Start")
 
@@ -840,6 +900,9 @@ async def test_jmp_ind(dut):
     clock = Clock(dut.clk, 10, units="us")
     cocotb.start_soon(clock.start())
 
+    #Fail fast on hangs and runaway loops (see watchdog.py)
+    start_watchdog(dut, "test_jmp_ind")
+
     #Reset
     dut._log.info("Reset")
     dut.ena.value    = 1
@@ -894,6 +957,8 @@ async def test_jmp_ind(dut):
 #-------------------------
 @cocotb.test()
 async def test_bne_beq(dut):
+    from watchdog import start_watchdog
+
     #Start
     dut._log.info("Start")
 
@@ -901,15 +966,18 @@ async def test_bne_beq(dut):
     clock = Clock(dut.clk, 10, units="us")
     cocotb.start_soon(clock.start())
 
+    #Fail fast on hangs and runaway loops (see watchdog.py)
+    start_watchdog(dut, "test_bne_beq")
+
     #Starter settings
     bne_ir       = IR_BNE_DIR
     beq_ir       = IR_BEQ_DIR
     bne_str      = 'IR_BNE_DIR'
     beq_str      = 'IR_BEQ_DIR'
     num_cycles   = CYCLES_JMP_DIR
-    extra_cycles = 1 #Needed to clock through an even number of NOPs if a branch is not taken
+    extra_cycles = 3 #Needed to clock through the rest of a NOP if a branch is not taken (S_FETCH_1->S_FETCH_2->S_DECODE_0->S_FETCH_0)
 
-    #Repeat for both IMM and DIR branch instructions
+    #Repeat for both DIR and IND branch instructions
     for _ in range(2):
 
         #Reset
@@ -926,7 +994,7 @@ async def test_bne_beq(dut):
 
         #Test Values
         #Intentionaly a NOP so that if we don't branch we go into a nop after that instead
-        #This is needed as a branch IMM can take either 6 cycles if taken, or just 4 cycles if skipped
+        #This is needed as a branch DIR can take either 6 cycles if taken, or just 5 cycles if skipped
         test_value = IR_NOP
 
         #z flag state
@@ -942,7 +1010,7 @@ async def test_bne_beq(dut):
 
             #Clock in the first half of the instruction
             #IF BRANCH TAKEN:   S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_JMP_DIR_0(current)
-            #IF BRANCH SKIPPED: S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_FETCH_0(current)
+            #IF BRANCH SKIPPED: S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_PC_INC_0(current)
             await ClockCycles(dut.clk, CYCLES_NOP)
 
             #Set the data buss to the test_value to be loaded
@@ -950,7 +1018,7 @@ async def test_bne_beq(dut):
 
             #Clock in the remaining cycles
             #IF BRANCH TAKEN:   S_JMP_DIR_0->S_JMP_DIR_1->S_FETCH_0(current)
-            #IF BRANCH SKIPPED: S_FETCH_0->S_FETCH_1->S_FETCH_2(current)
+            #IF BRANCH SKIPPED: S_PC_INC_0->S_FETCH_0->S_FETCH_1(current) (DIR) or ->S_FETCH_2->S_DECODE_0(current) (IND)
             await ClockCycles(dut.clk, num_cycles - CYCLES_NOP)
 
             #Verify that PC has the expected value
@@ -960,7 +1028,6 @@ async def test_bne_beq(dut):
                 assert dut.uo_out.value != (test_value & 0x7f)
 
                 #Clock in extra cycles to get back to S_FETCH_0
-                #S_FETCH_2->S_DECODE_0->S_FETCH_0(current)
                 await ClockCycles(dut.clk, extra_cycles)
 
             #Test BEQ
@@ -972,7 +1039,7 @@ async def test_bne_beq(dut):
 
             #Clock in the first half of the instruction
             #IF BRANCH TAKEN:   S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_JMP_DIR_0(current)
-            #IF BRANCH SKIPPED: S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_FETCH_0(current)
+            #IF BRANCH SKIPPED: S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_PC_INC_0(current)
             await ClockCycles(dut.clk, CYCLES_NOP)
 
             #Set the data buss to the test_value to be loaded
@@ -980,7 +1047,7 @@ async def test_bne_beq(dut):
 
             #Clock in the remaining cycles
             #IF BRANCH TAKEN:   S_JMP_DIR_0->S_JMP_DIR_1->S_FETCH_0(current)
-            #IF BRANCH SKIPPED: S_FETCH_0->S_FETCH_1->S_FETCH_2(current)
+            #IF BRANCH SKIPPED: S_PC_INC_0->S_FETCH_0->S_FETCH_1(current) (DIR) or ->S_FETCH_2->S_DECODE_0(current) (IND)
             await ClockCycles(dut.clk, num_cycles - CYCLES_NOP)
 
             #Verify that PC has the expected value
@@ -990,39 +1057,30 @@ async def test_bne_beq(dut):
                 assert dut.uo_out.value != (test_value & 0x7f)
 
                 #Clock in extra cycles to get back to S_FETCH_0
-                #S_FETCH_2->S_DECODE_0->S_FETCH_0(current)
                 await ClockCycles(dut.clk, extra_cycles)
 
-            #Do math to set the Z flag
+            #Fast-forward the Z flag
             #---------------------------
-            dut.uio_in.value = IR_ADD_IMM
-
-            #Clock in the first half of the instruction
-            #S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_<ALU>_IMM/DIR_0(current)
-            await ClockCycles(dut.clk, CYCLES_NOP)
-
-            #Add 0 to 0
-            dut.uio_in.value = 0
-
-            #Finish ALU op
-            await ClockCycles(dut.clk, CYCLES_ALU_IMM - CYCLES_NOP)
+            await fast_forward(dut, ccr=CCR_Z)
 
             #Set z state
             z_state = 1
 
-        #Change settings to cover DIR variants
+        #Change settings to cover IND variants
         bne_ir       = IR_BNE_IND
         beq_ir       = IR_BEQ_IND
         bne_str      = 'IR_BNE_IND'
         beq_str      = 'IR_BEQ_IND'
         num_cycles   = CYCLES_JMP_IND
-        extra_cycles = 3 #Needed as we jump through a NOPs worth of instructions plus a PC inc
+        extra_cycles = 1 #Needed as we skip through a NOPs worth of instructions plus a PC inc (S_DECODE_0->S_FETCH_0)
 
 
 #Test BPL_DIR/BMI_DIR/BPL_IND/BMI_IND
 #-------------------------
 @cocotb.test()
 async def test_bpl_bmi(dut):
+    from watchdog import start_watchdog
+
     #Start
     dut._log.info("Start")
 
@@ -1030,15 +1088,18 @@ async def test_bpl_bmi(dut):
     clock = Clock(dut.clk, 10, units="us")
     cocotb.start_soon(clock.start())
 
+    #Fail fast on hangs and runaway loops (see watchdog.py)
+    start_watchdog(dut, "test_bpl_bmi")
+
     #Starter settings
     bpl_ir       = IR_BPL_DIR
     bmi_ir       = IR_BMI_DIR
     bpl_str      = 'IR_BPL_DIR'
     bmi_str      = 'IR_BMI_DIR'
     num_cycles   = CYCLES_JMP_DIR
-    extra_cycles = 1 #Needed to clock through an even number of NOPs if a branch is not taken
+    extra_cycles = 3 #Needed to clock through the rest of a NOP if a branch is not taken (S_FETCH_1->S_FETCH_2->S_DECODE_0->S_FETCH_0)
 
-    #Repeat for both IMM and DIR branch instructions
+    #Repeat for both DIR and IND branch instructions
     for _ in range(2):
 
         #Reset
@@ -1055,7 +1116,7 @@ async def test_bpl_bmi(dut):
 
         #Test Values
         #Intentionaly a NOP so that if we don't branch we go into a nop after that instead
-        #This is needed as a branch IMM can take either 6 cycles if taken, or just 4 cycles if skipped
+        #This is needed as a branch DIR can take either 6 cycles if taken, or just 5 cycles if skipped
         test_value = IR_NOP
 
         #n flag state
@@ -1072,7 +1133,7 @@ async def test_bpl_bmi(dut):
 
             #Clock in the first half of the instruction
             #IF BRANCH TAKEN:   S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_JMP_DIR_0(current)
-            #IF BRANCH SKIPPED: S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_FETCH_0(current)
+            #IF BRANCH SKIPPED: S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_PC_INC_0(current)
             await ClockCycles(dut.clk, CYCLES_NOP)
 
             #Set the data buss to the test_value to be loaded
@@ -1080,7 +1141,7 @@ async def test_bpl_bmi(dut):
 
             #Clock in the remaining cycles
             #IF BRANCH TAKEN:   S_JMP_DIR_0->S_JMP_DIR_1->S_FETCH_0(current)
-            #IF BRANCH SKIPPED: S_FETCH_0->S_FETCH_1->S_FETCH_2(current)
+            #IF BRANCH SKIPPED: S_PC_INC_0->S_FETCH_0->S_FETCH_1(current) (DIR) or ->S_FETCH_2->S_DECODE_0(current) (IND)
             await ClockCycles(dut.clk, num_cycles - CYCLES_NOP)
 
             #Verify that PC has the expected value
@@ -1090,7 +1151,6 @@ async def test_bpl_bmi(dut):
                 assert dut.uo_out.value != (test_value & 0x7f)
 
                 #Clock in extra cycles to get back to S_FETCH_0
-                #S_FETCH_2->S_DECODE_0->S_FETCH_0(current)
                 await ClockCycles(dut.clk, extra_cycles)
 
 
@@ -1103,7 +1163,7 @@ async def test_bpl_bmi(dut):
 
             #Clock in the first half of the instruction
             #IF BRANCH TAKEN:   S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_JMP_DIR_0(current)
-            #IF BRANCH SKIPPED: S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_FETCH_0(current)
+            #IF BRANCH SKIPPED: S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_PC_INC_0(current)
             await ClockCycles(dut.clk, CYCLES_NOP)
 
             #Set the data buss to the test_value to be loaded
@@ -1111,7 +1171,7 @@ async def test_bpl_bmi(dut):
 
             #Clock in the remaining cycles
             #IF BRANCH TAKEN:   S_JMP_DIR_0->S_JMP_DIR_1->S_FETCH_0(current)
-            #IF BRANCH SKIPPED: S_FETCH_0->S_FETCH_1->S_FETCH_2(current)
+            #IF BRANCH SKIPPED: S_PC_INC_0->S_FETCH_0->S_FETCH_1(current) (DIR) or ->S_FETCH_2->S_DECODE_0(current) (IND)
             await ClockCycles(dut.clk, num_cycles - CYCLES_NOP)
 
             #Verify that PC has the expected value
@@ -1121,34 +1181,23 @@ async def test_bpl_bmi(dut):
                 assert dut.uo_out.value != (test_value & 0x7f)
 
                 #Clock in extra cycles to get back to S_FETCH_0
-                #S_FETCH_2->S_DECODE_0->S_FETCH_0(current)
                 await ClockCycles(dut.clk, extra_cycles)
 
 
-            #Do math to set the N flag
+            #Fast-forward the N flag
             #---------------------------
-            dut.uio_in.value = IR_SUB_IMM
-
-            #Clock in the first half of the instruction
-            #S_FETCH_0->S_FETCH_1->S_FETCH_2->S_DECODE_0->S_<ALU>_IMM/DIR_0(current)
-            await ClockCycles(dut.clk, CYCLES_NOP)
-
-            #Subtracy 1 from 0
-            dut.uio_in.value = 1
-
-            #Finish ALU op
-            await ClockCycles(dut.clk, CYCLES_ALU_IMM - CYCLES_NOP)
+            await fast_forward(dut, ccr=CCR_N)
 
             #Set n state
             n_state = 1
 
-        #Change settings to cover DIR variants
+        #Change settings to cover IND variants
         bpl_ir       = IR_BPL_IND
         bmi_ir       = IR_BMI_IND
         bpl_str      = 'IR_BPL_IND'
         bmi_str      = 'IR_BMI_IND'
         num_cycles   = CYCLES_JMP_IND
-        extra_cycles = 3 #Needed as we jump through a NOPs worth of instructions plus a PC inc
+        extra_cycles = 1 #Needed as we skip through a NOPs worth of instructions plus a PC inc (S_DECODE_0->S_FETCH_0)
 
 
 
@@ -1156,6 +1205,8 @@ async def test_bpl_bmi(dut):
 #-------------------------
 @cocotb.test()
 async def test_demorom(dut):
+    from watchdog import start_watchdog
+
     #Start
     dut._log.info("Start")
 
@@ -1163,6 +1214,9 @@ async def test_demorom(dut):
     clock = Clock(dut.clk, 10, units="us")
     cocotb.start_soon(clock.start())
 
+    #Fail fast on hangs and runaway loops (see watchdog.py)
+    start_watchdog(dut, "test_demorom")
+
     #Reset
     dut._log.info("Reset")
     dut.ena.value    = 1
@@ -1243,3 +1297,630 @@ async def test_demorom(dut):
             #Next clock
             await ClockCycles(dut.clk, 1)
 
+
+#Test Reg RAM Timing
+#-------------------------
+@cocotb.test()
+async def test_reg_ram_timing(dut):
+    from cocotb.triggers import FallingEdge
+
+    from minibyte_model import MinibyteModel
+    from watchdog import start_watchdog
+
+    #Start
+    dut._log.info("Start")
+
+    #Setup Clock
+    clock = Clock(dut.clk, 10, units="us")
+    cocotb.start_soon(clock.start())
+
+    #Fail fast on hangs and runaway loops (see watchdog.py)
+    start_watchdog(dut, "test_reg_ram_timing")
+
+    #Needs the reg RAM registers
+    try:
+        ram   = [getattr(dut.user_project.ram, f"r{i}").reg_out for i in range(8)]
+        state = dut.user_project.cpu.cu.curr_state
+    except AttributeError:
+        dut._log.info("No RTL hierarchy (gate level), skipping")
+        return
+
+    #STA_DIR and STA_IND into the reg RAM and back out
+    program = [
+        IR_LDA_IMM, 0x5a,
+        IR_STA_DIR, 0x7a,
+        IR_LDA_IMM, 0xc3,
+        IR_STA_IND, 0x41,
+        IR_LDA_DIR, 0x7a,
+        IR_ADD_DIR, 0x7d,
+        IR_STA_DIR, 0x7f,
+        IR_JMP_DIR, 0x00,
+    ]
+    memory = bytearray(128)
+    memory[:len(program)] = bytes(program)
+    memory[0x41] = 0x7d     #STA_IND pointer
+
+    #Reset
+    dut._log.info("Reset")
+    dut.ena.value    = 1
+    dut.ui_in.value  = TM_ONBOARD_RAM
+    dut.uio_in.value = memory[0]
+    dut.rst_n.value  = 0
+    await ClockCycles(dut.clk, 10)
+    dut.rst_n.value  = 1
+
+    #Model and RTL side by side, every falling edge: CU state, bus and the reg RAM, which
+    #latches on WE (STA_DIR_2/STA_IND_4), a cycle before the data is driven. The external
+    #memory is served from here, the reg RAM stores never reach it
+    model = MinibyteModel(bytearray(memory), onboard_ram=True)
+    for cycle in range(200):
+        await FallingEdge(dut.clk)
+        addr, we, drive, data = model.bus()
+        where = f"cycle {cycle} ({S_NAMES.get(model.state, model.state)})"
+        assert state.value.integer == model.state, f"{where}: CU state 0x{state.value.integer:02x}"
+        assert dut.uo_out.value.integer == addr | (we << 7), f"{where}: uo_out 0x{dut.uo_out.value.integer:02x}"
+        assert bytes(r.value.integer for r in ram) == bytes(model.reg_ram), \
+            f"{where}: reg RAM {bytes(r.value.integer for r in ram).hex()}, model {model.reg_ram.hex()}"
+        if drive and addr < 0x78:
+            memory[addr] = data
+        dut.uio_in.value = memory[addr]
+        model.cycle()
+
+    assert model.reg_ram[2] == 0x5a and model.reg_ram[5] == 0xc3 and model.reg_ram[7] == 0x1d
+    assert memory[0x78:] == bytes(8), "reg RAM stores reached the external memory"
+
+
+#Test Bus Trace
+#-------------------------
+#Only with BUS_TRACE=<dir>: one pass of the demo ROM traced to <dir>/test_bus_trace.bin by tb.v,
+#its writes checked against the reference model (see bus_trace.py)
+@cocotb.test(skip=not os.environ.get("BUS_TRACE"))
+async def test_bus_trace(dut):
+    from bus_trace import BusTraceWriter, load_bus_trace, writes
+    from minibyte_model import MinibyteModel, demo_rom_cycles
+    from watchdog import start_watchdog
+
+    #Start
+    dut._log.info("Start")
+
+    #Setup Clock
+    clock = Clock(dut.clk, 10, units="us")
+    cocotb.start_soon(clock.start())
+
+    #Fail fast on hangs and runaway loops (see watchdog.py)
+    start_watchdog(dut, "test_bus_trace")
+
+    #Reset
+    dut._log.info("Reset")
+    dut.ena.value    = 1
+    dut.ui_in.value  = TM_DEMO_ROM | TM_ONBOARD_RAM
+    dut.uio_in.value = 0
+    dut.rst_n.value  = 0
+    await ClockCycles(dut.clk, 10)
+    dut.rst_n.value  = 1
+
+    #Record from the first falling edge after the reset release, model cycle 0
+    os.makedirs(os.environ["BUS_TRACE"], exist_ok=True)
+    path   = os.path.join(os.environ["BUS_TRACE"], "test_bus_trace.bin")
+    cycles = demo_rom_cycles(1)
+    writer = BusTraceWriter(dut, path, cu_state=True).start()
+    try:
+        await ClockCycles(dut.clk, cycles)
+    finally:
+        await writer.close()
+
+    model    = MinibyteModel(demo_rom=True, onboard_ram=True)
+    expected = []
+    for _ in range(cycles):
+        addr, we, drive, data = model.bus()
+        if drive:
+            expected.append((model.cycles, addr, data))
+        model.cycle()
+
+    trace = load_bus_trace(path)
+    assert len(trace) == cycles, f"{len(trace)} records for {cycles} cycles"
+    assert [(int(r["cycle"]), int(r["addr"]), int(r["data"])) for r in writes(trace)] == expected
+
+
+#Test Debug Server
+#-------------------------
+@cocotb.test()
+async def test_debug_server(dut):
+    import threading
+    import time
+
+    from debug_server import DebugClient, DebugServer, RtlTarget
+    from watchdog import start_watchdog
+
+    #Start
+    dut._log.info("Start")
+
+    #Setup Clock
+    clock = Clock(dut.clk, 10, units="us")
+    cocotb.start_soon(clock.start())
+
+    #Fail fast on hangs and runaway loops (see watchdog.py)
+    start_watchdog(dut, "test_debug_server")
+
+    #Reset
+    dut._log.info("Reset")
+    dut.ena.value    = 1
+    dut.ui_in.value  = TM_DEMO_ROM | TM_ONBOARD_RAM
+    dut.uio_in.value = 0
+    dut.rst_n.value  = 0
+    await ClockCycles(dut.clk, 10)
+    dut.rst_n.value  = 1
+
+    #PC breakpoints need the RTL hierarchy
+    target = RtlTarget(dut)
+    if not target.has_hierarchy:
+        dut._log.info("No RTL hierarchy (gate level), skipping")
+        return
+
+    #Serve on a free port and drive the session from a client thread
+    #The simulation is frozen whenever the server waits on the client
+    server  = DebugServer(target, port=0, log=dut._log.info)
+    results = {}
+
+    def client():
+        try:
+            while server.port == 0:
+                time.sleep(0.01)
+            debug = DebugClient(port=server.port, timeout=60)
+
+            #Stop on the STA_DIR of the count loop (PC 0x06) twice
+            debug.break_pc(0x06)
+            debug.cont()
+            results["first"] = debug.registers()
+            debug.cont()
+            results["second"] = debug.registers()
+
+            #Stop on the write of the last DEADBEEF byte and step past it
+            debug.monitor("delete")
+            debug.monitor("break write 0x7b")
+            debug.cont()
+            debug.step()
+            results["step"] = debug.registers()
+            results["ram"]  = debug.reg_ram()
+
+            debug.detach()
+        except Exception as e:
+            results["error"] = e
+
+    thread = threading.Thread(target=client)
+    thread.start()
+    await target.attach()
+    await server.serve(timeout=60)
+    thread.join()
+
+    assert "error" not in results, results.get("error")
+
+    #About to fetch the STA_DIR with A holding the count
+    for key, count in (("first", 1), ("second", 2)):
+        assert results[key]["pc"]    == 0x06
+        assert results[key]["a"]     == count
+        assert results[key]["state"] == S_FETCH_0
+
+    #The step got past the store, not stuck on its second WE cycle
+    assert results["step"]["state"] == S_FETCH_0
+
+    #DEADBEEF made it to the reg RAM
+    assert results["ram"][:4] == bytes([0xde, 0xad, 0xbe, 0xef])
+
+
+#Test Debug Port
+#-------------------------
+#Only with DEBUG_PORT=<port>: the demo ROM under the debug server for a session from gdb or a
+#DebugClient script, until it detaches (see debug_server.py)
+@cocotb.test(skip=not os.environ.get("DEBUG_PORT"))
+async def test_debug_port(dut):
+    from debug_server import start_debug_server
+    from watchdog import UNBOUNDED, start_watchdog
+
+    #Start
+    dut._log.info("Start")
+
+    #Setup Clock
+    clock = Clock(dut.clk, 10, units="us")
+    cocotb.start_soon(clock.start())
+
+    #Hang checks only, a session runs for as long as the client wants
+    start_watchdog(dut, "test_debug_port", UNBOUNDED)
+
+    #Reset
+    dut._log.info("Reset")
+    dut.ena.value    = 1
+    dut.ui_in.value  = TM_DEMO_ROM | TM_ONBOARD_RAM
+    dut.uio_in.value = 0
+    dut.rst_n.value  = 0
+    await ClockCycles(dut.clk, 10)
+    dut.rst_n.value  = 1
+
+    await start_debug_server(dut)
+
+
+#Test Toggle Activity
+#-------------------------
+#Only with TOGGLE_ACTIVITY=<dir>: toggles of every net over one pass of the demo ROM, written to
+#<dir>/test_toggle_activity.saif with a per block summary in the log (see toggle_activity.py)
+@cocotb.test(skip=not os.environ.get("TOGGLE_ACTIVITY"))
+async def test_toggle_activity(dut):
+    from minibyte_model import demo_rom_cycles
+    from toggle_activity import ToggleMonitor
+    from watchdog import start_watchdog
+
+    #Start
+    dut._log.info("Start")
+
+    #Setup Clock
+    clock = Clock(dut.clk, 10, units="us")
+    cocotb.start_soon(clock.start())
+
+    #Fail fast on hangs and runaway loops (see watchdog.py)
+    start_watchdog(dut, "test_toggle_activity")
+
+    #Reset
+    dut._log.info("Reset")
+    dut.ena.value    = 1
+    dut.ui_in.value  = TM_DEMO_ROM | TM_ONBOARD_RAM
+    dut.uio_in.value = 0
+    dut.rst_n.value  = 0
+    await ClockCycles(dut.clk, 10)
+    dut.rst_n.value  = 1
+
+    os.makedirs(os.environ["TOGGLE_ACTIVITY"], exist_ok=True)
+    path    = os.path.join(os.environ["TOGGLE_ACTIVITY"], "test_toggle_activity.saif")
+    cycles  = demo_rom_cycles(1)
+    monitor = ToggleMonitor(dut).start()
+    try:
+        await ClockCycles(dut.clk, cycles)
+    finally:
+        dut._log.info("Toggle activity:\n" + monitor.stop(path))
+
+    clk = next(net for net in monitor.counter.nets if net.path == dut.clk._path)
+    assert clk.toggles >= 2 * cycles, f"{clk.toggles} clock toggles in {cycles} cycles"
+
+
+#Test Vector Replay
+#-------------------------
+@cocotb.test()
+async def test_vectors(dut):
+    from vectors import Scenario, compile_scenario, format_failure, replay_vectors
+    from watchdog import start_watchdog
+
+    #Start (no cocotb Clock here, tb.v clocks the replay itself)
+    dut._log.info("Start")
+
+    #Fail fast on hangs and runaway loops (see watchdog.py)
+    start_watchdog(dut, "test_vectors")
+
+    #Program touching every addressing mode, a taken and a not taken branch and both jumps
+    program = [
+        IR_LDA_IMM, 0x05,
+        IR_STA_DIR, 0x40,
+        IR_ADD_DIR, 0x40,
+        IR_STA_IND, 0x41,
+        IR_LSL_IMM, 0x04,
+        IR_BMI_DIR, 0x0e,
+        IR_JMP_DIR, 0x0c,   #Skipped by the BMI
+        IR_SUB_IMM, 0xa0,
+        IR_BNE_DIR, 0x00,   #Not taken
+        IR_LDA_DIR, 0x42,
+        IR_XOR_IMM, 0xff,
+        IR_ASR_IMM, 0x02,
+        IR_JMP_IND, 0x43,
+    ]
+    memory = bytearray(128)
+    memory[:len(program)] = bytes(program)
+    memory[0x41] = 0x42     #STA_IND pointer
+    memory[0x43] = 0x00     #JMP_IND target
+
+    #Halt for a while and look at a few debug outputs along the way
+    ui_in_changes = {
+        500: TM_HALT_CU,
+        560: TM_OFF,
+        700: TM_DEBUG_OUT_PC,
+        720: TM_DEBUG_OUT_CU_STATE,
+        740: TM_DEBUG_OUT_A,
+        760: TM_OFF,
+    }
+
+    scenarios = [
+        ("program",  Scenario(memory, TM_OFF, 2000, 10, ui_in_changes)),
+        ("demo rom", Scenario(b"", TM_DEMO_ROM | TM_ONBOARD_RAM, 20000)),  #Two passes, more than one chunk
+    ]
+
+    for name, scenario in scenarios:
+        dut._log.info(f"Replaying {name} ({scenario.cycles} cycles)")
+        failure = await replay_vectors(dut, compile_scenario(scenario))
+        assert failure is None, f"{name}: {format_failure(failure)}"
+
+
+#Test Benchmarks
+#-------------------------
+@cocotb.test()
+async def test_benchmarks(dut):
+    from benchmarks import BENCHMARKS, format_results, run_model, run_rtl, write_results
+    from watchdog import budget, start_watchdog
+
+    #Start
+    dut._log.info("Start")
+
+    #Setup Clock
+    clock = Clock(dut.clk, 10, units="us")
+    cocotb.start_soon(clock.start())
+
+    #Fail fast on hangs and runaway loops (see watchdog.py), on the kernels' model cycles
+    models = [run_model(bench) for bench in BENCHMARKS]
+    start_watchdog(dut, "test_benchmarks", budget([(sum(model.cycles for model in models), 1)], resets=len(models)))
+
+    #Every kernel on the DUT, next to the reference model
+    results = []
+    for bench, model in zip(BENCHMARKS, models):
+        dut._log.info(f"Running {bench.name}")
+        rtl      = await run_rtl(dut, bench)
+        results += [rtl, model]
+
+        assert rtl.passed, f"{bench.name}: {rtl.message}"
+        assert rtl.cycles == model.cycles, f"{bench.name}: {rtl.cycles} cycles, model {model.cycles}"
+        assert rtl.instructions in (None, model.instructions)
+
+    dut._log.info("Benchmarks:\n" + format_results(results))
+    if os.environ.get("BENCHMARKS"):
+        write_results(os.environ["BENCHMARKS"], results)
+
+
+#Test Soak
+#-------------------------
+#Only with SOAK_CYCLES=<n>, the demo ROM by default or SOAK_IMAGE=<.s/.hex/.bin> checked against
+#the reference model, SOAK_UI_IN sets ui_in for images (see soak.py)
+@cocotb.test(skip=not os.environ.get("SOAK_CYCLES"))
+async def test_soak(dut):
+    from minibyte_model import demo_rom_passes
+    from soak import DemoRomChecker, ModelChecker, load_image, soak_rtl
+    from watchdog import start_watchdog
+
+    #Start (no cocotb Clock here, tb.v clocks the run itself)
+    dut._log.info("Start")
+
+    #Fail fast on hangs and runaway loops (see watchdog.py)
+    start_watchdog(dut, "test_soak")
+
+    cycles = int(float(os.environ["SOAK_CYCLES"]))
+    image  = os.environ.get("SOAK_IMAGE")
+    if image:
+        memory  = load_image(image)
+        ui_in   = int(os.environ.get("SOAK_UI_IN", "0"), 0)
+        checker = ModelChecker(memory, ui_in)
+    else:
+        memory  = None
+        ui_in   = TM_DEMO_ROM | TM_ONBOARD_RAM
+        checker = DemoRomChecker()
+
+    await soak_rtl(dut, cycles, checker, memory, ui_in)
+    assert checker.writes, f"no bus writes in {cycles} cycles"
+
+    #A demo ROM that stalls part way through a pass makes no bad writes, count its passes too
+    if image is None:
+        passes = demo_rom_passes(cycles)
+        assert checker.passes == passes, f"{checker.passes} demo ROM passes in {cycles} cycles, expected {passes}"
+
+
+#Test Fuzz
+#-------------------------
+#Only with FUZZ=<dir>: random programs replayed through tb.v against the reference model for
+#FUZZ_MINUTES (or FUZZ_PROGRAMS programs), the corpus and crashes are kept in <dir> (see fuzz.py)
+@cocotb.test(skip=not os.environ.get("FUZZ"))
+async def test_fuzz(dut):
+    from fuzz import case_cycles, fuzz_rtl
+    from watchdog import UNBOUNDED, budget, start_watchdog
+
+    #Start (no cocotb Clock here, tb.v clocks the replay itself)
+    dut._log.info("Start")
+
+    minutes  = float(os.environ.get("FUZZ_MINUTES", "1"))
+    programs = os.environ.get("FUZZ_PROGRAMS")
+    seed     = os.environ.get("FUZZ_SEED")
+
+    #Fail fast on hangs and runaway loops (see watchdog.py), time bound runs only get the hang checks
+    start_watchdog(dut, "test_fuzz", budget([(int(programs) * case_cycles(), 1)], resets=0) if programs else UNBOUNDED)
+    campaign, mismatches = await fuzz_rtl(dut, os.environ["FUZZ"], minutes,
+                                          int(programs) if programs else None,
+                                          int(seed) if seed is not None else None)
+
+    signatures = sorted({mismatch.signature for mismatch in mismatches})
+    assert not mismatches, f"{len(mismatches)} mismatches against the model ({', '.join(signatures)}), see {os.environ['FUZZ']}/crashes"
+
+
+#Test Trace Equivalence
+#-------------------------
+#Only with TRACE_RECORD=<npz> (record the RTL) or TRACE_CHECK=<npz> (replay it on the gate level
+#netlist and diff), see trace_equiv.py
+@cocotb.test(skip=not (os.environ.get("TRACE_RECORD") or os.environ.get("TRACE_CHECK")))
+async def test_trace_equiv(dut):
+    from soak import load_image
+    from trace_equiv import CYCLES as TRACE_CYCLES
+    from trace_equiv import build_stimulus, diff_traces, format_diff, load_trace, record_trace, save_trace, trace_cycles
+    from vectors import pack
+    from watchdog import budget, start_watchdog
+
+    #Start (no cocotb Clock here, tb.v clocks the replay itself)
+    dut._log.info("Start")
+
+    #Fail fast on hangs and runaway loops (see watchdog.py)
+    start_watchdog(dut, "test_trace_equiv", budget([(trace_cycles(os.environ.get("TRACE_CHECK")), 1)]))
+
+    cycles = os.environ.get("TRACE_CYCLES")
+
+    #Record a reference trace (RTL)
+    record = os.environ.get("TRACE_RECORD")
+    if record:
+        image    = os.environ.get("TRACE_IMAGE")
+        memory   = load_image(image) if image else b""
+        ui_in    = int(os.environ.get("TRACE_UI_IN", "0" if image else str(TM_DEMO_ROM | TM_ONBOARD_RAM)), 0)
+        stimulus = build_stimulus(memory, ui_in, int(cycles) if cycles else TRACE_CYCLES)
+        stimulus = [pack(vector) for vector in stimulus]
+        save_trace(record, stimulus, await record_trace(dut, stimulus))
+        dut._log.info(f"{record}: {len(stimulus)} cycles")
+        return
+
+    #Replay it (gate level) and diff, stopping after the first chunk with a mismatch
+    check         = os.environ["TRACE_CHECK"]
+    stimulus, rtl = load_trace(check)
+    if cycles:
+        stimulus, rtl = stimulus[:int(cycles)], rtl[:int(cycles)]
+    outputs = await record_trace(dut, stimulus, rtl)
+    save_trace(os.path.splitext(check)[0] + ".gl.npz", stimulus[:len(outputs)], outputs)
+
+    diff = diff_traces(stimulus, rtl, outputs)
+    dut._log.info(format_diff(diff, stimulus, rtl, outputs))
+    assert diff.first is None, f"traces differ from cycle {diff.first}"
+
+
+#Test Peripherals
+#-------------------------
+@cocotb.test()
+async def test_peripherals(dut):
+    from minibyte_asm import assemble
+    from minibyte_model import demo_rom_cycles
+    from peripherals import run_model as run_peripherals_model, serve_bus, standard_bus, watch_writes
+    from watchdog import start_watchdog
+
+    #Start
+    dut._log.info("Start")
+
+    #Setup Clock
+    clock = Clock(dut.clk, 10, units="us")
+    cocotb.start_soon(clock.start())
+
+    #Fail fast on hangs and runaway loops (see watchdog.py)
+    start_watchdog(dut, "test_peripherals")
+
+    #Send "HI" (the second write while busy is dropped), echo the input port to the LEDs, time it all
+    program = assemble("""
+            sta 0x44            ; clear the timer
+    wait1:  lda 0x43
+            and #1
+            bne wait1
+            lda #0x48
+            sta 0x42
+            lda #0x49
+            sta 0x42
+    wait2:  lda 0x43
+            and #1
+            bne wait2
+            lda #0x49
+            sta 0x42
+            lda 0x41
+            sta 0x40
+            lda 0x44
+            sta t
+    done:   jmp done
+    t:      .byte 0
+    """)
+    schedule = {0: 0x11, 100: 0x5a}
+
+    bus, latch, port, uart, timer = standard_bus(program.memory, schedule=schedule)
+    await serve_bus(dut, bus, 1000)
+    ref, ref_latch, _, ref_uart, _ = standard_bus(program.memory, schedule=schedule)
+    run_peripherals_model(ref, 1000)
+
+    assert uart.text() == "HI", f"UART sent {uart.text()!r}"
+    assert uart.overruns == 1
+    assert uart.frames == ref_uart.frames, f"UART frames {uart.frames} (model {ref_uart.frames})"
+    assert latch.history == ref_latch.history == [(ref_latch.history[0][0], 0x5a)], f"LEDs {latch.history} (model {ref_latch.history})"
+    t = program.labels["t"]
+    assert bus.memory[t] == ref.memory[t], f"timer read 0x{bus.memory[t]:02x} (model 0x{ref.memory[t]:02x})"
+
+    #Demo ROM output port, only waking up on writes
+    cycles = demo_rom_cycles(1)
+    bus, latch, _, _, _ = standard_bus()
+    await watch_writes(dut, bus, cycles)
+    ref, ref_latch, _, _, _ = standard_bus()
+    run_peripherals_model(ref, cycles, TM_DEMO_ROM | TM_ONBOARD_RAM)
+
+    assert latch.history == ref_latch.history, f"{len(latch.history)} output port writes, first differences: " + \
+        str([(a, b) for a, b in zip(latch.history, ref_latch.history) if a != b][:4])
+    dut._log.info(f"{len(latch.history)} output port writes in {bus.batches} batches")
+
+
+#Test TB Memory
+#-------------------------
+@cocotb.test()
+async def test_tb_memory(dut):
+    from benchmarks import BENCHMARKS, check_results, run_model
+    from minibyte_asm import assemble
+    from minibyte_model import REG_RAM_BASE, MinibyteModel
+    from tb_memory import run_program
+    from watchdog import budget, start_watchdog
+
+    #Start (no cocotb Clock here, tb.v clocks the run itself)
+    dut._log.info("Start")
+
+    #Fail fast on hangs and runaway loops (see watchdog.py), on the kernels' model cycles
+    runs = [(bench, run_model(bench).cycles + 16) for bench in BENCHMARKS]
+    start_watchdog(dut, "test_tb_memory", budget([(sum(cycles for _, cycles in runs), 1)], resets=len(runs)))
+
+    #Every kernel from a freshly loaded image, with nothing but tb.v serving the bus
+    for bench, cycles in runs:
+        program = assemble(bench.source)
+        memory  = await run_program(dut, program.memory, cycles, bench.ui_in)
+
+        message = check_results(bench, program, memory)
+        assert not message, f"{bench.name}: {message}"
+
+        #Same memory as the model, reg RAM stores only land outside with the onboard RAM off
+        expected = bytearray(program.memory)
+        model    = MinibyteModel(expected, onboard_ram=bool(bench.ui_in & TM_ONBOARD_RAM))
+        for _ in range(cycles):
+            model.cycle()
+        end = REG_RAM_BASE if bench.ui_in & TM_ONBOARD_RAM else len(memory)
+        assert memory[:end] == expected[:end], f"{bench.name}: memory differs from the model"
+        if bench.ui_in & TM_ONBOARD_RAM:
+            assert memory[end:] == program.memory[end:], f"{bench.name}: reg RAM stores reached the external memory"
+        dut._log.info(f"{bench.name}: {cycles} cycles")
+
+
+#Test Clock Advance
+#-------------------------
+#FastClockCycles has to land on the same time and edge as ClockCycles, learning the period,
+#reusing it, right at MIN_CYCLES and when the clock restarts slower and it has to count again
+@cocotb.test()
+async def test_clock_advance(dut):
+    from cocotb.triggers import Combine, RisingEdge
+    from cocotb.utils import get_sim_time
+
+    from clock_advance import MIN_CYCLES, FastClockCycles
+
+    #Start
+    dut._log.info("Start")
+
+    #Setup Clock
+    clock = cocotb.start_soon(Clock(dut.clk, 10, units="us").start())
+    dut.ena.value   = 1
+    dut.ui_in.value = TM_OFF
+    dut.rst_n.value = 0
+
+    #Both waits from the same edge, (sim time, clk) where each resumed
+    async def wait(trigger, landed):
+        await trigger
+        landed.append((get_sim_time("step"), dut.clk.value.integer))
+
+    async def compare(cycles):
+        await RisingEdge(dut.clk)
+        fast, slow = [], []
+        await Combine(cocotb.start_soon(wait(FastClockCycles(dut.clk, cycles), fast)),
+                      cocotb.start_soon(wait(ClockCycles(dut.clk, cycles), slow)))
+        assert fast == slow, f"{cycles} cycles: FastClockCycles at {fast}, ClockCycles at {slow}"
+        assert fast[0][1] == 1, f"{cycles} cycles: landed on clk {fast[0][1]}"
+
+    for cycles in (1, MIN_CYCLES - 1, MIN_CYCLES, 10, 100):
+        await compare(cycles)
+
+    #Restart the clock at twice the period right after a rising edge, its edges stay in step
+    #with the learnt period so only the landing check can see it
+    await RisingEdge(dut.clk)
+    clock.kill()
+    cocotb.start_soon(Clock(dut.clk, 20, units="us").start())
+    for cycles in (10, 10, 100):
+        await compare(cycles)
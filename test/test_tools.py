@@ -0,0 +1,968 @@
+# SPDX-FileCopyrightText: © 2024 Zachary Frazee
+# SPDX-License-Identifier: Apache-2.0
+
+#Checks of the pure Python tools next to the cocotb tests, no simulator needed:
+#
+#   python -m pytest -q test_tools.py
+#
+#Every tool is checked against the reference model (MinibyteModel) or its own interpreter.
+
+#Includes
+#-------------------------
+import logging
+
+from minibyte_isa import (TM_DEBUG_OUT_CU_STATE, TM_HALT_CU, TM_DEMO_ROM, TM_ONBOARD_RAM, IR_JMP_DIR,
+                          CYCLES_STA_DIR, CYCLES_ALU_IMM, CYCLES_ALU_DIR, S_FETCH_0, S_FETCH_1, S_STA_DIR_2,
+                          S_STA_DIR_3, S_JMP_DIR_0, IR_NAMES)
+
+
+#Helpers
+#-------------------------
+class _Dut:
+    _log = logging.getLogger("test_tools")
+
+
+#Bus traces (bus_trace.py)
+#-------------------------
+
+#Demo ROM run on the model written through a BusTraceWriter, loaded back
+def _model_bus_trace(path, cycles, changes_only=False, poke=None):
+    from bus_trace import BusTraceWriter, load_bus_trace
+    from minibyte_model import MinibyteModel
+
+    model  = MinibyteModel(demo_rom=True, onboard_ram=True)
+    writer = BusTraceWriter(_Dut(), path, changes_only=changes_only, block=64)
+    for cycle in range(cycles):
+        addr, we, drive, data = model.bus()
+        if cycle == poke:
+            data ^= 0x01
+        writer.sample(addr | (we << 7), data if drive else 0, 0xff if drive else 0, 0 if drive else data)
+        model.cycle()
+    writer.close_file()
+    return load_bus_trace(path)
+
+def test_bus_trace_round_trip(tmp_path):
+    from bus_trace import iter_bus_trace
+
+    trace = _model_bus_trace(tmp_path / "full.bin", 1000)
+    assert len(trace) == 1000
+    assert [tuple(r) for r in iter_bus_trace(tmp_path / "full.bin")] == [tuple(int(f) for f in r) for r in trace]
+
+def test_bus_trace_first_difference(tmp_path):
+    from bus_trace import first_difference
+
+    full    = _model_bus_trace(tmp_path / "full.bin", 3000)
+    changes = _model_bus_trace(tmp_path / "changes.bin", 3000, changes_only=True)
+    assert len(changes) < len(full)
+
+    #Walked by cycle, a changes_only trace of the same run matches the full one
+    assert first_difference(full, full) is None
+    assert first_difference(full, changes, b_changes_only=True) is None
+    assert first_difference(changes, full, a_changes_only=True) is None
+
+    #And a difference is reported on its cycle, not a record index
+    poked = _model_bus_trace(tmp_path / "poked.bin", 3000, changes_only=True, poke=2500)
+    assert first_difference(full, poked, b_changes_only=True) == 2500
+    assert first_difference(changes, poked, True, True) == 2500
+
+    #Full traces have to be the same length
+    assert first_difference(full, _model_bus_trace(tmp_path / "short.bin", 2000)) == 2000
+
+#A changes_only trace that changed on every cycle looks full, only the header flag tells them apart
+def test_bus_trace_changes_only_flag(tmp_path):
+    from bus_trace import (BusTraceWriter, FLAG_CHANGES_ONLY, first_difference, load_bus_trace,
+                           main, read_header)
+
+    for name, changes_only in (("full.bin", False), ("changes.bin", True)):
+        writer = BusTraceWriter(_Dut(), tmp_path / name, changes_only=changes_only)
+        for cycle in range(20):
+            writer.sample(min(cycle, 9), 0, 0, 0)
+        writer.close_file()
+
+    assert not read_header(tmp_path / "full.bin")[0] & FLAG_CHANGES_ONLY
+    assert read_header(tmp_path / "changes.bin")[0] & FLAG_CHANGES_ONLY
+
+    full, changes = load_bus_trace(tmp_path / "full.bin"), load_bus_trace(tmp_path / "changes.bin")
+    assert len(changes) == 10 and changes["cycle"][-1] == 9
+    assert first_difference(full, changes, b_changes_only=True) is None
+    assert first_difference(full, changes) == 10
+    assert main([str(tmp_path / "full.bin"), "--diff", str(tmp_path / "changes.bin")]) == 0
+
+#tb.v buffer dump, X/Z fields read as 0 field by field
+def test_bus_trace_tb_buffer(tmp_path):
+    from bus_trace import read_tb_buffer
+
+    path = tmp_path / "bus_trace.hex"
+    path.write_text("// dump\n"
+                    "00000000000000058a5a00ff02\n"
+                    "0000000000000006050xzz0003\n"
+                    "000000000000000705xx3c00ff\n")
+    assert read_tb_buffer(path) == [(5, 0x8a, 0x5a, 0xff, 0x00, 0x02),
+                                    (6, 0x05, 0x00, 0x00, 0x00, 0x03),
+                                    (7, 0x05, 0x00, 0x00, 0x3c, 0xff)]
+
+
+#VCD index (vcd_index.py)
+#-------------------------
+
+#tb.vcd-like dump of the demo ROM on the model, a rising edge every 10 ticks
+#Returns the value changes of every signal, {name: [(time, value), ...]}
+def _model_vcd(path, cycles):
+    from minibyte_model import MinibyteModel
+
+    signals = [("clk", 1, ["tb", "clk"]), ("uo_out", 8, ["tb", "uo_out"]), ("uio_in", 8, ["tb", "uio_in"]),
+               ("uio_out", 8, ["tb", "uio_out"]), ("uio_oe", 8, ["tb", "uio_oe"]),
+               ("state", 8, ["tb", "user_project", "cpu", "cu", "curr_state"]),
+               ("pc", 7, ["tb", "user_project", "cpu", "reg_pc", "reg_out"])]
+    ids     = {name: chr(ord("!") + i) for i, (name, _, _) in enumerate(signals)}
+    history = {".".join(scope): [] for _, _, scope in signals}
+
+    lines = ["$timescale 1ps $end"]
+    depth = []
+    for name, width, scope in signals:
+        while depth != scope[:len(depth)] or len(depth) >= len(scope):
+            lines.append("$upscope $end")
+            depth.pop()
+        for module in scope[len(depth):-1]:
+            lines.append(f"$scope module {module} $end")
+            depth.append(module)
+        lines.append(f"$var wire {width} {ids[name]} {scope[-1]} $end")
+    lines += ["$upscope $end"] * len(depth) + ["$enddefinitions $end"]
+
+    last = {}
+    def dump(time, values):
+        lines.append(f"#{time}")
+        for name, width, scope in signals:
+            value = values[name]
+            if last.get(name) == value:
+                continue
+            last[name] = value
+            lines.append(f"{value}{ids[name]}" if width == 1 else f"b{value:b} {ids[name]}")
+            history[".".join(scope)].append((time, value))
+
+    model = MinibyteModel(demo_rom=True, onboard_ram=True)
+    for cycle in range(cycles):
+        addr, we, drive, data = model.bus()
+        values = {"clk": 0, "uo_out": addr | (we << 7), "uio_in": 0 if drive else data,
+                  "uio_out": data if drive else 0, "uio_oe": 0xff if drive else 0, "state": model.state, "pc": model.pc}
+        if cycle:
+            dump(10 * cycle, dict(values, clk=1))
+        dump(10 * cycle + 5, values)
+        model.cycle()
+
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return history
+
+def test_vcd_index_queries(tmp_path):
+    import random
+
+    from vcd_index import VcdIndex
+
+    path    = str(tmp_path / "tb.vcd")
+    history = _model_vcd(path, 3000)
+    index   = VcdIndex(path, chunk=4096)
+    assert len(index.checkpoints()) > 20
+
+    #Every query, from whichever checkpoint, gives what a full scan gives
+    def value_at(name, time):
+        return [value for t, value in history[name] if t <= time][-1]
+
+    names = sorted(history)
+    rng   = random.Random(1)
+    for time in [5, 29995] + [rng.randrange(5, 29995) for _ in range(40)]:
+        assert index.values_at(names, time) == {name: value_at(name, time) for name in names}
+
+    t0, t1 = 12345, 15000
+    window = index.window(["tb.uo_out"], t0, t1)["tb.uo_out"]
+    assert window[0] == (t0, value_at("tb.uo_out", t0))
+    assert window[1:] == [(t, value) for t, value in history["tb.uo_out"] if t0 < t <= t1]
+
+    #The sidecar index is picked up by the next reader
+    assert VcdIndex(path, chunk=4096)._load_index() == index.checkpoints()
+
+def test_vcd_instruction_trace(tmp_path):
+    from minibyte_model import MinibyteModel
+    from vcd_index import instruction_trace
+
+    path = str(tmp_path / "tb.vcd")
+    _model_vcd(path, 3000)
+
+    #Same instructions as the model fetched (the last one is cut off by the end of the dump)
+    model   = MinibyteModel(demo_rom=True, onboard_ram=True)
+    fetched = []
+    for cycle in range(2999):
+        if model.state == S_FETCH_1:
+            fetched.append((model.pc, model.bus()[3], cycle))
+        model.cycle()
+    trace = instruction_trace(path)
+    assert [(i.pc, i.ir) for i in trace] == [(pc, ir) for pc, ir, _ in fetched]
+    assert [i.cycles for i in trace[:-1]] == [b[2] - a[2] for a, b in zip(fetched, fetched[1:])]
+    assert [w for i in trace for w in i.writes][:3] == [(0x40, 1), (0x40, 2), (0x40, 3)]
+
+
+#Debug server (debug_server.py)
+#-------------------------
+def _debug_session(model):
+    import socket
+
+    from debug_server import DebugServer, ModelTarget, run_sync
+
+    server       = DebugServer(ModelTarget(model), port=0)
+    server._conn, peer = socket.socketpair()
+    return server, peer, lambda packet: run_sync(server._handle(packet))
+
+#The model target with tb.v's breakpoint comparators done in Python
+def _comparator_target(model):
+    from debug_server import DBG_SLOTS, DebugServer, ModelTarget
+
+    class ComparatorTarget(ModelTarget):
+        comparators = DBG_SLOTS
+        runs        = 0
+
+        #Stop on a match or after cycles, like tb.v
+        async def run_until(self, breakpoints, cycles):
+            server = DebugServer(self)
+            server.breakpoints = breakpoints
+            self.runs += 1
+            for ran in range(1, cycles + 1):
+                self.model.cycle()
+                if server._hit(*self.probe()):
+                    break
+            return ran
+
+    return ComparatorTarget(model)
+
+def test_debug_comparators():
+    from debug_server import INTERRUPT_POLL, ModelTarget
+    from minibyte_model import MinibyteModel
+
+    #Same stops as polling every cycle, with a run per INTERRUPT_POLL cycles in between
+    stops = {}
+    for name, target in (("poll", ModelTarget(MinibyteModel(demo_rom=True, onboard_ram=True))),
+                         ("tb.v", _comparator_target(MinibyteModel(demo_rom=True, onboard_ram=True)))):
+        server, peer, handle = _debug_session(target.model)
+        server.target = target
+        try:
+            handle("Z0,6,1")
+            handle("Z2,7b,1")
+            stops[name] = [(handle("c"), target.cycles, target.model.state) for _ in range(6)]
+            handle("z0,6,1")
+            stops[name] += [(handle("c"), target.cycles, target.model.state) for _ in range(2)]
+        finally:
+            server._conn.close()
+            peer.close()
+
+    assert stops["poll"] == stops["tb.v"]
+    assert target.runs < stops["tb.v"][-1][1] // INTERRUPT_POLL + 30
+
+def test_debug_step_off_watchpoint():
+    from minibyte_model import MinibyteModel
+
+    model = MinibyteModel(demo_rom=True, onboard_ram=True)
+    server, peer, handle = _debug_session(model)
+    try:
+        #Stops as WE goes up for the last DEADBEEF byte
+        assert handle("Z2,7b,1") == "OK"
+        assert handle("c") == "S05"
+        assert model.state == S_STA_DIR_2 and model.m == 0x7b
+
+        #Step gets past the store (still on the bus in STA_DIR_3) to the next instruction
+        pc = model.pc
+        assert handle("s") == "S05"
+        assert model.state == S_FETCH_0 and model.pc == pc + 1
+        assert model.reg_ram[3] == 0xef
+
+        #Next pass, the reg RAM latches on the WE edge, and a cycle step keeps ignoring it
+        cycles = model.cycles
+        assert handle("c") == "S05"
+        assert model.state == S_STA_DIR_2 and model.cycles > cycles + 1000
+        model.reg_ram[3] = 0
+        assert handle("i") == "S05"
+        assert model.state == S_STA_DIR_3 and model.reg_ram[3] == 0xef
+        assert handle("s") == "S05"
+        assert model.state == S_FETCH_0 and model.pc == pc + 1
+    finally:
+        server._conn.close()
+        peer.close()
+
+
+#Toggle activity (toggle_activity.py)
+#-------------------------
+
+#{full net bit name: (T0, T1, TX, TC)} read back from a SAIF, instance names joined with its DIVIDER
+def _read_saif(path):
+    import re
+
+    with open(path) as f:
+        text = f.read()
+    divider = re.search(r"\(DIVIDER (\S) \)", text).group(1)
+    nets    = {}
+    scope   = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("(INSTANCE "):
+            scope.append(line.split()[1])
+        elif line == "(NET":
+            scope.append(None)
+        elif line == ")" and scope:
+            scope.pop()
+        else:
+            match = re.fullmatch(r"\((\S+) \(T0 (\d+)\) \(T1 (\d+)\) \(TX (\d+)\) \(TC (\d+)\)\)", line)
+            if match:
+                nets[divider.join([name for name in scope if name] + [match.group(1)])] = tuple(int(v) for v in match.groups()[1:])
+    return nets
+
+def test_saif_paths(tmp_path):
+    from toggle_activity import ToggleCounter
+
+    counter = ToggleCounter()
+    clk     = counter.add_net("tb.clk", 1, "0")
+    alu     = counter.add_net("tb.user_project.cpu.alu.result", 8, "00000000")
+    state   = counter.add_net("tb.user_project.cpu.cu.curr_state", 6, "xxxxxx")
+    for now in range(5, 1000, 5):
+        clk.change(now, "1" if now % 10 else "0")
+        if now % 10 == 0:
+            alu.change(now, f"{now // 10 & 0xff:08b}")
+            state.change(now, f"{now // 10 % 5:06b}")
+    counter.finish(1000)
+    counter.write_saif(tmp_path / "tb.saif")
+
+    #Every bit comes back under the path it was counted on
+    nets = _read_saif(tmp_path / "tb.saif")
+    assert nets["tb.clk"] == (500, 500, 0, 199)
+    expected = {}
+    for net in (alu, state):
+        for i in range(net.width):
+            expected[f"{net.path}\\[{i}\\]"] = (net.t0[i], net.t1[i], net.tx[i], net.tc[i])
+    assert {name: value for name, value in nets.items() if name != "tb.clk"} == expected
+    assert nets["tb.user_project.cpu.cu.curr_state\\[0\\]"][2] == 10
+
+
+#Campaigns (campaign.py)
+#-------------------------
+
+#Stand-in for make + the simulator: writes the results.xml of TESTCASE, seed 3 fails and seeds
+#from 10 up take a long time
+FAKE_SIM = """
+import os, sys, time
+test, seed = os.environ["TESTCASE"], int(os.environ["RANDOM_SEED"])
+if seed >= 10:
+    time.sleep(30)
+failure = '<failure message="seed %d is bad" />' % seed if seed == 3 else ""
+with open("results.xml", "w") as f:
+    f.write('<testsuites><testsuite><testcase name="%s" sim_time_ns="%d">%s</testcase></testsuite></testsuites>'
+            % (test, 1000 * seed, failure))
+"""
+
+def _fake_campaign(monkeypatch, tmp_path, seeds, **kwargs):
+    import sys
+
+    import campaign
+
+    script = tmp_path / "fake_sim.py"
+    script.write_text(FAKE_SIM)
+    monkeypatch.setattr(campaign, "_make_command", lambda sim_build, gates: [sys.executable, str(script)])
+    return campaign.Campaign(["test_a", "test_b"], seeds, 4, tmp_path / "out", log=lambda line: None, **kwargs)
+
+def test_campaign_keep_going(monkeypatch, tmp_path):
+    import json
+
+    run = _fake_campaign(monkeypatch, tmp_path, range(1, 6), keep_going=True)
+    assert not run.run()
+
+    #Every job ran, only the failures kept their directory and a repro line
+    summary = json.loads((tmp_path / "out" / "summary.json").read_text())
+    assert summary["tests"]["test_a"]["runs"] == 5
+    assert summary["tests"]["test_a"]["failing_seeds"] == [3]
+    assert summary["tests"]["test_b"]["pass_rate"] == 0.8
+    assert sorted(p.name for p in (tmp_path / "out").iterdir() if p.name.startswith("test_")) == ["test_a_3", "test_b_3"]
+    assert "RANDOM_SEED=3" in (tmp_path / "out" / "test_a_3" / "repro.txt").read_text()
+
+def test_campaign_stops_on_failure(monkeypatch, tmp_path):
+    import time
+
+    #Seed 3 fails while the slow seeds are running, they get killed instead of waited for
+    run   = _fake_campaign(monkeypatch, tmp_path, [1, 10, 3, 11, 12, 13, 14, 15])
+    start = time.monotonic()
+    assert not run.run()
+    assert time.monotonic() - start < 20
+    assert {job.seed for job in run.results if not job.passed} == {3}
+    assert all(job.seed < 10 for job in run.results)
+    assert run.cancelled > 0
+
+
+#Vectors (vectors.py)
+#-------------------------
+
+#Data written to addr in the expected outputs of the vectors
+def _vector_writes(vectors, addr):
+    return [v.uio_out for v in vectors if v.uio_oe == 0xff and v.uo_out == 0x80 | addr]
+
+def test_vectors_debug_mux():
+    from vectors import Scenario, compile_scenario
+
+    #The debug outputs replace the demo ROM and reg RAM address too. Selecting one every 16
+    #cycles hits STA_DIR_2 at cycle 91 and the demo ROM count goes off the rails, as on the RTL
+    ui_in   = TM_DEMO_ROM | TM_ONBOARD_RAM
+    changes = {}
+    for k, cycle in enumerate(range(26, 1010, 16)):
+        changes[cycle]     = ui_in | (k % 7 + 1)
+        changes[cycle + 1] = ui_in
+    vectors = compile_scenario(Scenario(b"", ui_in, 1000, 10, changes))
+    assert _vector_writes(vectors, 0x40)[:6] == [1, 2, 4, 65, 66, 68]
+
+    #Without them the count goes on
+    vectors = compile_scenario(Scenario(b"", ui_in, 1000, 10))
+    assert _vector_writes(vectors, 0x40)[:6] == [1, 2, 3, 4, 5, 6]
+
+    #A debug output is what the pins show
+    vectors = compile_scenario(Scenario(b"", ui_in, 100, 10, {60: ui_in | TM_HALT_CU, 90: ui_in | TM_HALT_CU | TM_DEBUG_OUT_CU_STATE}))
+    assert vectors[95].uo_out == S_FETCH_0
+
+
+#Cost model (cost_model.py)
+#-------------------------
+def test_cost_model_all_paths():
+    from cost_model import all_paths, state_path
+    from minibyte_model import CU_BRANCH, instruction_cycles
+
+    #Every opcode (and branch outcome) is listed once, on a path of its own cycle count
+    paths = all_paths()
+    irs   = {name: ir for ir, name in IR_NAMES.items()}
+    names = [name for names in paths.values() for name in names]
+    assert len(names) == len(set(names)) == len(IR_NAMES) + len(CU_BRANCH)
+    for path, names in paths.items():
+        for name in names:
+            ir = irs[name.split()[0]]
+            assert len(path) == instruction_cycles(ir, not name.endswith("not taken"))
+
+    #Taken branches share the jump's states
+    assert paths[state_path(IR_JMP_DIR)] == ["JMP_DIR"] + [IR_NAMES[ir] + " taken" for ir in CU_BRANCH if CU_BRANCH[ir][2] == S_JMP_DIR_0]
+
+def test_cost_model_paths_from_states():
+    from cost_model import CostModel, VARIANTS, paths_from_model, paths_from_states
+    from minibyte_model import MinibyteModel
+
+    #Splitting a per cycle state list gives the paths of the same model run
+    model  = MinibyteModel(demo_rom=True, onboard_ram=True)
+    states = []
+    for _ in range(20000):
+        states.append(model.state)
+        model.cycle()
+    paths = paths_from_model(MinibyteModel(demo_rom=True, onboard_ram=True), 20000)
+    split = paths_from_states(states)
+    assert abs(sum(paths.values()) - sum(split.values())) <= 1
+    assert all(split[path] <= paths[path] for path in split)
+
+    #The baseline costs one cycle a state
+    assert CostModel(VARIANTS[0]).cycles(split) == sum(len(path) * count for path, count in split.items())
+
+
+#Peephole optimizer (peephole.py)
+#-------------------------
+def test_peephole_benchmarks():
+    from benchmarks import BENCHMARKS, Benchmark, run_model
+    from peephole import Peephole
+
+    #Optimized kernels still pass their checks, and are no slower
+    for bench in BENCHMARKS:
+        before = run_model(bench)
+        after  = run_model(Benchmark(bench.name, Peephole().optimize(bench.source), bench.ui_in, bench.expected))
+        assert after.passed, f"{bench.name}: {after.message}"
+        assert after.cycles <= before.cycles
+
+def test_peephole_demo_rom():
+    from minibyte_asm import assemble, lift
+    from minibyte_model import DEMO_ROM
+    from peephole import Peephole, observable_writes
+
+    #The output port is I/O, the rest of the demo ROM stores must stay as they are
+    source    = lift(DEMO_ROM, 0, 0x37)
+    optimized = Peephole(volatile=[0x40]).optimize(source)
+    before, after = assemble(source), assemble(optimized)
+    a, _ = observable_writes(before, after, 20000, onboard_ram=True)
+    b, _ = observable_writes(after, before, 20000, onboard_ram=True)
+    length = min(len(a), len(b))
+    assert length > 300 and a[:length] == b[:length]
+
+def test_peephole_constant_fold_operand():
+    from minibyte_asm import assemble
+    from peephole import Peephole, observable_writes
+
+    #The folded lda #6 is checked against its own operand, not the 3 of the add it replaced
+    #(A is 3 going in, which made it look redundant)
+    source    = "lda #3\nadd #3\nsta 0x40\nhalt: jmp halt\n"
+    optimized = Peephole().optimize(source)
+    assert "lda #0x06" in optimized
+    assert observable_writes(assemble(optimized), assemble(source), 200)[0] == [(0x40, 6)]
+
+
+#Superoptimizer (superopt.py)
+#-------------------------
+def test_superopt_minimum_imm():
+    import random
+
+    from superopt import CYCLES_IMM, IDENTITY, Superoptimizer, imm_instructions, verify
+
+    #IMM only (no scratch), every sequence of up to 3 instructions is cheap to list, so the
+    #search has to find the shortest one for the goal
+    constants = (1, 4, 0x0f)
+    tables    = [table for _, table in imm_instructions(constants)]
+    shortest  = {IDENTITY: 0}
+    level     = [IDENTITY]
+    for length in (1, 2, 3):
+        level = [a.translate(table) for a in level for table in tables]
+        for a in level:
+            shortest.setdefault(a, length)
+
+    rng       = random.Random(7)
+    optimizer = Superoptimizer(constants=constants, scratch=0, max_cycles=3 * CYCLES_IMM)
+    for goal in rng.sample(sorted(shortest), 20):
+        ops, cycles, _ = optimizer.search(goal)
+        assert cycles == shortest[goal] * CYCLES_IMM
+        assert verify(ops, lambda x: goal[x], cycles) == ""
+
+def test_superopt_scratch():
+    from superopt import superoptimize
+
+    #x*3 needs the scratch cell: sta t0 / lsl #1 / add t0
+    result = superoptimize("mul3", lambda x: x * 3)
+    assert result.verified and result.cycles == CYCLES_STA_DIR + CYCLES_ALU_IMM + CYCLES_ALU_DIR
+    assert superoptimize("mul3", lambda x: x * 3, scratch=0, max_cycles=2 * CYCLES_ALU_IMM).ops is None
+
+
+#DSL compiler (dsl_compiler.py)
+#-------------------------
+
+#Random DSL program: straight line code, ifs and counted loops over a few variables, some of
+#them read before they are written, with peek/poke of a small buffer in external memory
+#(0x74-0x77, spills go to 0x70-0x73)
+def _random_dsl(rng, depth=0):
+    names = "abcde"
+
+    def expr(level=0):
+        kind = rng.randrange(8 if level < 2 else 3)
+        if kind == 0:
+            return str(rng.randrange(256))
+        if kind in (1, 2):
+            return rng.choice(names)
+        if kind == 3:
+            return f"peek(0x{0x74 + rng.randrange(4):02x})"
+        if kind == 4:
+            return f"({expr(level + 1)} {rng.choice(['+', '-', '&', '|', '^'])} {expr(level + 1)})"
+        if kind == 5:
+            return f"({expr(level + 1)} {rng.choice(['<<', '>>'])} {rng.randrange(8)})"
+        if kind == 6:
+            return f"({expr(level + 1)} * {rng.randrange(1, 12)})"
+        return f"{rng.choice(['rol', 'ror', 'asr'])}({expr(level + 1)}, {rng.randrange(1, 4)})"
+
+    lines = []
+    for _ in range(rng.randrange(1, 5)):
+        kind = rng.randrange(7 if depth < 2 else 4)
+        if kind == 0:
+            lines.append(f"{rng.choice(names)} = {expr()}")
+        elif kind == 1:
+            lines.append(f"{rng.choice(names)} {rng.choice(['+', '-', '^', '|'])}= {expr()}")
+        elif kind == 2:
+            lines.append(f"out({expr()})")
+        elif kind == 3:
+            lines.append(f"poke(0x{0x74 + rng.randrange(4):02x}, {expr()})")
+        elif kind in (4, 5):
+            compare = rng.choice(["==", "!=", "<", "<=", ">", ">="])
+            lines.append(f"if {expr()} {compare} {expr()}:")
+            lines += ["    " + line for line in _random_dsl(rng, depth + 1)]
+            if kind == 5:
+                lines.append("else:")
+                lines += ["    " + line for line in _random_dsl(rng, depth + 1)]
+        else:
+            counter = f"n{depth}"
+            lines.append(f"{counter} = {rng.randrange(1, 5)}")
+            lines.append(f"while {counter} != 0:")
+            lines += ["    " + line for line in _random_dsl(rng, depth + 1)]
+            lines.append(f"    {counter} -= 1")
+    return lines
+
+#Compiled code on the model, starting from reg RAM holding fill (run_compiled with no reset
+#values assumed)
+def _run_dsl(code, fill):
+    from dsl_compiler import OUT_PORT
+    from minibyte_asm import assemble
+    from minibyte_model import MinibyteModel
+
+    program = assemble(code)
+    model   = MinibyteModel(bytearray(program.memory), onboard_ram=True)
+    model.reg_ram[:] = bytes([fill]) * len(model.reg_ram)
+    outputs = []
+    while model.cycles < 200000 and model.pc != program.labels["done"]:
+        addr, we, drive, data = model.bus()
+        if drive and addr == OUT_PORT:
+            outputs.append(data)
+            latched = model.memory[OUT_PORT]
+            model.cycle()
+            model.memory[OUT_PORT] = latched
+        else:
+            model.cycle()
+    assert model.pc == program.labels["done"]
+    return outputs, program
+
+def test_dsl_compile_matches_interpret():
+    import random
+
+    from dsl_compiler import CompileError, Compiler, interpret
+    from minibyte_asm import assemble
+
+    rng      = random.Random(37)
+    compiled = 0
+    for case in range(200):
+        source = "\n".join(_random_dsl(rng)) + "\n"
+        for optimize in (True, False):
+            try:
+                code = Compiler(spill_base=0x70, optimize=optimize).compile(source)
+            except CompileError:
+                continue
+            if max(assemble(code).used) >= 0x70:
+                continue
+            outputs, program = _run_dsl(code, fill=0xa5)
+            assert outputs == interpret(source, program.memory), f"case {case}:\n{source}\n{code}"
+            compiled += 1
+    assert compiled > 250
+
+def test_dsl_peek_and_uninitialized():
+    import ast
+
+    from dsl_compiler import Compiler, interpret, read_before_write
+    from minibyte_asm import assemble
+
+    source = "if peek(0x30) == 7:\n    x = 3\nout(x)\ny += peek(0x31)\nout(y)\nz = 1\nout(z)\n"
+    assert read_before_write(ast.parse(source).body) == {"x", "y"}
+
+    #Memory the program reads is the same image for both
+    code   = Compiler().compile(source) + "        .org 0x30\n        .byte 7, 5\n"
+    memory = assemble(code).memory
+    assert interpret(source, memory) == [3, 5, 1]
+    assert _run_dsl(code, fill=0xa5)[0] == [3, 5, 1]
+    assert _run_dsl(code.replace(".byte 7, 5", ".byte 6, 5"), fill=0xa5)[0] == [0, 5, 1]
+
+
+#Soak runs (soak.py)
+#-------------------------
+def test_demo_rom_passes():
+    from minibyte_model import demo_rom_cycles, demo_rom_passes
+    from soak import DemoRomChecker, soak_model
+
+    #A pass is done on the cycle its last write is on the bus
+    for passes in range(4):
+        cycles = demo_rom_cycles(passes) if passes else 100
+        assert demo_rom_passes(cycles) == passes
+        assert demo_rom_passes(cycles - 1) == max(passes - 1, 0)
+
+    #What test_soak expects, on the model
+    cycles = 50000
+    checker = soak_model(cycles, DemoRomChecker(), log=lambda line: None)
+    assert checker.passes == demo_rom_passes(cycles)
+
+
+#Watchdog (watchdog.py)
+#-------------------------
+def test_watchdog_unbounded():
+    from watchdog import TEST_BUDGETS, UNBOUNDED, Watchdog
+
+    #A debug session: no budget Timer (it would not fit cocotb's int64 of sim steps), only the
+    #hang checks
+    watchdog = Watchdog(_Dut(), "test_debug_port", UNBOUNDED)
+    assert not watchdog.bounded
+    assert watchdog._budget_trigger() is None
+
+    assert Watchdog(_Dut(), "test_nop", TEST_BUDGETS["test_nop"]()).bounded
+
+
+#GPI profiler (gpi_profile.py)
+#-------------------------
+
+#Await trigger the way the scheduler does, blocked for seconds in between
+def _fake_await(trigger, seconds):
+    import time
+
+    awaiting = trigger.__await__()
+    next(awaiting)
+    time.sleep(seconds)
+    try:
+        awaiting.send(None)
+    except StopIteration:
+        pass
+
+def test_gpi_profile_awaits():
+    import cocotb.handle
+    import cocotb.triggers
+
+    from gpi_profile import GpiProfiler
+
+    original = cocotb.triggers.Trigger.__dict__["__await__"], cocotb.handle.ModifiableObject.__dict__["value"]
+    profiler = GpiProfiler("unused").install()
+    try:
+        _fake_await(cocotb.triggers.NullTrigger(), 0.002)
+    finally:
+        profiler.uninstall()
+    assert (cocotb.triggers.Trigger.__dict__["__await__"], cocotb.handle.ModifiableObject.__dict__["value"]) == original
+
+    #Keyed on the test source line that awaited, timed while blocked
+    [(stack, kind)] = list(profiler.stats["<no test>"])
+    count, ns       = profiler.stats["<no test>"][(stack, kind)]
+    assert kind == "await NullTrigger" and count == 1 and ns >= 2000000
+    assert stack[-2].startswith("test_gpi_profile_awaits:") and stack[-1].startswith("_fake_await:")
+
+def test_gpi_profile_reports(tmp_path, capsys):
+    from gpi_profile import GpiProfiler, folded, main
+
+    #A ClockCycles of 10 cycles, 10 ms blocked of which 8 ms in its RisingEdge wakeups
+    stack = ("test_x:10", "helper:20")
+    stats = {(stack, "await ClockCycles"): [1, 10000000], (stack, "ClockCycles wakeup"): [10, 8000000],
+             (stack, "ClockCycles cycles"): [10, 0], (stack, "read uo_out"): [100, 500000]}
+    lines = folded("test_x", stats).split()
+    assert "test_x;test_x:10;helper:20;await_ClockCycles" in lines and lines[lines.index("test_x;test_x:10;helper:20;await_ClockCycles") + 1] == "2000"
+    assert "test_x;test_x:10;helper:20;await_ClockCycles;RisingEdge_wakeup" in lines
+
+    #The command line merges the per test json
+    for test in ("test_x", "test_y"):
+        profiler = GpiProfiler(str(tmp_path))
+        profiler.stats[test], profiler.started[test] = dict(stats), 0
+        profiler.write(test)
+    assert main([str(tmp_path)]) == 0
+    out = capsys.readouterr().out
+    assert out.startswith("2 tests:")
+    assert "ClockCycles cycles" in out and "        20" in out
+    assert "test_y:helper:20" in out
+
+
+#Fuzzing (fuzz.py)
+#-------------------------
+def test_fuzz_check_blames_cases(tmp_path):
+    import asyncio
+
+    from fuzz import FuzzCampaign, Generator, compile_batch, signature
+
+    campaign  = FuzzCampaign(str(tmp_path), seed=1, log=lambda line: None)
+    cases     = [Generator(campaign.rng).case() for _ in range(6)]
+    _, starts = compile_batch(cases, campaign.cycles)
+
+    #Case 2 fails 40 cycles in, then (replaying cases 3-5) case 4 at the same cycle, then no more
+    failures = [starts[2] + 40, starts[4] - starts[3] + 40]
+    replays  = []
+
+    async def replay(vectors):
+        replays.append(len(vectors))
+        return (failures.pop(0), "mismatch") if failures else None
+
+    mismatches = asyncio.run(campaign.check(cases, replay))
+    assert [m.case for m in mismatches] == [cases[2], cases[4]]
+    assert [m.cycle for m in mismatches] == [40, 40]
+    assert [m.signature for m in mismatches] == [signature(cases[2], 40), signature(cases[4], 40)]
+    assert len(replays) == 3 and campaign.programs == len(cases)
+
+    #One crash file per signature, repeats are only counted
+    assert sum(campaign.crashes.values()) == 2
+    assert sorted(campaign.crashes) == sorted({m.signature for m in mismatches})
+    for name in campaign.crashes:
+        assert (tmp_path / "crashes" / f"{name}.bin").exists()
+        assert (tmp_path / "crashes" / f"{name}.txt").exists()
+
+
+#Trace equivalence (trace_equiv.py)
+#-------------------------
+def test_trace_stimulus_keeps_program():
+    from soak import DemoRomChecker
+    from trace_equiv import build_stimulus
+
+    #Debug samples all along, and the demo ROM still does its passes undisturbed
+    vectors = build_stimulus(cycles=12000)
+    samples = [v for v in vectors if v.ui_in & 0x07]
+    assert len(samples) > 12000 // 16 - 20
+    assert {v.ui_in & 0x07 for v in samples} == set(range(1, 8))
+
+    checker = DemoRomChecker()
+    for cycle, v in enumerate(vectors):
+        if v.uio_oe == 0xff:
+            checker.write(cycle, v.uo_out & 0x7f, v.uio_out)
+    assert checker.passes >= 1
+
+
+#Simulation build cache (sim_cache.py)
+#-------------------------
+def test_sim_cache_key(tmp_path):
+    from sim_cache import build_key
+
+    #Keyed on contents, not paths
+    for name in ("a", "b"):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "cpu.v").write_text("module cpu; endmodule\n")
+        (tmp_path / name / "defs.vh").write_text("`define X 1\n")
+
+    def key(name, args="-g2012", version="Icarus 12"):
+        root = tmp_path / name
+        return build_key("icarus", "tb", f"{args} -I{root}", [str(root / "cpu.v")], version)
+
+    assert key("a") == key("b")
+    assert key("a", version="Icarus 11") != key("b")
+    assert key("a", args="-g2005") != key("b")
+
+    #Included files count too
+    (tmp_path / "b" / "defs.vh").write_text("`define X 2\n")
+    assert key("a") != key("b")
+    (tmp_path / "b" / "defs.vh").write_text("`define X 1\n")
+    (tmp_path / "b" / "cpu.v").write_text("module cpu; wire w; endmodule\n")
+    assert key("a") != key("b")
+
+def test_sim_cache_fetch_store(tmp_path):
+    import os
+    import time
+
+    from sim_cache import entries, fetch, prune, store
+
+    cache, build, other = str(tmp_path / "cache"), tmp_path / "build", tmp_path / "other"
+    build.mkdir()
+    (build / "sim.vvp").write_text("vvp one")
+    (build / "cmds.f").write_text("+timescale")
+
+    assert "not cached" in fetch(cache, str(other), "k1")
+    assert "stored" in store(cache, str(build), "k1")
+    assert "already cached" in store(cache, str(build), "k1")
+
+    #Another build directory picks it up, then sees it as up to date
+    assert "from" in fetch(cache, str(other), "k1")
+    assert (other / "sim.vvp").read_text() == "vvp one"
+    assert "up to date" in fetch(cache, str(other), "k1")
+
+    #A key that is not cached takes the stale build away, so make compiles
+    assert "not cached" in fetch(cache, str(other), "k2")
+    assert not (other / "sim.vvp").exists()
+
+    #Most recently used first, pruning keeps those
+    (build / "sim.vvp").write_text("vvp two")
+    store(cache, str(build), "k2")
+    os.utime(os.path.join(cache, "k1"), (time.time() - 100, time.time() - 100))
+    assert [key for key, _, _ in entries(cache)] == ["k2", "k1"]
+    assert prune(cache, 1) == ["k1"]
+    assert [key for key, _, _ in entries(cache)] == ["k2"]
+
+
+#WCET analysis (wcet.py)
+#-------------------------
+
+#Main's (bcet, wcet) up to "jmp done" of a benchmark source
+def _wcet_done(source, ui_in):
+    from minibyte_asm import assemble
+    from wcet import HALT, Analysis, source_bounds
+
+    program  = assemble(source)
+    analysis = Analysis(program.memory, source_bounds(source, program),
+                        onboard_ram=bool(ui_in & TM_ONBOARD_RAM), demo_rom=bool(ui_in & TM_DEMO_ROM))
+    [done]   = [t for t in analysis.timings(program.labels) if t.routine == "main" and t.end == f"{HALT} done"]
+    return done.bcet, done.wcet
+
+def test_wcet_benchmarks():
+    from benchmarks import BENCHMARKS, run_model
+
+    for bench in BENCHMARKS:
+        bcet, wcet = _wcet_done(bench.source, bench.ui_in)
+        assert bcet <= run_model(bench).cycles <= wcet, bench.name
+
+def test_wcet_multiply_every_input():
+    from benchmarks import BENCHMARKS, Benchmark, run_model
+
+    #Every multiplier is inside the bounds of its own image, and inside the kernel's bounds,
+    #which are met (y = 0 and y = 0xff)
+    bench  = [bench for bench in BENCHMARKS if bench.name == "multiply"][0]
+    cycles = []
+    for y in range(256):
+        source     = bench.source.replace("y:      .byte 11", f"y:      .byte {y}")
+        bcet, wcet = _wcet_done(source, bench.ui_in)
+        cycles.append(run_model(Benchmark(bench.name, source, bench.ui_in, bench.expected)).cycles)
+        assert bcet <= cycles[-1] <= wcet, f"y={y}"
+    assert (min(cycles), max(cycles)) == _wcet_done(bench.source, bench.ui_in)
+
+def test_wcet_demo_rom():
+    from minibyte_model import MinibyteModel
+    from wcet import DEMO_ROM_BOUNDS, FOREVER, analyze
+
+    #One pass of the endless main loop, from reset to the fetch at 0x00 that starts the next
+    [main]  = analyze(b"", DEMO_ROM_BOUNDS, demo_rom=True, onboard_ram=True)
+    model   = MinibyteModel(demo_rom=True, onboard_ram=True)
+    fetches = []
+    while len(fetches) < 2:
+        if model.state == S_FETCH_0 and model.pc == 0:
+            fetches.append(model.cycles)
+        model.cycle()
+    assert main.end == f"{FOREVER} 0x00"
+    assert main.bcet == main.wcet == fetches[1]
+
+
+#Lane model (lane_model.py)
+#-------------------------
+def test_lane_model_random_programs(capsys):
+    from lane_model import main
+
+    #Fuzzer programs, a sample of the lanes also run on MinibyteModel
+    assert main(["--lanes", "256", "--cycles", "1500", "--sample", "64", "--seed", "47"]) == 0
+    assert "64 of 64 lanes match" in capsys.readouterr().out
+
+def test_lane_model_grid():
+    from benchmarks import BENCHMARKS
+    from lane_model import compare, grid
+    from minibyte_asm import assemble
+
+    #Every kernel image x A x CCR, each lane against its own MinibyteModel
+    images = [assemble(bench.source).memory for bench in BENCHMARKS]
+    lanes  = grid(images, a=range(0, 256, 51), ccr=range(4), onboard_ram=True)
+    models = [lanes.model(lane) for lane in range(len(lanes.a))]
+    lanes.run(3000)
+    for model in models:
+        model.run(3000)
+    assert compare(lanes, range(len(models)), models) == []
+    assert len({int(cycles) for cycles in lanes.cycles}) > 1
+
+def test_lane_model_demo_rom():
+    import numpy as np
+
+    from lane_model import LaneModel, compare
+
+    #Internal memories, one lane with the reg RAM on and one without
+    lanes  = LaneModel(2, np.zeros((2, 128), dtype=np.uint8), demo_rom=True, onboard_ram=[True, False])
+    models = [lanes.model(lane) for lane in range(2)]
+    lanes.run(8000)
+    for model in models:
+        model.run(8000)
+    assert compare(lanes, range(2), models) == []
+    assert bytes(lanes.reg_ram[0].tobytes()) != bytes(8)
+
+
+#Board link (board_link.py)
+#-------------------------
+def test_board_link_loadtest(capsys):
+    from board_link import main
+
+    #Every program on the pty board emulator (its own process), checked against the model
+    assert main(["loadtest", "--runs", "40"]) == 0
+    assert "every run matches the model" in capsys.readouterr().out
+
+def test_board_link_window():
+    from board_link import HELLO, BoardLink, load_test, run_board, start_emulator
+    from minibyte_asm import assemble
+    from peripherals import standard_bus
+
+    #In process emulator with a turnaround per write, one frame in flight at a time
+    emulator, thread, path = start_emulator(latency=0.0005)
+    link = BoardLink.open(path, window=1)
+    try:
+        assert link.hello()[1] == 128
+
+        bus, latch, _, uart, _ = standard_bus(assemble(HELLO).memory)
+        run_board(link, bus, 1500)
+        assert uart.text() == "HELLO" and len(latch.history) == 1
+
+        runs, cycles, failures = load_test(link, 7, log=lambda line: None)
+        assert failures == [] and cycles > 5000
+    finally:
+        link.close()
+        emulator.stop()
+        thread.join(5)
@@ -0,0 +1,253 @@
+# SPDX-FileCopyrightText: © 2024 Zachary Frazee
+# SPDX-License-Identifier: Apache-2.0
+
+#Toggle activity collection for switching power estimation
+#
+#Every net under the design gets a value change callback (cocotb Edge trigger), so nets that
+#do not move cost nothing. For every bit of every net the time spent at 0, 1 and X and the
+#number of transitions are accumulated, which is exactly what a SAIF file holds:
+#   - write_saif() writes a backward SAIF (2.0) for power tools (SDC/OpenSTA style hierarchy)
+#   - summary() groups the nets by block (ALU, CU, reg_ram_8B, demo_rom_64B, ...)
+#
+#Enabled in the tests with TOGGLE_ACTIVITY=<dir>, one <test>.saif per test.
+
+#Includes
+#-------------------------
+import time
+
+#Constants
+#-------------------------
+
+#Hierarchy divider of the net paths (cocotb handle paths, "tb.user_project.cpu.alu"), the SAIF
+#header declares the same one
+SAIF_DIVIDER = "."
+
+#Blocks
+#-------------------------
+
+#Instance path prefix => block name for the summary (longest prefix wins)
+BLOCKS = [
+    ("tb.user_project.cpu.alu",     "ALU"),
+    ("tb.user_project.cpu.cu",      "CU"),
+    ("tb.user_project.cpu.reg_",    "registers"),
+    ("tb.user_project.cpu",         "cpu datapath"),
+    ("tb.user_project.ram",         "reg_ram_8B"),
+    ("tb.user_project.rom",         "demo_rom_64B"),
+    ("tb.user_project",             "top"),
+    ("tb",                          "tb"),
+]
+
+def block_of(path):
+    best = None
+    for prefix, name in BLOCKS:
+        if (path == prefix or path.startswith(prefix)) and (best is None or len(prefix) > len(best[0])):
+            best = (prefix, name)
+    return best[1] if best else "other"
+
+
+#Counting
+#-------------------------
+
+#Per bit time at 0/1/X and toggle counts of one net
+class NetActivity:
+    def __init__(self, path, width, value, now):
+        self.path  = path
+        self.width = width
+        self.value = value.rjust(width, "x")[-width:]
+        self.since = now
+        self.t0    = [0] * width
+        self.t1    = [0] * width
+        self.tx    = [0] * width
+        self.tc    = [0] * width
+
+    #Charge the time since the last change to the old value of every bit
+    def _charge(self, now):
+        elapsed = now - self.since
+        if elapsed:
+            for i, bit in enumerate(reversed(self.value)):
+                if bit == "0":
+                    self.t0[i] += elapsed
+                elif bit == "1":
+                    self.t1[i] += elapsed
+                else:
+                    self.tx[i] += elapsed
+        self.since = now
+
+    #value is a binary string, MSB first (X/Z allowed)
+    def change(self, now, value):
+        value = value.rjust(self.width, "x")[-self.width:]
+        self._charge(now)
+
+        #Only 0<->1 transitions count as toggles (SAIF TC)
+        old = self.value
+        for i in range(self.width):
+            a = old[self.width - 1 - i]
+            b = value[self.width - 1 - i]
+            if a != b and a in "01" and b in "01":
+                self.tc[i] += 1
+        self.value = value
+
+    def finish(self, now):
+        self._charge(now)
+
+    @property
+    def toggles(self):
+        return sum(self.tc)
+
+class ToggleCounter:
+    def __init__(self, start=0):
+        self.nets  = []
+        self.start = start
+        self.end   = start
+
+    def add_net(self, path, width, value="", now=0):
+        net = NetActivity(path, width, value, now)
+        self.nets.append(net)
+        return net
+
+    def finish(self, now):
+        for net in self.nets:
+            net.finish(now)
+        self.end = now
+
+    #SAIF
+    #-------------------------
+
+    #timescale - (number, unit) of one time step, e.g. (1, "ps")
+    def write_saif(self, path, design="tb", timescale=(1, "ps")):
+        #Build the instance tree from the net paths
+        tree = {"nets": [], "children": {}}
+        for net in self.nets:
+            parts = net.path.split(SAIF_DIVIDER)
+            node  = tree
+            for part in parts[:-1]:
+                node = node["children"].setdefault(part, {"nets": [], "children": {}})
+            node["nets"].append((parts[-1], net))
+
+        with open(path, "w") as f:
+            f.write("(SAIFILE\n")
+            f.write("(SAIFVERSION \"2.0\")\n")
+            f.write("(DIRECTION \"backward\")\n")
+            f.write(f"(DESIGN \"{design}\")\n")
+            f.write(f"(DATE \"{time.strftime('%a %b %d %H:%M:%S %Y')}\")\n")
+            f.write("(VENDOR \"minibyte\")\n")
+            f.write("(PROGRAM_NAME \"toggle_activity.py\")\n")
+            f.write("(VERSION \"1.0\")\n")
+            f.write(f"(DIVIDER {SAIF_DIVIDER} )\n")
+            f.write(f"(TIMESCALE {timescale[0]} {timescale[1]})\n")
+            f.write(f"(DURATION {self.end - self.start})\n")
+            for name, node in tree["children"].items():
+                self._write_instance(f, name, node, 0)
+            f.write(")\n")
+
+    def _write_instance(self, f, name, node, depth):
+        pad = "  " * depth
+        f.write(f"{pad}(INSTANCE {name}\n")
+        if node["nets"]:
+            f.write(f"{pad}  (NET\n")
+            for net_name, net in node["nets"]:
+                for i in range(net.width):
+                    bit = f"{net_name}\\[{i}\\]" if net.width > 1 else net_name
+                    f.write(f"{pad}    ({bit} (T0 {net.t0[i]}) (T1 {net.t1[i]}) (TX {net.tx[i]}) (TC {net.tc[i]}))\n")
+            f.write(f"{pad}  )\n")
+        for child, child_node in node["children"].items():
+            self._write_instance(f, child, child_node, depth + 1)
+        f.write(f"{pad})\n")
+
+    #Summary
+    #-------------------------
+
+    #[(block, bits, toggles, toggles per bit per cycle)] sorted hottest first
+    def summary(self, cycles=None):
+        blocks = {}
+        for net in self.nets:
+            name = block_of(net.path)
+            bits, toggles = blocks.get(name, (0, 0))
+            blocks[name] = (bits + net.width, toggles + net.toggles)
+
+        rows = []
+        for name, (bits, toggles) in blocks.items():
+            rate = toggles / bits / cycles if cycles else None
+            rows.append((name, bits, toggles, rate))
+        return sorted(rows, key=lambda row: row[2], reverse=True)
+
+    def format_summary(self, cycles=None, top=10):
+        lines = [f"{'block':<14}{'bits':>6}{'toggles':>12}{'per bit/cycle':>16}"]
+        for name, bits, toggles, rate in self.summary(cycles):
+            lines.append(f"{name:<14}{bits:>6}{toggles:>12}{'' if rate is None else f'{rate:.4f}':>16}")
+
+        #Hottest nets, handy to see what is driving a block
+        lines.append("hottest nets:")
+        for net in sorted(self.nets, key=lambda net: net.toggles, reverse=True)[:top]:
+            lines.append(f"  {net.path:<48}{net.toggles:>12}")
+        return "\n".join(lines)
+
+
+#cocotb
+#-------------------------
+
+#All logic signals below handle (depth first), skipping parameters, integers and reals
+def _signals(handle):
+    from cocotb.handle import ModifiableObject, RegionObject
+
+    for child in handle:
+        if isinstance(child, RegionObject):
+            yield from _signals(child)
+        elif type(child) is ModifiableObject:
+            yield child
+
+def _binstr(handle):
+    return handle.value.binstr
+
+class ToggleMonitor:
+    #dut   - cocotb handle of tb
+    #clock - net counted as the cycle reference for the summary
+    def __init__(self, dut, clock=None):
+        self.dut     = dut
+        self.clock   = clock if clock is not None else dut.clk
+        self.counter = None
+        self._clock  = None
+        self._tasks  = []
+
+    def start(self):
+        import cocotb
+        from cocotb.utils import get_sim_time
+
+        now          = get_sim_time("step")
+        self.counter = ToggleCounter(now)
+        for handle in _signals(self.dut):
+            net = self.counter.add_net(handle._path, len(handle), _binstr(handle), now)
+            self._tasks.append(cocotb.start_soon(self._watch(handle, net)))
+            if handle._path == self.clock._path:
+                self._clock = net
+        return self
+
+    async def _watch(self, handle, net):
+        from cocotb.triggers import Edge
+        from cocotb.utils import get_sim_time
+
+        edge = Edge(handle)
+        while True:
+            await edge
+            net.change(get_sim_time("step"), _binstr(handle))
+
+    #Stop counting, write the SAIF (if path is given) and return the summary text
+    def stop(self, path=None):
+        from cocotb.utils import get_sim_time
+        import cocotb.simulator
+
+        for task in self._tasks:
+            task.kill()
+        self._tasks = []
+        self.counter.finish(get_sim_time("step"))
+
+        if path is not None:
+            #Simulator precision is a power of 10 in seconds (e.g. -12 => 1 ps, -11 => 10 ps)
+            precision = cocotb.simulator.get_precision()
+            base      = precision - precision % 3
+            unit      = {-15: "fs", -12: "ps", -9: "ns", -6: "us", -3: "ms", 0: "s"}[base]
+            self.counter.write_saif(path, timescale=(10 ** (precision - base), unit))
+
+        #Two clock toggles per cycle
+        cycles = self._clock.tc[0] // 2 if self._clock is not None else None
+        return self.counter.format_summary(cycles)
@@ -0,0 +1,265 @@
+# SPDX-FileCopyrightText: © 2024 Zachary Frazee
+# SPDX-License-Identifier: Apache-2.0
+
+#RTL vs gate level trace equivalence
+#
+#Gate level runs only re-run the pass/fail asserts. This records what the pins do every cycle
+#on the RTL and replays the very same stimulus on the netlist:
+#   - the stimulus is a vector stream (vectors.py) with the checks off. Memory answers come from
+#     the reference model, every debug_every cycles one of the debug outputs is selected for a
+#     cycle, so A, A upper, M, PC, IR, CCR and the CU state are sampled along the way. The debug
+#     mux also addresses the demo ROM and reg RAM, so samples are moved to the next cycle whose
+#     CU state latches nothing from the bus and writes nothing (fetch, decode, ...), and the
+#     program runs the same as without them
+#   - tb.v records {uo_out, uio_out, uio_oe} before every rising edge (vector_record) and
+#     writes them out per chunk, so no Python runs per cycle
+#   - the two traces are diffed with numpy: first mismatching cycle (uio_out only counts while
+#     driven, X/Z always mismatches) and the cycle shift, if any, that lines them up best
+#   - the gate level replay stops after the first chunk with a mismatch, and TRACE_CYCLES cuts
+#     the stimulus short, so reruns only go as far as the window that matters
+#
+#A trace is an .npz: stimulus (packed vector words), outputs (N x 3, 0x100 for X/Z bytes).
+#
+#   make TESTCASE=test_trace_equiv TRACE_RECORD=rtl.npz [TRACE_IMAGE=prog.s TRACE_UI_IN=0x80 TRACE_CYCLES=n]
+#   make TESTCASE=test_trace_equiv TRACE_CHECK=rtl.npz GATES=yes [TRACE_CYCLES=n]
+#   python trace_equiv.py rtl.npz rtl.gl.npz        # diff two traces
+#   python trace_equiv.py --model model.npz         # reference trace from the model, no simulator
+
+#Includes
+#-------------------------
+import os
+import sys
+from collections import namedtuple
+
+from minibyte_isa import (TM_OFF, TM_DEBUG_OUT_A, TM_DEBUG_OUT_A_UPPER, TM_DEBUG_OUT_M, TM_DEBUG_OUT_PC,
+                          TM_DEBUG_OUT_IR, TM_DEBUG_OUT_CCR, TM_DEBUG_OUT_CU_STATE, TM_HALT_CU, TM_DEMO_ROM,
+                          TM_ONBOARD_RAM)
+from minibyte_model import MinibyteModel, bus_quiet
+from vectors import CTRL_CHECK, CTRL_RST_N, VECTOR_DEPTH, Scenario, compile_scenario, pack, unpack
+
+#Constants
+#-------------------------
+CYCLES      = 20000             #Two demo ROM passes
+RESET       = 10
+DEBUG_EVERY = 16
+MAX_SHIFT   = 8
+CONTEXT     = 8
+UNKNOWN     = 0x100             #An output byte with X/Z bits
+
+DEBUG_NAMES = {TM_DEBUG_OUT_A: "A", TM_DEBUG_OUT_A_UPPER: "A upper", TM_DEBUG_OUT_M: "M", TM_DEBUG_OUT_PC: "PC",
+               TM_DEBUG_OUT_IR: "IR", TM_DEBUG_OUT_CCR: "CCR", TM_DEBUG_OUT_CU_STATE: "CU state"}
+
+#first      - first mismatching cycle (None if the traces agree)
+#mismatches - mismatching cycles, compared - cycles out of reset in both traces
+#shift      - cycles the second trace lags the first by at best, with its mismatch count
+TraceDiff = namedtuple("TraceDiff", ["first", "mismatches", "compared", "shift", "shift_mismatches"])
+
+
+#Stimulus
+#-------------------------
+
+#CU state of every cycle out of reset, with no debug outputs selected
+def _states(memory, ui_in, cycles):
+    model = MinibyteModel(bytearray(bytes(memory)[:128].ljust(128, b"\0")), bool(ui_in & TM_DEMO_ROM), bool(ui_in & TM_ONBOARD_RAM))
+    model.halt = bool(ui_in & TM_HALT_CU)
+    states = []
+    for _ in range(cycles):
+        states.append(model.state)
+        model.cycle()
+    return states
+
+#Vectors with the checks off, sampling the debug outputs every debug_every cycles, each on the
+#first bus quiet cycle from there
+def build_stimulus(memory=b"", ui_in=TM_DEMO_ROM | TM_ONBOARD_RAM, cycles=CYCLES, reset=RESET, debug_every=DEBUG_EVERY):
+    changes = {}
+    if debug_every:
+        states   = _states(memory, ui_in, cycles)
+        cycle, k = debug_every, 0
+        while True:
+            while cycle < cycles - 1 and not bus_quiet(states[cycle]):
+                cycle += 1
+            if cycle >= cycles - 1:
+                break
+            changes[reset + cycle]     = ui_in | (k % 7 + 1)
+            changes[reset + cycle + 1] = ui_in
+            k    += 1
+            cycle = max(cycle + 2, (k + 1) * debug_every)
+
+    return [vector._replace(ctrl=vector.ctrl & ~CTRL_CHECK)
+            for vector in compile_scenario(Scenario(memory, ui_in, cycles, reset, changes))]
+
+#What the model expects of the same stimulus, a trace to diff against without a simulator
+def model_trace(memory=b"", ui_in=TM_DEMO_ROM | TM_ONBOARD_RAM, cycles=CYCLES, reset=RESET, debug_every=DEBUG_EVERY):
+    import numpy as np
+
+    vectors  = build_stimulus(memory, ui_in, cycles, reset, debug_every)
+    outputs  = np.array([(v.uo_out, v.uio_out, v.uio_oe) for v in vectors], dtype=np.uint16)
+    stimulus = np.array([pack(v) for v in vectors], dtype=np.uint64)
+    return stimulus, outputs
+
+
+#Traces
+#-------------------------
+
+#tb.v's {uo_out, uio_out, uio_oe} hex words into an N x 3 array
+def parse_outputs(lines):
+    import numpy as np
+
+    text = "".join(lines).lower()
+    if "x" not in text and "z" not in text:
+        words = np.array([int(line, 16) for line in lines], dtype=np.uint32)
+        return np.stack([(words >> 16) & 0xff, (words >> 8) & 0xff, words & 0xff], axis=1).astype(np.uint16)
+
+    outputs = np.full((len(lines), 3), UNKNOWN, dtype=np.uint16)
+    for i, line in enumerate(lines):
+        line = line.lower().rjust(6, "0")
+        for j in range(3):
+            byte = line[2 * j:2 * j + 2]
+            if "x" not in byte and "z" not in byte:
+                outputs[i, j] = int(byte, 16)
+    return outputs
+
+def save_trace(path, stimulus, outputs):
+    import numpy as np
+
+    np.savez_compressed(path, stimulus=np.asarray(stimulus, dtype=np.uint64), outputs=outputs)
+
+def load_trace(path):
+    import numpy as np
+
+    with np.load(path) as data:
+        return data["stimulus"], data["outputs"]
+
+
+#Diff
+#-------------------------
+
+#Per cycle mismatches of b against a, b shifted later by shift cycles
+def _mismatch(stimulus, a, b, shift=0):
+    import numpy as np
+
+    n = min(len(a), len(b) - shift) if shift >= 0 else min(len(a) + shift, len(b))
+    if n <= 0:
+        return np.zeros(0, dtype=bool), np.zeros(0, dtype=bool)
+    a0 = max(0, -shift)
+    b0 = max(0, shift)
+    a  = a[a0:a0 + n]
+    b  = b[b0:b0 + n]
+
+    rst_n  = ((stimulus >> np.uint64(56)) & np.uint64(1)).astype(bool)
+    valid  = rst_n[a0:a0 + n] & rst_n[b0:b0 + n]
+    differ = (a[:, 0] != b[:, 0]) | (a[:, 2] != b[:, 2]) | ((a[:, 2] != 0) & (a[:, 1] != b[:, 1]))
+    differ |= (b == UNKNOWN).any(axis=1)
+    return differ & valid, valid
+
+def diff_traces(stimulus, a, b, max_shift=MAX_SHIFT):
+    import numpy as np
+
+    differ, valid = _mismatch(stimulus, a, b)
+    cycles = np.flatnonzero(differ)
+    first  = int(cycles[0]) if len(cycles) else None
+
+    #Only worth looking for a skew when the traces disagree
+    shift, shift_mismatches = 0, len(cycles)
+    if first is not None:
+        for s in range(-max_shift, max_shift + 1):
+            count = int(_mismatch(stimulus, a, b, s)[0].sum())
+            if count < shift_mismatches:
+                shift, shift_mismatches = s, count
+
+    return TraceDiff(first, len(cycles), int(valid.sum()), shift, shift_mismatches)
+
+def _pins(row):
+    return " ".join("xx" if value == UNKNOWN else f"{value:02x}" for value in row)
+
+def format_diff(diff, stimulus, a, b, context=CONTEXT, names=("rtl", "gl")):
+    if diff.first is None:
+        return f"traces match over {diff.compared} cycles"
+
+    lines = [f"first mismatch at cycle {diff.first}, {diff.mismatches} of {diff.compared} cycles differ"]
+    if diff.shift:
+        lines.append(f"{names[1]} shifted by {diff.shift} cycles leaves {diff.shift_mismatches} mismatches")
+    lines.append(f"rerun with TRACE_CYCLES={diff.first + context + 1} to stop right after it")
+    lines.append("")
+    lines.append(f"{'cycle':>7}  rst ui uio  {names[0] + ' uo uio oe':<16}{names[1] + ' uo uio oe':<16}debug out")
+
+    for cycle in range(max(0, diff.first - context), min(len(a), len(b), diff.first + context + 1)):
+        vector = unpack(int(stimulus[cycle]))
+        mark   = ">" if cycle == diff.first else " "
+        debug  = DEBUG_NAMES.get(vector.ui_in & 0x07, "")
+        lines.append(f"{mark}{cycle:>6}  {vector.ctrl & CTRL_RST_N:>3} {vector.ui_in:02x} {vector.uio_in:02x}   "
+                     f"{_pins(a[cycle]):<16}{_pins(b[cycle]):<16}{debug}")
+    return "\n".join(lines)
+
+#Cycles a check run of the trace at path replays (TRACE_CYCLES cuts it short)
+def trace_cycles(path=None):
+    cycles = os.environ.get("TRACE_CYCLES")
+    if path and os.path.exists(path):
+        length = len(load_trace(path)[0])
+        return min(length, int(cycles)) if cycles else length
+    return int(cycles) if cycles else RESET + CYCLES
+
+
+#cocotb
+#-------------------------
+
+#Replay the stimulus chunk by chunk and record the outputs. With a reference, stop after the
+#first chunk that does not match it. Returns the outputs recorded
+async def record_trace(dut, stimulus, reference=None):
+    import numpy as np
+
+    from vectors import record_vectors
+
+    vectors = [unpack(int(word)) for word in stimulus]
+    outputs = []
+    for base in range(0, len(vectors), VECTOR_DEPTH):
+        chunk = parse_outputs(await record_vectors(dut, vectors[base:base + VECTOR_DEPTH]))
+        outputs.append(chunk)
+
+        if reference is not None:
+            end = base + len(chunk)
+            if _mismatch(np.asarray(stimulus[base:end], dtype=np.uint64), reference[base:end], chunk)[0].any():
+                dut._log.info(f"mismatch in cycles {base}..{end - 1}, stopping the replay")
+                break
+
+    return np.concatenate(outputs) if outputs else np.zeros((0, 3), dtype=np.uint16)
+
+
+#Command line
+#-------------------------
+def main(argv):
+    import argparse
+
+    from soak import load_image
+
+    parser = argparse.ArgumentParser(description="Diff two pin traces, or write the model's trace of a stimulus")
+    parser.add_argument("traces",        nargs="*", help="reference trace and the trace to check against it")
+    parser.add_argument("--model",       help="write the reference model's trace here instead")
+    parser.add_argument("--image",       help="memory image (.s, .hex or binary), the demo ROM if not given")
+    parser.add_argument("--ui-in",       type=lambda text: int(text, 0), default=None)
+    parser.add_argument("--cycles",      type=int, default=CYCLES)
+    parser.add_argument("--debug-every", type=int, default=DEBUG_EVERY)
+    parser.add_argument("--max-shift",   type=int, default=MAX_SHIFT)
+    parser.add_argument("--context",     type=int, default=CONTEXT)
+    args = parser.parse_args(argv)
+
+    if args.model:
+        memory = load_image(args.image) if args.image else b""
+        ui_in  = args.ui_in if args.ui_in is not None else (TM_OFF if args.image else TM_DEMO_ROM | TM_ONBOARD_RAM)
+        stimulus, outputs = model_trace(memory, ui_in, args.cycles, RESET, args.debug_every)
+        save_trace(args.model, stimulus, outputs)
+        print(f"{args.model}: {len(outputs)} cycles")
+        return 0
+
+    if len(args.traces) != 2:
+        parser.error("need a reference trace and a trace to check")
+
+    stimulus, a = load_trace(args.traces[0])
+    _, b        = load_trace(args.traces[1])
+    diff        = diff_traces(stimulus, a, b, args.max_shift)
+    print(format_diff(diff, stimulus, a, b, args.context,
+                      tuple(os.path.splitext(os.path.basename(path))[0] for path in args.traces)))
+    return 0 if diff.first is None else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,448 @@
+# SPDX-FileCopyrightText: © 2024 Zachary Frazee
+# SPDX-License-Identifier: Apache-2.0
+
+#Lazy, indexed reader for the tb.vcd files the tests dump
+#
+#Long runs produce VCDs that are far too big to load whole. The first time a file is opened
+#it is scanned once and a sparse index is written next to it (<vcd>.idx.json):
+#   - every ~8 MiB a checkpoint of (time, byte offset, value of every signal) is stored
+#   - the index is reused as long as the size/mtime of the VCD have not changed
+#
+#A query then seeks to the nearest checkpoint at or before the start time and only parses
+#from there, only keeping the signals that were asked for.
+#
+#Times are in VCD ticks (the $timescale of the file, 1ps for tb.v) but every query also takes
+#strings with units ("1500ns", "1.5us") so times can be pasted straight from the cocotb log.
+
+#Includes
+#-------------------------
+import bisect
+import fnmatch
+import json
+import os
+import re
+import sys
+from collections import namedtuple
+
+from minibyte_isa import S_PC_INC_0, S_FETCH_0, S_FETCH_1, S_FETCH_2, S_DECODE_0, IR_NAMES
+
+#Constants
+#-------------------------
+INDEX_VERSION    = 1
+INDEX_SUFFIX     = ".idx.json"
+CHECKPOINT_BYTES = 8 << 20
+
+TIME_UNITS_FS = {
+    "fs": 1,
+    "ps": 10**3,
+    "ns": 10**6,
+    "us": 10**9,
+    "ms": 10**12,
+    "s" : 10**15,
+}
+
+#Signals used to rebuild the instruction stream (RTL dumps only)
+SIG_CLK       = "tb.clk"
+SIG_CU_STATE  = "tb.user_project.cpu.cu.curr_state"
+SIG_PC        = "tb.user_project.cpu.reg_pc.reg_out"
+SIG_DATA_IN   = "tb.user_project.data_buss_muxed_in"
+SIG_UIO_IN    = "tb.uio_in"
+SIG_UO_OUT    = "tb.uo_out"
+SIG_UIO_OUT   = "tb.uio_out"
+SIG_UIO_OE    = "tb.uio_oe"
+
+#States that can put pc + 1 on the address buss without reading an operand
+OPERAND_SKIP_STATES = (S_FETCH_0, S_FETCH_2, S_DECODE_0, S_PC_INC_0)
+
+Instruction = namedtuple("Instruction", ["time", "pc", "ir", "name", "operand", "cycles", "writes"])
+
+
+#Value Helpers
+#-------------------------
+
+#VCD value string to int, None if any bit is X/Z
+def vcd_int(value):
+    if value is None:
+        return None
+    try:
+        return int(value, 2)
+    except ValueError:
+        return None
+
+#Split one value change line into (id, value), None for anything else
+def _parse_change(line):
+    c = line[0]
+    if c in "01xXzZ":
+        return line[1:], line[0]
+    if c in "bBrR":
+        value, ident = line[1:].split()
+        return ident, value
+    return None
+
+
+#Index
+#-------------------------
+class VcdIndex:
+    #path  - VCD file
+    #chunk - bytes between checkpoints when (re)building the index
+    #cache - read/write the .idx.json sidecar
+    def __init__(self, path, chunk=CHECKPOINT_BYTES, cache=True):
+        self.path  = path
+        self.chunk = chunk
+        self.cache = cache
+
+        self.timescale_fs = TIME_UNITS_FS["ps"]
+        self.names        = {}   #Hierarchical name => (id, width)
+        self.ids          = {}   #Id => [names]
+
+        self._parse_header()
+        self._checkpoints = None
+
+    #Header
+    #-------------------------
+    def _parse_header(self):
+        scope  = []
+        tokens = []
+        with open(self.path, "r", errors="replace") as f:
+            while True:
+                line = f.readline()
+                if not line:
+                    raise ValueError(f"{self.path}: no $enddefinitions in VCD header")
+                tokens += line.split()
+
+                #Handle each complete "$command ... $end"
+                while "$end" in tokens:
+                    end     = tokens.index("$end")
+                    command = tokens[:end]
+                    tokens  = tokens[end + 1:]
+                    if not command:
+                        continue
+
+                    kind = command[0]
+                    if kind == "$scope":
+                        scope.append(command[2])
+                    elif kind == "$upscope":
+                        scope.pop()
+                    elif kind == "$var":
+                        width, ident, ref = int(command[2]), command[3], command[4]
+                        name = ".".join(scope + [ref])
+                        self.names[name] = (ident, width)
+                        self.ids.setdefault(ident, []).append(name)
+                    elif kind == "$timescale":
+                        self.timescale_fs = self._parse_timescale("".join(command[1:]))
+                    elif kind == "$enddefinitions":
+                        self._body = f.tell()
+                        return
+
+    def _parse_timescale(self, text):
+        match = re.fullmatch(r"(\d+)(fs|ps|ns|us|ms|s)", text)
+        if match is None:
+            raise ValueError(f"{self.path}: bad $timescale {text!r}")
+        return int(match.group(1)) * TIME_UNITS_FS[match.group(2)]
+
+    #Times
+    #-------------------------
+
+    #Int ticks pass through, strings may carry a unit ("1500ns", "1.5 us")
+    def ticks(self, time):
+        if isinstance(time, int):
+            return time
+        match = re.fullmatch(r"\s*([0-9.]+)\s*(fs|ps|ns|us|ms|s)?\s*", str(time))
+        if match is None:
+            raise ValueError(f"Bad time {time!r}")
+        if match.group(2) is None:
+            return int(match.group(1))
+        return round(float(match.group(1)) * TIME_UNITS_FS[match.group(2)] / self.timescale_fs)
+
+    def to_unit(self, ticks, unit="ns"):
+        return ticks * self.timescale_fs / TIME_UNITS_FS[unit]
+
+    #Signals
+    #-------------------------
+
+    #All signal names matching a glob ("*cu.curr_state", "tb.user_project.ram.*")
+    def find(self, pattern="*"):
+        return sorted(name for name in self.names if fnmatch.fnmatchcase(name, pattern))
+
+    def _ident(self, name):
+        if name in self.names:
+            return self.names[name][0]
+        matches = self.find(name)
+        if len(matches) != 1:
+            raise KeyError(f"{name!r} matches {len(matches)} signals in {self.path}")
+        return self.names[matches[0]][0]
+
+    #Checkpoints
+    #-------------------------
+    def _index_path(self):
+        return self.path + INDEX_SUFFIX
+
+    def _stamp(self):
+        stat = os.stat(self.path)
+        return {"version": INDEX_VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "chunk": self.chunk}
+
+    def checkpoints(self):
+        if self._checkpoints is None:
+            self._checkpoints = self._load_index()
+            if self._checkpoints is None:
+                self._checkpoints = self._build_index()
+                self._save_index()
+            self._times = [checkpoint[0] for checkpoint in self._checkpoints]
+        return self._checkpoints
+
+    def _load_index(self):
+        if not self.cache:
+            return None
+        try:
+            with open(self._index_path()) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if index.get("stamp") != self._stamp():
+            return None
+        return [tuple(checkpoint) for checkpoint in index["checkpoints"]]
+
+    def _save_index(self):
+        if not self.cache:
+            return
+        try:
+            with open(self._index_path(), "w") as f:
+                json.dump({"stamp": self._stamp(), "checkpoints": self._checkpoints}, f)
+        except OSError:
+            pass
+
+    #One pass over the whole file, snapshotting every value each time chunk bytes have gone by
+    #A checkpoint is taken at a timestamp line and holds the values from *before* that time
+    def _build_index(self):
+        values      = {}
+        checkpoints = [(0, self._body, {})]
+        last        = self._body
+        offset      = self._body
+
+        with open(self.path, "rb") as f:
+            f.seek(self._body)
+            for raw in f:
+                start   = offset
+                offset += len(raw)
+                line    = raw.decode("ascii", "replace").strip()
+                if not line:
+                    continue
+
+                if line[0] == "#":
+                    if start - last >= self.chunk:
+                        checkpoints.append((int(line[1:]), start, dict(values)))
+                        last = start
+                elif line[0] != "$":
+                    change = _parse_change(line)
+                    if change is not None:
+                        values[change[0]] = change[1]
+
+        return checkpoints
+
+    #Nearest checkpoint at or before time
+    def _checkpoint_before(self, time):
+        checkpoints = self.checkpoints()
+        i = max(bisect.bisect_left(self._times, time) - 1, 0)
+        return checkpoints[i]
+
+    #Scanning
+    #-------------------------
+
+    #Yields (time, {id: value}) for every timestamp in [t0, t1] that changes one of idents
+    #The first item is (None, values) with the values in effect just before t0
+    def _scan(self, idents, t0, t1):
+        idents             = set(idents)
+        time, offset, snap = self._checkpoint_before(t0)
+        values             = {ident: snap.get(ident) for ident in idents}
+        changes            = {}
+        started            = False
+
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            for raw in f:
+                line = raw.decode("ascii", "replace").strip()
+                if not line:
+                    continue
+
+                if line[0] == "#":
+                    #Close out the previous timestamp
+                    if started and changes:
+                        yield time, changes
+                    elif changes:
+                        values.update(changes)
+                    changes = {}
+
+                    time = int(line[1:])
+                    if time > t1:
+                        break
+                    if time >= t0 and not started:
+                        started = True
+                        yield None, dict(values)
+                elif line[0] != "$":
+                    change = _parse_change(line)
+                    if change is not None and change[0] in idents:
+                        changes[change[0]] = change[1]
+            else:
+                if started and changes:
+                    yield time, changes
+                elif changes:
+                    values.update(changes)
+
+        if not started:
+            yield None, dict(values)
+
+    #Queries
+    #-------------------------
+
+    #{name: int or None} at time (after every change at that time)
+    def values_at(self, names, time):
+        time   = self.ticks(time)
+        idents = {name: self._ident(name) for name in names}
+        values = {}
+        for t, changes in self._scan(idents.values(), time, time):
+            values.update(changes)
+        return {name: vcd_int(values.get(ident)) for name, ident in idents.items()}
+
+    #{name: [(time, int or None), ...]} with the value at t0 followed by every change up to t1
+    def window(self, names, t0, t1):
+        t0, t1  = self.ticks(t0), self.ticks(t1)
+        idents  = {name: self._ident(name) for name in names}
+        history = {name: [] for name in names}
+        values  = {}
+
+        for time, changes in self._scan(idents.values(), t0, t1):
+            if time is None:
+                values = changes
+                continue
+            if time == t0:
+                values.update(changes)
+                continue
+            for name, ident in idents.items():
+                if ident in changes:
+                    history[name].append((time, vcd_int(changes[ident])))
+
+        for name, ident in idents.items():
+            history[name].insert(0, (t0, vcd_int(values.get(ident))))
+        return history
+
+    #Yields (time, {name: int or None}) at every rising edge of clock in [t0, t1]
+    #The values are the ones from just before the edge, i.e. what the flops sample
+    def rising_edges(self, clock, names, t0=0, t1=None):
+        t0     = self.ticks(t0)
+        t1     = self.ticks(t1) if t1 is not None else float("inf")
+        clk    = self._ident(clock)
+        idents = {name: self._ident(name) for name in names}
+        values = {}
+
+        for time, changes in self._scan(list(idents.values()) + [clk], t0, t1):
+            if time is None:
+                values = changes
+                continue
+            if clk in changes and changes[clk] == "1" and values.get(clk) == "0":
+                yield time, {name: vcd_int(values.get(ident)) for name, ident in idents.items()}
+            values.update(changes)
+
+
+#Instruction Trace
+#-------------------------
+
+#Rebuild the executed instructions between t0 and t1 from an RTL dump
+#   - an instruction starts on the edge that leaves S_FETCH_1 (IR is latched from the data buss)
+#   - its operand is the data buss on the first later edge that reads pc + 1
+#   - it lasts until the next instruction starts
+#   - writes are edges with WE set while the CPU drives the data buss
+def instruction_trace(vcd, t0=0, t1=None):
+    index = vcd if isinstance(vcd, VcdIndex) else VcdIndex(vcd)
+
+    data  = SIG_DATA_IN if SIG_DATA_IN in index.names else SIG_UIO_IN
+    names = [SIG_CU_STATE, SIG_PC, data, SIG_UO_OUT, SIG_UIO_OUT, SIG_UIO_OE]
+    for name in names:
+        if name not in index.names:
+            raise KeyError(f"{index.path} has no {name}, instruction traces need an RTL dump")
+
+    trace   = []
+    current = None
+    cycles  = 0
+
+    for time, values in index.rising_edges(SIG_CLK, names, t0, t1):
+        state  = values[SIG_CU_STATE]
+        uo_out = values[SIG_UO_OUT]
+        cycles += 1
+
+        if state == S_FETCH_1:
+            if current is not None:
+                trace.append(current._replace(cycles=cycles - 1))
+            ir      = values[data]
+            pc      = values[SIG_PC]
+            current = Instruction(time, pc, ir, IR_NAMES.get(ir, "???"), None, 0, [])
+            cycles  = 1
+            continue
+
+        if current is None or uo_out is None:
+            continue
+
+        #Operand read
+        if (current.operand is None and current.pc is not None and state not in OPERAND_SKIP_STATES
+                and (uo_out & 0x7f) == ((current.pc + 1) & 0x7f)):
+            current = current._replace(operand=values[data])
+
+        #Write
+        if uo_out >> 7 and values[SIG_UIO_OE]:
+            current.writes.append((uo_out & 0x7f, values[SIG_UIO_OUT]))
+
+    if current is not None:
+        trace.append(current._replace(cycles=cycles))
+    return trace
+
+def format_instruction(index, instruction):
+    pc      = "--" if instruction.pc is None else f"{instruction.pc:02x}"
+    ir      = "--" if instruction.ir is None else f"{instruction.ir:02x}"
+    operand = "" if instruction.operand is None else f" 0x{instruction.operand:02x}"
+    writes  = "".join(f" [0x{addr:02x}]<=0x{data:02x}" for addr, data in instruction.writes if data is not None)
+    return (f"{index.to_unit(instruction.time):>14.3f}ns  pc={pc} ir={ir} {instruction.name:<8}{operand:<6}"
+            f" {instruction.cycles:>3} cycles{writes}")
+
+
+#Command line
+#-------------------------
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Query large VCD files through a sparse time index")
+    parser.add_argument("vcd")
+    parser.add_argument("--list",         metavar="GLOB", nargs="?", const="*", help="list signals matching a glob")
+    parser.add_argument("--signals", "-s", nargs="+", default=[],               help="signals (names or globs) to query")
+    parser.add_argument("--at",           help="print the signal values at this time")
+    parser.add_argument("--window",       nargs=2, metavar=("T0", "T1"),        help="print every change of the signals in a window")
+    parser.add_argument("--instructions", nargs=2, metavar=("T0", "T1"),        help="print the instructions executed in a window")
+    parser.add_argument("--rebuild",      action="store_true",                  help="ignore any existing index")
+    args = parser.parse_args(argv)
+
+    index = VcdIndex(args.vcd)
+    if args.rebuild and os.path.exists(index._index_path()):
+        os.remove(index._index_path())
+
+    if args.list:
+        for name in index.find(args.list):
+            print(f"{name} [{index.names[name][1]}]")
+
+    signals = [name for pattern in args.signals for name in (index.find(pattern) or [pattern])]
+
+    if args.at:
+        for name, value in index.values_at(signals, args.at).items():
+            print(f"{name} = {'x' if value is None else hex(value)}")
+
+    if args.window:
+        for name, history in index.window(signals, *args.window).items():
+            print(name)
+            for time, value in history:
+                print(f"  {index.to_unit(time):>14.3f}ns {'x' if value is None else hex(value)}")
+
+    if args.instructions:
+        for instruction in instruction_trace(index, *args.instructions):
+            print(format_instruction(index, instruction))
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
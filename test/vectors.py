@@ -0,0 +1,196 @@
+# SPDX-FileCopyrightText: © 2024 Zachary Frazee
+# SPDX-License-Identifier: Apache-2.0
+
+#Precompiled per-cycle stimulus/expected vectors, replayed by tb.v
+#
+#A deterministic scenario (memory image, ui_in settings, reset length, number of cycles) is run
+#through the reference model ahead of time and turned into one 64-bit word per cycle holding the
+#inputs to apply and the outputs to expect. tb.v loads them with $readmemh, drives the clock and
+#inputs and checks the outputs itself, so cocotb only starts the replay and waits for it to end.
+#
+#Word layout (must match tb.v):
+#   [58] check  [57] ena  [56] rst_n  [55:48] ui_in  [47:40] uio_in
+#   [39:32] uo_out  [31:24] uio_out  [23:16] uio_oe  [15:8] uo_out mask  [7:0] uio_out mask
+#
+#   python vectors.py --demo-rom --onboard-ram --cycles 20000 -o vectors.hex
+
+#Includes
+#-------------------------
+import os
+import sys
+from collections import namedtuple
+
+from minibyte_isa import TM_OFF, TM_HALT_CU, TM_DEMO_ROM, TM_ONBOARD_RAM
+from minibyte_model import MinibyteModel
+
+#Constants
+#-------------------------
+VECTOR_DEPTH   = 16384              #Must match tb.v
+VECTOR_FILE    = "vectors.hex"      #Read by tb.v from the simulator's working directory
+OUTPUT_FILE    = "vectors_out.hex"  #Written by tb.v when recording
+
+CTRL_RST_N     = 0x01
+CTRL_ENA       = 0x02
+CTRL_CHECK     = 0x04
+
+Vector   = namedtuple("Vector", ["ctrl", "ui_in", "uio_in", "uo_out", "uio_out", "uio_oe", "uo_mask", "uio_mask"])
+
+#ui_in_changes - {cycle: ui_in} to change the test bits part way through (halt, debug modes...)
+Scenario = namedtuple("Scenario", ["memory", "ui_in", "cycles", "reset_cycles", "ui_in_changes"],
+                      defaults=[TM_OFF, 1000, 10, {}])
+
+#Failure reported back from tb.v
+VectorFailure = namedtuple("VectorFailure", ["cycle", "expected", "uo_out", "uio_out", "uio_oe"])
+
+
+#Packing
+#-------------------------
+def pack(vector):
+    word = 0
+    for field in vector:
+        word = (word << 8) | (field & 0xff)
+    return word
+
+def unpack(word):
+    return Vector(*((word >> shift) & 0xff for shift in range(56, -8, -8)))
+
+def write_vectors(path, vectors):
+    with open(path, "w") as f:
+        for vector in vectors:
+            f.write(f"{pack(vector):016x}\n")
+
+def read_vectors(path):
+    with open(path) as f:
+        return [unpack(int(line, 16)) for line in f if line.strip() and not line.startswith("//")]
+
+
+#Compiler
+#-------------------------
+
+#What the pins of a CPU in this model state show (the model's debug mux is set from ui_in)
+def expected_pins(model, ui_in):
+    model.debug = ui_in & 0x07
+    addr, we, drive, data = model.bus()
+    return addr | (we << 7), data, 0xff if drive else 0x00, 0xff if drive else 0x00
+
+#Run the scenario on the reference model, one Vector per cycle
+#External memory answers every cycle with whatever is at the address on the buss. With a debug
+#output selected that is the debug value, the same address the demo ROM and reg RAM see
+def compile_scenario(scenario):
+    memory = bytearray(128)
+    memory[:len(scenario.memory)] = bytes(scenario.memory)[:128]
+    model  = MinibyteModel(memory)
+    ui_in  = scenario.ui_in
+
+    vectors = []
+    for cycle in range(scenario.reset_cycles + scenario.cycles):
+        ui_in = scenario.ui_in_changes.get(cycle, ui_in)
+        model.demo_rom    = bool(ui_in & TM_DEMO_ROM)
+        model.onboard_ram = bool(ui_in & TM_ONBOARD_RAM)
+        model.halt        = bool(ui_in & TM_HALT_CU)
+        model.debug       = ui_in & 0x07
+
+        addr   = model.bus()[0]
+        uio_in = memory[addr]
+
+        #Held in reset, outputs are not checked
+        if cycle < scenario.reset_cycles:
+            vectors.append(Vector(CTRL_ENA, ui_in, uio_in, 0, 0, 0, 0, 0))
+            continue
+
+        uo_out, uio_out, uio_oe, uio_mask = expected_pins(model, ui_in)
+        vectors.append(Vector(CTRL_RST_N | CTRL_ENA | CTRL_CHECK, ui_in, uio_in, uo_out, uio_out, uio_oe, 0xff, uio_mask))
+        model.cycle()
+
+    return vectors
+
+
+#cocotb
+#-------------------------
+
+#Replay vectors on the DUT, in VECTOR_DEPTH sized chunks (tb.v only holds that many)
+#No cocotb Clock may be running, tb.v drives clk itself. Returns a VectorFailure or None
+async def replay_vectors(dut, vectors, path=VECTOR_FILE):
+    from cocotb.triggers import RisingEdge, Timer
+
+    for base in range(0, len(vectors), VECTOR_DEPTH):
+        chunk = vectors[base:base + VECTOR_DEPTH]
+        write_vectors(path, chunk)
+
+        dut.vector_count.value = len(chunk)
+        dut.vector_start.value = 1
+        await RisingEdge(dut.vector_done)
+
+        failed = dut.vector_fail.value.integer
+        if failed:
+            index = dut.vector_fail_cycle.value.integer
+            failure = VectorFailure(
+                base + index, chunk[index],
+                dut.vector_fail_uo_out.value.integer,
+                dut.vector_fail_uio_out.value.integer,
+                dut.vector_fail_uio_oe.value.integer
+            )
+
+        dut.vector_start.value = 0
+        await Timer(1, units="ns")
+
+        if failed:
+            return failure
+
+    return None
+
+#Replay one chunk (at most VECTOR_DEPTH) and return what the outputs were every cycle, as the
+#{uo_out, uio_out, uio_oe} hex words tb.v writes. Checks still apply, leave CTRL_CHECK off to
+#record everything
+async def record_vectors(dut, chunk, path=VECTOR_FILE, output=OUTPUT_FILE):
+    from cocotb.triggers import RisingEdge, Timer
+
+    assert len(chunk) <= VECTOR_DEPTH, f"{len(chunk)} vectors, tb.v holds {VECTOR_DEPTH}"
+    write_vectors(path, chunk)
+
+    dut.vector_record.value = 1
+    dut.vector_count.value  = len(chunk)
+    dut.vector_start.value  = 1
+    await RisingEdge(dut.vector_done)
+
+    dut.vector_start.value  = 0
+    dut.vector_record.value = 0
+    await Timer(1, units="ns")
+
+    with open(output) as f:
+        return [line.strip() for line in f if line.strip() and line[0] not in "/@"]
+
+def format_failure(failure):
+    expected = failure.expected
+    return (f"cycle {failure.cycle}: uo_out=0x{failure.uo_out:02x} (expected 0x{expected.uo_out:02x} mask 0x{expected.uo_mask:02x}) "
+            f"uio_out=0x{failure.uio_out:02x} (expected 0x{expected.uio_out:02x} mask 0x{expected.uio_mask:02x}) "
+            f"uio_oe=0x{failure.uio_oe:02x} (expected 0x{expected.uio_oe:02x})")
+
+
+#Command line
+#-------------------------
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compile a scenario into tb.v replay vectors")
+    parser.add_argument("program",       nargs="?", help="raw binary memory image")
+    parser.add_argument("--cycles",      type=int, default=1000)
+    parser.add_argument("--reset",       type=int, default=10)
+    parser.add_argument("--demo-rom",    action="store_true")
+    parser.add_argument("--onboard-ram", action="store_true")
+    parser.add_argument("-o", "--output", default=VECTOR_FILE)
+    args = parser.parse_args(argv)
+
+    memory = b""
+    if args.program:
+        with open(args.program, "rb") as f:
+            memory = f.read()
+
+    ui_in   = (TM_DEMO_ROM if args.demo_rom else 0) | (TM_ONBOARD_RAM if args.onboard_ram else 0)
+    vectors = compile_scenario(Scenario(memory, ui_in, args.cycles, args.reset))
+    write_vectors(args.output, vectors)
+    print(f"{args.output}: {len(vectors)} vectors")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
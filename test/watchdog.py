@@ -0,0 +1,195 @@
+# SPDX-FileCopyrightText: © 2024 Zachary Frazee
+# SPDX-License-Identifier: Apache-2.0
+
+#Simulated time watchdogs for the cocotb tests
+#
+#start_watchdog(dut, name) runs next to a test and fails it (a failing background task aborts
+#the test in cocotb) with the last bus transactions attached when:
+#   - the test runs longer than its cycle budget, TEST_BUDGETS below, derived from the
+#     instructions the test is expected to execute (or from reference model runs). Tests whose
+#     budget comes from one of the tools work it out themselves and pass it in, so this only
+#     depends on the ISA and the model
+#   - nothing moves for IDLE_CYCLES while the CU should be running: no change of address/WE
+#     on uo_out or (with an RTL hierarchy) no change of PC, every instruction changes it at least
+#     once. A stuck CU state stops both. Reset, ena low, TM_HALT_CU and the debug outputs (uo_out
+#     is not the bus then) are not hangs
+#
+#tb.v does the counting at every rising edge (whoever drives the clock) and keeps the last bus
+#changes, so the watchdog sleeps on a single trigger for the whole test: tb.v's idle hit or the
+#end of the budget.
+#
+#Runs with no cycle bound (a debug session, time bound fuzzing) pass an UNBOUNDED budget and
+#only get the hang checks, no budget Timer.
+#
+#   WATCHDOG=0            off
+#   WATCHDOG_SCALE=<x>    multiply every budget (slow gate level debugging, ...)
+
+#Includes
+#-------------------------
+import os
+
+from minibyte_isa import (CYCLES_NOP, CYCLES_LDA_IMM, CYCLES_LDA_DIR, CYCLES_STA_DIR, CYCLES_STA_IND,
+                          CYCLES_ALU_IMM, CYCLES_ALU_DIR, CYCLES_JMP_DIR, CYCLES_JMP_IND, S_NAMES)
+from bus_ring import BusRing, read_tb_ring
+from minibyte_model import demo_rom_cycles
+
+#Constants
+#-------------------------
+CLOCK_PERIOD_NS = 10000         #The 10us Clock of test.py, tb.v replays vectors at the same rate
+IDLE_CYCLES     = 64            #Longest instruction is 11 cycles
+RING_SIZE       = 32
+RESET_CYCLES    = 12            #10 in reset + S_RESET_0 -> S_FETCH_0
+MARGIN          = 2
+SLACK           = 1000
+UNBOUNDED       = 10 ** 12
+MAX_TIMER_STEPS = 2 ** 63 - 1   #cocotb's register_timed_callback takes an int64 of sim steps
+
+#Setting A through fast_forward: halting and depositing, or executing the setup instructions
+#on gate level netlists (LDA_DIR, LDA_IMM, ADD_IMM, LDA_IMM, JMP_DIR)
+FAST_FORWARD    = CYCLES_LDA_DIR + 3 * CYCLES_ALU_IMM + CYCLES_JMP_DIR + CYCLES_STA_IND
+
+ALU_TESTS       = 22 * 200      #alu_test_suite x test_vals
+
+class WatchdogError(AssertionError):
+    pass
+
+
+#Budgets
+#-------------------------
+
+#Cycles for (count, cycles per instruction) groups and resets, with the margin
+def budget(work, resets=1):
+    return (RESET_CYCLES * resets + sum(count * cycles for count, cycles in work)) * MARGIN + SLACK
+
+def _soak_cycles():
+    return int(float(os.environ.get("SOAK_CYCLES", "0")))
+
+#test name => function returning the budget in cycles
+TEST_BUDGETS = {
+    "test_tm_debug_out_a":  lambda: budget([(4, CYCLES_LDA_IMM)]),
+    "test_nop":             lambda: budget([(7, CYCLES_NOP)]),
+    "test_lda_imm_sta_dir": lambda: budget([(4, CYCLES_LDA_IMM), (4, CYCLES_STA_DIR)]),
+    "test_lda_dir_sta_ind": lambda: budget([(4, CYCLES_LDA_DIR), (4, CYCLES_STA_IND)]),
+    "test_alu_imm_dir":     lambda: budget([(ALU_TESTS, FAST_FORWARD + CYCLES_ALU_DIR)]),
+    "test_alu_ccr":         lambda: budget([(ALU_TESTS, FAST_FORWARD + CYCLES_ALU_DIR + CYCLES_NOP)]),
+    "test_jmp_dir":         lambda: budget([(4, CYCLES_JMP_DIR)]),
+    "test_jmp_ind":         lambda: budget([(4, CYCLES_JMP_IND)]),
+    "test_bne_beq":         lambda: budget([(8, CYCLES_JMP_IND + CYCLES_NOP), (4, FAST_FORWARD)], resets=2),
+    "test_bpl_bmi":         lambda: budget([(8, CYCLES_JMP_IND + CYCLES_NOP), (4, FAST_FORWARD)], resets=2),
+    "test_demorom":         lambda: budget([(demo_rom_cycles(2), 1)]),
+    "test_debug_server":    lambda: budget([(demo_rom_cycles(1), 1)]),
+    "test_bus_trace":       lambda: budget([(demo_rom_cycles(1), 1)]),
+    "test_toggle_activity": lambda: budget([(demo_rom_cycles(1), 1)]),
+    "test_reg_ram_timing":  lambda: budget([(200, 1)]),
+    "test_vectors":         lambda: budget([(2000 + 20000, 1)], resets=2),
+    "test_soak":            lambda: budget([(_soak_cycles(), 1)]),
+    "test_peripherals":     lambda: budget([(1000 + demo_rom_cycles(1), 1)], resets=2),
+}
+
+DEFAULT_BUDGET = 1000000
+
+
+#Watchdog
+#-------------------------
+class Watchdog:
+    def __init__(self, dut, name, budget, idle_cycles=IDLE_CYCLES, period_ns=CLOCK_PERIOD_NS, ring_size=RING_SIZE):
+        self.dut         = dut
+        self.name        = name
+        self.budget      = budget
+        self.idle_cycles = idle_cycles
+        self.period_ns   = period_ns
+        self.ring        = BusRing(ring_size)
+        self.task        = None
+        self.start_cycle = 0
+        self.bounded     = budget < UNBOUNDED
+
+        #PC and CU state, when there is an RTL hierarchy to look at
+        try:
+            cpu        = dut.user_project.cpu
+            self.pc    = cpu.reg_pc.reg_out
+            self.state = cpu.cu.curr_state
+        except AttributeError:
+            self.pc    = None
+            self.state = None
+
+    def start(self):
+        import cocotb
+
+        self.task = cocotb.start_soon(self._run())
+        return self
+
+    def stop(self):
+        if self.task is not None:
+            self.task.kill()
+            self.task = None
+
+    def _now(self):
+        from cocotb.utils import get_sim_time
+
+        return int(get_sim_time("ns")) // self.period_ns
+
+    #Trigger for the end of the budget, None for unbounded budgets. Longer budgets than a Timer
+    #can take are capped (the hang checks still run)
+    def _budget_trigger(self):
+        from cocotb.triggers import Timer
+        from cocotb.utils import get_sim_steps
+
+        if not self.bounded:
+            return None
+        steps = get_sim_steps((self.budget + 1) * self.period_ns - 2, "ns", round_mode="ceil")
+        return Timer(min(steps, MAX_TIMER_STEPS), units="step")
+
+    #tb.v counts the idle cycles at every rising edge, so this only wakes up on a hang or at the
+    #end of the budget
+    async def _run(self):
+        from cocotb.triggers import First, RisingEdge, Timer
+
+        dut = self.dut
+        dut.wd_idle_limit.value = self.idle_cycles
+        dut.wd_restart.value    = 1
+        await Timer(1, units="ns")
+        dut.wd_restart.value    = 0
+        await Timer(1, units="ns")
+        self.start_cycle = dut.wd_cycle.value.integer
+
+        budget = self._budget_trigger()
+        if budget is None:
+            await RisingEdge(dut.wd_idle_hit)
+        elif await First(RisingEdge(dut.wd_idle_hit), budget) is budget:
+            self._fail(f"{self.name} ran past its budget of {self.budget} cycles")
+
+        if dut.wd_bus_idle.value.integer >= self.idle_cycles:
+            self._fail(f"{self.name} hung: no bus activity for {dut.wd_bus_idle.value.integer} cycles")
+        self._fail(f"{self.name} hung: PC stuck for {dut.wd_pc_idle.value.integer} cycles")
+
+    def _fail(self, message):
+        try:
+            read_tb_ring(self.dut, self.ring, self.start_cycle)
+        except (AttributeError, IndexError, ValueError):
+            pass
+        lines = [f"{message} (cycle {self._now()})"]
+        if self.pc is not None:
+            try:
+                state = self.state.value.integer
+                lines.append(f"PC 0x{self.pc.value.integer:02x}, CU state {S_NAMES.get(state, state)}")
+            except ValueError:
+                lines.append("PC/CU state unknown (X/Z)")
+        lines.append(f"last {min(self.ring.count, self.ring.size)} bus transactions (cycles since the watchdog started):")
+        lines.append(self.ring.format())
+        self.dut._log.error("\n".join(lines))
+        raise WatchdogError("\n".join(lines))
+
+
+#Start the watchdog of a test (budget in cycles, from TEST_BUDGETS if not given), None with WATCHDOG=0
+def start_watchdog(dut, name, budget=None, **kwargs):
+    if os.environ.get("WATCHDOG", "1") == "0":
+        return None
+
+    if budget is None:
+        budget = TEST_BUDGETS[name]() if name in TEST_BUDGETS else DEFAULT_BUDGET
+    if budget < UNBOUNDED:
+        budget = int(budget * float(os.environ.get("WATCHDOG_SCALE", "1")))
+        dut._log.info(f"Watchdog: {budget} cycles")
+    else:
+        dut._log.info("Watchdog: no cycle budget, hang checks only")
+    return Watchdog(dut, name, budget, **kwargs).start()
@@ -0,0 +1,600 @@
+# SPDX-FileCopyrightText: © 2024 Zachary Frazee
+# SPDX-License-Identifier: Apache-2.0
+
+#Static worst and best case execution time of minibyte programs
+#
+#Works on the 128 byte image alone, nothing is run:
+#   - value analysis: A, the CCR and every memory cell are sets of up to MAX_VALUES bytes (or
+#     unknown), pushed through the program until nothing changes. This is what finds the
+#     targets of JMP_IND and the IND branches (the pointer cells' values), the operands patched
+#     by self modifying code and the branches that can only go one way
+#   - calls: "lda #back / sta ret / jmp sub" (A and a cell both hold the address after the jmp)
+#     enters sub with back pushed on a call context, a JMP_IND to back returns. Every call site
+#     gets its own copy of the routine, so returns never look like loops
+#   - costs: every edge costs what its instruction takes in the CU tables (minibyte_model.py,
+#     same as control_unit.v): 6 cycles for a taken DIR branch, 8 for a taken IND branch and 5
+#     for a branch not taken (DECODE -> PC_INC -> FETCH)
+#   - loops: natural loops are collapsed inside out, each needs a bound on the passes through
+#     its header: "; bound 8" (always 8) or "; bound 1..8" on the header line of the source,
+#     or --bound label=8. A loop with no way out is an end of its own (the demo ROM's main loop)
+#   - "jmp ." ends the program, the time is counted up to its first fetch (and from the reset
+#     cycle, like benchmarks.py counts)
+#
+#Each point keeps up to MAX_STATES states apart before joining them, so counted loops are
+#followed pass by pass and their counters decide the branches. Stores through unknown pointers
+#are assumed to leave the code alone (the report lists where that was needed).
+#
+#   python wcet.py program.s [--bound loop=8] [--target 0x30=0x10,0x20] [--onboard-ram]
+#   python wcet.py --benchmarks            (bounds next to the measured model cycles)
+
+#Includes
+#-------------------------
+import re
+import sys
+from collections import namedtuple
+
+from minibyte_isa import (TM_DEMO_ROM, TM_ONBOARD_RAM, IR_NOP, IR_STA_DIR, IR_STA_IND, IR_JMP_DIR,
+                          IR_JMP_IND, S_JMP_IND_0, IR_NAMES)
+from minibyte_model import CU_BRANCH, CU_DECODE, CU_NEXT, CU_OUTPUTS, DEMO_ROM, REG_RAM_BASE, instruction_cycles, alu
+
+#Constants
+#-------------------------
+MEM_SIZE     = 128
+MAX_VALUES   = 16               #Values a cell can hold before it is unknown
+MAX_STATES   = 64               #States kept apart per node before they are joined
+MAX_DEPTH    = 8                #Nested calls
+RESET_CYCLES = 1                #S_RESET_0 before the first fetch
+
+TOP          = None             #Unknown value
+
+#Ends of a routine
+HALT         = "halt"
+RETURN       = "return"
+FOREVER      = "forever"
+_BACK        = "back"
+
+#routine - name, entry - address, end - how it ends (halt/return/forever and where)
+#wcet/bcet - cycles, calls - call sites (0 for main)
+Timing = namedtuple("Timing", ["routine", "entry", "end", "wcet", "bcet", "calls"])
+
+#header - loop header address, bound - (min, max) passes, contexts - call contexts it runs in
+Loop   = namedtuple("Loop", ["header", "bound", "contexts"])
+
+#Demo ROM loops: LOOP0 counts A up to 0 again, LOOP1 shifts a 1 up to bit 7
+DEMO_ROM_BOUNDS = {0x03: (256, 256), 0x0e: (7, 7)}
+
+_BOUND = re.compile(r"\bbound\s+(\d+)(?:\s*\.\.\s*(\d+))?", re.IGNORECASE)
+
+class AnalysisError(ValueError):
+    pass
+
+
+#Values
+#-------------------------
+def _join(a, b):
+    if a is TOP or b is TOP:
+        return TOP
+    joined = a | b
+    return joined if len(joined) <= MAX_VALUES else TOP
+
+def _union(sets):
+    result = frozenset()
+    for values in sets:
+        result = _join(result, values)
+        if result is TOP:
+            break
+    return result
+
+#(result values, ccr values) of an ALU op over every pair
+def _apply(op, a, b):
+    if a is TOP or b is TOP:
+        return TOP, TOP
+    outcomes = {alu(op, x, y) for x in a for y in b}
+    results  = frozenset(res for res, _ in outcomes)
+    return (results if len(results) <= MAX_VALUES else TOP), frozenset(flags for _, flags in outcomes)
+
+#(can be taken, can fall through)
+def _condition(ccr, mask, value):
+    if ccr is TOP:
+        return True, True
+    return any((c & mask) == value for c in ccr), any((c & mask) != value for c in ccr)
+
+#(alu op, sets the ccr) of the state that loads A, for LDA and the ALU ops
+_ALU_STEPS = {}
+
+def _alu_step(ir):
+    if ir not in _ALU_STEPS:
+        state = CU_DECODE[ir]
+        while True:
+            _, alu_op, set_a, _, _, _, _, set_ccr, _, _ = CU_OUTPUTS[state]
+            if set_a:
+                break
+            state = CU_NEXT[state]
+        _ALU_STEPS[ir] = (alu_op, set_ccr)
+    return _ALU_STEPS[ir]
+
+class _State:
+    def __init__(self, a, ccr, cells=None, wild=False):
+        self.a     = a
+        self.ccr   = ccr
+        self.cells = dict(cells or {})  #Cells written so far, the rest hold the image
+        self.wild  = wild               #Stored through an unknown pointer, unwritten cells are unknown
+
+    def copy(self):
+        return _State(self.a, self.ccr, self.cells, self.wild)
+
+    def __eq__(self, other):
+        return (self.a, self.ccr, self.wild, self.cells) == (other.a, other.ccr, other.wild, other.cells)
+
+
+#Analysis
+#-------------------------
+class Analysis:
+    #bounds  - {header address: (min, max)} passes through each loop header
+    #targets - {address: [targets]} of a JMP_IND or IND branch, instead of the value analysis
+    def __init__(self, memory, bounds=None, targets=None, demo_rom=False, onboard_ram=False):
+        self.image       = bytearray(MEM_SIZE)
+        self.image[:len(memory)] = bytes(memory)[:MEM_SIZE]
+        self.bounds      = dict(bounds or {})
+        self.targets     = {addr: frozenset(t & 0x7f for t in values) for addr, values in (targets or {}).items()}
+        self.demo_rom    = demo_rom
+        self.onboard_ram = onboard_ram
+        self.assumptions = set()        #Code read from the image after a store through an unknown pointer
+        self.loops       = {}
+        self.missing     = set()
+        self.states      = {}           #{(address, call context): [states]}
+        self.joined      = set()        #Nodes with too many states, joined into one
+        self.edges       = {}
+        self._explore()
+
+    #Memory
+    #-------------------------
+    def _reg_ram(self, addr):
+        return self.onboard_ram and addr >= REG_RAM_BASE
+
+    def _initial(self, addr):
+        if self._reg_ram(addr):
+            return frozenset([0])
+        if self.demo_rom:
+            return frozenset([DEMO_ROM[addr & 0x3f]])
+        return frozenset([self.image[addr]])
+
+    def _read(self, state, addr):
+        addr &= 0x7f
+        if addr in state.cells:
+            return state.cells[addr]
+        return TOP if state.wild and not (self.demo_rom and not self._reg_ram(addr)) else self._initial(addr)
+
+    def _load(self, state, addrs):
+        if addrs is TOP:
+            return TOP
+        return _union(self._read(state, addr) for addr in addrs)
+
+    #Code bytes, unknown ones after a wild store are taken from the image
+    def _code(self, state, addr):
+        addr   &= 0x7f
+        values  = self._read(state, addr)
+        if values is TOP and state.wild and addr not in state.cells:
+            self.assumptions.add(addr)
+            values = self._initial(addr)
+        return values
+
+    def _store(self, state, addrs, value):
+        if addrs is TOP:
+            if not self.demo_rom:
+                state.cells = {}
+                state.wild  = True
+                return
+            addrs = range(REG_RAM_BASE, MEM_SIZE) if self.onboard_ram else ()
+            strong = False
+        else:
+            addrs  = {addr & 0x7f for addr in addrs}
+            strong = len(addrs) == 1
+
+        for addr in addrs:
+            #Stores under the demo ROM only show in the reg RAM
+            if self.demo_rom and not self._reg_ram(addr):
+                continue
+            state.cells[addr] = value if strong else _join(self._read(state, addr), value)
+
+    def _join_states(self, s, t):
+        cells = {addr: _join(self._read(s, addr), self._read(t, addr)) for addr in set(s.cells) | set(t.cells)}
+        return _State(_join(s.a, t.a), _join(s.ccr, t.ccr), cells, s.wild or t.wild)
+
+    #Transfer
+    #-------------------------
+
+    #[(next node or end, cycles, state)] out of node (address, call context)
+    def _successors(self, node, state):
+        pc, context = node
+        opcodes     = self._code(state, pc)
+        if opcodes is TOP or len(opcodes) != 1:
+            raise AnalysisError(f"0x{pc:02x}: the opcode changes at run time ({self._show(opcodes)})")
+        ir    = next(iter(opcodes))
+        here  = (pc + 1) & 0x7f
+        after = (pc + 2) & 0x7f
+
+        #NOP and undefined opcodes are one byte
+        if ir not in IR_NAMES or ir == IR_NOP:
+            return [((here, context), instruction_cycles(ir), state)]
+
+        if ir in CU_BRANCH:
+            mask, value, first = CU_BRANCH[ir]
+            taken, falls       = _condition(state.ccr, mask, value)
+            found = [((after, context), instruction_cycles(ir, taken=False), state)] if falls else []
+            if taken:
+                found += self._jump(node, state, ir, first == S_JMP_IND_0)
+            return found
+        if ir in (IR_JMP_DIR, IR_JMP_IND):
+            return self._jump(node, state, ir, ir == IR_JMP_IND)
+
+        following = state.copy()
+        operand   = self._read(state, here)
+        if ir == IR_STA_DIR:
+            self._store(following, operand, state.a)
+        elif ir == IR_STA_IND:
+            self._store(following, self._load(state, operand), state.a)
+        else:
+            op, set_ccr = _alu_step(ir)
+            b           = operand if IR_NAMES[ir].endswith("_IMM") else self._load(state, operand)
+            following.a, flags = _apply(op, state.a, b)
+            if set_ccr:
+                following.ccr = flags
+        return [((after, context), instruction_cycles(ir), following)]
+
+    def _jump(self, node, state, ir, indirect):
+        pc, context = node
+        after       = (pc + 2) & 0x7f
+        cycles      = instruction_cycles(ir)
+        operand     = self._code(state, pc + 1)
+        targets     = self.targets.get(pc)
+        if targets is None:
+            targets = self._load(state, operand) if indirect else operand
+        if targets is TOP:
+            raise AnalysisError(f"0x{pc:02x}: cannot tell where {IR_NAMES[ir]} goes, give it --target")
+
+        #lda #back / sta ret / jmp sub
+        call = (ir == IR_JMP_DIR and state.a == {after}
+                and any(values == {after} for values in state.cells.values()))
+
+        found = []
+        for target in sorted({t & 0x7f for t in targets}):
+            if ir == IR_JMP_DIR and target == pc:
+                found.append(((HALT, pc), 0, state))
+            elif indirect and context and target == context[-1]:
+                found.append(((target, context[:-1]), cycles, state))
+            elif call:
+                if len(context) >= MAX_DEPTH:
+                    raise AnalysisError(f"0x{pc:02x}: calls nested more than {MAX_DEPTH} deep")
+                found.append(((target, context + (after,)), cycles, state))
+            else:
+                found.append(((target, context), cycles, state))
+        return found
+
+    #Every node keeps up to MAX_STATES states apart (a counted loop is followed pass by pass,
+    #so its counter decides the branch), past that they are joined into one.
+    #Returns the state to carry on from, None if nothing new
+    def _add(self, node, state):
+        states = self.states.setdefault(node, [])
+        if node in self.joined:
+            joined = self._join_states(states[0], state)
+            if joined == states[0]:
+                return None
+            states[0] = joined
+            return joined
+
+        if state in states:
+            return None
+        states.append(state)
+        if len(states) <= MAX_STATES:
+            return state
+
+        joined = states[0]
+        for other in states[1:]:
+            joined = self._join_states(joined, other)
+        self.states[node] = [joined]
+        self.joined.add(node)
+        return joined
+
+    def _explore(self):
+        start = (0, ())
+        work  = [(start, self._add(start, _State(frozenset([0]), frozenset([0]))))]
+        while work:
+            node, state = work.pop()
+            for target, _, following in self._successors(node, state):
+                if isinstance(target[0], str):
+                    continue
+                added = self._add(target, following)
+                if added is not None:
+                    work.append((target, added))
+
+        #States only grow, so the edges out of the final states are all of them
+        for node, states in self.states.items():
+            edges = set()
+            for state in states:
+                edges.update((target, cycles) for target, cycles, _ in self._successors(node, state))
+            self.edges[node] = sorted(edges, key=str)
+
+    def _show(self, values):
+        return "unknown" if values is TOP else ", ".join(f"0x{v:02x}" for v in sorted(values))
+
+    #Paths
+    #-------------------------
+    def _bound(self, header):
+        bound = self.bounds.get(header[0])
+        if bound is None:
+            self.missing.add(header[0])
+            bound = (1, 1)
+        loop = self.loops.get(header[0])
+        self.loops[header[0]] = Loop(header[0], bound, (loop.contexts if loop else set()) | {header[1]})
+        return bound
+
+    #Longest and shortest paths from entry out of nodes: {end: (wcet, bcet)}. An end is a node
+    #outside, a (HALT/FOREVER, address) or _BACK for the edges to back (the header of the loop
+    #nodes are the body of)
+    def _region(self, nodes, entry, back=None):
+        inside = set(nodes)
+        inner  = {node: [t for t, _ in self.edges[node] if t in inside and t != back] for node in inside}
+
+        units   = []
+        unit_of = {}
+        outputs = {}
+        for scc in reversed(_sccs([entry] + sorted(inside - {entry}), inner)):
+            if len(scc) == 1 and scc[0] not in inner[scc[0]]:
+                node = scc[0]
+                units.append(node)
+                unit_of[node] = node
+                outputs[node] = [(target, cycles, cycles) for target, cycles in self.edges[node]]
+                continue
+
+            members = set(scc)
+            headers = {node for node in scc if node == entry}
+            headers |= {t for node in inside - members for t in inner[node] if t in members}
+            if len(headers) != 1:
+                entries = ", ".join(f"0x{node[0]:02x}" for node in sorted(headers))
+                raise AnalysisError(f"loop entered at {entries} has more than one header, it cannot be bounded")
+
+            header = headers.pop()
+            body   = self._region(scc, header, back=header)
+            bw, bb = body.pop(_BACK)
+            if body:
+                low, high = self._bound(header)
+                out = [(end, (high - 1) * bw + w, (low - 1) * bb + b) for end, (w, b) in body.items()]
+            else:
+                out = [((FOREVER, header[0]), bw, bb)]
+
+            units.append(header)
+            outputs[header] = out
+            for node in scc:
+                unit_of[node] = header
+
+        arrive = {entry: (0, 0)}
+        ends   = {}
+        for unit in units:
+            if unit not in arrive:
+                continue
+            aw, ab = arrive[unit]
+            for end, w, b in outputs[unit]:
+                if end == back:
+                    end = _BACK
+                if end != _BACK and end in inside:
+                    _merge(arrive, unit_of[end], aw + w, ab + b)
+                else:
+                    _merge(ends, end, aw + w, ab + b)
+        return ends
+
+    #Results
+    #-------------------------
+
+    #Timing per routine and end, main first. labels - {name: address} for the report
+    def timings(self, labels=None):
+        #The last label at an address is the one on the instruction's line
+        names = {addr: name for name, addr in (labels or {}).items()}
+
+        def end_name(end, resume):
+            if end == resume:
+                return RETURN
+            if isinstance(end[0], str):
+                return f"{end[0]} {names.get(end[1], f'0x{end[1]:02x}')}"
+            return f"exit 0x{end[0]:02x}"
+
+        main  = self._region(sorted(self.states), (0, ()))
+        found = {}
+        for end, (w, b) in main.items():
+            found[("main", 0, end_name(end, None))] = (w + RESET_CYCLES, b + RESET_CYCLES, 0)
+
+        #Every call site's copy of a routine: the nodes under its context, back to the caller
+        calls = sorted({target for node, edges in self.edges.items() for target, _ in edges
+                        if not isinstance(target[0], str) and len(target[1]) > len(node[1])})
+        for entry in calls:
+            context = entry[1]
+            resume  = (context[-1], context[:-1])
+            nodes   = [node for node in self.states if node[1][:len(context)] == context]
+            name    = names.get(entry[0], f"sub_{entry[0]:02x}")
+            for end, (w, b) in self._region(nodes, entry).items():
+                key = (name, entry[0], end_name(end, resume))
+                if key in found:
+                    old = found[key]
+                    w, b = max(w, old[0]), min(b, old[1])
+                found[key] = (w, b, found.get(key, (0, 0, 0))[2] + 1)
+
+        if self.missing:
+            headers = ", ".join(f"{names.get(addr, '')}@0x{addr:02x}".lstrip("@") for addr in sorted(self.missing))
+            raise AnalysisError(f"loops need a bound: {headers}")
+
+        return [Timing(name, entry, end, w, b, count) for (name, entry, end), (w, b, count) in found.items()]
+
+def _merge(table, key, w, b):
+    if key in table:
+        table[key] = (max(table[key][0], w), min(table[key][1], b))
+    else:
+        table[key] = (w, b)
+
+#Strongly connected components, sinks first (iterative Tarjan)
+def _sccs(nodes, succ):
+    index   = {}
+    low     = {}
+    stack   = []
+    on      = set()
+    found   = []
+    for root in nodes:
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on.add(root)
+        work = [(root, iter(succ[root]))]
+        while work:
+            node, successors = work[-1]
+            for target in successors:
+                if target not in index:
+                    index[target] = low[target] = len(index)
+                    stack.append(target)
+                    on.add(target)
+                    work.append((target, iter(succ[target])))
+                    break
+                if target in on:
+                    low[node] = min(low[node], index[target])
+            else:
+                work.pop()
+                if work:
+                    low[work[-1][0]] = min(low[work[-1][0]], low[node])
+                if low[node] == index[node]:
+                    scc = []
+                    while True:
+                        member = stack.pop()
+                        on.discard(member)
+                        scc.append(member)
+                        if member == node:
+                            break
+                    found.append(scc)
+    return found
+
+
+#Annotations
+#-------------------------
+
+#"8" is exactly 8 passes, "1..8" anywhere from 1 to 8
+def parse_bound(text):
+    match = re.fullmatch(r"\s*(\d+)(?:\s*\.\.\s*(\d+))?\s*", text)
+    if not match:
+        raise ValueError(f"bad loop bound '{text}', use N or MIN..MAX")
+    low  = int(match.group(1))
+    high = int(match.group(2)) if match.group(2) else low
+    if not 1 <= low <= high:
+        raise ValueError(f"bad loop bound '{text}', passes start at 1")
+    return low, high
+
+#"; bound N" comments, on the header's line or a label line just above it: {address: (min, max)}
+def source_bounds(source, program):
+    lines  = sorted(program.instructions, key=lambda ins: ins.line)
+    bounds = {}
+    for number, raw in enumerate(source.splitlines(), 1):
+        comment = raw.partition(";")[2]
+        match   = _BOUND.search(comment)
+        if not match:
+            continue
+        following = [ins for ins in lines if ins.line >= number]
+        if not following:
+            raise ValueError(f"line {number}: bound after the last instruction")
+        bounds[following[0].addr] = parse_bound(match.group(0).split(None, 1)[1])
+    return bounds
+
+def analyze(memory, bounds=None, targets=None, demo_rom=False, onboard_ram=False, labels=None):
+    return Analysis(memory, bounds, targets, demo_rom, onboard_ram).timings(labels)
+
+def format_timings(timings, analysis=None):
+    lines = [f"{'routine':<12}{'entry':<7}{'end':<18}{'wcet':>8}{'bcet':>8}{'calls':>7}"]
+    for t in timings:
+        lines.append(f"{t.routine:<12}0x{t.entry:02x}   {t.end:<18}{t.wcet:>8}{t.bcet:>8}{t.calls or '':>7}")
+    if analysis is not None:
+        for loop in sorted(analysis.loops.values()):
+            low, high = loop.bound
+            copies = f", in {len(loop.contexts)} call contexts" if len(loop.contexts) > 1 else ""
+            lines.append(f"loop at 0x{loop.header:02x}: {low if low == high else f'{low}..{high}'} passes{copies}")
+        if analysis.assumptions:
+            cells = ", ".join(f"0x{addr:02x}" for addr in sorted(analysis.assumptions))
+            lines.append(f"assumed stores through unknown pointers miss the code at {cells}")
+    return "\n".join(lines)
+
+
+#Command line
+#-------------------------
+def _check_benchmarks():
+    from benchmarks import BENCHMARKS, run_model
+    from minibyte_asm import assemble
+
+    failed = 0
+    print(f"{'kernel':<12}{'bcet':>8}{'model':>8}{'wcet':>8}")
+    for bench in BENCHMARKS:
+        program  = assemble(bench.source)
+        analysis = Analysis(program.memory, source_bounds(bench.source, program),
+                            onboard_ram=bool(bench.ui_in & TM_ONBOARD_RAM), demo_rom=bool(bench.ui_in & TM_DEMO_ROM))
+        done     = [t for t in analysis.timings(program.labels) if t.routine == "main" and t.end == f"{HALT} done"][0]
+        cycles   = run_model(bench).cycles
+        ok       = done.bcet <= cycles <= done.wcet
+        failed  += not ok
+        print(f"{bench.name:<12}{done.bcet:>8}{cycles:>8}{done.wcet:>8}{'' if ok else '  OUT OF BOUNDS'}")
+    return 1 if failed else 0
+
+def main(argv):
+    import argparse
+
+    from minibyte_asm import assemble
+    from soak import load_image
+
+    parser = argparse.ArgumentParser(description="Static WCET/BCET of a minibyte program")
+    parser.add_argument("image",         nargs="?", help="program (.s, .hex or binary), the demo ROM if not given")
+    parser.add_argument("--bound",       action="append", default=[], metavar="LOOP=N|MIN..MAX",
+                        help="passes through the loop with this header (label or address)")
+    parser.add_argument("--target",      action="append", default=[], metavar="ADDR=T1,T2",
+                        help="where the JMP_IND or IND branch at ADDR can go")
+    parser.add_argument("--onboard-ram", action="store_true")
+    parser.add_argument("--demo-rom",    action="store_true")
+    parser.add_argument("--benchmarks",  action="store_true", help="check the bounds of the benchmark kernels")
+    args = parser.parse_args(argv)
+
+    if args.benchmarks:
+        return _check_benchmarks()
+
+    labels = {}
+    bounds = {}
+    if args.image is None:
+        memory = b""
+        bounds = dict(DEMO_ROM_BOUNDS)
+        args.demo_rom = args.onboard_ram = True
+    elif args.image.endswith(".s"):
+        with open(args.image) as f:
+            source = f.read()
+        program = assemble(source)
+        memory  = program.memory
+        labels  = program.labels
+        bounds  = source_bounds(source, program)
+    else:
+        memory = load_image(args.image)
+
+    def addr(text):
+        return labels[text] if text in labels else int(text, 0)
+
+    try:
+        for text in args.bound:
+            loop, _, bound = text.partition("=")
+            bounds[addr(loop)] = parse_bound(bound)
+        targets = {}
+        for text in args.target:
+            where, _, to = text.partition("=")
+            targets[addr(where)] = [addr(t) for t in to.split(",")]
+    except (KeyError, ValueError) as e:
+        parser.error(str(e))
+
+    try:
+        analysis = Analysis(memory, bounds, targets, args.demo_rom, args.onboard_ram)
+        timings  = analysis.timings(labels)
+    except AnalysisError as e:
+        print(f"wcet: {e}", file=sys.stderr)
+        return 1
+    print(format_timings(timings, analysis))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))